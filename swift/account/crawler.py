@@ -18,10 +18,12 @@ from random import random
 from swift.account import server as account_server
 from swift.account.backend import AccountBroker
 from swift.common.utils import get_logger, audit_location_generator, \
-    config_true_value
+    config_true_value, listdir
 from swift.common.daemon import Daemon
 from eventlet import Timeout
-from swift.metadata.utils import Sender
+from swift.metadata.utils import CrawlCheckpoints, CrawlRateLimiter, \
+    account_tombstone, db_changed_since, db_size, get_metadata_ring, \
+    get_sender, run_device_workers
 
 
 class AccountCrawler(Daemon):
@@ -33,22 +35,67 @@ class AccountCrawler(Daemon):
         self.devices = conf.get('devices', '/srv/node')
         self.ip = conf.get('md-server-ip', '127.0.0.1')
         self.port = conf.get('md-server-port', '6090')
+        # set when the metadata store is sharded by account
+        self.metadata_ring = get_metadata_ring(conf)
         self.mount_check = config_true_value(conf.get('mount_check', 'true'))
         self.interval = int(conf.get('interval', 30))
-        self.crawled_time = time.time()  # last time this daemon ran
+        # number of devices crawled at once, each by a worker process
+        self.concurrency = int(conf.get('concurrency', 1))
+        self.checkpoints = CrawlCheckpoints(conf, 'account_crawler',
+                                            self.logger)
 
     def _one_crawler_pass(self):
+        if self.concurrency > 1:
+            run_device_workers(self.crawl_devices, listdir(self.devices),
+                               self.concurrency, self.logger)
+        else:
+            self.crawl_devices()
+
+    def crawl_devices(self, device_dirs=None):
+        """
+        Crawls the account DBs of the given devices, partition by
+        partition.
+
+        :param device_dirs: devices to crawl, all of them if not given
+        """
+        begin = time.time()
+        self.checkpoints.reload()
+        limiter = CrawlRateLimiter(self.conf)
         all_locs = audit_location_generator(self.devices,
                                             account_server.DATADIR, '.db',
                                             mount_check=self.mount_check,
-                                            logger=self.logger)
-        metaList = []
+                                            logger=self.logger,
+                                            device_dirs=device_dirs)
+        crawled = set()
+        failed = set()
+
+        def on_batch(success, tags):
+            if not success:
+                failed.update(tags)
+
+        AccountSender = get_sender(
+            self.conf, 'account_crawler', self.ip, self.port, self.logger,
+            ring=self.metadata_ring, on_batch=on_batch)
+        AccountDeleter = get_sender(
+            self.conf, 'account_crawler', self.ip, self.port, self.logger,
+            ring=self.metadata_ring, on_batch=on_batch, method='DELETE')
         for path, device, partition in all_locs:
+            crawled.add((device, partition))
+            if not db_changed_since(
+                    path, self.checkpoints.get(device, partition)):
+                continue
             metaDict = self.account_crawl(path)
             if metaDict != {}:
-                metaList.append(format_metadata(metaDict))
-        AccountSender = Sender(self.conf)
-        AccountSender.sendData(metaList, 'account_crawler', self.ip, self.port)
+                AccountSender.add(format_metadata(metaDict),
+                                  (device, partition))
+            tombstone = self.account_tombstone(path)
+            if tombstone:
+                AccountDeleter.add(tombstone, (device, partition))
+            limiter.wait(db_size(path))
+        for sender in (AccountSender, AccountDeleter):
+            sender.flush()
+            sender.close()
+        self.checkpoints.advance(crawled - failed, begin)
 
     def run_forever(self, *args, **kwargs):
         """Run the account crawler until stopped."""
@@ -73,14 +120,10 @@ class AccountCrawler(Daemon):
 
         :param path: the path to an account db
         """
-        #start_time = time.time()
         metaDict = {}
         try:
             broker = AccountBroker(path)
             if not broker.is_deleted():
-                #reportedTime = broker.get_info()['put_timestamp']
-                #if normalize_timestamp(self.crawled_time) <
-                #reportedTime < normalize_timestamp(start_time):
                 metaDict = broker.get_info()
                 metaDict.update((key, value)
                        for key, (value, timestamp) in
@@ -89,6 +132,23 @@ class AccountCrawler(Daemon):
             self.logger.increment('failures')
         return metaDict
 
+    def account_tombstone(self, path):
+        """
+        Returns the tombstone of the given account path if the account is
+        deleted, None otherwise.
+
+        :param path: the path to an account db
+        """
+        try:
+            broker = AccountBroker(path)
+            if broker.is_deleted():
+                info = broker.get_info()
+                return account_tombstone(info['account'],
+                                         info['delete_timestamp'])
+        except (Exception, Timeout):
+            self.logger.increment('failures')
+        return None
+
 
 def format_metadata(data):
     metadata = {}
@@ -112,6 +112,19 @@ class GreenDBConnection(sqlite3.Connection):
             self.timeout, self.db_file,
             lambda: sqlite3.Connection.commit(self))
 
+    def retry_locked(self, call):
+        """
+        Call a function that may execute any number of statements on plain
+        sqlite3 cursors of this connection, calling it again until it gets
+        through without the database being locked. This saves the cost of a
+        GreenDBCursor and its timeout on every statement, so it suits reads
+        that execute many short statements.
+
+        :param call: the function to call
+        :returns: what the function returns
+        """
+        return _db_timeout(self.timeout, self.db_file, call)
+
 
 class GreenDBCursor(sqlite3.Cursor):
     """SQLite Cursor handler that plays well with eventlet."""
@@ -127,6 +127,10 @@ class SegmentError(SwiftException):
     pass
 
 
+class MetadataQueryError(SwiftException):
+    pass
+
+
 class ReplicationException(Exception):
     pass
 
@@ -35,7 +35,7 @@ ALL_SERVERS = ['account-auditor', 'account-server', 'container-auditor',
                'object-expirer', 'object-replicator', 'object-updater',
                'proxy-server', 'account-replicator', 'account-reaper',
                'account-crawler', 'object-crawler', 'container-crawler',
-               'metadata-server']
+               'metadata-server', 'metadata-compactor']
 MAIN_SERVERS = ['proxy-server', 'account-server', 'container-server',
                 'object-server', 'metadata-server']
 REST_SERVERS = [s for s in ALL_SERVERS if s not in MAIN_SERVERS]
@@ -48,13 +48,14 @@ import cPickle as pickle
 import logging
 import time
 from bisect import bisect
+from collections import defaultdict
 from swift import gettext_ as _
 from hashlib import md5
 from distutils.version import StrictVersion
 
 from eventlet.green import socket
 from eventlet.pools import Pool
-from eventlet import Timeout, __version__ as eventlet_version
+from eventlet import GreenPile, Timeout, __version__ as eventlet_version
 
 from swift.common.utils import json
 
@@ -218,41 +219,138 @@ class MemcacheRing(object):
                 self._error_limited[server] = now + ERROR_LIMIT_DURATION
                 logging.error(_('Error limiting server %s'), server)
 
-    def _get_conns(self, key):
+    def _servers_for(self, key):
         """
-        Retrieves a server conn from the pool, or connects a new one.
-        Chooses the server based on a consistent hash of "key".
+        Returns the servers a (hashed) key is kept on, in the order they are
+        tried. Chooses the servers based on a consistent hash of "key".
         """
         pos = bisect(self._sorted, key)
         served = []
         while len(served) < self._tries:
             pos = (pos + 1) % len(self._sorted)
             server = self._ring[self._sorted[pos]]
-            if server in served:
-                continue
-            served.append(server)
+            if server not in served:
+                served.append(server)
+        return served
+
+    def _get_conn(self, server):
+        """
+        Retrieves a conn to server from the pool, or connects a new one.
+
+        :returns: (fp, sock), or None if no connection could be had
+        """
+        sock = None
+        try:
+            with MemcachePoolTimeout(self._pool_timeout):
+                fp, sock = self._client_cache[server].get()
+            return fp, sock
+        except MemcachePoolTimeout as e:
+            self._exception_occurred(
+                server, e, action='getting a connection',
+                got_connection=False)
+        except (Exception, Timeout) as e:
+            # Typically a Timeout exception caught here is the one raised
+            # by the create() method of this server's MemcacheConnPool
+            # object.
+            self._exception_occurred(
+                server, e, action='connecting', sock=sock)
+
+    def _get_conns(self, key):
+        """
+        Retrieves a server conn from the pool, or connects a new one.
+        Chooses the server based on a consistent hash of "key".
+        """
+        for server in self._servers_for(key):
             if self._error_limited[server] > time.time():
                 continue
-            sock = None
-            try:
-                with MemcachePoolTimeout(self._pool_timeout):
-                    fp, sock = self._client_cache[server].get()
-                yield server, fp, sock
-            except MemcachePoolTimeout as e:
-                self._exception_occurred(
-                    server, e, action='getting a connection',
-                    got_connection=False)
-            except (Exception, Timeout) as e:
-                # Typically a Timeout exception caught here is the one raised
-                # by the create() method of this server's MemcacheConnPool
-                # object.
-                self._exception_occurred(
-                    server, e, action='connecting', sock=sock)
+            conn = self._get_conn(server)
+            if conn:
+                yield (server,) + conn
 
     def _return_conn(self, server, fp, sock):
         """Returns a server connection to the pool."""
         self._client_cache[server].put((fp, sock))
 
+    def _encode(self, value, serialize):
+        """Returns the flags and the value to store for a value."""
+        flags = 0
+        if serialize and self._allow_pickle:
+            value = pickle.dumps(value, PICKLE_PROTOCOL)
+            flags |= PICKLE_FLAG
+        elif serialize:
+            value = json.dumps(value)
+            flags |= JSON_FLAG
+        return flags, value
+
+    def _decode(self, flags, value):
+        """Returns the value for a value stored with flags."""
+        if flags & PICKLE_FLAG:
+            if self._allow_unpickle:
+                return pickle.loads(value)
+            return None
+        elif flags & JSON_FLAG:
+            return json.loads(value)
+        return value
+
+    def _run_many(self, keys, run):
+        """
+        Runs a batch of commands on each server, all at once, for the
+        (hashed) keys kept there. The keys of a server that fails are tried
+        again on their next server, as one batch per server again.
+
+        :param keys: hashed keys
+        :param run: called with (fp, sock, keys) for each server, with the
+                    keys for that server; sends their commands, reads the
+                    responses and returns a dict of results by key
+        :returns: dict of the results of the keys some server ran the
+                  commands of; the others could not be run anywhere
+        """
+        results = {}
+        servers_left = dict((key, self._servers_for(key)) for key in keys)
+        while servers_left:
+            keys_by_server = defaultdict(list)
+            now = time.time()
+            for key, servers in servers_left.items():
+                while servers and self._error_limited[servers[0]] > now:
+                    servers.pop(0)
+                if servers:
+                    keys_by_server[servers.pop(0)].append(key)
+                else:
+                    del servers_left[key]
+            if len(keys_by_server) == 1:
+                batches = [self._run_on_server(
+                    run, *keys_by_server.items()[0])]
+            else:
+                batches = GreenPile(max(len(keys_by_server), 1))
+                for server, server_keys in keys_by_server.iteritems():
+                    batches.spawn(self._run_on_server, run, server,
+                                  server_keys)
+            for server_keys, server_results in batches:
+                if server_results is not None:
+                    results.update(server_results)
+                    for key in server_keys:
+                        servers_left.pop(key, None)
+        return results
+
+    def _run_on_server(self, run, server, keys):
+        """
+        Runs a batch of commands of _run_many on one server.
+
+        :returns: the keys, and the results of run or None if it failed
+        """
+        conn = self._get_conn(server)
+        if not conn:
+            return keys, None
+        fp, sock = conn
+        try:
+            with Timeout(self._io_timeout):
+                results = run(fp, sock, keys)
+            self._return_conn(server, fp, sock)
+            return keys, results
+        except (Exception, Timeout) as e:
+            self._exception_occurred(server, e, sock=sock, fp=fp)
+            return keys, None
+
     def set(self, key, value, serialize=True, timeout=0, time=0,
             min_compress_len=0):
         """
@@ -279,13 +377,7 @@ class MemcacheRing(object):
         if timeout:
             logging.warn("parameter timeout has been deprecated, use time")
         timeout = sanitize_timeout(time or timeout)
-        flags = 0
-        if serialize and self._allow_pickle:
-            value = pickle.dumps(value, PICKLE_PROTOCOL)
-            flags |= PICKLE_FLAG
-        elif serialize:
-            value = json.dumps(value)
-            flags |= JSON_FLAG
+        flags, value = self._encode(value, serialize)
         for (server, fp, sock) in self._get_conns(key):
             try:
                 with Timeout(self._io_timeout):
@@ -317,14 +409,7 @@ class MemcacheRing(object):
                     while line[0].upper() != 'END':
                         if line[0].upper() == 'VALUE' and line[1] == key:
                             size = int(line[3])
-                            value = fp.read(size)
-                            if int(line[2]) & PICKLE_FLAG:
-                                if self._allow_unpickle:
-                                    value = pickle.loads(value)
-                                else:
-                                    value = None
-                            elif int(line[2]) & JSON_FLAG:
-                                value = json.loads(value)
+                            value = self._decode(int(line[2]), fp.read(size))
                             fp.readline()
                         line = fp.readline().strip().split()
                     self._return_conn(server, fp, sock)
@@ -459,13 +544,7 @@ class MemcacheRing(object):
         msg = ''
         for key, value in mapping.iteritems():
             key = md5hash(key)
-            flags = 0
-            if serialize and self._allow_pickle:
-                value = pickle.dumps(value, PICKLE_PROTOCOL)
-                flags |= PICKLE_FLAG
-            elif serialize:
-                value = json.dumps(value)
-                flags |= JSON_FLAG
+            flags, value = self._encode(value, serialize)
             msg += ('set %s %d %d %s\r\n%s\r\n' %
                     (key, flags, timeout, len(value), value))
         for (server, fp, sock) in self._get_conns(server_key):
@@ -500,14 +579,7 @@ class MemcacheRing(object):
                     while line[0].upper() != 'END':
                         if line[0].upper() == 'VALUE':
                             size = int(line[3])
-                            value = fp.read(size)
-                            if int(line[2]) & PICKLE_FLAG:
-                                if self._allow_unpickle:
-                                    value = pickle.loads(value)
-                                else:
-                                    value = None
-                            elif int(line[2]) & JSON_FLAG:
-                                value = json.loads(value)
+                            value = self._decode(int(line[2]), fp.read(size))
                             responses[line[1]] = value
                             fp.readline()
                         line = fp.readline().strip().split()
@@ -521,3 +593,116 @@ class MemcacheRing(object):
                     return values
             except (Exception, Timeout) as e:
                 self._exception_occurred(server, e, sock=sock, fp=fp)
+
+    def get_many(self, keys):
+        """
+        Gets the values of keys kept on any of the servers, with one
+        request to each server involved, all sent at once.
+
+        :param keys: keys for values to be retrieved from memcache
+        :returns: list of values, None for the keys not found
+        """
+        hashed_keys = [md5hash(key) for key in keys]
+
+        def get_batch(fp, sock, server_keys):
+            sock.sendall('get %s\r\n' % ' '.join(server_keys))
+            values = {}
+            line = fp.readline().strip().split()
+            while line[0].upper() != 'END':
+                if line[0].upper() == 'VALUE':
+                    value = fp.read(int(line[3]))
+                    values[line[1]] = self._decode(int(line[2]), value)
+                    fp.readline()
+                line = fp.readline().strip().split()
+            return values
+
+        values = self._run_many(set(hashed_keys), get_batch)
+        return [values.get(key) for key in hashed_keys]
+
+    def set_many(self, mapping, serialize=True, time=0):
+        """
+        Sets key/value pairs kept on any of the servers, with one pipelined
+        request to each server involved, all sent at once.
+
+        :param mapping: dictionary of keys and values to be set in memcache
+        :param serialize: if True, values are serialized as with set()
+        :param time: the time to live
+        """
+        timeout = sanitize_timeout(time)
+        commands = {}
+        for key, value in mapping.iteritems():
+            key = md5hash(key)
+            flags, value = self._encode(value, serialize)
+            commands[key] = 'set %s %d %d %s\r\n%s\r\n' % (
+                key, flags, timeout, len(value), value)
+
+        def set_batch(fp, sock, server_keys):
+            sock.sendall(''.join(commands[key] for key in server_keys))
+            # Wait for the sets to complete
+            for _junk in server_keys:
+                fp.readline()
+            return {}
+
+        self._run_many(commands, set_batch)
+
+    def incr_many(self, deltas, time=0):
+        """
+        Increments (or decrements, for negative deltas) counters kept on any
+        of the servers, as incr() does, with pipelined requests to each
+        server involved, all sent at once.
+
+        :param deltas: dictionary of keys and the amounts to add to them
+        :param time: the time to live of counters that are added
+        :returns: dictionary of keys and the results of incrementing
+        :raises MemcacheConnectionError: if some counter could not be
+                                         incremented on any server
+        """
+        timeout = sanitize_timeout(time)
+        commands = {}
+        adds = {}
+        keys = {}
+        for key, delta in deltas.iteritems():
+            hashed_key = md5hash(key)
+            keys[hashed_key] = key
+            command = 'incr' if delta >= 0 else 'decr'
+            delta = str(abs(int(delta)))
+            add_val = delta if command == 'incr' else '0'
+            commands[hashed_key] = '%s %s %s\r\n' % (
+                command, hashed_key, delta)
+            adds[hashed_key] = (add_val, 'add %s %d %d %s\r\n%s\r\n' % (
+                hashed_key, 0, timeout, len(add_val), add_val))
+
+        def incr_batch(fp, sock, server_keys):
+            results = {}
+            sock.sendall(''.join(commands[key] for key in server_keys))
+            not_found = []
+            for key in server_keys:
+                line = fp.readline().strip().split()
+                if line[0].upper() == 'NOT_FOUND':
+                    not_found.append(key)
+                else:
+                    results[key] = int(line[0].strip())
+            if not not_found:
+                return results
+            sock.sendall(''.join(adds[key][1] for key in not_found))
+            not_stored = []
+            for key in not_found:
+                line = fp.readline().strip().split()
+                if line[0].upper() == 'NOT_STORED':
+                    # added by someone else in the meantime
+                    not_stored.append(key)
+                else:
+                    results[key] = int(adds[key][0])
+            if not not_stored:
+                return results
+            sock.sendall(''.join(commands[key] for key in not_stored))
+            for key in not_stored:
+                line = fp.readline().strip().split()
+                results[key] = int(line[0].strip())
+            return results
+
+        results = self._run_many(commands, incr_batch)
+        if len(results) < len(commands):
+            raise MemcacheConnectionError(
+                "No Memcached connections succeeded.")
+        return dict((keys[key], value) for key, value in results.iteritems())
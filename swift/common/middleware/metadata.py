@@ -13,8 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from swift.common.swob import Request, Response
-from swift.common.utils import json
+from swift import gettext_ as _
+from swift.common.exceptions import ConnectionTimeout
+from swift.common.http import is_server_error
+from swift.common.swob import Request, Response, HTTPServiceUnavailable
+from swift.common.utils import json, get_logger
+from swift.metadata.utils import get_metadata_ring
+from eventlet import Timeout
 from eventlet.green.httplib import HTTPConnection
 
 
@@ -30,14 +35,67 @@ class MetaDataMiddleware(object):
         self.mds_ip = conf.get('md-server-ip', '127.0.0.1')
         self.mds_port = conf.get('md-server-port', '6090')
         self.version = 'v1'
+        self.client_chunk_size = int(conf.get('client_chunk_size', 65536))
+        self.conn_timeout = float(conf.get('conn_timeout', 0.5))
+        self.node_timeout = float(conf.get('node_timeout', 60))
+        self.logger = get_logger(conf, log_route='metadata')
+        # with shard_by_account, queries go to the metadata servers holding
+        # the account's partition instead of md-server-ip
+        self.metadata_ring = get_metadata_ring(conf)
+
+    def get_nodes(self, req):
+        """
+        Returns the (ip, port) of every metadata server that can answer a
+        query: the replicas of the account's shard, or the one configured
+        metadata server.
+        """
+        if self.metadata_ring is not None:
+            version, account, rest = req.split_path(1, 3, True)
+            if account:
+                part, nodes = self.metadata_ring.get_nodes(account)
+                return [(node['ip'], node['port']) for node in nodes]
+        return [(self.mds_ip, self.mds_port)]
 
     def GET(self, req):
-        """Handle the query request."""
-        conn = HTTPConnection('%s:%s' % (self.mds_ip, self.mds_port))
+        """
+        Handle the query request.
+        The metadata server's response is passed on as it arrives rather
+        than read whole, so large results are never held by the proxy.
+        Servers are tried in turn until one answers without a server
+        error.
+        """
         headers = req.params
-        conn.request('GET', req.path, headers=headers)
-        resp = conn.getresponse()
-        return Response(request=req, body=resp.read(), content_type=resp.getheader('Content-Type'))
+        nodes = self.get_nodes(req)
+        for i, (ip, port) in enumerate(nodes):
+            try:
+                with ConnectionTimeout(self.conn_timeout):
+                    conn = HTTPConnection('%s:%s' % (ip, port))
+                    conn.request('GET', req.path, headers=headers)
+                with Timeout(self.node_timeout):
+                    resp = conn.getresponse()
+            except (Exception, Timeout):
+                self.logger.exception(
+                    _('ERROR querying metadata server %(ip)s:%(port)s'),
+                    {'ip': ip, 'port': port})
+                continue
+            if is_server_error(resp.status) and i < len(nodes) - 1:
+                conn.close()
+                continue
+            return Response(request=req, status=resp.status,
+                            app_iter=self._iter_body(conn, resp),
+                            content_type=resp.getheader('Content-Type'))
+        return HTTPServiceUnavailable(request=req)
+
+    def _iter_body(self, conn, resp):
+        """Yields the body of resp in chunks, then closes conn"""
+        try:
+            while True:
+                chunk = resp.read(self.client_chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            conn.close()
 
     def BAD(self, req):
         """Returns a 400 for bad request"""
@@ -135,7 +135,8 @@ class ReconMiddleware(object):
                                           self.container_recon_cache)
         elif recon_type == 'object':
             return self._from_recon_cache(['object_replication_time',
-                                           'object_replication_last'],
+                                           'object_replication_last',
+                                           'object_replication_queue'],
                                           self.object_recon_cache)
         else:
             return None
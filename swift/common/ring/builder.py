@@ -402,13 +402,16 @@ class RingBuilder(object):
                 for dev_id in part2dev:
                     dev_usage[dev_id] += 1
 
-        for part, replica in self._each_part_replica():
-            dev_id = self._replica2part2dev[replica][part]
-            if dev_id >= dev_len or not self.devs[dev_id]:
+        # Each device id in use only has to be checked once; the partitions
+        # are only searched to report the first one not allocated.
+        for replica, part2dev in enumerate(self._replica2part2dev):
+            unallocated = [dev_id for dev_id in set(part2dev)
+                           if dev_id >= dev_len or not self.devs[dev_id]]
+            if unallocated:
                 raise exceptions.RingValidationError(
                     "Partition %d, replica %d was not allocated "
                     "to a device." %
-                    (part, replica))
+                    (min(map(part2dev.index, unallocated)), replica))
 
         for dev in self._iter_devs():
             if not isinstance(dev['port'], int):
@@ -470,8 +473,7 @@ class RingBuilder(object):
         255 hours ago. This can be used to force a full rebalance on the next
         call to rebalance.
         """
-        for part in xrange(self.parts):
-            self._last_part_moves[part] = 0xff
+        self._last_part_moves[:] = array('B', [0xff]) * self.parts
 
     def get_part_devices(self, part):
         """
@@ -582,7 +584,7 @@ class RingBuilder(object):
                 for part in xrange(desired_length):
                     to_assign[part].append(replica)
                 self._replica2part2dev.append(
-                    array('H', (0 for _junk in xrange(desired_length))))
+                    array('H', [0]) * desired_length)
 
         return (list(to_assign.iteritems()), removed_replicas)
 
@@ -591,7 +593,7 @@ class RingBuilder(object):
         Initial partition assignment is the same as rebalancing an
         existing ring, but with some initial setup beforehand.
         """
-        self._last_part_moves = array('B', (0 for _junk in xrange(self.parts)))
+        self._last_part_moves = array('B', [0]) * self.parts
         self._last_part_moves_epoch = int(time())
 
         self._reassign_parts(self._adjust_replica2part2dev_size()[0])
@@ -603,14 +605,14 @@ class RingBuilder(object):
         more recently than min_part_hours.
         """
         elapsed_hours = int(time() - self._last_part_moves_epoch) / 3600
-        for part in xrange(self.parts):
-            # The "min(self._last_part_moves[part] + elapsed_hours, 0xff)"
-            # which was here showed up in profiling, so it got inlined.
-            last_plus_elapsed = self._last_part_moves[part] + elapsed_hours
-            if last_plus_elapsed < 0xff:
-                self._last_part_moves[part] = last_plus_elapsed
-            else:
-                self._last_part_moves[part] = 0xff
+        if elapsed_hours:
+            # Looping over the partitions showed up in profiling; mapping
+            # every byte through a translation table of
+            # min(hours + elapsed_hours, 0xff) does the same in C.
+            table = ''.join(chr(min(hours + elapsed_hours, 0xff))
+                            for hours in xrange(0x100))
+            self._last_part_moves = array(
+                'B', self._last_part_moves.tostring().translate(table))
         self._last_part_moves_epoch = int(time())
 
     def _gather_reassign_parts(self):
@@ -629,13 +631,15 @@ class RingBuilder(object):
         # choices will skip other replicas of the same partition if possible.
         removed_dev_parts = defaultdict(list)
         if self._remove_devs:
-            dev_ids = [d['id'] for d in self._remove_devs if d['parts']]
+            dev_ids = set(d['id'] for d in self._remove_devs if d['parts'])
             if dev_ids:
-                for part, replica in self._each_part_replica():
-                    dev_id = self._replica2part2dev[replica][part]
-                    if dev_id in dev_ids:
-                        self._last_part_moves[part] = 0
-                        removed_dev_parts[part].append(replica)
+                for replica, part2dev in enumerate(self._replica2part2dev):
+                    if dev_ids.isdisjoint(part2dev):
+                        continue
+                    for part, dev_id in enumerate(part2dev):
+                        if dev_id in dev_ids:
+                            self._last_part_moves[part] = 0
+                            removed_dev_parts[part].append(replica)
 
         # Now we gather partitions that are "at risk" because they aren't
         # currently sufficient spread out across the cluster.
@@ -645,6 +649,10 @@ class RingBuilder(object):
             # Only move one replica at a time if possible.
             if part in removed_dev_parts:
                 continue
+            # None of the replicas of a partition moved too recently could be
+            # moved anyway.
+            if self._last_part_moves[part] < self.min_part_hours:
+                continue
 
             # First, add up the count of replicas at each tier for each
             # partition.
@@ -659,6 +667,13 @@ class RingBuilder(object):
                         replicas_at_tier[tier] = 1
                     else:
                         replicas_at_tier[tier] += 1
+            # Most partitions are spread out well enough; removing replicas
+            # below only lowers the counts, so those can be skipped.
+            for tier, rep_at_tier in replicas_at_tier.iteritems():
+                if rep_at_tier > max_allowed_replicas[tier]:
+                    break
+            else:
+                continue
 
             # Now, look for partitions not yet spread out enough and not
             # recently moved.
@@ -698,7 +713,13 @@ class RingBuilder(object):
         start += random.randint(0, self.parts / 2)  # GRAH PEP8!!!
 
         self._last_part_gather_start = start
+        # Only the partitions of these devices are looked at any further, so
+        # a ring with few overweight devices is not walked in full.
+        overweight_dev_ids = set(dev['id'] for dev in self._iter_devs()
+                                 if dev['parts_wanted'] < 0)
         for replica, part2dev in enumerate(self._replica2part2dev):
+            if not overweight_dev_ids:
+                break
             # If we've got a partial replica, start may be out of
             # range. Scale it down so that we get a similar movement
             # pattern (but scaled down) on sequential runs.
@@ -706,16 +727,21 @@ class RingBuilder(object):
 
             for part in itertools.chain(xrange(this_start, len(part2dev)),
                                         xrange(0, this_start)):
+                if part2dev[part] not in overweight_dev_ids:
+                    continue
                 if self._last_part_moves[part] < self.min_part_hours:
                     continue
                 if part in removed_dev_parts or part in spread_out_parts:
                     continue
                 dev = self.devs[part2dev[part]]
-                if dev['parts_wanted'] < 0:
-                    self._last_part_moves[part] = 0
-                    dev['parts_wanted'] += 1
-                    dev['parts'] -= 1
-                    reassign_parts[part].append(replica)
+                self._last_part_moves[part] = 0
+                dev['parts_wanted'] += 1
+                dev['parts'] -= 1
+                reassign_parts[part].append(replica)
+                if dev['parts_wanted'] >= 0:
+                    overweight_dev_ids.discard(dev['id'])
+                    if not overweight_dev_ids:
+                        break
 
         reassign_parts.update(spread_out_parts)
         reassign_parts.update(removed_dev_parts)
@@ -754,6 +780,9 @@ class RingBuilder(object):
         """
         for dev in self._iter_devs():
             dev['sort_key'] = self._sort_key_for(dev)
+            # Devices without weight can still hold replicas that stay where
+            # they are, so they need their tiers too.
+            dev['tiers'] = tiers_for_dev(dev)
 
         available_devs = \
             sorted((d for d in self._iter_devs() if d['weight']),
@@ -764,7 +793,6 @@ class RingBuilder(object):
         tier2dev_sort_key = defaultdict(list)
         max_tier_depth = 0
         for dev in available_devs:
-            dev['tiers'] = tiers_for_dev(dev)
             for tier in dev['tiers']:
                 tier2devs[tier].append(dev)  # <-- starts out sorted!
                 tier2dev_sort_key[tier].append(dev['sort_key'])
@@ -793,13 +821,11 @@ class RingBuilder(object):
             # Gather up what other tiers (regions, zones, ip/ports, and
             # devices) the replicas not-to-be-moved are in for this part.
             other_replicas = defaultdict(int)
-            unique_tiers_by_tier_len = defaultdict(set)
             for replica in self._replicas_for_part(part):
                 if replica not in replace_replicas:
                     dev = self.devs[self._replica2part2dev[replica][part]]
                     for tier in dev['tiers']:
                         other_replicas[tier] += 1
-                        unique_tiers_by_tier_len[len(tier)].add(tier)
 
             for replica in replace_replicas:
                 tier = ()
@@ -825,25 +851,18 @@ class RingBuilder(object):
                     # This used to be a cute, recursive function, but it's been
                     # unrolled for performance.
 
-                    # We sort the tiers here so that, when we look for a tier
-                    # with the lowest number of replicas, the first one we
-                    # find is the one with the hungriest drive (i.e. drive
-                    # with the largest sort_key value). This lets us
-                    # short-circuit the search while still ensuring we get the
-                    # right tier.
-                    candidates_with_replicas = \
-                        unique_tiers_by_tier_len[len(tier) + 1]
-                    # Find a tier with the minimal replica count and the
-                    # hungriest drive among all the tiers with the minimal
-                    # replica count.
-                    if len(tier2children[tier]) > \
-                            len(candidates_with_replicas):
-                        # There exists at least one tier with 0 other replicas
-                        tier = max((t for t in tier2children[tier]
-                                    if other_replicas[t] == 0),
-                                   key=tier2sort_key.__getitem__)
+                    # The child tiers are kept sorted by their hungriest
+                    # drive (i.e. drive with the largest sort_key value), so
+                    # the last one without other replicas is the one we want.
+                    # This short-circuits the search in the common case; if
+                    # every child tier has replicas, find the one with the
+                    # fewest and, among those, the hungriest drive.
+                    children = tier2children[tier]
+                    for tier in reversed(children):
+                        if not other_replicas[tier]:
+                            break
                     else:
-                        tier = max(tier2children[tier],
+                        tier = max(children,
                                    key=lambda t: (-other_replicas[t],
                                                   tier2sort_key[t]))
                     depth += 1
@@ -854,35 +873,41 @@ class RingBuilder(object):
                 new_sort_key = dev['sort_key'] = self._sort_key_for(dev)
                 for tier in dev['tiers']:
                     other_replicas[tier] += 1
-                    unique_tiers_by_tier_len[len(tier)].add(tier)
 
-                    index = bisect.bisect_left(tier2dev_sort_key[tier],
-                                               old_sort_key)
-                    tier2devs[tier].pop(index)
-                    tier2dev_sort_key[tier].pop(index)
+                    tier_devs = tier2devs[tier]
+                    dev_sort_keys = tier2dev_sort_key[tier]
+                    index = bisect.bisect_left(dev_sort_keys, old_sort_key)
+                    tier_devs.pop(index)
+                    dev_sort_keys.pop(index)
 
-                    new_index = bisect.bisect_left(tier2dev_sort_key[tier],
+                    new_index = bisect.bisect_left(dev_sort_keys,
                                                    new_sort_key)
-                    tier2devs[tier].insert(new_index, dev)
-                    tier2dev_sort_key[tier].insert(new_index, new_sort_key)
-
-                    new_last_sort_key = tier2dev_sort_key[tier][-1]
+                    tier_devs.insert(new_index, dev)
+                    dev_sort_keys.insert(new_index, new_sort_key)
+
+                    old_last_sort_key = tier2sort_key[tier]
+                    new_last_sort_key = dev_sort_keys[-1]
+                    if new_last_sort_key == old_last_sort_key:
+                        # Some other drive was the hungriest in this tier,
+                        # and still is; the tier keeps its place.
+                        continue
                     tier2sort_key[tier] = new_last_sort_key
 
-                    # Now jiggle tier2children values to keep them sorted
+                    # Now jiggle tier2children values to keep them sorted.
+                    # The tier is found by its own old sort key, which is
+                    # only the drive's if the drive was its hungriest.
                     parent_tier = tier[0:-1]
-                    index = bisect.bisect_left(
-                        tier2children_sort_key[parent_tier],
-                        old_sort_key)
-                    popped = tier2children[parent_tier].pop(index)
-                    tier2children_sort_key[parent_tier].pop(index)
-
-                    new_index = bisect.bisect_left(
-                        tier2children_sort_key[parent_tier],
-                        new_last_sort_key)
-                    tier2children[parent_tier].insert(new_index, popped)
-                    tier2children_sort_key[parent_tier].insert(
-                        new_index, new_last_sort_key)
+                    siblings = tier2children[parent_tier]
+                    sibling_sort_keys = tier2children_sort_key[parent_tier]
+                    index = bisect.bisect_left(sibling_sort_keys,
+                                               old_last_sort_key)
+                    siblings.pop(index)
+                    sibling_sort_keys.pop(index)
+
+                    new_index = bisect.bisect_left(sibling_sort_keys,
+                                                   new_last_sort_key)
+                    siblings.insert(new_index, tier)
+                    sibling_sort_keys.insert(new_index, new_last_sort_key)
 
                 self._replica2part2dev[replica][part] = dev['id']
 
@@ -15,19 +15,27 @@
 
 import array
 import cPickle as pickle
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import ctypes
 from gzip import GzipFile
+import mmap
 from os.path import getmtime
 import struct
 from time import time
 import os
 from io import BufferedReader
 from hashlib import md5
-from itertools import chain
+from itertools import chain, izip
+from operator import itemgetter
+import sys
 
 from swift.common.utils import hash_path, validate_configuration, json
 from swift.common.ring.utils import tiers_for_dev
 
+#: Version of the uncompressed ring format that can be memory-mapped
+MMAP_FORMAT_VERSION = 2
+GZIP_MAGIC = '\x1f\x8b'
+
 
 class RingData(object):
     """Partitioned consistent hashing ring data (used for serialization)."""
@@ -53,13 +61,85 @@ class RingData(object):
         return ring_dict
 
     @classmethod
-    def load(cls, filename):
+    def read_header_v2(cls, fp):
+        """
+        Reads the header of a ring in the memory-mapped format.
+
+        :param fp: file positioned at the start of the ring
+        :returns: the ring dict of the header, and the offset of the first
+                  replica's table in the file
+        """
+        magic, version = struct.unpack('!4sH', fp.read(6))
+        if magic != 'R1NG' or version != MMAP_FORMAT_VERSION:
+            raise Exception('Unknown ring format version %d' % version)
+        json_len, = struct.unpack('!I', fp.read(4))
+        ring_dict = json.loads(fp.read(json_len))
+        return ring_dict, _table_offset(json_len)
+
+    @classmethod
+    def load_v2(cls, filename, mapped=False):
+        """
+        Loads a ring in the memory-mapped format.
+
+        :param filename: path to a file saved with mmap_format=True
+        :param mapped: if True, the replica tables are not read but mapped,
+                       copy on write, so every process using the ring
+                       shares one copy of them in the page cache. Mapped
+                       tables are ctypes arrays, which can't be pickled or
+                       saved in the gzip format; by default they are read
+                       into arrays like those of any other ring.
+        :returns: the ring dict
+        """
+        with open(filename, 'rb') as fp:
+            ring_dict, offset = cls.read_header_v2(fp)
+            lengths = ring_dict['replica_lengths']
+            ring_dict['replica2part2dev_id'] = []
+            if mapped and ring_dict['byteorder'] == sys.byteorder and \
+                    any(lengths):
+                table = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY)
+                for length in lengths:
+                    ring_dict['replica2part2dev_id'].append(
+                        (ctypes.c_uint16 * length).from_buffer(table, offset))
+                    offset += 2 * length
+            else:
+                fp.seek(offset)
+                for length in lengths:
+                    part2dev_id = array.array('H', fp.read(2 * length))
+                    if ring_dict['byteorder'] != sys.byteorder:
+                        # written on a host of the other byte order
+                        part2dev_id.byteswap()
+                    ring_dict['replica2part2dev_id'].append(part2dev_id)
+        return ring_dict
+
+    @classmethod
+    def checksum(cls, filename):
+        """
+        Returns the checksum recorded in the header of a ring in the
+        memory-mapped format, without loading the ring; None for other
+        formats.
+        """
+        with open(filename, 'rb') as fp:
+            if fp.read(2) == GZIP_MAGIC:
+                return None
+            fp.seek(0)
+            return cls.read_header_v2(fp)[0]['checksum']
+
+    @classmethod
+    def load(cls, filename, mapped=False):
         """
         Load ring data from a file.
 
         :param filename: Path to a file serialized by the save() method.
+        :param mapped: map the replica tables of a ring in the memory-mapped
+                       format instead of reading them; see load_v2
         :returns: A RingData instance containing the loaded data.
         """
+        with open(filename, 'rb') as fp:
+            compressed = fp.read(2) == GZIP_MAGIC
+        if not compressed:
+            ring_data = cls.load_v2(filename, mapped=mapped)
+            return RingData(ring_data['replica2part2dev_id'],
+                            ring_data['devs'], ring_data['part_shift'])
         gz_file = GzipFile(filename, 'rb')
         # Python 2.6 GzipFile doesn't support BufferedIO
         if hasattr(gz_file, '_checkReadable'):
@@ -96,12 +176,47 @@ class RingData(object):
         for part2dev_id in ring['replica2part2dev_id']:
             file_obj.write(part2dev_id.tostring())
 
-    def save(self, filename):
+    def serialize_v2(self, file_obj):
+        ring = self.to_dict()
+        tables = [str(buffer(part2dev_id))
+                  for part2dev_id in ring['replica2part2dev_id']]
+        devs_json = json.dumps(ring['devs'], sort_keys=True)
+        checksum = md5(devs_json)
+        checksum.update(str(ring['part_shift']))
+        for table in tables:
+            checksum.update(table)
+        json_encoder = json.JSONEncoder(sort_keys=True)
+        json_text = json_encoder.encode(
+            {'devs': ring['devs'], 'part_shift': ring['part_shift'],
+             'replica_count': len(tables),
+             'replica_lengths': [len(table) / 2 for table in tables],
+             'byteorder': sys.byteorder,
+             'checksum': checksum.hexdigest()})
+        json_len = len(json_text)
+        file_obj.write(struct.pack('!4sHI', 'R1NG', MMAP_FORMAT_VERSION,
+                                   json_len))
+        file_obj.write(json_text)
+        # pad so the tables start aligned
+        file_obj.write('\0' * (_table_offset(json_len) - 10 - json_len))
+        for table in tables:
+            file_obj.write(table)
+
+    def save(self, filename, mmap_format=False):
         """
         Serialize this RingData instance to disk.
 
         :param filename: File into which this instance should be serialized.
+        :param mmap_format: write the uncompressed format that Ring maps
+                            into memory instead of reading
         """
+        if mmap_format:
+            # Mapped rings must never be changed in place, so the new ring
+            # is written aside and renamed over the old one.
+            tmp_file = '%s.%s.tmp' % (filename, os.getpid())
+            with open(tmp_file, 'wb') as file_obj:
+                self.serialize_v2(file_obj)
+            os.rename(tmp_file, filename)
+            return
         # Override the timestamp so that the same ring data creates
         # the same bytes on disk. This makes a checksum comparison a
         # good way to see if two rings are identical.
@@ -121,15 +236,27 @@ class RingData(object):
                 'part_shift': self._part_shift}
 
 
+def _table_offset(json_len):
+    """
+    Returns the offset of the first replica table of a ring in the
+    memory-mapped format, after the header, aligned to 8 bytes.
+    """
+    return (10 + json_len + 7) & ~7
+
+
 class Ring(object):
     """
     Partitioned consistent hashing ring.
 
     :param serialized_path: path to serialized RingData instance
     :param reload_time: time interval in seconds to check for a ring change
+    :param handoff_cache_size: number of partitions whose handoff nodes are
+                               kept once computed; 0 to compute them on
+                               every call to get_more_nodes
     """
 
-    def __init__(self, serialized_path, reload_time=15, ring_name=None):
+    def __init__(self, serialized_path, reload_time=15, ring_name=None,
+                 handoff_cache_size=1024):
         # can't use the ring unless HASH_PATH_SUFFIX is set
         validate_configuration()
         if ring_name:
@@ -138,30 +265,45 @@ class Ring(object):
         else:
             self.serialized_path = os.path.join(serialized_path)
         self.reload_time = reload_time
+        self.handoff_cache_size = handoff_cache_size
+        self._handoffs = OrderedDict()
         self._reload(force=True)
 
     def _reload(self, force=False):
         self._rtime = time() + self.reload_time
         if force or self.has_changed():
-            ring_data = RingData.load(self.serialized_path)
-            self._mtime = getmtime(self.serialized_path)
-            self._devs = ring_data.devs
+            mtime = getmtime(self.serialized_path)
+            checksum = RingData.checksum(self.serialized_path)
+            if not force and checksum and checksum == self._checksum:
+                # the same ring again, e.g. pushed out to every node anew
+                self._mtime = mtime
+                return
+            ring_data = RingData.load(self.serialized_path, mapped=True)
+            self._mtime = mtime
+            self._checksum = checksum
+            self._handoffs.clear()
+            devs = ring_data.devs
             # NOTE(akscram): Replication parameters like replication_ip
             #                and replication_port are required for
             #                replication process. An old replication
             #                ring doesn't contain this parameters into
             #                device. Old-style pickled rings won't have
             #                region information.
-            for dev in self._devs:
+            for dev in devs:
                 if dev:
                     dev.setdefault('region', 1)
                     if 'ip' in dev:
                         dev.setdefault('replication_ip', dev['ip'])
                     if 'port' in dev:
                         dev.setdefault('replication_port', dev['port'])
+            devs_changed = force or devs != self._devs
+            self._devs = devs
 
             self._replica2part2dev_id = ring_data._replica2part2dev_id
             self._part_shift = ring_data._part_shift
+            if not devs_changed:
+                # nothing below depends on the partition assignments
+                return
             self._rebuild_tier_data()
 
             # Do this now, when we know the data has changed, rather then
@@ -249,6 +391,71 @@ class Ring(object):
         part = struct.unpack_from('>I', key)[0] >> self._part_shift
         return part
 
+    def get_parts_many(self, names):
+        """
+        Get the partitions for many accounts/containers/objects at once.
+
+        The digests of all the names are unpacked together, rather than one
+        struct.unpack_from per name as in :func:`get_part`.
+
+        :param names: iterable of (account, container, obj) tuples; the
+                      container and obj may be left out or None
+        :returns: list of partition numbers, in the order of names
+        """
+        digests = ''.join(hash_path(*name, raw_digest=True)
+                          for name in names)
+        if time() > self._rtime:
+            self._reload()
+        keys = array.array('I')
+        keys.fromstring(digests)
+        if sys.byteorder == 'little':
+            keys.byteswap()
+        # the partition comes from the first 4 bytes of each 16 byte digest
+        part_shift = self._part_shift
+        return [key >> part_shift for key in keys[::4]]
+
+    def get_part_nodes_many(self, parts):
+        """
+        Get the nodes that are responsible for many partitions at once.
+
+        Each distinct partition is only resolved once, and the device ids
+        of all of them are gathered from each replica's table in one go.
+        As with :func:`get_part_nodes`, a node responsible for more than
+        one replica of a partition only appears once in its list.
+
+        :param parts: iterable of partitions to get nodes for
+        :returns: list of lists of node dicts, in the order of parts
+        """
+        if time() > self._rtime:
+            self._reload()
+        parts = list(parts)
+        unique = list(set(parts))
+        if not unique:
+            return []
+        max_part = max(unique)
+        replica_dev_ids = []
+        for r2p2d in self._replica2part2dev_id:
+            if len(r2p2d) > max_part:
+                dev_ids = itemgetter(*unique)(r2p2d)
+                if len(unique) == 1:
+                    dev_ids = (dev_ids,)
+            else:
+                # a partial replica does not cover every partition
+                dev_ids = [r2p2d[part] if part < len(r2p2d) else None
+                           for part in unique]
+            replica_dev_ids.append(dev_ids)
+        devs = self._devs
+        part2nodes = {}
+        for part, dev_ids in izip(unique, izip(*replica_dev_ids)):
+            part_nodes = []
+            seen_ids = set()
+            for dev_id in dev_ids:
+                if dev_id is not None and dev_id not in seen_ids:
+                    part_nodes.append(devs[dev_id])
+                    seen_ids.add(dev_id)
+            part2nodes[part] = part_nodes
+        return [list(part2nodes[part]) for part in parts]
+
     def get_part_nodes(self, part):
         """
         Get the nodes that are responsible for the partition. If one
@@ -312,6 +519,65 @@ class Ring(object):
         """
         if time() > self._rtime:
             self._reload()
+        if self.handoff_cache_size <= 0:
+            for dev in self._get_more_nodes(part):
+                yield dev
+            return
+        # The handoffs already computed for the partition are a list walk;
+        # only past its end is the ring searched, and the nodes found are
+        # kept for the next caller.
+        nodes, more_nodes = self._cached_handoffs(part)
+        index = 0
+        while True:
+            if index == len(nodes):
+                try:
+                    nodes.append(next(more_nodes))
+                except StopIteration:
+                    return
+            yield nodes[index]
+            index += 1
+
+    def precompute_handoffs(self, parts, count=None):
+        """
+        Computes the handoff nodes of partitions ahead of their requests,
+        e.g. for the hot partitions of a proxy.
+
+        :param parts: partitions to compute the handoff nodes of
+        :param count: number of handoff nodes to compute for each
+                      partition; all of them if None
+        """
+        if self.handoff_cache_size <= 0:
+            return
+        if time() > self._rtime:
+            self._reload()
+        for part in parts:
+            nodes, more_nodes = self._cached_handoffs(part)
+            while count is None or len(nodes) < count:
+                try:
+                    nodes.append(next(more_nodes))
+                except StopIteration:
+                    break
+
+    def _cached_handoffs(self, part):
+        """
+        Returns the handoff nodes of a partition computed so far and the
+        generator of the rest, from the LRU kept until the ring changes.
+        """
+        try:
+            entry = self._handoffs.pop(part)
+        except KeyError:
+            entry = ([], self._get_more_nodes(part))
+            while self._handoffs and \
+                    len(self._handoffs) >= self.handoff_cache_size:
+                self._handoffs.popitem(last=False)
+        self._handoffs[part] = entry
+        return entry
+
+    def _get_more_nodes(self, part):
+        """
+        Generator of the handoff nodes of a partition, searched for in the
+        ring as it is now; see :func:`get_more_nodes`.
+        """
         primary_nodes = self._get_part_nodes(part)
 
         used = set(d['id'] for d in primary_nodes)
@@ -1570,7 +1570,7 @@ def remove_file(path):
 
 
 def audit_location_generator(devices, datadir, suffix='',
-                             mount_check=True, logger=None):
+                             mount_check=True, logger=None, device_dirs=None):
     '''
     Given a devices path and a data directory, yield (path, device,
     partition) for all files in that directory
@@ -1583,8 +1583,14 @@ def audit_location_generator(devices, datadir, suffix='',
     :param mount_check: Flag to check if a mount check should be performed
                     on devices
     :param logger: a logger object
+    :param device_dirs: optional list of the devices to look in, all of them
+                        if not given
     '''
     device_dir = listdir(devices)
+    if device_dirs:
+        # ignore any devices that are not under the devices path
+        device_dir = [device for device in device_dir
+                      if device in device_dirs]
     # randomize devices in case of process restart before sweep completed
     shuffle(device_dir)
     for device in device_dir:
@@ -184,6 +184,20 @@ class ContainerBroker(DatabaseBroker):
                 'SELECT object_count from container_stat').fetchone()
             return (row[0] == 0)
 
+    def get_deleted_objects(self, since):
+        """
+        Get the objects deleted after a given time.
+
+        :param since: timestamp to list deletions after
+        :returns: list of (name, delete timestamp) tuples
+        """
+        self._commit_puts_stale_ok()
+        with self.get() as conn:
+            return [tuple(row) for row in conn.execute('''
+                SELECT name, created_at FROM object
+                WHERE deleted = 1 AND created_at > ?
+            ''', (normalize_timestamp(since),))]
+
     def delete_object(self, name, timestamp):
         """
         Mark an object deleted.
@@ -371,7 +385,6 @@ class ContainerBroker(DatabaseBroker):
         :returns: list of tuples of (name, created_at, size, content_type,
                   etag)
         """
-        delim_force_gte = False
         (marker, end_marker, prefix, delimiter, path) = utf8encode(
             marker, end_marker, prefix, delimiter, path)
         self._commit_puts_stale_ok()
@@ -382,79 +395,89 @@ class ContainerBroker(DatabaseBroker):
             delimiter = '/'
         elif delimiter and not prefix:
             prefix = ''
-        orig_marker = marker
+        # The listing is of the names from lower (inclusive or not) up to but
+        # not including upper: the end marker or, with a prefix, the first
+        # name past the names that start with it.
+        if marker and marker >= prefix:
+            lower, inclusive = marker, False
+        else:
+            lower, inclusive = prefix or '', True
+        upper = end_marker
+        if prefix:
+            prefix_end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            if not upper or prefix_end < upper:
+                upper = prefix_end
+        query = '''SELECT name, created_at, size, content_type, etag
+                   FROM object WHERE name %s ?'''
+        if upper:
+            query += ' AND name < ?'
         with self.get() as conn:
-            results = []
-            while len(results) < limit:
-                query = '''SELECT name, created_at, size, content_type, etag
-                           FROM object WHERE'''
-                query_args = []
-                if end_marker:
-                    query += ' name < ? AND'
-                    query_args.append(end_marker)
-                if delim_force_gte:
-                    query += ' name >= ? AND'
-                    query_args.append(marker)
-                    # Always set back to False
-                    delim_force_gte = False
-                elif marker and marker >= prefix:
-                    query += ' name > ? AND'
-                    query_args.append(marker)
-                elif prefix:
-                    query += ' name >= ? AND'
-                    query_args.append(prefix)
-                if self.get_db_version(conn) < 1:
-                    query += ' +deleted = 0'
-                else:
-                    query += ' deleted = 0'
-                query += ' ORDER BY name LIMIT ?'
-                query_args.append(limit - len(results))
-                curs = conn.execute(query, query_args)
+            if self.get_db_version(conn) < 1:
+                query += ' AND +deleted = 0'
+            else:
+                query += ' AND deleted = 0'
+            query += ' ORDER BY name LIMIT ?'
+            # Every query of the listing is one of these two, so sqlite3
+            # prepares each once and reuses it on every skip past a
+            # subdirectory.
+            queries = {True: query % '>=', False: query % '>'}
+
+            def list_objects():
+                curs = conn.cursor(sqlite3.Cursor)
                 curs.row_factory = None
+                try:
+                    return list_objects_on(curs)
+                finally:
+                    curs.close()
+
+            def list_objects_on(curs):
+                def execute(lower, inclusive, limit):
+                    args = [lower, upper, limit] if upper else [lower, limit]
+                    return curs.execute(queries[inclusive], args)
 
-                if prefix is None:
-                    # A delimiter without a specified prefix is ignored
-                    return [r for r in curs]
                 if not delimiter:
-                    if not prefix:
-                        # It is possible to have a delimiter but no prefix
-                        # specified. As above, the prefix will be set to the
-                        # empty string, so avoid performing the extra work to
-                        # check against an empty prefix.
-                        return [r for r in curs]
-                    else:
-                        return [r for r in curs if r[0].startswith(prefix)]
+                    return [r for r in execute(lower, inclusive, limit)]
 
                 # We have a delimiter and a prefix (possibly empty string) to
-                # handle
-                rowcount = 0
-                for row in curs:
-                    rowcount += 1
-                    marker = name = row[0]
-                    if len(results) >= limit or not name.startswith(prefix):
-                        curs.close()
-                        return results
-                    end = name.find(delimiter, len(prefix))
-                    if path is not None:
-                        if name == path:
-                            continue
-                        if end >= 0 and len(name) > end + len(delimiter):
-                            marker = name[:end] + chr(ord(delimiter) + 1)
-                            curs.close()
+                # handle: list the names up to the delimiter once, as a
+                # subdirectory, then skip past all the names under it with
+                # a new query.
+                past_delimiter = chr(ord(delimiter) + 1)
+                start, start_inclusive = lower, inclusive
+                results = []
+                while len(results) < limit:
+                    wanted = limit - len(results)
+                    rowcount = 0
+                    for row in execute(start, start_inclusive, wanted):
+                        rowcount += 1
+                        name = row[0]
+                        end = name.find(delimiter, len(prefix))
+                        if path is not None:
+                            if name == path:
+                                continue
+                            if end >= 0 and len(name) > end + len(delimiter):
+                                start = name[:end] + past_delimiter
+                                start_inclusive = True
+                                break
+                        elif end > 0:
+                            dir_name = name[:end + 1]
+                            if dir_name != marker:
+                                results.append([dir_name, '0', 0, None, ''])
+                            start = name[:end] + past_delimiter
+                            start_inclusive = True
                             break
-                    elif end > 0:
-                        marker = name[:end] + chr(ord(delimiter) + 1)
-                        # we want result to be inclusinve of delim+1
-                        delim_force_gte = True
-                        dir_name = name[:end + 1]
-                        if dir_name != orig_marker:
-                            results.append([dir_name, '0', 0, None, ''])
-                        curs.close()
-                        break
-                    results.append(row)
-                if not rowcount:
-                    break
-            return results
+                        results.append(row)
+                    else:
+                        if rowcount < wanted:
+                            # nothing left in the listing's range
+                            break
+                        start, start_inclusive = name, False
+                return results
+
+            # The listing runs all its queries on one plain cursor, and over
+            # again if the database was locked, rather than each query on a
+            # cursor of its own with its own lock timeout.
+            return conn.retry_locked(list_objects)
 
     def merge_items(self, item_list, source=None):
         """
@@ -18,11 +18,13 @@ from random import random
 from swift.container import server as container_server
 from swift.container.backend import ContainerBroker
 from swift.common.utils import get_logger, audit_location_generator, \
-    config_true_value
+    config_true_value, listdir
 from swift.common.request_helpers import is_sys_or_user_meta
 from swift.common.daemon import Daemon
 from eventlet import Timeout
-from swift.metadata.utils import Sender
+from swift.metadata.utils import CrawlCheckpoints, CrawlRateLimiter, \
+    container_tombstone, db_changed_since, db_size, get_metadata_ring, \
+    get_sender, object_tombstone, run_device_workers
 
 
 class ContainerCrawler(Daemon):
@@ -34,26 +36,77 @@ class ContainerCrawler(Daemon):
         self.devices = conf.get('devices', '/srv/node')
         self.ip = conf.get('md-server-ip', '127.0.0.1')
         self.port = conf.get('md-server-port', '6090')
+        # set when the metadata store is sharded by account
+        self.metadata_ring = get_metadata_ring(conf)
         self.mount_check = config_true_value(conf.get('mount_check', 'true'))
         self.interval = int(conf.get('interval', 30))
+        # number of devices crawled at once, each by a worker process
+        self.concurrency = int(conf.get('concurrency', 1))
 
         #swift.common.db.DB_PREALLOCATION = \
         #config_true_value(conf.get('db_preallocation', 'f'))
-        self.crawled_time = time.time()  # last time this daemon ran
+        self.checkpoints = CrawlCheckpoints(conf, 'container_crawler',
+                                            self.logger)
 
     def _one_crawler_pass(self):
+        if self.concurrency > 1:
+            run_device_workers(self.crawl_devices, listdir(self.devices),
+                               self.concurrency, self.logger)
+        else:
+            self.crawl_devices()
+
+    def crawl_devices(self, device_dirs=None):
+        """
+        Crawls the container DBs of the given devices, partition by
+        partition.
+
+        :param device_dirs: devices to crawl, all of them if not given
+        """
+        begin = time.time()
+        self.checkpoints.reload()
+        limiter = CrawlRateLimiter(self.conf)
         all_locs = audit_location_generator(self.devices,
                                             container_server.DATADIR, '.db',
                                             mount_check=self.mount_check,
-                                            logger=self.logger)
-        metaList = []
+                                            logger=self.logger,
+                                            device_dirs=device_dirs)
+        crawled = set()
+        failed = set()
+
+        def on_batch(success, tags):
+            if not success:
+                failed.update(tags)
+
+        ContainerSender = get_sender(
+            self.conf, 'container_crawler', self.ip, self.port, self.logger,
+            ring=self.metadata_ring, on_batch=on_batch)
+        # tombstones of deleted containers, and of the objects deleted
+        # from them
+        ContainerDeleter = get_sender(
+            self.conf, 'container_crawler', self.ip, self.port, self.logger,
+            ring=self.metadata_ring, on_batch=on_batch, method='DELETE')
+        ObjectDeleter = get_sender(
+            self.conf, 'object_crawler', self.ip, self.port, self.logger,
+            ring=self.metadata_ring, on_batch=on_batch, method='DELETE')
         for path, device, partition in all_locs:
+            crawled.add((device, partition))
+            checkpoint = self.checkpoints.get(device, partition)
+            if not db_changed_since(path, checkpoint):
+                continue
             metaDict = self.container_crawl(path)
             if metaDict != {}:
-                metaList.append(format_metadata(metaDict))
-        ContainerSender = Sender(self.conf)
-        ContainerSender.sendData(
-            metaList, 'container_crawler', self.ip, self.port)
+                ContainerSender.add(format_metadata(metaDict),
+                                    (device, partition))
+            for tombstone in self.container_tombstones(path, checkpoint):
+                if 'object_uri' in tombstone:
+                    ObjectDeleter.add(tombstone, (device, partition))
+                else:
+                    ContainerDeleter.add(tombstone, (device, partition))
+            limiter.wait(db_size(path))
+        for sender in (ContainerSender, ContainerDeleter, ObjectDeleter):
+            sender.flush()
+            sender.close()
+        self.checkpoints.advance(crawled - failed, begin)
 
     def run_forever(self, *args, **kwargs):
         """Run the container crawler until stopped."""
@@ -82,9 +135,6 @@ class ContainerCrawler(Daemon):
         try:
             broker = ContainerBroker(path)
             if not broker.is_deleted():
-                #reportedTime = broker.get_info()['put_timestamp']
-                #if normalize_timestamp(self.crawled_time)
-                #< reportedTime < normalize_timestamp(start_time):
                 metaDict = broker.get_info()
                 metaDict.update(
                     (key, value)
@@ -94,6 +144,31 @@ class ContainerCrawler(Daemon):
             self.logger.increment('failures')
         return metaDict
 
+    def container_tombstones(self, path, since):
+        """
+        Collects the tombstones of the given container path: one for each
+        object deleted after since, and one for the container itself once
+        it is deleted.
+
+        :param path: the path to an container db
+        :param since: crawl position of the container's partition
+        :returns: list of object and container tombstones
+        """
+        tombstones = []
+        try:
+            broker = ContainerBroker(path)
+            info = broker.get_info()
+            for name, timestamp in broker.get_deleted_objects(since):
+                tombstones.append(object_tombstone(
+                    info['account'], info['container'], name, timestamp))
+            if broker.is_deleted():
+                tombstones.append(container_tombstone(
+                    info['account'], info['container'],
+                    info['delete_timestamp']))
+        except (Exception, Timeout):
+            self.logger.increment('failures')
+        return tombstones
+
 
 def format_metadata(data):
     metadata = {}
@@ -14,11 +14,143 @@
 # limitations under the License.
 import os
 import time
-from string import maketrans
+from swift import gettext_ as _
 from swift.common.utils import normalize_timestamp
 from swift.common.db import DatabaseBroker
 from swift.common.utils import json
 
+"""
+List of system attributes supported from OSMS API
+"""
+ACCOUNT_SYS_ATTRS = [
+    'account_uri',
+    'account_name',
+    'account_tenant_id',
+    'account_first_use_time',
+    'account_last_modified_time',
+    'account_last_changed_time',
+    'account_delete_time',
+    'account_last_activity_time',
+    'account_container_count',
+    'account_object_count',
+    'account_bytes_used']
+
+CONTAINER_SYS_ATTRS = [
+    'container_uri',
+    'container_name',
+    'container_account_name',
+    'container_create_time',
+    'container_last_modified_time',
+    'container_last_changed_time',
+    'container_delete_time',
+    'container_last_activity_time',
+    'container_read_permissions',
+    'container_write_permissions',
+    'container_sync_to',
+    'container_sync_key',
+    'container_versions_location',
+    'container_object_count',
+    'container_bytes_used']
+
+OBJECT_SYS_ATTRS = [
+    'object_uri',
+    'object_name',
+    'object_account_name',
+    'object_container_name',
+    'object_location',
+    'object_uri_create_time',
+    'object_last_modified_time',
+    'object_last_changed_time',
+    'object_delete_time',
+    'object_last_activity_time',
+    'object_etag_hash',
+    'object_content_type',
+    'object_content_length',
+    'object_content_encoding',
+    'object_content_disposition',
+    'object_content_language',
+    'object_cache_control',
+    'object_delete_at',
+    'object_manifest_type',
+    'object_manifest',
+    'object_access_control_allow_origin',
+    'object_access_control_allow_credentials',
+    'object_access_control_expose_headers',
+    'object_access_control_max_age',
+    'object_access_control_allow_methods',
+    'object_access_control_allow_headers',
+    'object_origin',
+    'object_access_control_request_method',
+    'object_access_control_request_headers']
+
+"""
+Table, uri column and system attributes of each kind of item
+"""
+SCOPES = {
+    'account': ('account_metadata', 'account_uri', ACCOUNT_SYS_ATTRS),
+    'container': ('container_metadata', 'container_uri', CONTAINER_SYS_ATTRS),
+    'object': ('object_metadata', 'object_uri', OBJECT_SYS_ATTRS),
+}
+
+CUSTOM_MD_INSERT = """
+    INSERT OR REPLACE INTO custom_metadata (
+        uri,
+        custom_key,
+        custom_value,
+        timestamp
+    )
+    VALUES (?, ?, ?, ?)
+"""
+
+"""
+Indexes backing the scope filters and joins of the search API, and lookups
+of custom metadata by key and value. The scope indexes end with the uri
+column so uri-only listings are answered from the index alone.
+"""
+METADATA_INDEXES = """
+    CREATE INDEX IF NOT EXISTS account_name_idx
+    ON account_metadata (account_name, account_uri);
+    CREATE INDEX IF NOT EXISTS container_scope_idx
+    ON container_metadata (container_account_name, container_name,
+                           container_uri);
+    CREATE INDEX IF NOT EXISTS object_scope_idx
+    ON object_metadata (object_account_name, object_container_name,
+                        object_uri);
+    CREATE INDEX IF NOT EXISTS custom_key_value_idx
+    ON custom_metadata (custom_key, custom_value, uri);
+"""
+
+"""
+Walks the objects of an account in uri order, so paged listings of a whole
+account never have to sort the account's objects to find the next page.
+"""
+LISTING_INDEXES = """
+    CREATE INDEX IF NOT EXISTS object_account_uri_idx
+    ON object_metadata (object_account_name, object_uri);
+"""
+
+"""
+Tombstones of deleted accounts, containers and objects. Their rows are
+removed as soon as the delete is ingested; the tombstone stays behind until
+the compactor reclaims it, so metadata crawled before the delete cannot
+bring the item back.
+"""
+TOMBSTONE_TABLE = """
+    CREATE TABLE IF NOT EXISTS metadata_tombstone (
+        uri TEXT PRIMARY KEY,
+        delete_time TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS tombstone_delete_time_idx
+    ON metadata_tombstone (delete_time);
+"""
+
+# PRAGMA auto_vacuum of a DB whose free pages are given back on request
+INCREMENTAL_VACUUM = 2
+
+# most uris looked up by a single statement, well under SQLite's limit on
+# the number of parameters
+URI_CHUNK_SIZE = 500
+
 
 class MetadataBroker(DatabaseBroker):
     """ 
@@ -30,12 +162,69 @@ class MetadataBroker(DatabaseBroker):
     db_contains_type = 'object'
     db_reclaim_timestamp = 'created_at'
 
-    
+    # Schema migrations, in order. Applying the Nth entry takes the DB from
+    # schema version N (stored in PRAGMA user_version) to N + 1. Migrations
+    # must be safe to run twice, since two servers may race to apply them.
+    schema_migrations = (
+        '_migrate_add_indexes',
+        '_migrate_add_listing_indexes',
+        '_migrate_add_tombstones',
+    )
+
     def _initialize(self, conn, timestamp):
         self.create_account_md_table(conn)
         self.create_container_md_table(conn)
         self.create_object_md_table(conn)
         self.create_custom_md_table(conn)
+        self._migrate(conn)
+        # Nothing has been written yet, so switching to incremental
+        # vacuuming, which the compactor relies on, is cheap.
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+
+    @property
+    def schema_version(self):
+        """The schema version a fully migrated DB is at"""
+        return len(self.schema_migrations)
+
+    def get_schema_version(self, conn):
+        """Returns the schema version of the DB behind conn"""
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def _migrate(self, conn):
+        """
+        Apply any schema migration the DB behind conn is missing.
+
+        :returns: number of migrations applied
+        """
+        start = self.get_schema_version(conn)
+        for version in xrange(start, self.schema_version):
+            getattr(self, self.schema_migrations[version])(conn)
+            conn.execute('PRAGMA user_version = %d' % (version + 1))
+        return max(self.schema_version - start, 0)
+
+    def migrate(self):
+        """
+        Bring an existing DB up to the current schema version.
+
+        :returns: number of migrations applied
+        """
+        with self.get() as conn:
+            applied = self._migrate(conn)
+            conn.commit()
+        if applied:
+            self.logger.info(_('Migrated %(db)s to schema version %(ver)d'),
+                             {'db': self.db_file, 'ver': self.schema_version})
+        return applied
+
+    def _migrate_add_indexes(self, conn):
+        conn.executescript(METADATA_INDEXES)
+
+    def _migrate_add_listing_indexes(self, conn):
+        conn.executescript(LISTING_INDEXES)
+
+    def _migrate_add_tombstones(self, conn):
+        conn.executescript(TOMBSTONE_TABLE)
 
     def create_account_md_table(self, conn):
         conn.executescript("""
@@ -122,201 +311,178 @@ class MetadataBroker(DatabaseBroker):
         """)
 
     def insert_custom_md(self, conn, uri, key, value):
-        query = '''
-            INSERT OR REPLACE INTO custom_metadata (
-                uri,
-                custom_key,
-                custom_value,
-                timestamp
-            )
-            VALUES ("%s","%s","%s","%s")
-            ;
-        '''
-
-        # Build and execute query for each requested insertion
-        formatted_query = \
-            query % (uri, key, value, normalize_timestamp(time.time()))
-        conn.execute(formatted_query)
+        """Insert or replace a single custom metadata key of a uri"""
+        conn.execute(CUSTOM_MD_INSERT,
+                     (uri, key, value, normalize_timestamp(time.time())))
 
+    def _insert_md(self, table, columns, custom_prefix, data):
+        """
+        Bulk insert a batch of metadata rows, and their custom metadata,
+        in a single transaction.
+
+        Both tables are written with one parameterized statement each,
+        run through executemany, so sqlite only has to compile each
+        statement once per connection. All custom rows in the batch share
+        one timestamp. Crawlers send every custom key of an item, so the
+        keys an item no longer has are dropped.
+
+        Items last modified before they were deleted, according to their
+        tombstones, are skipped; newer ones bring the item back.
+
+        :param table: system metadata table to insert into
+        :param columns: columns of that table, the first being the uri
+        :param custom_prefix: prefix of the custom metadata keys for this
+                              kind of item, e.g. 'object_meta'
+        :param data: list of metadata dicts as sent by the crawlers
+        """
+        uri_column = columns[0]
+        modified_column = uri_column[:-len('_uri')] + '_last_modified_time'
+        query = 'INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+            table, ', '.join(columns), ', '.join('?' * len(columns)))
+        timestamp = normalize_timestamp(time.time())
+        with self.get() as conn:
+            deleted = self._get_timestamps(
+                conn, 'SELECT uri, delete_time FROM metadata_tombstone '
+                'WHERE uri IN (%s)', [item[uri_column] for item in data])
+            data = [item for item in data
+                    if item[uri_column] not in deleted or
+                    timestamp_value(item[modified_column]) >
+                    deleted[item[uri_column]]]
+            conn.executemany(
+                'DELETE FROM metadata_tombstone WHERE uri = ?',
+                ((item[uri_column],) for item in data
+                 if item[uri_column] in deleted))
+            conn.executemany(
+                query, (tuple(item[column] for column in columns)
+                        for item in data))
+            conn.executemany(
+                'DELETE FROM custom_metadata WHERE uri = ?',
+                ((item[uri_column],) for item in data))
+            conn.executemany(
+                CUSTOM_MD_INSERT,
+                ((item[uri_column], key, value, timestamp)
+                 for item in data
+                 for key, value in item.iteritems()
+                 if key.startswith(custom_prefix)))
+            conn.commit()
 
     def insert_account_md(self, data):
         """Data insertion methods for account metadata table"""
-        with self.get() as conn:
-            query = '''
-                INSERT OR REPLACE INTO account_metadata (
-                    account_uri,
-                    account_name,
-                    account_tenant_id,
-                    account_first_use_time,
-                    account_last_modified_time,
-                    account_last_changed_time,
-                    account_delete_time,
-                    account_last_activity_time,
-                    account_container_count,
-                    account_object_count,
-                    account_bytes_used
-                )
-                VALUES ("%s","%s","%s","%s","%s","%s","%s","%s","%s","%s","%s")
-                ;
-            '''
-            # Build and execute query for each requested insertion
-            conn.commit()
-            for item in data:
-                formatted_query = query % (
-                    item['account_uri'],
-                    item['account_name'],
-                    item['account_tenant_id'],
-                    item['account_first_use_time'],
-                    item['account_last_modified_time'],
-                    item['account_last_changed_time'],
-                    item['account_delete_time'],
-                    item['account_last_activity_time'],
-                    item['account_container_count'],
-                    item['account_object_count'],
-                    item['account_bytes_used']
-                )
-                for custom in item:
-                    if(custom.startswith("account_meta")):
-                        self.insert_custom_md(
-                            conn, item['account_uri'], custom, item[custom])
-                conn.execute(formatted_query)
-            conn.commit()
+        self._insert_md(
+            'account_metadata', ACCOUNT_SYS_ATTRS, 'account_meta', data)
 
     def insert_container_md(self, data):
         """Data insertion methods for container metadata table"""
-        with self.get() as conn:
-            query = '''
-                INSERT OR REPLACE INTO container_metadata (
-                    container_uri,
-                    container_name,
-                    container_account_name,
-                    container_create_time,
-                    container_last_modified_time,
-                    container_last_changed_time,
-                    container_delete_time,
-                    container_last_activity_time,
-                    container_read_permissions,
-                    container_write_permissions,
-                    container_sync_to,
-                    container_sync_key,
-                    container_versions_location,
-                    container_object_count,
-                    container_bytes_used
-                )
-                VALUES (
-                    "%s", "%s", "%s", "%s",
-                    "%s", "%s", "%s", "%s",
-                    "%s", "%s", "%s", "%s",
-                    "%s", "%s", "%s"
-                )
-                ;
-            '''
-            conn.commit()
-            for item in data:
-                formatted_query = query % (
-                    item['container_uri'],
-                    item['container_name'],
-                    item['container_account_name'],
-                    item['container_create_time'],
-                    item['container_last_modified_time'],
-                    item['container_last_changed_time'],
-                    item['container_delete_time'],
-                    item['container_last_activity_time'],
-                    item['container_read_permissions'],
-                    item['container_write_permissions'],
-                    item['container_sync_to'],
-                    item['container_sync_key'],
-                    item['container_versions_location'],
-                    item['container_object_count'],
-                    item['container_bytes_used']
-                )
-                for custom in item:
-                    if(custom.startswith("container_meta")):
-                        self.insert_custom_md(
-                            conn, item['container_uri'], custom, item[custom])
-                conn.execute(formatted_query)
-            conn.commit()
+        self._insert_md(
+            'container_metadata', CONTAINER_SYS_ATTRS, 'container_meta', data)
 
     def insert_object_md(self, data):
         """Data insertion methods for object metadata table"""
+        self._insert_md(
+            'object_metadata', OBJECT_SYS_ATTRS, 'object_meta', data)
+
+    def delete_md(self, scope, data):
+        """
+        Ingests a batch of tombstones: the rows and custom metadata of the
+        deleted items are removed, and a tombstone of each is kept. A
+        tombstone older than the metadata already ingested for its item
+        is ignored.
+
+        :param scope: 'account', 'container' or 'object'
+        :param data: list of dicts with the uri (e.g. 'object_uri') and
+                     delete time (e.g. 'object_delete_time') of each item
+        """
+        table, uri_column, _junk = SCOPES[scope]
+        delete_column = scope + '_delete_time'
+        uris = [item[uri_column] for item in data]
         with self.get() as conn:
-            query = '''
-                INSERT OR REPLACE INTO object_metadata (
-                    object_uri,
-                    object_name,
-                    object_account_name,
-                    object_container_name,
-                    object_location,
-                    object_uri_create_time,
-                    object_last_modified_time,
-                    object_last_changed_time,
-                    object_delete_time,
-                    object_last_activity_time,
-                    object_etag_hash,
-                    object_content_type,
-                    object_content_length,
-                    object_content_encoding,
-                    object_content_disposition,
-                    object_content_language,
-                    object_cache_control,
-                    object_delete_at,
-                    object_manifest_type,
-                    object_manifest,
-                    object_access_control_allow_origin,
-                    object_access_control_allow_credentials,
-                    object_access_control_expose_headers,
-                    object_access_control_max_age,
-                    object_access_control_allow_methods,
-                    object_access_control_allow_headers,
-                    object_origin,
-                    object_access_control_request_method,
-                    object_access_control_request_headers
-                ) VALUES (
-                    "%s", "%s", "%s", "%s", "%s", "%s", "%s", "%s", "%s", "%s",
-                    "%s", "%s", "%s", "%s", "%s", "%s", "%s", "%s", "%s", "%s",
-                    "%s", "%s", "%s", "%s", "%s", "%s", "%s", "%s", "%s"
-                )
-                ;
-            '''
-            conn.commit()
+            modified = self._get_timestamps(
+                conn, 'SELECT %s, %s_last_modified_time FROM %s '
+                'WHERE %s IN (%%s)' % (uri_column, scope, table, uri_column),
+                uris)
+            deleted = self._get_timestamps(
+                conn, 'SELECT uri, delete_time FROM metadata_tombstone '
+                'WHERE uri IN (%s)', uris)
+            tombstones = {}
             for item in data:
-                formatted_query = query % (
-                    item['object_uri'],
-                    item['object_name'],
-                    item['object_account_name'],
-                    item['object_container_name'],
-                    item['object_location'],
-                    item['object_uri_create_time'],
-                    item['object_last_modified_time'],
-                    item['object_last_changed_time'],
-                    item['object_delete_time'],
-                    item['object_last_activity_time'],
-                    item['object_etag_hash'],
-                    item['object_content_type'],
-                    item['object_content_length'],
-                    item['object_content_encoding'],
-                    item['object_content_disposition'],
-                    item['object_content_language'],
-                    item['object_cache_control'],
-                    item['object_delete_at'],
-                    item['object_manifest_type'],
-                    item['object_manifest'],
-                    item['object_access_control_allow_origin'],
-                    item['object_access_control_allow_credentials'],
-                    item['object_access_control_expose_headers'],
-                    item['object_access_control_max_age'],
-                    item['object_access_control_allow_methods'],
-                    item['object_access_control_allow_headers'],
-                    item['object_origin'],
-                    item['object_access_control_request_method'],
-                    item['object_access_control_request_headers']
-                )
-                for custom in item:
-                    if(custom.startswith("object_meta")):
-                        self.insert_custom_md(
-                            conn, item['object_uri'], custom, item[custom])
-                conn.execute(formatted_query)
+                uri = item[uri_column]
+                delete_time = timestamp_value(item[delete_column])
+                if modified.get(uri, 0) > delete_time or \
+                        deleted.get(uri, -1) >= delete_time or \
+                        tombstones.get(uri, -1) >= delete_time:
+                    continue
+                tombstones[uri] = delete_time
+            conn.executemany(
+                'INSERT OR REPLACE INTO metadata_tombstone (uri, delete_time) '
+                'VALUES (?, ?)',
+                ((uri, normalize_timestamp(delete_time))
+                 for uri, delete_time in tombstones.iteritems()))
+            conn.executemany(
+                'DELETE FROM %s WHERE %s = ?' % (table, uri_column),
+                ((uri,) for uri in tombstones))
+            conn.executemany(
+                'DELETE FROM custom_metadata WHERE uri = ?',
+                ((uri,) for uri in tombstones))
+            conn.commit()
+
+    def _get_timestamps(self, conn, query, uris):
+        """
+        Looks up a timestamp for each of a list of uris.
+
+        :param conn: connection to run the query on
+        :param query: SELECT of (uri, timestamp) rows, with a 'uri IN (%s)'
+                      condition to fill with placeholders
+        :param uris: uris to look up, a chunk of them at a time
+        :returns: dict of uri to timestamp, as a float
+        """
+        timestamps = {}
+        for i in xrange(0, len(uris), URI_CHUNK_SIZE):
+            chunk = uris[i:i + URI_CHUNK_SIZE]
+            for uri, timestamp in conn.execute(
+                    query % ','.join('?' * len(chunk)), chunk):
+                timestamps[uri] = timestamp_value(timestamp)
+        return timestamps
+
+    def reclaim(self, age_timestamp, sync_timestamp):
+        """
+        Removes the tombstones of items deleted before age_timestamp, and
+        the replication sync points last updated before sync_timestamp.
+
+        :param age_timestamp: max delete_time of tombstones to remove
+        :param sync_timestamp: max updated_at of sync rows to remove
+        :returns: number of tombstones removed
+        """
+        with self.get() as conn:
+            reclaimed = conn.execute(
+                'DELETE FROM metadata_tombstone WHERE delete_time < ?',
+                (normalize_timestamp(age_timestamp),)).rowcount
+            conn.execute('DELETE FROM outgoing_sync WHERE updated_at < ?',
+                         (sync_timestamp,))
+            conn.execute('DELETE FROM incoming_sync WHERE updated_at < ?',
+                         (sync_timestamp,))
             conn.commit()
+        return reclaimed
+
+    def vacuum(self, pages):
+        """
+        Gives up to pages of the DB's free pages back to the file system.
+        A DB created before incremental vacuuming was turned on is first
+        switched over, which takes one full VACUUM.
+
+        :param pages: most free pages to give back
+        :returns: number of free pages left in the DB
+        """
+        with self.get() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != \
+                    INCREMENTAL_VACUUM:
+                self.logger.info(
+                    _('Switching %s to incremental vacuuming'), self.db_file)
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+            else:
+                conn.execute(
+                    'PRAGMA incremental_vacuum(%d)' % pages).fetchall()
+            return conn.execute('PRAGMA freelist_count').fetchone()[0]
 
     def getAll(self):
         """
@@ -358,6 +524,15 @@ class MetadataBroker(DatabaseBroker):
         if attrsStartWith(attrs) == "BAD":
             return "BAD"
 
+        # Select each attribute once, and the uri of the item last, so the
+        # query can be wrapped in another SELECT without clashing names.
+        uri_column = attrsStartWith(attrs) + '_uri'
+        columns = []
+        for attr in attrs.split(','):
+            if attr not in columns and attr != uri_column:
+                columns.append(attr)
+        attrs = ','.join(columns + [uri_column])
+
         # JOIN all our tables together so the API can do queries
         # across tables.
         fromStr = """account_metadata
@@ -367,100 +542,85 @@ class MetadataBroker(DatabaseBroker):
             ON account_name=object_account_name
             AND container_name=object_container_name"""
 
+        # The scope is bound from scope_args(), never spliced into the SQL.
+        domain = attrsStartWith(attrs)
+
         # Object Scope
         if obj != "" and obj is not None:
-            Ouri = "'/" + acc + "/" + con + "/" + obj + "'"
-            Curi = "'/" + acc + "/" + con + "'"
-            Auri = "'/" + acc + "'"
-            domain = attrsStartWith(attrs)
-            if domain == 'object':
-                uri = Ouri
-            elif domain == 'container':
-                uri = Curi
-            else:
-                uri = Auri
             return """
-                SELECT distinct %s,%s_uri
+                SELECT distinct %s
                 FROM %s
-                WHERE %s_uri=%s
-            """ % (attrs, domain, fromStr, domain, uri)
+                WHERE %s_uri=:scope_%s_uri
+            """ % (attrs, fromStr, domain, domain)
 
         # Container Scope
         elif con != "" and con is not None:
-            uri = "'/" + acc + "/" + con + "'"
-            Auri = "'/" + acc + "'"
-            if attrsStartWith(attrs) == 'object':
+            if domain == 'object':
+                # Outer joins, so objects are listed even before their
+                # container and account have been crawled.
                 return """
-                    SELECT distinct %s,object_uri
+                    SELECT distinct %s
                     FROM object_metadata
-                    WHERE object_container_name=%s
-                """ % (attrs, "'" + con + "'")
+                    LEFT JOIN container_metadata
+                    ON object_account_name=container_account_name
+                    AND object_container_name=container_name
+                    LEFT JOIN account_metadata
+                    ON object_account_name=account_name
+                    WHERE object_account_name=:scope_account
+                    AND object_container_name=:scope_container
+                """ % attrs
 
-            elif attrsStartWith(attrs) == 'container':
+            elif domain == 'container':
                 return """
-                    SELECT distinct %s,container_uri
+                    SELECT distinct %s
                     FROM %s
-                    WHERE container_uri=%s
-                """ % (attrs, fromStr, uri)
+                    WHERE container_uri=:scope_container_uri
+                """ % (attrs, fromStr)
 
-            elif attrsStartWith(attrs) == 'account':
+            elif domain == 'account':
                 return """
-                    SELECT distinct %s,account_uri
+                    SELECT distinct %s
                     FROM %s
-                    WHERE account_uri=%s
-                """ % (attrs, fromStr, Auri)
+                    WHERE account_uri=:scope_account_uri
+                """ % (attrs, fromStr)
 
         # Account scope
         elif acc != "" and acc is not None:
-            uri = "'/" + acc + "'"
-            if attrsStartWith(attrs) == 'object':
+            if domain == 'object':
                 return """
-                    SELECT distinct %s,object_uri
+                    SELECT distinct %s
                     FROM %s
-                    WHERE object_account_name='%s'
-                """ % (attrs, fromStr, acc)
+                    WHERE object_account_name=:scope_account
+                """ % (attrs, fromStr)
 
-            elif attrsStartWith(attrs) == 'container':
+            elif domain == 'container':
                 return """
-                    SELECT distinct %s,container_uri
+                    SELECT distinct %s
                     FROM %s
-                    WHERE container_account_name='%s'
-                """ % (attrs, fromStr, acc)
+                    WHERE container_account_name=:scope_account
+                """ % (attrs, fromStr)
 
-            elif attrsStartWith(attrs) == 'account':
+            elif domain == 'account':
                 return """
-                    SELECT distinct %s,account_uri
+                    SELECT distinct %s
                     FROM %s
-                    WHERE account_uri=%s
-                """ % (attrs, fromStr, uri)
+                    WHERE account_uri=:scope_account_uri
+                """ % (attrs, fromStr)
 
-    
-    def get_uri_query(self, sql, queries):
-        '''
-        URI Query parser
-        Takes the output of get_attributes_query() as input (sql), and adds
-        additional query information based on ?query=<> from the URI
-        If Query refrences custom attribute, replace condition with EXECPT
-        Subquery on custom_metadata table with condition inside where clause.
-        Also preforms sanitation preventing SQL injection.
-        '''
-        queries = queries.replace("%20", " ")
-        queries = queries.translate(None,';%[]&')
-        query = ""
-        querysplit = queries.split(" ")
-        for i in querysplit:
-            if (i.startswith("object_meta") 
-                        or i.startswith("container_meta") 
-                        or i.startswith("account_meta")):
-                first = i.split("_")[0]
-                key = "_".join(i.translate(maketrans("<>!=","____")).split("_")[:3])
-                i = """EXISTS (SELECT * FROM custom_metadata 
-                        where uri == %s_uri AND custom_key='%s' 
-                        AND custom_value%s)""" %\
-                        (first,key,i[len(key):])
-            query += " " + i 
-
-        return sql + " AND" + query
+    def get_uri_query(self, sql, args, plan):
+        """
+        Adds the condition of a ?query=<> to the WHERE clause of a query
+        built by get_attributes_query().
+
+        :param sql: the query to narrow
+        :param args: the parameters of sql
+        :param plan: the QueryPlan the query compiled to, see
+                     swift.metadata.query
+        :returns: (sql, args) of the narrowed query
+        """
+        args = dict(args)
+        args.update(plan.args)
+        return sql + ' AND ' + plan.sql, args
 
     def custom_attributes_query(self, customAttrs, sysMetaList,
                                 all_obj_meta, all_con_meta, all_acc_meta):
@@ -468,30 +628,58 @@ class MetadataBroker(DatabaseBroker):
         This function executes a query to get custom Attributes
         and merge them into the list of dictionaries which is created
         before this function is called. Only merges attributes in the
-        customAttrs list passed in.
+        customAttrs list passed in, plus every custom attribute of a kind
+        whose all_*_meta flag is set.
+
+        The uris of the result set are loaded into a temporary table and
+        joined against custom_metadata, so all custom attributes are
+        fetched by a single statement however many rows there are.
         """
+        keys = [key for key in customAttrs.split(',') if key]
+        prefixes = [prefix for prefix, wanted in (
+            ('object_meta', all_obj_meta),
+            ('container_meta', all_con_meta),
+            ('account_meta', all_acc_meta)) if wanted]
+        if not sysMetaList or not (keys or prefixes):
+            return sysMetaList
+        by_uri = {}
+        for x in sysMetaList:
+            uri = x.keys()[0]
+            by_uri.setdefault(uri, []).append(x[uri])
+        conditions = []
+        args = []
+        if keys:
+            conditions.append(
+                'custom_key IN (%s)' % ','.join('?' * len(keys)))
+            args.extend(keys)
+        for prefix in prefixes:
+            conditions.append('substr(custom_key, 1, ?) = ?')
+            args.extend((len(prefix), prefix))
         with self.get() as conn:
-            for x in sysMetaList:
-                uri = x.keys()[0]
-                query = """SELECT custom_key, custom_value
-                FROM custom_metadata
-                WHERE uri='%s'
-                """ % uri
-                cur = conn.cursor()
-                cur.execute(query)
-                l = cur.fetchall()
-                for d in l:
-                    if (d['custom_key'] in customAttrs.split(',')) or \
-                        (all_obj_meta and
-                            d['custom_key'].startswith("object_meta")) or \
-                        (all_con_meta and
-                            d['custom_key'].startswith("container_meta")) or \
-                        (all_acc_meta and
-                            d['custom_key'].startswith("account_meta")):
-                                x[uri][d['custom_key']] = d['custom_value']
+            conn.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS result_uri (
+                    uri TEXT PRIMARY KEY
+                )""")
+            # The rows only live until get() rolls the transaction back.
+            conn.executemany(
+                'INSERT OR IGNORE INTO result_uri (uri) VALUES (?)',
+                ((uri,) for uri in by_uri))
+            # CROSS JOIN keeps result_uri as the outer loop, so the work
+            # done is bound by the size of the result set rather than by
+            # how common the requested keys are across the whole DB.
+            rows = conn.execute("""
+                SELECT custom_metadata.uri, custom_key, custom_value
+                FROM result_uri
+                CROSS JOIN custom_metadata
+                ON custom_metadata.uri = result_uri.uri
+                WHERE %s
+            """ % ' OR '.join(conditions), args)
+            for row in rows:
+                for md in by_uri[row['uri']]:
+                    md[row['custom_key']] = row['custom_value']
         return sysMetaList
 
-    def execute_query(self, query, acc, con, obj, includeURI):
+    def execute_query(self, query, acc, con, obj, includeURI, args=None):
         """
         Execute the main query.
         Executes a query which has been built
@@ -504,46 +692,151 @@ class MetadataBroker(DatabaseBroker):
         Each 'row' is now a dictionary in a list
         This list of dictonaries is returned
         """
+        if args is None:
+            args = scope_args(acc, con, obj)
         with self.get() as conn:
             conn.row_factory = dict_factory
             cur = conn.cursor()
-            cur.execute(query)
-            queryList = cur.fetchall()
-            retList = []
-            for row in queryList:
-                if not includeURI:
-                    try:
-                        uri = row['object_uri']
-                        retList.append({uri: row})
-                        del row['object_uri']
-                    except KeyError:
-                        pass
-                    try:
-                        uri = row['container_uri']
-                        retList.append({uri: row})
-                        del row['container_uri']
-                    except KeyError:
-                        pass
-                    try:
-                        uri = row['account_uri']
-                        retList.append({uri: row})
-                        del row['account_uri']
-                    except KeyError:
-                        pass
-                else:
-                    try:
-                        retList.append({row['object_uri']: row})
-                    except KeyError:
-                        pass
-                    try:
-                        retList.append({row['container_uri']: row})
-                    except KeyError:
-                        pass
-                    try:
-                        retList.append({row['account_uri']: row})
-                    except KeyError:
-                        pass
-            return retList
+            cur.execute(query, args)
+            return uri_rows(cur.fetchall(), includeURI)
+
+    def execute_page(self, query, args, uri_column, includeURI, marker=None,
+                     limit=None):
+        """
+        Execute the main query for one page of results.
+        The page is the rows whose uri comes after marker, in uri order,
+        and at most limit of them. Both are pushed down into the SQL so
+        a page costs the same wherever it is in the listing.
+
+        :param query: query built by get_attributes_query() and
+                      get_uri_query()
+        :param args: dict of the parameters of query
+        :param uri_column: the uri column of the table queried,
+                           e.g. 'object_uri'
+        :param includeURI: whether the uri should be kept in each row
+        :param marker: uri of the last row of the previous page
+        :param limit: maximum number of rows to return
+        :returns: list of {uri: row} dictionaries, as execute_query()
+        """
+        args = dict(args)
+        if marker:
+            query += ' AND %s > :page_marker' % uri_column
+            args['page_marker'] = marker
+        query += ' ORDER BY %s' % uri_column
+        if limit is not None:
+            query += ' LIMIT :page_limit'
+            args['page_limit'] = limit
+        with self.get() as conn:
+            conn.row_factory = dict_factory
+            return uri_rows(conn.execute(query, args).fetchall(), includeURI)
+
+    def _sort_columns(self, scope, uri_ref, sort_keys):
+        """
+        Builds the SQL expressions the sort keys evaluate to for items of
+        one kind. A key that does not apply to that kind of item, or a
+        custom attribute an item does not have, evaluates to NULL.
+
+        :param scope: 'account', 'container' or 'object'
+        :param uri_ref: SQL reference to the uri of the item being sorted
+        :param sort_keys: list of 'uri', system or custom attribute names
+        :returns: (list of SQL expressions, dict of their parameters)
+        """
+        table, uri_column, sys_attrs = SCOPES[scope]
+        exprs = []
+        args = {}
+        for i, key in enumerate(sort_keys):
+            if key == 'uri':
+                exprs.append(uri_ref)
+            elif key in sys_attrs:
+                exprs.append('(SELECT %s FROM %s WHERE %s = %s)' % (
+                    key, table, uri_column, uri_ref))
+            elif key.startswith(scope + '_meta'):
+                exprs.append(
+                    '(SELECT custom_value FROM custom_metadata '
+                    'WHERE uri = %s AND custom_key = :sort_key_%d)' % (
+                        uri_ref, i))
+                args['sort_key_%d' % i] = key
+            else:
+                exprs.append('NULL')
+        return exprs, args
+
+    def get_sort_position(self, uri, sort_keys):
+        """
+        Returns where an item sits in a listing sorted by sort_keys, in the
+        form execute_sorted_page() uses. An item that no longer exists
+        sorts as if it had none of the sort attributes.
+
+        :param uri: uri of the item
+        :param sort_keys: list of attribute names the listing is sorted by
+        """
+        scope = uri_scope(uri)
+        exprs, args = self._sort_columns(
+            scope, 'item.%s_uri' % scope, sort_keys)
+        args['item_uri'] = uri
+        with self.get() as conn:
+            conn.row_factory = dict_factory
+            row = conn.execute(
+                'SELECT %s FROM (SELECT :item_uri AS %s_uri) AS item' % (
+                    ', '.join('%s AS sort_%d' % (expr, i)
+                              for i, expr in enumerate(exprs)), scope),
+                args).fetchone()
+        return sort_position(
+            [row['sort_%d' % i] for i in xrange(len(exprs))], uri)
+
+    def execute_sorted_page(self, query, args, uri_column, includeURI,
+                            sort_keys, after=None, limit=None):
+        """
+        Execute the main query for one page of results sorted by
+        sort_keys. Items are ordered by each sort key in turn, items
+        missing an attribute coming after those that have it, and
+        finally by uri. The ordering, the start of the page and its
+        length are all done by SQLite.
+
+        :param query: query built by get_attributes_query() and
+                      get_uri_query()
+        :param args: dict of the parameters of query
+        :param uri_column: the uri column of the table queried
+        :param includeURI: whether the uri should be kept in each row
+        :param sort_keys: list of 'uri', system or custom attribute names
+        :param after: position of the last item of the previous page, as
+                      returned with it or by get_sort_position()
+        :param limit: maximum number of rows to return
+        :returns: list of (position, {uri: row}) tuples; positions of
+                  items from different queries compare the way the
+                  items should be listed
+        """
+        exprs, sort_args = self._sort_columns(
+            uri_column[:-len('_uri')], 'page.' + uri_column, sort_keys)
+        args = dict(args, **sort_args)
+        order = []
+        for i in xrange(len(exprs)):
+            order.extend(('(sort_%d IS NULL)' % i, 'sort_%d' % i))
+        order.append(uri_column)
+        sql = 'SELECT * FROM (SELECT page.*, %s FROM (%s) AS page)' % (
+            ', '.join('%s AS sort_%d' % (expr, i)
+                      for i, expr in enumerate(exprs)), query)
+        if after is not None:
+            # rows past `after` in the (lexicographic) sort order
+            clauses = []
+            for i, term in enumerate(order):
+                args['after_%d' % i] = after[i]
+                clauses.append('(%s)' % ' AND '.join(
+                    ['%s IS :after_%d' % (t, j)
+                     for j, t in enumerate(order[:i])] +
+                    ['%s > :after_%d' % (term, i)]))
+            sql += ' WHERE ' + ' OR '.join(clauses)
+        sql += ' ORDER BY ' + ', '.join(order)
+        if limit is not None:
+            sql += ' LIMIT :page_limit'
+            args['page_limit'] = limit
+        with self.get() as conn:
+            conn.row_factory = dict_factory
+            rows = conn.execute(sql, args).fetchall()
+        positions = [
+            sort_position([row.pop('sort_%d' % i) for i in xrange(len(exprs))],
+                          row[uri_column])
+            for row in rows]
+        return zip(positions, uri_rows(rows, includeURI))
 
     def is_deleted(self, mdtable, timestamp=None):
         '''
@@ -581,6 +874,74 @@ def dict_factory(cursor, row):
 
 
 
+def uri_rows(rows, includeURI):
+    """
+    Wraps each row of a query in a dictionary keyed by its uri.
+    The uri column is dropped from the row unless includeURI is set.
+    """
+    retList = []
+    for row in rows:
+        for column in ('object_uri', 'container_uri', 'account_uri'):
+            if column in row:
+                if includeURI:
+                    retList.append({row[column]: row})
+                else:
+                    retList.append({row.pop(column): row})
+    return retList
+
+
+
+def scope_args(acc, con, obj):
+    """
+    Returns the parameters a query from get_attributes_query() needs for
+    the scope of a request.
+    """
+    args = {'scope_account': acc, 'scope_container': con,
+            'scope_account_uri': '/%s' % acc}
+    if con:
+        args['scope_container_uri'] = '/%s/%s' % (acc, con)
+        if obj:
+            args['scope_object_uri'] = '/%s/%s/%s' % (acc, con, obj)
+    return args
+
+
+
+def timestamp_value(value):
+    """
+    Returns a timestamp sent by a crawler as a float, or 0 for the 'NULL'
+    of an unknown one.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+
+def uri_scope(uri):
+    """Returns whether a uri names an account, a container or an object"""
+    depth = uri.count('/')
+    if depth <= 1:
+        return 'account'
+    elif depth == 2:
+        return 'container'
+    return 'object'
+
+
+
+def sort_position(values, uri):
+    """
+    Builds the sort position of an item from the values of its sort keys,
+    matching the ORDER BY of MetadataBroker.execute_sorted_page().
+    """
+    position = []
+    for value in values:
+        position.extend((value is None, value))
+    position.append(uri)
+    return tuple(position)
+
+
+
 def attachURI(metaDict, acc, con, obj):
     """Add URI to dict as `label`"""
     if obj != "" and obj is not None:
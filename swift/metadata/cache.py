@@ -0,0 +1,164 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Result cache of the metadata GET API.
+
+Rendered responses are cached under a key made of the request (scope,
+attributes, query, sorting, paging and format) and of the generations of
+the scopes the response reads from. Ingesting metadata for an account or
+container moves those generations on, so stale entries are never looked
+up again and simply expire.
+
+Generations are kept in the same cache as the results. With memcache
+(MemcacheRing) every metadata server process shares them; the in-process
+LocalCache is only coherent when the server runs a single worker, beyond
+that the TTL bounds how stale a result can get.
+"""
+
+from collections import OrderedDict
+from hashlib import md5
+from time import time as now
+from uuid import uuid4
+
+from swift.common.utils import json
+
+GENERATION_PREFIX = 'metadata/generation/'
+RESULT_PREFIX = 'metadata/result/'
+
+
+class LocalCache(object):
+    """
+    In-process LRU with the parts of the MemcacheRing interface the result
+    cache uses.
+
+    :param size: number of entries to keep
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        try:
+            expires, value = self.entries.pop(key)
+        except KeyError:
+            return None
+        if expires and expires <= now():
+            return None
+        self.entries[key] = (expires, value)
+        return value
+
+    def set(self, key, value, serialize=True, time=0):
+        self.entries.pop(key, None)
+        while self.entries and len(self.entries) >= self.size:
+            self.entries.popitem(last=False)
+        if self.size > 0:
+            self.entries[key] = (time and now() + time, value)
+
+
+class ResultCache(object):
+    """
+    Caches rendered GET responses, keyed on the request and on the
+    generations of its scope.
+
+    :param cache: a MemcacheRing or LocalCache
+    :param ttl: seconds a result is kept
+    :param max_size: largest body, in bytes, that is cached
+    """
+
+    def __init__(self, cache, ttl=60, max_size=1048576):
+        self.cache = cache
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def _generation(self, scope):
+        key = GENERATION_PREFIX + scope
+        generation = self.cache.get(key)
+        if generation is None:
+            # start from a value never used before, so results cached
+            # under a generation that was evicted are not found again
+            generation = uuid4().hex
+            self.cache.set(key, generation)
+        return generation
+
+    def key(self, acc, con, obj, request):
+        """
+        Returns the cache key of a GET.
+
+        :param acc: account of the request, if any
+        :param con: container of the request, if any
+        :param obj: object of the request, if any
+        :param request: list of what else the response depends on, e.g.
+                        attributes, query plan, sorting, paging and format
+        """
+        if not acc:
+            scopes = ['']
+        elif not con:
+            scopes = ['account/%s' % acc]
+        else:
+            # object listings see their container and account too
+            scopes = ['container/%s/%s' % (acc, con),
+                      'account_row/%s' % acc]
+        generations = [self._generation(scope) for scope in scopes]
+        return RESULT_PREFIX + md5(json.dumps(
+            [generations, acc, con, obj, request],
+            sort_keys=True)).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached (content type, body) of a key, or None.
+        """
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        return cached['content_type'], cached['body'].encode('utf-8')
+
+    def iter_store(self, key, content_type, app_iter):
+        """
+        Passes app_iter through, caching the body once it is complete if
+        it is no bigger than max_size.
+        """
+        body = []
+        size = 0
+        for chunk in app_iter:
+            if body is not None:
+                size += len(chunk)
+                if size > self.max_size:
+                    body = None
+                else:
+                    body.append(chunk)
+            yield chunk
+        if body is not None:
+            self.cache.set(key, {'content_type': content_type,
+                                 'body': ''.join(body).decode('utf-8')},
+                           time=self.ttl)
+
+    def invalidate(self, accounts=(), containers=()):
+        """
+        Moves on the generations of the scopes metadata was ingested for.
+
+        :param accounts: names of accounts whose own rows changed
+        :param containers: (account, container) pairs whose container or
+                           objects changed
+        """
+        scopes = set([''])
+        for acc in accounts:
+            scopes.update(['account/%s' % acc, 'account_row/%s' % acc])
+        for acc, con in containers:
+            scopes.update(['account/%s' % acc,
+                           'container/%s/%s' % (acc, con)])
+        for scope in scopes:
+            self.cache.set(GENERATION_PREFIX + scope, uuid4().hex)
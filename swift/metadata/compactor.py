@@ -0,0 +1,98 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+from glob import glob
+from random import random
+
+from eventlet import Timeout
+
+from swift import gettext_ as _
+from swift.common.daemon import Daemon
+from swift.common.utils import get_logger
+from swift.metadata.backend import MetadataBroker
+
+
+class MetadataCompactor(Daemon):
+    """
+    Reclaims the tombstones of the metadata DBs once they are older than
+    reclaim_age, and gives the space freed by deletes back to the file
+    system a little at a time, with SQLite's incremental vacuum.
+    """
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.logger = get_logger(conf, log_route='metadata-compactor')
+        self.location = conf.get('location', '/srv/node/sdb1/metadata/')
+        self.interval = int(conf.get('interval', 3600))
+        self.reclaim_age = float(conf.get('reclaim_age', 86400 * 7))
+        # free pages given back per DB and pass
+        self.vacuum_pages = int(conf.get('vacuum_pages', 1000))
+
+    def run_forever(self, *args, **kwargs):
+        """Run the compactor until stopped."""
+        time.sleep(random() * self.interval)
+        while True:
+            begin = time.time()
+            try:
+                self.compact_all()
+            except (Exception, Timeout):
+                self.logger.exception(_('Exception in top-level compactor '
+                                        'loop'))
+            elapsed = time.time() - begin
+            if elapsed < self.interval:
+                time.sleep(self.interval - elapsed)
+
+    def run_once(self, *args, **kwargs):
+        """Run the compactor once."""
+        self.compact_all()
+
+    def db_files(self):
+        """
+        Returns the metadata DBs under location: meta.db, or one per
+        partition when the metadata store is sharded by account.
+        """
+        return sorted(glob(os.path.join(self.location, 'meta.db')) +
+                      glob(os.path.join(self.location, '*', 'meta.db')))
+
+    def compact_all(self):
+        """Compacts every metadata DB."""
+        for db_file in self.db_files():
+            try:
+                self.compact(db_file)
+            except (Exception, Timeout):
+                self.logger.increment('failures')
+                self.logger.exception(_('ERROR compacting %s'), db_file)
+
+    def compact(self, db_file):
+        """
+        Reclaims the old tombstones of a metadata DB and vacuums some of
+        its free pages.
+
+        :param db_file: path to the DB
+        """
+        broker = MetadataBroker(db_file, logger=self.logger)
+        broker.migrate()
+        now = time.time()
+        reclaimed = broker.reclaim(now - self.reclaim_age,
+                                   now - self.reclaim_age * 2)
+        free_pages = broker.vacuum(self.vacuum_pages)
+        if reclaimed:
+            self.logger.update_stats('tombstones_reclaimed', reclaimed)
+        self.logger.info(
+            _('Compacted %(db)s: %(reclaimed)d tombstones reclaimed, '
+              '%(free)d free pages left'),
+            {'db': db_file, 'reclaimed': reclaimed, 'free': free_pages})
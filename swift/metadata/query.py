@@ -0,0 +1,253 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Query language of the metadata search API.
+
+The ``query`` header holds a boolean expression over system and custom
+attributes::
+
+    object_content_length>=1024 AND (object_meta_color='red' OR
+                                     NOT container_name="logs")
+
+Comparisons are ``=``, ``==``, ``!=``, ``<>``, ``<``, ``<=``, ``>`` and
+``>=`` between an attribute and a quoted string (quotes are escaped by
+doubling them) or a number. They are combined with ``AND``, ``OR``,
+``NOT`` and parentheses, ``AND`` binding tighter than ``OR``.
+
+Queries are parsed into a small AST, checked against the known
+attributes and compiled into a SQL condition whose values are all bound
+parameters. Compiled plans are kept in an LRU keyed on the normalized
+query text.
+"""
+
+import re
+from collections import namedtuple, OrderedDict
+
+from swift.common.exceptions import MetadataQueryError
+from swift.metadata.backend import ACCOUNT_SYS_ATTRS, CONTAINER_SYS_ATTRS, \
+    OBJECT_SYS_ATTRS
+
+SYS_ATTRS = frozenset(ACCOUNT_SYS_ATTRS + CONTAINER_SYS_ATTRS +
+                      OBJECT_SYS_ATTRS)
+CUSTOM_PREFIXES = ('account_meta_', 'container_meta_', 'object_meta_')
+KEYWORDS = ('AND', 'OR', 'NOT')
+OPERATORS = {'=': '=', '==': '=', '!=': '!=', '<>': '!=', '<': '<',
+             '<=': '<=', '>': '>', '>=': '>='}
+# deepest nesting of parentheses and NOTs a query may use
+MAX_DEPTH = 32
+
+TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<lparen>\() |
+        (?P<rparen>\)) |
+        (?P<op><=|>=|!=|<>|==|=|<|>) |
+        (?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*") |
+        (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(?![\w.]) |
+        (?P<word>[A-Za-z_][\w.-]*)
+    )\s*""", re.VERBOSE)
+
+Comparison = namedtuple('Comparison', 'attr op value')
+BoolOp = namedtuple('BoolOp', 'op operands')
+Not = namedtuple('Not', 'operand')
+QueryPlan = namedtuple('QueryPlan', 'sql args')
+
+
+def tokenize(text):
+    """
+    Splits a query into (kind, text) tokens.
+
+    :raises MetadataQueryError: on characters that start no token
+    """
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise MetadataQueryError(
+                'Unexpected character at position %d of query' % pos)
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'word' and value.upper() in KEYWORDS:
+            kind, value = 'keyword', value.upper()
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+def normalize(tokens):
+    """Returns the canonical text of a tokenized query"""
+    return ' '.join(OPERATORS[value] if kind == 'op' else value
+                    for kind, value in tokens)
+
+
+class _Parser(object):
+    """Recursive descent parser for a tokenized query"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        self.depth = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self, kind, what):
+        token_kind, value = self.peek()
+        if token_kind != kind:
+            raise MetadataQueryError('Expected %s in query, found %s' % (
+                what, value or 'end of query'))
+        self.pos += 1
+        return value
+
+    def parse(self):
+        if not self.tokens:
+            raise MetadataQueryError('Empty query')
+        node = self.parse_or()
+        if self.pos < len(self.tokens):
+            raise MetadataQueryError(
+                'Unexpected %s in query' % self.peek()[1])
+        return node
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == ('keyword', 'OR'):
+            self.pos += 1
+            operands.append(self.parse_and())
+        if len(operands) == 1:
+            return operands[0]
+        return BoolOp('OR', tuple(operands))
+
+    def parse_and(self):
+        operands = [self.parse_term()]
+        while self.peek() == ('keyword', 'AND'):
+            self.pos += 1
+            operands.append(self.parse_term())
+        if len(operands) == 1:
+            return operands[0]
+        return BoolOp('AND', tuple(operands))
+
+    def parse_term(self):
+        token = self.peek()
+        if token == ('keyword', 'NOT') or token[0] == 'lparen':
+            self.depth += 1
+            if self.depth > MAX_DEPTH:
+                raise MetadataQueryError('Query is nested too deeply')
+            self.pos += 1
+            if token[0] == 'lparen':
+                node = self.parse_or()
+                self.take('rparen', "')'")
+            else:
+                node = Not(self.parse_term())
+            self.depth -= 1
+            return node
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        attr = self.take('word', 'an attribute')
+        if attr not in SYS_ATTRS and not (
+                attr.startswith(CUSTOM_PREFIXES) and
+                attr not in CUSTOM_PREFIXES):
+            raise MetadataQueryError('Unknown attribute %s in query' % attr)
+        op = OPERATORS[self.take('op', 'a comparison operator')]
+        kind, value = self.peek()
+        if kind == 'string':
+            value = value[1:-1].replace(value[0] * 2, value[0])
+        elif kind == 'number':
+            try:
+                value = int(value)
+            except ValueError:
+                value = float(value)
+        else:
+            raise MetadataQueryError(
+                'Expected a quoted string or a number in query, found %s' %
+                (value or 'end of query'))
+        self.pos += 1
+        return Comparison(attr, op, value)
+
+
+def parse(text):
+    """
+    Parses a query into its AST.
+
+    :raises MetadataQueryError: if the query is malformed or refers to
+                                unknown attributes
+    """
+    return _Parser(tokenize(text)).parse()
+
+
+def compile_query(node):
+    """
+    Compiles a query AST into a SQL condition over the joined metadata
+    tables. System attributes are their own columns; a custom attribute
+    holds when its item has a custom_metadata row for that key whose
+    value compares true. Every value is a named parameter.
+
+    :returns: a QueryPlan of the condition and a dict of its parameters
+    """
+    args = {}
+
+    def _compile(node):
+        if isinstance(node, BoolOp):
+            return '(%s)' % (' %s ' % node.op).join(
+                _compile(operand) for operand in node.operands)
+        if isinstance(node, Not):
+            return '(NOT %s)' % _compile(node.operand)
+        value = 'query_%d' % len(args)
+        args[value] = node.value
+        if node.attr in SYS_ATTRS:
+            return '(%s %s :%s)' % (node.attr, node.op, value)
+        key = 'query_%d' % len(args)
+        args[key] = node.attr
+        return ('EXISTS (SELECT 1 FROM custom_metadata '
+                'WHERE uri = %s_uri AND custom_key = :%s '
+                'AND custom_value %s :%s)' % (
+                    node.attr.split('_', 1)[0], key, node.op, value))
+
+    return QueryPlan(_compile(node), args)
+
+
+class QueryCache(object):
+    """
+    LRU of compiled query plans, keyed on the normalized query text, so a
+    query that is asked again is only tokenized.
+
+    :param size: number of plans to keep
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.plans = OrderedDict()
+
+    def get(self, text):
+        """
+        Returns the QueryPlan of a query, compiling it if need be.
+
+        :raises MetadataQueryError: if the query is not valid
+        """
+        tokens = tokenize(text)
+        key = normalize(tokens)
+        try:
+            plan = self.plans.pop(key)
+        except KeyError:
+            plan = compile_query(_Parser(tokens).parse())
+            while self.plans and len(self.plans) >= self.size:
+                self.plans.popitem(last=False)
+        if self.size > 0:
+            self.plans[key] = plan
+        return plan
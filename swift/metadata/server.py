@@ -13,98 +13,43 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import heapq
 import os
 import time
 import traceback
+from itertools import chain, islice
 from swift import gettext_ as _
 
-from eventlet import Timeout
+from eventlet import Timeout, sleep, spawn
 import swift.common.db
 
-from swift.metadata.backend import MetadataBroker
+from swift.metadata.backend import MetadataBroker, ACCOUNT_SYS_ATTRS, \
+    CONTAINER_SYS_ATTRS, OBJECT_SYS_ATTRS, scope_args
+from swift.metadata.cache import LocalCache, ResultCache
+from swift.metadata.query import QueryCache
+from swift.metadata.spool import IngestSpool
+from swift.common.memcached import MemcacheRing
 from swift.common.db import DatabaseAlreadyExists
+from swift.common.exceptions import LockTimeout, MetadataQueryError
 
 from swift.common.utils import get_logger, public, \
     config_true_value, json, timing_stats, \
-    split_path
+    split_path, dump_recon_cache
 
 from swift.common.constraints import check_utf8
 
 from swift.common.db_replicator import ReplicatorRpc
 
-from swift.common.swob import HTTPBadRequest, HTTPConflict, \
+from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPConflict, \
     HTTPInternalServerError, HTTPNoContent, \
     HTTPPreconditionFailed, HTTPMethodNotAllowed, Request, Response, \
     HTTPException
 
-from swift.metadata.utils import output_plain, output_json, output_xml, Sort_metadata
+from swift.metadata.utils import iter_output_plain, iter_output_json, \
+    iter_output_xml, get_metadata_ring, item_account
 
 DATADIR = 'metadata'
 
-"""
-List of system attributes supported from OSMS API
-"""
-ACCOUNT_SYS_ATTRS = [
-    'account_uri',
-    'account_name',
-    'account_tenant_id',
-    'account_first_use_time',
-    'account_last_modified_time',
-    'account_last_changed_time',
-    'account_delete_time',
-    'account_last_activity_time',
-    'account_container_count',
-    'account_object_count',
-    'account_bytes_used']
-
-CONTAINER_SYS_ATTRS = [
-    'container_uri',
-    'container_name',
-    'container_account_name',
-    'container_create_time',
-    'container_last_modified_time',
-    'container_last_changed_time',
-    'container_delete_time',
-    'container_last_activity_time',
-    'container_read_permissions',
-    'container_write_permissions',
-    'container_sync_to',
-    'container_sync_key',
-    'container_versions_location',
-    'container_object_count',
-    'container_bytes_used']
-
-OBJECT_SYS_ATTRS = [
-    'object_uri',
-    'object_name',
-    'object_account_name',
-    'object_container_name',
-    'object_location',
-    'object_uri_create_time',
-    'object_last_modified_time',
-    'object_last_changed_time',
-    'object_delete_time',
-    'object_last_activity_time',
-    'object_etag_hash',
-    'object_content_type',
-    'object_content_length',
-    'object_content_encoding',
-    'object_content_disposition',
-    'object_content_language',
-    'object_cache_control',
-    'object_delete_at',
-    'object_manifest_type',
-    'object_manifest',
-    'object_access_control_allow_origin',
-    'object_access_control_allow_credentials',
-    'object_access_control_expose_headers',
-    'object_access_control_max_age',
-    'object_access_control_allow_methods',
-    'object_access_control_allow_headers',
-    'object_origin',
-    'object_access_control_request_method',
-    'object_access_control_request_headers']
-
 
 class MetadataController(object):
     """"
@@ -122,11 +67,31 @@ class MetadataController(object):
         self.location = conf.get('location', '/srv/node/sdb1/metadata/')
         # path the the actual file
         self.db_file = os.path.join(self.location, 'meta.db')
+        # with shard_by_account, each partition of the metadata ring has
+        # a DB of its own, location/<partition>/meta.db
+        self.metadata_ring = get_metadata_ring(conf)
         self.logger = logger or get_logger(conf, log_route='metadata-server')
         self.root = conf.get('devices', '/srv/node')
         self.mount_check = config_true_value(conf.get('mount_check', 'true'))
         self.node_timeout = int(conf.get('node_timeout', 3))
         self.conn_timeout = float(conf.get('node_timeout', 3))
+        # rows fetched from the DB at a time while streaming a GET response
+        self.listing_chunk_size = int(conf.get('listing_chunk_size', 1000))
+        # compiled plans of recently seen query headers
+        self.query_cache = QueryCache(int(conf.get('query_cache_size', 1024)))
+        # rendered GET responses, invalidated as PUTs ingest metadata
+        self.result_cache = None
+        if config_true_value(conf.get('result_cache', 'false')):
+            memcache_servers = conf.get('memcache_servers')
+            if memcache_servers:
+                cache = MemcacheRing([s.strip() for s in
+                                      memcache_servers.split(',')
+                                      if s.strip()])
+            else:
+                cache = LocalCache(int(conf.get('result_cache_size', 1024)))
+            self.result_cache = ResultCache(
+                cache, int(conf.get('result_cache_ttl', 60)),
+                int(conf.get('result_cache_max_size', 1048576)))
         replication_server = conf.get('replication_server', None)
         if replication_server is not None:
             replication_server = config_true_value(replication_server)
@@ -149,13 +114,50 @@ class MetadataController(object):
 
         swift.common.db.DB_PREALLOCATION = config_true_value(
             conf.get('db_preallocation', 'f'))
+        # DBs this process has made sure have a current schema
+        self.schema_checked = set()
+        # With async_ingest, PUTs are spooled and answered with a 202, and
+        # a writer greenthread ingests the spool in large transactions.
+        self.async_ingest = config_true_value(
+            conf.get('async_ingest', 'false'))
+        self.spool = IngestSpool(
+            conf.get('spool_dir', os.path.join(self.location, 'spool')),
+            self.logger)
+        self.spool_batch_size = int(conf.get('spool_batch_size', 10000))
+        self.spool_interval = float(conf.get('spool_interval', 1))
+        self.spool_writer = None
+        self.spool_depth = None
+        self.recon_cache = os.path.join(
+            conf.get('recon_cache_path', '/var/cache/swift'),
+            'metadata.recon')
+
+    def get_db_file(self, account=None):
+        """
+        Returns the path of the DB that holds an account's metadata.
+        """
+        if self.metadata_ring is None or account is None:
+            return self.db_file
+        return os.path.join(self.location,
+                            str(self.metadata_ring.get_part(account)),
+                            'meta.db')
 
-    def _get_metadata_broker(self, **kwargs):
+    def _get_metadata_broker(self, account=None, **kwargs):
         """
         Returns an instance of the DB abstraction layer object (broker)
+        The first time an existing DB is opened it is migrated to the
+        current schema version; new DBs are created fully migrated.
+
+        :param account: account whose shard to open, when the metadata
+                        store is sharded by account
         """
-        kwargs.setdefault('db_file', self.db_file)
-        return MetadataBroker(**kwargs)
+        kwargs.setdefault('db_file', self.get_db_file(account))
+        kwargs.setdefault('logger', self.logger)
+        broker = MetadataBroker(**kwargs)
+        if broker.db_file not in self.schema_checked and \
+                os.path.exists(broker.db_file):
+            broker.migrate()
+            self.schema_checked.add(broker.db_file)
+        return broker
 
     def check_attrs(self, attrs, acc, con, obj):
         """
@@ -244,6 +246,23 @@ class MetadataController(object):
                 return False
         return True
 
+    def check_sort_keys(self, sort_keys):
+        """
+        Verify that the attributes to sort by are valid: the uri, a
+        system attribute or a custom attribute.
+
+        returns: boolean wether the sort keys are valid
+        """
+        for key in sort_keys:
+            if key != 'uri' and \
+                    key not in ACCOUNT_SYS_ATTRS and \
+                    key not in CONTAINER_SYS_ATTRS and \
+                    key not in OBJECT_SYS_ATTRS and \
+                    not key.startswith(('object_meta_', 'container_meta_',
+                                        'account_meta_')):
+                return False
+        return True
+
     @public
     @timing_stats()
     def GET(self, req):
@@ -253,16 +272,47 @@ class MetadataController(object):
         Custom attributes need to be handled specially, since they exist
         in a seperate table
         """
-        broker = self._get_metadata_broker()
-
         base_version, acc, con, obj = split_path(req.path, 1, 4, True)
+        broker = self._get_metadata_broker(acc)
+        marker = req.headers.get('marker')
+        limit = req.headers.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+                if limit < 0:
+                    raise ValueError()
+            except ValueError:
+                return HTTPBadRequest(body='Invalid limit', request=req,
+                                      content_type='text/plain')
+        plan = None
+        if 'query' in req.headers:
+            # older clients sent the query with its spaces still quoted
+            try:
+                plan = self.query_cache.get(
+                    req.headers['query'].replace('%20', ' '))
+            except MetadataQueryError as err:
+                return HTTPBadRequest(body=str(err), request=req,
+                                      content_type='text/plain')
+        sort_keys = None
         if 'sorted' in req.headers:
-            sort_value_list = req.headers['sorted']
-            if sort_value_list == '':
-                sort_value_list = 'uri'
-            toSort = True
-        else:
-            toSort = False
+            sort_keys = req.headers['sorted'].split(',')
+            if sort_keys == ['']:
+                sort_keys = ['uri']
+            if not self.check_sort_keys(sort_keys):
+                return HTTPBadRequest(
+                    body='One or more sort attributes not supported',
+                    request=req, content_type='text/plain')
+        cache_key = None
+        if self.result_cache:
+            cache_key = self.result_cache.key(acc, con, obj, [
+                sorted(set(req.headers.get('attributes', '').split(','))),
+                plan, sort_keys, marker, limit, req.headers.get('format')])
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                self.logger.increment('result_cache.hits')
+                return Response(request=req, body=cached[1],
+                                content_type=cached[0])
+            self.logger.increment('result_cache.misses')
         if 'attributes' in req.headers:
             attrs = req.headers['attributes']
         # if there is no attributes lists, include everything in scope
@@ -297,123 +347,324 @@ class MetadataController(object):
             conQuery = broker.get_attributes_query(acc, con, obj, conAttrs)
             objQuery = broker.get_attributes_query(acc, con, obj, objAttrs)
 
-            # If there is a query in the request add it to the end
-            # of the WHERE clause of the SQL
-            if 'query' in req.headers:
-                query = req.headers['query']
-                accQuery = broker.get_uri_query(accQuery, query)
-                conQuery = broker.get_uri_query(conQuery, query)
-                objQuery = broker.get_uri_query(objQuery, query)
-
-            # if successful query add the results to the end of the
-            # accumulator list
-            ret = []
-            if not accQuery.startswith("BAD"):
-                ret.extend(broker.execute_query(
-                    accQuery, acc, con, obj,
-                    'account_uri' in attrs.split(',')))
-            if not conQuery.startswith("BAD"):
-                ret.extend(broker.execute_query(
-                    conQuery, acc, con, obj,
-                    'container_uri' in attrs.split(',')))
-            if not objQuery.startswith("BAD"):
-                ret.extend(broker.execute_query(
-                    objQuery, acc, con, obj,
-                    'object_uri' in attrs.split(',')))
-
-            # query the custom table
-            ret = broker.custom_attributes_query(
-                customAttrs, ret, all_obj_meta, all_con_meta, all_acc_meta)
-
-            """
-            Do the deletion thing mentioned above
-            """
-            ret = [x for x in ret if x[x.keys()[0]] != {}]
-
-            if toSort:
-                sorter = Sort_metadata()
-                ret = sorter.sort_data(ret, sort_value_list.split(","))
+            # the successful queries, with the depth of their uris,
+            # in the order their results are listed
+            scopes = []
+            for depth, q, uri_column in ((1, accQuery, 'account_uri'),
+                                         (2, conQuery, 'container_uri'),
+                                         (3, objQuery, 'object_uri')):
+                if q.startswith("BAD"):
+                    continue
+                args = scope_args(acc, con, obj)
+                # If there is a query in the request add it to the end
+                # of the WHERE clause of the SQL
+                if plan is not None:
+                    q, args = broker.get_uri_query(q, args, plan)
+                scopes.append((depth, q, args, uri_column,
+                               uri_column in attrs.split(',')))
+            custom = (customAttrs, all_obj_meta, all_con_meta, all_acc_meta)
+
+            if sort_keys:
+                ret = self.iter_sorted_results(
+                    broker, scopes, custom, sort_keys, marker, limit)
+            else:
+                ret = self.iter_results(broker, scopes, custom, marker, limit)
+            # Run the first query now, so a bad query or missing DB is
+            # still answered with an error status.
+            ret = chain(list(islice(ret, 1)), ret)
 
             # default format is plain text
             # can choose between json/xml as well
             # no error handling done right now
             # just default everything to plain if spelling error
-            if "format" in req.headers:
-                if req.headers['format'] == "json":
-                    format = "application/json"
-                    out = output_json(ret)
-                elif req.headers['format'] == "xml":
-                    format = "application/xml"
-                    out = output_xml(ret)
-                else:
-                    out = output_plain(ret)
+            if req.headers.get('format') == "json":
+                format = "application/json"
+                out = iter_output_json(ret)
+            elif req.headers.get('format') == "xml":
+                format = "application/xml"
+                out = iter_output_xml(ret)
             else:
-                out = output_plain(ret)
+                out = iter_output_plain(ret)
             status = 200
+            out = chain(out, ["\n"])
+            if cache_key:
+                out = self.result_cache.iter_store(cache_key, format, out)
 
         else:
-            out = "One or more attributes not supported"
+            out = ["One or more attributes not supported\n"]
             status = 400
             format = "text/plain"
 
-        # Returns the HTTP Response object with the result of the API request
+        # Returns the HTTP Response object with the result of the API
+        # request, rendered as the results are read from the DB
         return Response(
-            request=req, body=out + "\n", content_type=format, status=status)
+            request=req, app_iter=out, content_type=format, status=status)
 
-    @public
-    @timing_stats()
-    def PUT(self, req):
+    def iter_results(self, broker, scopes, custom, marker=None, limit=None):
         """
-        Handles incoming PUT requests
-        Crawlers running on the object/container/account servers
-        will send over new metadata. This is where that new metadata
-        is sent to the database
+        Yields the results of a GET, reading them from the DB a chunk at a
+        time so that a wide query never has to be held in memory whole.
+        Results are listed account, container then object, each in uri
+        order.
+
+        :param broker: the MetadataBroker to query
+        :param scopes: list of (uri depth, query, query parameters, uri
+                       column, include uri) tuples, one per kind of item
+                       requested
+        :param custom: (customAttrs, all_obj_meta, all_con_meta,
+                       all_acc_meta) as passed to custom_attributes_query
+        :param marker: uri of the last result of the previous page; the
+                       listing resumes right after it
+        :param limit: maximum number of results to yield
+        """
+        marker_depth = min(marker.count('/'), 3) if marker else 0
+        for depth, query, args, uri_column, includeURI in scopes:
+            if depth < marker_depth:
+                # listed in full on earlier pages
+                continue
+            scope_marker = marker if depth == marker_depth else None
+            while limit is None or limit > 0:
+                fetch = self.listing_chunk_size
+                if limit is not None:
+                    fetch = min(fetch, limit)
+                rows = broker.execute_page(
+                    query, args, uri_column, includeURI, scope_marker, fetch)
+                if not rows:
+                    break
+                scope_marker = rows[-1].keys()[0]
+                rows = broker.custom_attributes_query(custom[0], rows,
+                                                      *custom[1:])
+                # Skip things that only had their uri selected so they
+                # could carry custom attributes, and got none.
+                found = [x for x in rows if x[x.keys()[0]] != {}]
+                for x in found:
+                    yield x
+                if limit is not None:
+                    limit -= len(found)
+                if len(rows) < fetch:
+                    break
+
+    def iter_sorted_results(self, broker, scopes, custom, sort_keys,
+                            marker=None, limit=None):
+        """
+        Yields the results of a GET sorted by sort_keys. Each kind of item
+        is sorted and paged by SQLite, and the sorted streams are merged
+        here.
+
+        :param sort_keys: list of 'uri', system or custom attribute names
+        :param marker: uri of the last result of the previous page; the
+                       listing resumes right after it
+        See iter_results() for the other parameters.
         """
-        broker = self._get_metadata_broker()
+        after = None
+        if marker:
+            after = broker.get_sort_position(marker, sort_keys)
+        streams = [
+            self._iter_sorted_scope(broker, query, args, uri_column,
+                                    includeURI, custom, sort_keys, after,
+                                    limit)
+            for depth, query, args, uri_column, includeURI in scopes]
+        for position, x in islice(heapq.merge(*streams), limit):
+            yield x
+
+    def _iter_sorted_scope(self, broker, query, args, uri_column,
+                           includeURI, custom, sort_keys, after, limit):
+        """
+        Yields (position, result) for one kind of item in sorted order.
+        Unlike uri order, a sort order has no index to walk, so every
+        read costs a pass over all the matching items. Rather than reading
+        in chunks, read as many as the request can use at once: the whole
+        page, or everything when there is no limit.
+        """
+        fetch = limit
+        while fetch is None or fetch > 0:
+            rows = broker.execute_sorted_page(
+                query, args, uri_column, includeURI, sort_keys, after, fetch)
+            if not rows:
+                break
+            after = rows[-1][0]
+            broker.custom_attributes_query(
+                custom[0], [x for position, x in rows], *custom[1:])
+            for position, x in rows:
+                if x[x.keys()[0]] != {}:
+                    yield position, x
+            if fetch is None or len(rows) < fetch:
+                break
+
+    def get_batch(self, req):
+        """
+        Reads the batch a crawler sent with a PUT or DELETE.
 
-        # Call broker insertion
+        :returns: (user agent of the crawler, list of metadata dicts)
+        :raises HTTPBadRequest: if the crawler or the batch is not valid
+        """
         if 'user-agent' not in req.headers:
 
-            return HTTPBadRequest(
+            raise HTTPBadRequest(
                 body='No user agent specified',
                 request=req,
                 content_type='text/plain'
             )
         md_type = req.headers['user-agent']
-        md_data = json.loads(req.body)
-
-        if not os.path.exists(broker.db_file):
-            try:
-                broker.initialize(time.time())
-                # created = True
-            except DatabaseAlreadyExists:
-                # created = False
-                pass
-        else:
-            #created = broker.is_deleted(md_type)
-            # broker.update_put_timestamp(time.time())
-            if broker.is_deleted(md_type):
-                return HTTPConflict(request=req)
-
-        # check the user agent type
-        if md_type == 'account_crawler':
-            # insert accounts
-            broker.insert_account_md(md_data)
-        elif md_type == 'container_crawler':
-            # Insert containers
-            broker.insert_container_md(md_data)
-        elif md_type == 'object_crawler':
-            # Insert object
-            broker.insert_object_md(md_data)
-        else:
+        if md_type not in ('account_crawler', 'container_crawler',
+                           'object_crawler'):
             # raise exception
-            return HTTPBadRequest(
+            raise HTTPBadRequest(
                 body='Invalid user agent',
                 request=req,
                 content_type='text/plain'
             )
+        try:
+            md_data = json.loads(req.body)
+        except ValueError:
+            md_data = None
+        if not isinstance(md_data, list) or \
+                not all(isinstance(item, dict) for item in md_data):
+            raise HTTPBadRequest(body='Invalid metadata batch', request=req,
+                                 content_type='text/plain')
+        return md_type, md_data
+
+    @public
+    @timing_stats()
+    def PUT(self, req):
+        """
+        Handles incoming PUT requests
+        Crawlers running on the object/container/account servers
+        will send over new metadata. This is where that new metadata
+        is sent to the database
+        """
+        md_type, md_data = self.get_batch(req)
+        if self.async_ingest:
+            self.spool.append(md_type, req.body)
+            return HTTPAccepted(request=req)
+        if not self.ingest(md_type, md_data):
+            return HTTPConflict(request=req)
+        return HTTPNoContent(request=req)
+
+    @public
+    @timing_stats()
+    def DELETE(self, req):
+        """
+        Handles incoming DELETE requests
+        Crawlers send the tombstones of deleted accounts, containers and
+        objects, each a dict of the item's uri, names and delete time
+        (e.g. object_delete_time). Deletes are always ingested right
+        away, even with async_ingest; spooled PUTs older than a delete
+        are skipped when the spool gets to them.
+        """
+        md_type, md_data = self.get_batch(req)
+        if not self.ingest(md_type, md_data, delete=True):
+            return HTTPConflict(request=req)
         return HTTPNoContent(request=req)
 
+    def ingest(self, md_type, md_data, delete=False):
+        """
+        Inserts a batch of metadata sent by a crawler.
+
+        :param md_type: user agent of the crawler, e.g. 'object_crawler'
+        :param md_data: list of metadata dicts
+        :param delete: if set, md_data is a batch of tombstones
+        :returns: False if the metadata DB has been deleted
+        """
+        # When sharded by account, each account's rows go to the DB of its
+        # partition, and only that partition's DB is locked to write them.
+        shards = {}
+        for item in md_data:
+            account = None
+            if self.metadata_ring is not None:
+                account = item_account(item)
+            shards.setdefault(self.get_db_file(account), []).append(item)
+
+        for db_file, items in sorted(shards.items()):
+            broker = self._get_metadata_broker(db_file=db_file)
+            if not os.path.exists(broker.db_file):
+                try:
+                    broker.initialize(time.time())
+                    # created = True
+                except DatabaseAlreadyExists:
+                    # created = False
+                    pass
+            else:
+                #created = broker.is_deleted(md_type)
+                # broker.update_put_timestamp(time.time())
+                if broker.is_deleted(md_type):
+                    return False
+
+            # check the user agent type
+            if delete:
+                broker.delete_md(md_type[:-len('_crawler')], items)
+            elif md_type == 'account_crawler':
+                # insert accounts
+                broker.insert_account_md(items)
+            elif md_type == 'container_crawler':
+                # Insert containers
+                broker.insert_container_md(items)
+            else:
+                # Insert object
+                broker.insert_object_md(items)
+
+        if md_type == 'account_crawler':
+            changed = {'accounts': set(
+                item['account_name'] for item in md_data)}
+        elif md_type == 'container_crawler':
+            changed = {'containers': set(
+                (item['container_account_name'], item['container_name'])
+                for item in md_data)}
+        else:
+            changed = {'containers': set(
+                (item['object_account_name'], item['object_container_name'])
+                for item in md_data)}
+        if self.result_cache:
+            self.result_cache.invalidate(**changed)
+        return True
+
+    def _ingest_spooled(self, md_type, md_data):
+        if not self.ingest(md_type, md_data):
+            self.logger.error(
+                _('Dropped %(count)d spooled %(type)s items, the metadata '
+                  'DB is deleted'), {'count': len(md_data), 'type': md_type})
+
+    def drain_spool(self):
+        """
+        Ingests the oldest spooled batches and reports the state of the
+        spool: its depth and lag go to the recon cache, and to statsd as
+        ingest_spool.lag (a timing) and ingest_spool.items (a counter of
+        the items ingested).
+
+        :returns: number of items ingested
+        """
+        try:
+            ingested = self.spool.drain(self._ingest_spooled,
+                                        self.spool_batch_size)
+        except LockTimeout:
+            # another worker is draining
+            return 0
+        stats = self.spool.stats()
+        if ingested:
+            self.logger.update_stats('ingest_spool.items', ingested)
+        self.logger.timing('ingest_spool.lag', stats['lag'] * 1000)
+        if ingested or stats['depth'] != self.spool_depth:
+            dump_recon_cache({'ingest_spool_depth': stats['depth'],
+                              'ingest_spool_lag': stats['lag']},
+                             self.recon_cache, self.logger)
+            self.spool_depth = stats['depth']
+        return ingested
+
+    def run_spool_writer(self):
+        """
+        Drains the spool for as long as the server runs, sleeping
+        spool_interval seconds whenever it is empty.
+        """
+        while True:
+            try:
+                if self.drain_spool():
+                    # let the requests waiting on this worker in
+                    sleep(0)
+                    continue
+            except (Exception, Timeout):
+                self.logger.exception(_('Exception draining ingest spool'))
+            sleep(self.spool_interval)
+
     def __call__(self, env, start_response):
         """
         Boilerplate code for how the server's code gets called
@@ -423,6 +674,12 @@ class MetadataController(object):
         # start_time = time.time()
         req = Request(env)
         self.logger.txn_id = req.headers.get('x-trans-id', None)
+        if self.async_ingest and (self.spool_writer is None or
+                                  self.spool_writer.dead):
+            # started by the first request of any kind, so that batches
+            # spooled before a restart are drained without waiting for a
+            # PUT; not at init, which also runs in the parent before fork
+            self.spool_writer = spawn(self.run_spool_writer)
         if not check_utf8(req.path_info):
             res = HTTPPreconditionFailed(body='Invalid UTF8 or contains NULL')
         else:
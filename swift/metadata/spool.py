@@ -0,0 +1,160 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Durable ingest spool of the metadata server.
+
+With async_ingest, a PUT from a crawler only validates its batch and
+writes it to the spool, one file per batch::
+
+    <spool_dir>/<timestamp>-<random>.<crawler type>
+
+Files are written to a temporary name, fsynced and renamed into place, so
+a spooled batch is either complete or not there at all. A writer drains
+the spool into the DB, oldest first, ingesting many batches in each
+transaction. Ingesting is an INSERT OR REPLACE, so a batch that is
+ingested again after a crash does no harm.
+"""
+
+import errno
+import os
+import time
+from collections import OrderedDict
+from tempfile import mkstemp
+from uuid import uuid4
+
+from swift import gettext_ as _
+from swift.common.utils import fsync, json, lock_path, mkdirs, \
+    normalize_timestamp, renamer
+
+MD_TYPES = ('account_crawler', 'container_crawler', 'object_crawler')
+TMP_DIR = 'tmp'
+QUARANTINE_DIR = 'failed'
+
+
+class IngestSpool(object):
+    """
+    A directory of metadata batches waiting to be ingested.
+
+    :param spool_dir: directory holding the spooled batches
+    :param logger: logger used to report batches that cannot be ingested
+    :param lock_timeout: seconds a writer waits for another one to finish
+                         draining
+    """
+
+    def __init__(self, spool_dir, logger, lock_timeout=10):
+        self.spool_dir = spool_dir
+        self.logger = logger
+        self.lock_timeout = lock_timeout
+
+    def append(self, md_type, body):
+        """
+        Durably adds a batch to the spool.
+
+        :param md_type: user agent of the crawler that sent the batch
+        :param body: the batch, a JSON list of metadata dicts
+        :returns: name of the spooled batch
+        """
+        name = '%s-%s.%s' % (normalize_timestamp(time.time()),
+                             uuid4().hex, md_type)
+        tmp_dir = os.path.join(self.spool_dir, TMP_DIR)
+        mkdirs(tmp_dir)
+        fd, tmp_path = mkstemp(dir=tmp_dir)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(body)
+            fp.flush()
+            fsync(fp.fileno())
+        renamer(tmp_path, os.path.join(self.spool_dir, name))
+        return name
+
+    def batches(self):
+        """Returns the names of the spooled batches, oldest first"""
+        try:
+            names = os.listdir(self.spool_dir)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return []
+        return sorted(name for name in names
+                      if name.rsplit('.', 1)[-1] in MD_TYPES)
+
+    def stats(self):
+        """
+        Returns the depth of the spool, in batches, and its lag, the age in
+        seconds of the oldest batch.
+        """
+        names = self.batches()
+        lag = 0
+        if names:
+            lag = max(0, time.time() - float(names[0].split('-', 1)[0]))
+        return {'depth': len(names), 'lag': lag}
+
+    def drain(self, ingest, max_items=10000):
+        """
+        Feeds the oldest spooled batches, up to about max_items items, to
+        ingest and removes them. Batches of the same kind are ingested
+        together. If that fails, they are retried one by one, and a batch
+        that still fails is moved to the failed directory so it cannot
+        hold up the rest of the spool.
+
+        Only one writer drains at a time; the others wait for the lock.
+
+        :param ingest: callable taking (md_type, list of metadata dicts)
+        :param max_items: number of items after which to stop reading
+                          batches
+        :returns: number of items ingested
+        """
+        with lock_path(self.spool_dir, timeout=self.lock_timeout):
+            groups = OrderedDict()
+            count = 0
+            for name in self.batches():
+                if count >= max_items:
+                    break
+                try:
+                    with open(os.path.join(self.spool_dir, name)) as fp:
+                        items = json.load(fp)
+                except ValueError:
+                    self.quarantine(name)
+                    continue
+                groups.setdefault(name.rsplit('.', 1)[-1], []).append(
+                    (name, items))
+                count += len(items)
+
+            ingested = 0
+            for md_type, batches in groups.iteritems():
+                try:
+                    ingest(md_type,
+                           [item for _junk, batch in batches
+                            for item in batch])
+                    done = batches
+                except Exception:
+                    done = []
+                    for name, items in batches:
+                        try:
+                            ingest(md_type, items)
+                            done.append((name, items))
+                        except Exception:
+                            self.quarantine(name)
+                for name, items in done:
+                    os.unlink(os.path.join(self.spool_dir, name))
+                    ingested += len(items)
+            return ingested
+
+    def quarantine(self, name):
+        """Moves a batch that cannot be ingested out of the spool"""
+        self.logger.exception(
+            _('Unable to ingest spooled metadata batch %s'), name)
+        renamer(os.path.join(self.spool_dir, name),
+                os.path.join(self.spool_dir, QUARANTINE_DIR, name))
@@ -13,10 +13,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import signal
+from random import shuffle
+from swift import gettext_ as _
 from swift.common.exceptions import ConnectionTimeout
-from swift.common.http import HTTP_INTERNAL_SERVER_ERROR
-from swift.common.utils import json
-from eventlet import Timeout
+from swift.common.http import HTTP_INTERNAL_SERVER_ERROR, is_success
+from swift.common.ring import Ring
+from swift.common.utils import json, dump_recon_cache, config_true_value, \
+    normalize_timestamp, ratelimit_sleep
+from eventlet import sleep, Timeout
 from eventlet.green.httplib import HTTPConnection
 from collections import OrderedDict
 import operator
@@ -42,12 +48,511 @@ class Sender():
             except (Exception, Timeout):
                 return HTTP_INTERNAL_SERVER_ERROR
 
-def output_xml(metaList):
+
+class BatchSender(object):
     """
-    Converts the list of dicts into XML format
+    Streams crawler metadata to the metadata server in bounded batches.
+
+    Items are serialized as they are added and flushed every batch_size
+    items or batch_bytes bytes, whichever comes first, so a crawler's memory
+    use does not grow with the size of its pass. Each batch is one chunked
+    PUT over a keep-alive connection that is reused between batches. A
+    failed batch is retried with exponential backoff before it is given up
+    on.
+
+    :param conf: crawler configuration
+    :param data_type: user agent identifying the crawler to the server
+    :param server_ip: metadata server ip
+    :param server_port: metadata server port
+    :param logger: crawler logger
+    :param on_batch: optional callable taking (success, tags) after every
+                     batch, where tags is the set of tags passed to add()
+                     for the items in that batch
+    :param method: 'PUT' to send metadata, 'DELETE' to send tombstones
+    """
+
+    def __init__(self, conf, data_type, server_ip, server_port, logger,
+                 on_batch=None, method='PUT'):
+        self.data_type = data_type
+        self.method = method
+        self.host = '%s:%s' % (server_ip, server_port)
+        self.logger = logger
+        self.on_batch = on_batch
+        self.batch_size = int(conf.get('batch_size', 1000))
+        self.batch_bytes = int(conf.get('batch_bytes', 1048576))
+        self.send_retries = int(conf.get('send_retries', 3))
+        self.retry_backoff = float(conf.get('retry_backoff', 0.5))
+        self.conn_timeout = float(conf.get('conn_timeout', 3))
+        self.node_timeout = float(conf.get('node_timeout', 10))
+        self.conn = None
+        self.chunks = []
+        self.chunk_bytes = 0
+        self.tags = set()
+        self.batches_sent = 0
+        self.batches_failed = 0
+
+    def add(self, item, tag=None):
+        """
+        Queues an item, flushing the batch if it is full.
+
+        :param item: metadata dict to send
+        :param tag: optional hashable reported back through on_batch
+        """
+        chunk = json.dumps(item)
+        self.chunks.append(chunk)
+        self.chunk_bytes += len(chunk)
+        if tag is not None:
+            self.tags.add(tag)
+        if len(self.chunks) >= self.batch_size or \
+                self.chunk_bytes >= self.batch_bytes:
+            self.flush()
+
+    def flush(self):
+        """
+        Sends the queued items.
+
+        :returns: True if the server accepted the batch or there was nothing
+                  to send, False if every attempt failed
+        """
+        if not self.chunks:
+            return True
+        chunks, tags = self.chunks, self.tags
+        self.chunks, self.chunk_bytes, self.tags = [], 0, set()
+        success = False
+        for attempt in xrange(self.send_retries + 1):
+            if attempt:
+                sleep(self.retry_backoff * 2 ** (attempt - 1))
+            if self._send_batch(chunks):
+                success = True
+                break
+        if success:
+            self.batches_sent += 1
+            self.logger.increment('batch_successes')
+        else:
+            self.batches_failed += 1
+            self.logger.increment('batch_failures')
+        if self.on_batch:
+            self.on_batch(success, tags)
+        return success
+
+    def close(self):
+        """Closes the connection to the metadata server."""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _send_batch(self, chunks):
+        """
+        Makes one attempt at sending a batch as a JSON list.
+
+        :returns: True if the server answered with a 2xx
+        """
+        try:
+            if self.conn is None:
+                with ConnectionTimeout(self.conn_timeout):
+                    self.conn = HTTPConnection(self.host)
+                    self.conn.connect()
+            with Timeout(self.node_timeout):
+                self.conn.putrequest(self.method, '/')
+                self.conn.putheader('User-Agent', self.data_type)
+                self.conn.putheader('Transfer-Encoding', 'chunked')
+                self.conn.endheaders()
+                last = len(chunks) - 1
+                for i, chunk in enumerate(chunks):
+                    chunk = (',' if i else '[') + chunk + \
+                        (']' if i == last else '')
+                    self.conn.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+                self.conn.send('0\r\n\r\n')
+                resp = self.conn.getresponse()
+                resp.read()
+            if resp.will_close:
+                self.close()
+            if is_success(resp.status):
+                return True
+            self.logger.error(
+                _('Metadata server %(host)s returned %(status)s for a batch '
+                  'of %(count)d items'),
+                {'host': self.host, 'status': resp.status,
+                 'count': len(chunks)})
+        except (Exception, Timeout):
+            self.logger.exception(
+                _('ERROR sending a batch of %(count)d items to metadata '
+                  'server %(host)s'),
+                {'count': len(chunks), 'host': self.host})
+            self.close()
+        return False
+
+
+class ShardedBatchSender(object):
+    """
+    Sends crawler metadata to the metadata servers that own each item's
+    account. Accounts are placed by the metadata ring and every replica of
+    an account's partition is sent the item, through one BatchSender per
+    metadata server.
+
+    A batch that fails on any server reports its tags as failed through
+    on_batch, so the crawler sends them again on its next pass.
+
+    :param conf: crawler configuration
+    :param data_type: user agent identifying the crawler to the servers
+    :param ring: the metadata ring
+    :param logger: crawler logger
+    :param on_batch: see BatchSender
+    :param method: see BatchSender
+    """
+
+    def __init__(self, conf, data_type, ring, logger, on_batch=None,
+                 method='PUT'):
+        self.conf = conf
+        self.data_type = data_type
+        self.ring = ring
+        self.logger = logger
+        self.on_batch = on_batch
+        self.method = method
+        self.senders = {}
+
+    def add(self, item, tag=None):
+        """
+        Queues an item for every replica of its account's partition.
+        """
+        part, nodes = self.ring.get_nodes(item_account(item))
+        for node in nodes:
+            key = (node['ip'], node['port'])
+            if key not in self.senders:
+                self.senders[key] = BatchSender(
+                    self.conf, self.data_type, node['ip'], node['port'],
+                    self.logger, on_batch=self.on_batch, method=self.method)
+            self.senders[key].add(item, tag)
+
+    def flush(self):
+        """
+        Sends the queued items to every server.
+
+        :returns: True if every server accepted its batch
+        """
+        return all([sender.flush() for sender in self.senders.values()])
+
+    def close(self):
+        """Closes the connections to the metadata servers."""
+        for sender in self.senders.values():
+            sender.close()
+
+    @property
+    def batches_sent(self):
+        return sum(s.batches_sent for s in self.senders.values())
+
+    @property
+    def batches_failed(self):
+        return sum(s.batches_failed for s in self.senders.values())
+
+
+def item_account(item):
+    """
+    Returns the name of the account an account, container or object
+    metadata item belongs to.
+    """
+    for key in ('object_account_name', 'container_account_name',
+                'account_name'):
+        if key in item:
+            return item[key]
+    raise ValueError('Metadata item without an account name')
+
+
+def account_tombstone(account, timestamp):
+    """
+    Builds the tombstone a crawler sends for a deleted account.
+
+    :param account: account name
+    :param timestamp: when the account was deleted
+    """
+    return {'account_uri': '/%s' % account,
+            'account_name': account,
+            'account_delete_time': normalize_timestamp(timestamp)}
+
+
+def container_tombstone(account, container, timestamp):
+    """
+    Builds the tombstone a crawler sends for a deleted container.
+
+    :param account: account name
+    :param container: container name
+    :param timestamp: when the container was deleted
+    """
+    return {'container_uri': '/%s/%s' % (account, container),
+            'container_name': container,
+            'container_account_name': account,
+            'container_delete_time': normalize_timestamp(timestamp)}
+
+
+def object_tombstone(account, container, obj, timestamp):
+    """
+    Builds the tombstone a crawler sends for a deleted object.
+
+    :param account: account name
+    :param container: container name
+    :param obj: object name
+    :param timestamp: X-Timestamp of the DELETE
+    """
+    return {'object_uri': '/%s/%s/%s' % (account, container, obj),
+            'object_name': obj,
+            'object_account_name': account,
+            'object_container_name': container,
+            'object_delete_time': normalize_timestamp(timestamp)}
+
+
+def format_metadata(data):
+    """
+    Builds the metadata item a crawler or an object server sends for an
+    object, from the object's on-disk metadata.
+
+    :param data: the object's metadata, with its full path as 'name'
+    """
+    metadata = {}
+    uri = data['name'].split("/")
+    metadata['object_uri'] = data['name']
+    metadata['object_name'] = ("/".join(uri[3:]))
+    metadata['object_account_name'] = uri[1]
+    metadata['object_container_name'] = uri[2]
+    metadata['object_location'] = 'NULL'  # Not implemented yet
+    metadata['object_uri_create_time'] = \
+        data.setdefault('X-Timestamp', 'NULL')
+
+    metadata['object_last_modified_time'] = \
+        data.setdefault('X-Timestamp', 'NULL')
+
+    metadata['object_last_changed_time'] = 'NULL'
+
+    metadata['object_delete_time'] = 'NULL'
+
+    metadata['object_last_activity_time'] = \
+        data.setdefault('X-Timestamp', 'NULL')
+
+    metadata['object_etag_hash'] = \
+        data.setdefault('ETag', 'NULL')
+
+    metadata['object_content_type'] = \
+        data.setdefault('Content-Type', 'NULL')
+
+    metadata['object_content_length'] = \
+        data.setdefault('Content-Length', 'NULL')
+
+    metadata['object_content_encoding'] = \
+        data.setdefault('Content-Encoding', 'NULL')
+
+    metadata['object_content_disposition'] = \
+        data.setdefault('Content-Disposition', 'NULL')
+
+    metadata['object_content_language'] = \
+        data.setdefault('Content-Langauge', 'NULL')
+
+    metadata['object_cache_control'] = 'NULL'
+
+    metadata['object_delete_at'] = \
+        data.setdefault('X-Delete-At', 'NULL')
+
+    metadata['object_manifest_type'] = 'NULL'
+    metadata['object_manifest'] = 'NULL'
+    metadata['object_access_control_allow_origin'] = 'NULL'
+    metadata['object_access_control_allow_credentials'] = 'NULL'
+    metadata['object_access_control_expose_headers'] = 'NULL'
+    metadata['object_access_control_max_age'] = 'NULL'
+    metadata['object_access_control_allow_methods'] = 'NULL'
+    metadata['object_access_control_allow_headers'] = 'NULL'
+    metadata['object_origin'] = 'NULL'
+    metadata['object_access_control_request_method'] = 'NULL'
+    metadata['object_access_control_request_headers'] = 'NULL'
+
+    # Insert all Object custom metadata
+    for custom in data:
+        if(custom.startswith("X-Object-Meta")):
+            sanitized_custom = custom[2:13].lower() + custom[13:]
+            sanitized_custom = sanitized_custom.replace('-', '_')
+            metadata[sanitized_custom] = data[custom]
+
+    return metadata
+
+
+def get_metadata_ring(conf):
+    """
+    Loads the metadata ring if the metadata store is sharded by account,
+    as set by the shard_by_account option.
+
+    :returns: a Ring, or None when a single metadata server holds
+              everything
+    """
+    if not config_true_value(conf.get('shard_by_account', 'false')):
+        return None
+    return Ring(conf.get('swift_dir', '/etc/swift'), ring_name='metadata')
+
+
+def get_sender(conf, data_type, server_ip, server_port, logger, ring=None,
+               on_batch=None, method='PUT'):
+    """
+    Returns a BatchSender to the configured metadata server, or a
+    ShardedBatchSender when there is a metadata ring.
+    """
+    if ring is not None:
+        return ShardedBatchSender(conf, data_type, ring, logger, on_batch,
+                                  method=method)
+    return BatchSender(conf, data_type, server_ip, server_port, logger,
+                       on_batch=on_batch, method=method)
+
+
+def db_changed_since(db_file, position):
+    """
+    Tells whether an account or container DB, or its .pending file, was
+    modified after the given crawl position, without opening the DB.
+    """
+    for path in (db_file, db_file + '.pending'):
+        try:
+            if os.path.getmtime(path) > position:
+                return True
+        except OSError:
+            pass
+    return False
+
+
+def db_size(db_file):
+    """
+    Returns the size of an account or container DB, 0 if it is gone.
+    """
+    try:
+        return os.path.getsize(db_file)
+    except OSError:
+        return 0
+
+
+class CrawlCheckpoints(object):
+    """
+    Durable per-device, per-partition crawl positions.
+
+    A position is the start time of the last crawler pass over a partition
+    whose metadata the metadata server acknowledged, so anything changed
+    after it still has to be sent. Positions survive daemon restarts by being
+    kept in a recon style cache file, one top level key per device.
+
+    :param conf: crawler configuration
+    :param crawler_type: prefix of the checkpoint file name, e.g.
+                         'object_crawler'
+    :param logger: logger used to report problems writing the file
+    """
+
+    def __init__(self, conf, crawler_type, logger):
+        recon_cache_path = conf.get('recon_cache_path', '/var/cache/swift')
+        self.checkpoint_file = os.path.join(
+            recon_cache_path, '%s.checkpoint' % crawler_type)
+        self.logger = logger
+        self.positions = self._load()
+
+    def reload(self):
+        """
+        Re-reads the positions from the file, which other crawler workers
+        may have moved forward.
+        """
+        self.positions = self._load()
+
+    def _load(self):
+        try:
+            with open(self.checkpoint_file) as fp:
+                positions = json.loads(fp.readline())
+        except (IOError, ValueError):
+            return {}
+        if not isinstance(positions, dict):
+            return {}
+        return positions
+
+    def get(self, device, partition):
+        """
+        Returns the acknowledged position for a partition, 0 if it has never
+        been crawled.
+        """
+        return float(self.positions.get(device, {}).get(partition, 0))
+
+    def advance(self, crawled, position):
+        """
+        Moves the given partitions forward and persists the new positions.
+
+        :param crawled: iterable of (device, partition) tuples
+        :param position: new position, the start time of the acknowledged
+                         pass
+        """
+        changed = {}
+        for device, partition in crawled:
+            changed.setdefault(device, self.positions.setdefault(device, {}))
+            changed[device][partition] = position
+        if changed:
+            dump_recon_cache(changed, self.checkpoint_file, self.logger)
+
+
+class CrawlRateLimiter(object):
+    """
+    Throttles a crawler worker to files_per_second items and
+    bytes_per_second bytes read, so crawling does not starve the disks
+    serving client requests. A limit of 0 turns it off.
+
+    :param conf: crawler configuration
     """
-    out = '<?xml version="1.0" encoding="UTF-8"?>\n\n'
-    out += "<metadata>" +'\n'
+
+    def __init__(self, conf):
+        self.max_files_per_second = float(conf.get('files_per_second', 0))
+        self.max_bytes_per_second = float(conf.get('bytes_per_second', 0))
+        self.files_running_time = 0
+        self.bytes_running_time = 0
+
+    def wait(self, bytes_read=0):
+        """
+        Accounts for one more item read, sleeping if the worker is ahead of
+        its limits.
+
+        :param bytes_read: size of what was read for the item
+        """
+        self.files_running_time = ratelimit_sleep(
+            self.files_running_time, self.max_files_per_second)
+        self.bytes_running_time = ratelimit_sleep(
+            self.bytes_running_time, self.max_bytes_per_second,
+            incr_by=bytes_read)
+
+
+def run_device_workers(crawl, devices, concurrency, logger):
+    """
+    Crawls each device in a worker process of its own, with at most
+    concurrency of them running at once, so a slow or failing disk only
+    holds up its own worker. Returns once every device was crawled.
+
+    :param crawl: called in the worker with the list of devices to crawl
+    :param devices: names of the devices to crawl
+    :param concurrency: maximum number of workers running at once
+    :param logger: logger used to report a failed worker
+    """
+    devices = list(devices)
+    # randomize devices in case of process restart before a pass completed
+    shuffle(devices)
+    pids = []
+    while devices or pids:
+        if devices and len(pids) < concurrency:
+            device = devices.pop()
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                try:
+                    crawl([device])
+                except (Exception, Timeout):
+                    logger.exception(_('ERROR crawling %s'), device)
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        else:
+            pid = os.wait()[0]
+            if pid in pids:
+                pids.remove(pid)
+
+
+def iter_output_xml(metaList):
+    """
+    Converts an iterable of dicts into XML format, one piece at a time
+    """
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n\n'
+    yield "<metadata>" + '\n'
 
     for d in metaList:
         uri = d.keys()[0]
@@ -58,35 +563,66 @@ def output_xml(metaList):
             level = "container"
         elif c >= 4:
             level = "object"
-            
-        out += "<" + level + ' uri="' + uri + '">\n'
-        
+
+        out = "<" + level + ' uri="' + uri + '">\n'
         for k in d[uri].keys():
             val = d[uri][k]
             out += "    <" + k + ">" + str(val) + "</" + k + ">\n"
-        
         out += "</" + level + ">\n"
-    out += "</metadata>" + '\n'
-    return out
+        yield out
+    yield "</metadata>" + '\n'
 
-def output_plain(metaList):
+
+def iter_output_plain(metaList):
     """
-    Converts the list of dicts into a plain text format
+    Converts an iterable of dicts into a plain text format, one piece at a
+    time
     """
-    out = ""
     for d in metaList:
         uri = d.keys()[0]
-        out += uri + '\n'
+        out = uri + '\n'
         for k in d[uri].keys():
             val = d[uri][k]
             out += "    " + k + ":" + str(val) + '\n'
-    return out 
+        yield out
+
+
+def iter_output_json(metaList):
+    """
+    Converts an iterable of dicts into a JSON list, one piece at a time.
+    The result is the same as output_json() gives for the whole list.
+    """
+    sep = '[\n    '
+    for d in metaList:
+        yield sep + json.dumps(
+            d, indent=4, separators=(',', ' : ')).replace('\n', '\n    ')
+        sep = ',\n    '
+    if sep.startswith('['):
+        yield '[]'
+    else:
+        yield '\n]'
+
+
+def output_xml(metaList):
+    """
+    Converts the list of dicts into XML format
+    """
+    return ''.join(iter_output_xml(metaList))
+
+
+def output_plain(metaList):
+    """
+    Converts the list of dicts into a plain text format
+    """
+    return ''.join(iter_output_plain(metaList))
+
 
 def output_json(metaList):
     """
-    Converts the list of dicts into a JSON format 
+    Converts the list of dicts into a JSON format
     """
-    return json.dumps(metaList, indent=4, separators=(',', ' : '))
+    return ''.join(iter_output_json(metaList))
+
 
 class Sort_metadata():
     def sort_data_helper(self, attr_list, sort_value):
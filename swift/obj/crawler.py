@@ -13,13 +13,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import cPickle as pickle
+import os
 import time
 from random import random
-from swift.common.utils import get_logger, config_true_value, normalize_timestamp
+from swift import gettext_ as _
+from swift.common.utils import get_logger, config_true_value, \
+    normalize_timestamp, listdir, renamer
+from swift.common.constraints import check_mount
 from swift.common.daemon import Daemon
-from swift.obj.diskfile import DiskFileManager, DiskFileNotExist
+from swift.obj.diskfile import ASYNC_METADATA_DIR, DiskFileManager, \
+    DiskFileNotExist, DiskFileDeleted, DiskFileExpired
+from swift.obj import journal
 from eventlet import Timeout
-from swift.metadata.utils import Sender
+from swift.metadata.utils import CrawlCheckpoints, CrawlRateLimiter, \
+    format_metadata, get_metadata_ring, get_sender, object_tombstone, \
+    run_device_workers
 
 
 class ObjectCrawler(Daemon):
@@ -31,15 +40,25 @@ class ObjectCrawler(Daemon):
         self.devices = conf.get('devices', '/srv/node')
         self.ip = conf.get('md-server-ip', '127.0.0.1')
         self.port = conf.get('md-server-port', '6090')
+        # set when the metadata store is sharded by account
+        self.metadata_ring = get_metadata_ring(conf)
         self.mount_check = config_true_value(conf.get('mount_check', 'true'))
         self.swift_dir = conf.get('swift_dir', '/etc/swift')
         self.interval = int(conf.get('interval', 30))
+        # 'sweep' walks every object on every pass, 'journal' only looks at
+        # objects named in the change journals the object server writes when
+        # its change_journal option is turned on, and 'inline' only resends
+        # the metadata the object server failed to publish inline when its
+        # publish_metadata option is turned on.
+        self.crawl_mode = conf.get('crawl_mode', 'sweep').lower()
+        # number of devices crawled at once, each by a worker process
+        self.concurrency = int(conf.get('concurrency', 1))
         #self.container_ring = None
-        #self.concurrency = int(conf.get('concurrency', 1))
         #self.slowdown = float(conf.get('slowdown', 0.01))
         #self.node_timeout = int(conf.get('node_timeout', 10))
         #self.conn_timeout = float(conf.get('conn_timeout', .5))
-        self.last_time_ran = 0
+        self.checkpoints = CrawlCheckpoints(conf, 'object_crawler',
+                                            self.logger)
         self.diskfile_mgr = DiskFileManager(conf, self.logger)
 
     def run_forever(self, *args, **kwargs):
@@ -49,8 +68,7 @@ class ObjectCrawler(Daemon):
             with open("/opt/swift/OBJLOG.txt", "a+") as f:
                 f.write("START\n")
             try:
-                self.object_sweep()
-                self.last_time_ran = time.time()
+                self._one_crawler_pass()
             except (Exception, Timeout):
                 pass
             time.sleep(self.interval)
@@ -59,105 +77,239 @@ class ObjectCrawler(Daemon):
 
     def run_once(self, *args, **kwargs):
         """Run the updater once."""
-        self.object_sweep()
+        self._one_crawler_pass()
 
-    def object_sweep(self):
+    def _one_crawler_pass(self):
+        if self.concurrency > 1:
+            run_device_workers(self.object_sweep, listdir(self.devices),
+                               self.concurrency, self.logger)
+        else:
+            self.object_sweep()
+
+    def object_sweep(self, device_dirs=None):
         """
         Scan through all objects and send metadata dict of ones with updates.
+
+        :param device_dirs: devices to crawl, all of them if not given
         """
+        self.async_metadata_sweep(device_dirs)
+        if self.crawl_mode == 'inline':
+            return
+        if self.crawl_mode == 'journal':
+            return self.journal_sweep(device_dirs)
 
-        all_locs = self.diskfile_mgr.object_audit_location_generator()
-        metaList = []
+        begin = time.time()
+        self.checkpoints.reload()
+        limiter = CrawlRateLimiter(self.conf)
+        all_locs = self.diskfile_mgr.object_audit_location_generator(
+            device_dirs)
+        crawled = set()
+        failed = set()
+        ObjectSender = get_sender(
+            self.conf, 'object_crawler', self.ip, self.port, self.logger,
+            ring=self.metadata_ring,
+            on_batch=lambda success, tags: success or failed.update(tags))
         for location in all_locs:
+            part_key = (location.device, location.partition)
+            crawled.add(part_key)
             try:
                 metaDict = self.collect_object(location)
 
                 metaDict = self.format_metadata(metaDict)
                 if metaDict != {}:
                     modtime = metaDict["object_last_modified_time"]
-                    if modtime != 'NULL' and float(modtime) > self.last_time_ran:
-                        metaList.append(metaDict)
+                    checkpoint = self.checkpoints.get(*part_key)
+                    # the checkpoint is a pass start time, and an object
+                    # can land on disk well after its X-Timestamp (a long
+                    # upload, a replicated copy), so go by when it arrived
+                    if modtime != 'NULL' and max(
+                            float(modtime),
+                            os.path.getmtime(location.path)) > checkpoint:
+                        ObjectSender.add(metaDict, part_key)
             except Exception:
                 pass
-            
-        if metaList != []:
-            ObjectSender = Sender(self.conf)
-            ObjectSender.sendData(
-                metaList, 'object_crawler', self.ip, self.port)
-
-    def collect_object(self, location):
-        """
-        Process the object metadata
-        """
-        metadata = {}
-        try:
-            df = self.diskfile_mgr.get_diskfile_from_audit_location(location)
-            metadata = df.read_metadata()
-        except DiskFileNotExist:
-            pass
-        return metadata
-
-    def format_metadata(self, data):
-        metadata = {}
-        uri = data['name'].split("/")
-        metadata['object_uri'] = data['name']
-        metadata['object_name'] = ("/".join(uri[3:]))
-        metadata['object_account_name'] = uri[1]
-        metadata['object_container_name'] = uri[2]
-        metadata['object_location'] = 'NULL'  # Not implemented yet
-        metadata['object_uri_create_time'] = \
-            data.setdefault('X-Timestamp', 'NULL')
+            limiter.wait()
 
-        metadata['object_last_modified_time'] = \
-            data.setdefault('X-Timestamp', 'NULL')
+        ObjectSender.flush()
+        ObjectSender.close()
+        # partitions with an unacknowledged batch are crawled again next time
+        self.checkpoints.advance(crawled - failed, begin)
 
-        metadata['object_last_changed_time'] = 'NULL'
+    def journal_sweep(self, device_dirs=None):
+        """
+        Send metadata for the objects named in each device's change journal.
 
-        metadata['object_delete_time'] = 'NULL'
+        Objects deleted since they were journaled are sent as tombstones.
+        Claimed journals are only released once the metadata server has
+        accepted every batch built from them; otherwise they are picked up
+        again on the next pass.
 
-        metadata['object_last_activity_time'] = \
-            data.setdefault('X-Timestamp', 'NULL')
+        :param device_dirs: devices to crawl, all of them if not given
+        """
+        limiter = CrawlRateLimiter(self.conf)
+        failed = set()
 
-        metadata['object_etag_hash'] = \
-            data.setdefault('ETag', 'NULL')
+        def on_batch(success, tags):
+            if not success:
+                failed.update(tags)
 
-        metadata['object_content_type'] = \
-            data.setdefault('Content-Type', 'NULL')
+        ObjectSender = get_sender(
+            self.conf, 'object_crawler', self.ip, self.port, self.logger,
+            ring=self.metadata_ring, on_batch=on_batch)
+        ObjectDeleter = get_sender(
+            self.conf, 'object_crawler', self.ip, self.port, self.logger,
+            ring=self.metadata_ring, on_batch=on_batch, method='DELETE')
+        for device in device_dirs or listdir(self.devices):
+            if self.mount_check and not check_mount(self.devices, device):
+                self.logger.increment('errors')
+                continue
+            device_path = os.path.join(self.devices, device)
+            claimed = journal.claim_journal(device_path)
+            if not claimed:
+                continue
+            for record in journal.iter_claimed_records(claimed):
+                try:
+                    metaDict = self.collect_journal_record(device, record)
+                    if 'deleted' in metaDict:
+                        ObjectDeleter.add(object_tombstone(
+                            record['account'], record['container'],
+                            record['obj'], metaDict['deleted']), device)
+                    elif metaDict != {}:
+                        ObjectSender.add(self.format_metadata(metaDict),
+                                         device)
+                except Exception:
+                    self.logger.increment('failures')
+                    # claimed again next pass, as nothing else would send it
+                    failed.add(device)
+                limiter.wait()
+            ObjectSender.flush()
+            ObjectDeleter.flush()
+            if device not in failed:
+                journal.release_claimed(claimed)
+        ObjectSender.close()
+        ObjectDeleter.close()
 
-        metadata['object_content_length'] = \
-            data.setdefault('Content-Length', 'NULL')
+    def async_metadata_sweep(self, device_dirs=None):
+        """
+        Resend the metadata of the changes the object server could not
+        publish inline, from each device's async_metadata directory.
 
-        metadata['object_content_encoding'] = \
-            data.setdefault('Content-Encoding', 'NULL')
+        Only the newest change of each object is kept, and the object's
+        current metadata is sent rather than what the change wrote, so a
+        retried change never overwrites a newer one. A change is removed
+        once the metadata server accepted its batch.
 
-        metadata['object_content_disposition'] = \
-            data.setdefault('Content-Disposition', 'NULL')
+        :param device_dirs: devices to crawl, all of them if not given
+        """
+        limiter = CrawlRateLimiter(self.conf)
 
-        metadata['object_content_language'] = \
-            data.setdefault('Content-Langauge', 'NULL')
+        def on_batch(success, tags):
+            if success:
+                for update_path in tags:
+                    self.unlink_update(update_path)
 
-        metadata['object_cache_control'] = 'NULL' 
+        ObjectSender = get_sender(
+            self.conf, 'object_crawler', self.ip, self.port, self.logger,
+            ring=self.metadata_ring, on_batch=on_batch)
+        ObjectDeleter = get_sender(
+            self.conf, 'object_crawler', self.ip, self.port, self.logger,
+            ring=self.metadata_ring, on_batch=on_batch, method='DELETE')
+        for device in device_dirs or listdir(self.devices):
+            if self.mount_check and not check_mount(self.devices, device):
+                self.logger.increment('errors')
+                continue
+            async_dir = os.path.join(self.devices, device, ASYNC_METADATA_DIR)
+            for prefix in listdir(async_dir):
+                prefix_path = os.path.join(async_dir, prefix)
+                last_obj_hash = None
+                for update in sorted(listdir(prefix_path), reverse=True):
+                    update_path = os.path.join(prefix_path, update)
+                    obj_hash = update.split('-')[0]
+                    if obj_hash == last_obj_hash:
+                        self.unlink_update(update_path)
+                        continue
+                    last_obj_hash = obj_hash
+                    try:
+                        with open(update_path, 'rb') as fp:
+                            record = pickle.load(fp)
+                    except Exception:
+                        self.logger.exception(
+                            _('ERROR Pickle problem, quarantining %s'),
+                            update_path)
+                        self.logger.increment('quarantines')
+                        renamer(update_path, os.path.join(
+                            self.devices, device, 'quarantined', 'objects',
+                            update))
+                        continue
+                    try:
+                        metaDict = self.collect_journal_record(device, record)
+                        if 'deleted' in metaDict:
+                            ObjectDeleter.add(object_tombstone(
+                                record['account'], record['container'],
+                                record['obj'], metaDict['deleted']),
+                                update_path)
+                        elif metaDict != {}:
+                            ObjectSender.add(self.format_metadata(metaDict),
+                                             update_path)
+                        else:
+                            # nothing left to publish
+                            self.unlink_update(update_path)
+                    except Exception:
+                        self.logger.increment('failures')
+                    limiter.wait()
+            ObjectSender.flush()
+            ObjectDeleter.flush()
+            for prefix in listdir(async_dir):
+                try:
+                    os.rmdir(os.path.join(async_dir, prefix))
+                except OSError:
+                    pass
+        ObjectSender.close()
+        ObjectDeleter.close()
 
-        metadata['object_delete_at'] = \
-            data.setdefault('X-Delete-At', 'NULL')
+    def unlink_update(self, update_path):
+        """Removes a change that no longer has to be sent."""
+        try:
+            os.unlink(update_path)
+        except OSError:
+            pass
+        self.logger.increment('unlinks')
 
-        metadata['object_manifest_type'] = 'NULL'
-        metadata['object_manifest'] = 'NULL'
-        metadata['object_access_control_allow_origin'] = 'NULL'
-        metadata['object_access_control_allow_credentials'] = 'NULL'
-        metadata['object_access_control_expose_headers'] = 'NULL'
-        metadata['object_access_control_max_age'] = 'NULL'
-        metadata['object_access_control_allow_methods'] = 'NULL'
-        metadata['object_access_control_allow_headers'] = 'NULL'
-        metadata['object_origin'] = 'NULL'
-        metadata['object_access_control_request_method'] = 'NULL'
-        metadata['object_access_control_request_headers'] = 'NULL'
+    def collect_journal_record(self, device, record):
+        """
+        Read the current metadata of the object named by a journal record.
 
-        #Insert all Object custom metadata
-        for custom in data:
-            if(custom.startswith("X-Object-Meta")):
-                sanitized_custom = custom[2:13].lower() + custom[13:]
-                sanitized_custom = sanitized_custom.replace('-', '_')
-                metadata[sanitized_custom] = data[custom]
+        :param device: device the journal belongs to
+        :param record: a record from journal.iter_claimed_records
+        :returns: the object's metadata, {'deleted': <timestamp>} if it was
+                  deleted, or {} if it no longer exists for another reason
+        """
+        metadata = {}
+        try:
+            df = self.diskfile_mgr.get_diskfile(
+                device, record['partition'], record['account'],
+                record['container'], record['obj'])
+            metadata = df.read_metadata()
+        except DiskFileExpired:
+            # the object expirer will DELETE it
+            pass
+        except DiskFileDeleted as err:
+            metadata = {'deleted': err.timestamp}
+        except DiskFileNotExist:
+            pass
+        return metadata
 
+    def collect_object(self, location):
+        """
+        Process the object metadata
+        """
+        metadata = {}
+        try:
+            df = self.diskfile_mgr.get_diskfile_from_audit_location(location)
+            metadata = df.read_metadata()
+        except DiskFileNotExist:
+            pass
         return metadata
+
+    def format_metadata(self, data):
+        return format_metadata(data)
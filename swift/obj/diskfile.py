@@ -38,7 +38,7 @@ import uuid
 import hashlib
 import logging
 import traceback
-from os.path import basename, dirname, exists, getmtime, join
+from os.path import basename, dirname, exists, getmtime, getsize, join
 from random import shuffle
 from tempfile import mkstemp
 from contextlib import contextmanager
@@ -58,17 +58,20 @@ from swift.common.exceptions import DiskFileQuarantined, DiskFileNotExist, \
     DiskFileDeleted, DiskFileError, DiskFileNotOpen, PathNotDir, \
     ReplicationLockTimeout, DiskFileExpired
 from swift.common.swob import multi_range_iterator
+from swift.obj import journal
 
 
 PICKLE_PROTOCOL = 2
 ONE_WEEK = 604800
 HASH_FILE = 'hashes.pkl'
+HASH_INVALIDATIONS_FILE = 'hashes.invalid'
 METADATA_KEY = 'user.swift.metadata'
 # These are system-set metadata keys that cannot be changed with a POST.
 # They should be lowercase.
 DATAFILE_SYSTEM_META = set('content-length content-type deleted etag'.split())
 DATADIR = 'objects'
 ASYNCDIR = 'async_pending'
+ASYNC_METADATA_DIR = 'async_metadata'
 
 
 def read_metadata(fd):
@@ -252,23 +255,63 @@ def invalidate_hash(suffix_dir):
     """
     Invalidates the hash for a suffix_dir in the partition's hashes file.
 
+    The suffix is appended to the partition's invalidations file, which
+    :func:`get_hashes` folds into the hashes file the next time it runs, so
+    a PUT or DELETE does not have to load and rewrite the hashes file.
+
     :param suffix_dir: absolute path to suffix dir whose hash needs
                        invalidating
     """
 
     suffix = basename(suffix_dir)
     partition_dir = dirname(suffix_dir)
+    invalidations_file = join(partition_dir, HASH_INVALIDATIONS_FILE)
+    with lock_path(partition_dir):
+        with open(invalidations_file, 'ab') as fp:
+            fp.write(suffix + '\n')
+
+
+def consolidate_hashes(partition_dir):
+    """
+    Marks the suffixes listed in the partition's invalidations file invalid
+    in its hashes file, and empties the invalidations file.
+
+    :param partition_dir: absolute path of partition
+    :returns: the consolidated dictionary of hashes, or None if the hashes
+              file is missing or cannot be read
+    :raises OSError: for errors reading the invalidations file, other than
+                     it not existing
+    """
     hashes_file = join(partition_dir, HASH_FILE)
+    invalidations_file = join(partition_dir, HASH_INVALIDATIONS_FILE)
     with lock_path(partition_dir):
         try:
             with open(hashes_file, 'rb') as fp:
                 hashes = pickle.load(fp)
-            if suffix in hashes and not hashes[suffix]:
-                return
         except Exception:
-            return
-        hashes[suffix] = None
-        write_pickle(hashes, hashes_file, partition_dir, PICKLE_PROTOCOL)
+            hashes = None
+        modified = False
+        try:
+            with open(invalidations_file, 'rb') as fp:
+                for line in fp:
+                    suffix = line.strip()
+                    if hashes is not None and \
+                            (suffix not in hashes or hashes[suffix]):
+                        # a suffix new since the hashes file was written
+                        # is added, so get_hashes hashes it too
+                        hashes[suffix] = None
+                        modified = True
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return hashes
+        if modified:
+            write_pickle(hashes, hashes_file, partition_dir, PICKLE_PROTOCOL)
+        # every invalidation is in the hashes file now (or there is no
+        # hashes file and every suffix will be hashed anyway)
+        with open(invalidations_file, 'wb'):
+            pass
+    return hashes
 
 
 def get_hashes(partition_dir, recalculate=None, do_listdir=False,
@@ -288,19 +331,28 @@ def get_hashes(partition_dir, recalculate=None, do_listdir=False,
 
     hashed = 0
     hashes_file = join(partition_dir, HASH_FILE)
+    invalidations_file = join(partition_dir, HASH_INVALIDATIONS_FILE)
     modified = False
     force_rewrite = False
-    hashes = {}
+    hashes = None
     mtime = -1
 
     if recalculate is None:
         recalculate = []
 
     try:
-        with open(hashes_file, 'rb') as fp:
-            hashes = pickle.load(fp)
+        if getsize(invalidations_file):
+            hashes = consolidate_hashes(partition_dir)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    try:
+        if hashes is None:
+            with open(hashes_file, 'rb') as fp:
+                hashes = pickle.load(fp)
         mtime = getmtime(hashes_file)
     except Exception:
+        hashes = {}
         do_listdir = True
         force_rewrite = True
     if do_listdir:
@@ -322,15 +374,15 @@ def get_hashes(partition_dir, recalculate=None, do_listdir=False,
             modified = True
     if modified:
         with lock_path(partition_dir):
+            # Invalidations made while hashing are still in the
+            # invalidations file. If the hashes file changed, another
+            # process got there first; what it wrote is as current as what
+            # we have, so there is no need to hash again.
             if force_rewrite or not exists(hashes_file) or \
                     getmtime(hashes_file) == mtime:
                 write_pickle(
                     hashes, hashes_file, partition_dir, PICKLE_PROTOCOL)
-                return hashed, hashes
-        return get_hashes(partition_dir, recalculate, do_listdir,
-                          reclaim_age)
-    else:
-        return hashed, hashes
+    return hashed, hashes
 
 
 class AuditLocation(object):
@@ -348,7 +400,8 @@ class AuditLocation(object):
         return str(self.path)
 
 
-def object_audit_location_generator(devices, mount_check=True, logger=None):
+def object_audit_location_generator(devices, mount_check=True, logger=None,
+                                    device_dirs=None):
     """
     Given a devices path (e.g. "/srv/node"), yield an AuditLocation for all
     objects stored under that directory. The AuditLocation only knows the path
@@ -360,8 +413,15 @@ def object_audit_location_generator(devices, mount_check=True, logger=None):
     :param mount_check: flag to check if a mount check should be performed
                         on devices
     :param logger: a logger object
+    :param device_dirs: optional list of the devices to look in, all of them
+                        if not given
     """
-    device_dirs = listdir(devices)
+    if device_dirs:
+        # ignore any devices that are not under the devices path
+        device_dirs = [device for device in listdir(devices)
+                       if device in device_dirs]
+    else:
+        device_dirs = listdir(devices)
     # randomize devices in case of process restart before sweep completed
     shuffle(device_dirs)
     for device in device_dirs:
@@ -491,6 +551,54 @@ class DiskFileManager(object):
             os.path.join(device_path, 'tmp'))
         self.logger.increment('async_pendings')
 
+    def pickle_async_metadata(self, device, partition, account, container,
+                              obj, op, timestamp):
+        """
+        Saves a change whose metadata could not be published inline, for
+        the object crawler to send later.
+
+        :param device: name of the device the object is on
+        :param partition: partition the object is in
+        :param account: account name for the object
+        :param container: container name for the object
+        :param obj: object name
+        :param op: operation performed (ex: 'PUT', 'POST' or 'DELETE')
+        :param timestamp: X-Timestamp of the change
+        """
+        device_path = self.construct_dev_path(device)
+        async_dir = os.path.join(device_path, ASYNC_METADATA_DIR)
+        ohash = hash_path(account, container, obj)
+        data = {'op': op, 'partition': partition, 'account': account,
+                'container': container, 'obj': obj}
+        self.threadpools[device].run_in_thread(
+            write_pickle,
+            data,
+            os.path.join(async_dir, ohash[-3:], ohash + '-' +
+                         normalize_timestamp(timestamp)),
+            os.path.join(device_path, 'tmp'))
+        self.logger.increment('async_metadata')
+
+    def journal_change(self, device, partition, account, container, obj, op,
+                       timestamp):
+        """
+        Appends a change record for the object to the device's change
+        journal, which the object crawler tails instead of sweeping the disk.
+
+        :param device: name of the device the object is on
+        :param partition: partition the object is in
+        :param account: account name for the object
+        :param container: container name for the object
+        :param obj: object name
+        :param op: operation performed (ex: 'PUT', 'POST' or 'DELETE')
+        :param timestamp: X-Timestamp of the change
+        """
+        device_path = self.construct_dev_path(device)
+        record = journal.format_record(
+            op, partition, '/%s/%s/%s' % (account, container, obj), timestamp)
+        self.threadpools[device].run_in_thread(
+            journal.append_record, device_path, record)
+        self.logger.increment('journal_changes')
+
     def get_diskfile(self, device, partition, account, container, obj,
                      **kwargs):
         dev_path = self.get_dev_path(device)
@@ -499,9 +607,9 @@ class DiskFileManager(object):
         return DiskFile(self, dev_path, self.threadpools[device],
                         partition, account, container, obj, **kwargs)
 
-    def object_audit_location_generator(self):
+    def object_audit_location_generator(self, device_dirs=None):
         return object_audit_location_generator(self.devices, self.mount_check,
-                                               self.logger)
+                                               self.logger, device_dirs)
 
     def get_diskfile_from_audit_location(self, audit_location):
         dev_path = self.get_dev_path(audit_location.device, mount_check=False)
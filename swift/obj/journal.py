@@ -0,0 +1,157 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-device change journal for the object crawler.
+
+The object server appends one short line per PUT, POST or DELETE to
+``<device>/change_journal/changes``. The crawler periodically claims the
+journal by renaming it out of the way (under the same directory lock the
+writers use) and then only has to look at the objects named in the claimed
+files, so a crawl costs time proportional to churn instead of to the total
+number of objects on the device.
+
+Each record is a single line::
+
+    <timestamp> <op> <partition> <quoted object name>
+"""
+
+import os
+import time
+from urllib import unquote
+
+from swift.common.utils import lock_path, normalize_timestamp, quote, \
+    split_path
+
+JOURNALDIR = 'change_journal'
+JOURNAL_FILE = 'changes'
+CLAIMED_SUFFIX = '.claimed'
+
+
+def get_journal_dir(device_path):
+    """
+    Returns the path to the change journal directory of a device.
+
+    :param device_path: full path to the device
+    """
+    return os.path.join(device_path, JOURNALDIR)
+
+
+def format_record(op, partition, name, timestamp):
+    """
+    Builds a single journal line.
+
+    :param op: operation performed (ex: 'PUT', 'POST' or 'DELETE')
+    :param partition: partition the object lives in
+    :param name: object name as stored in its metadata, '/a/c/o'
+    :param timestamp: X-Timestamp of the request
+    :returns: a newline terminated journal record
+    """
+    return '%s %s %s %s\n' % (normalize_timestamp(timestamp), op,
+                              partition, quote(name))
+
+
+def parse_record(line):
+    """
+    Parses a journal line produced by :func:`format_record`.
+
+    :returns: a dict with timestamp, op, partition, name, account,
+              container and obj keys, or None if the line is truncated or
+              otherwise malformed
+    """
+    if not line.endswith('\n'):
+        return None
+    parts = line.split()
+    if len(parts) != 4:
+        return None
+    timestamp, op, partition, name = parts
+    name = unquote(name)
+    try:
+        account, container, obj = split_path(name, 3, 3, True)
+    except ValueError:
+        return None
+    return {'timestamp': timestamp, 'op': op, 'partition': partition,
+            'name': name, 'account': account, 'container': container,
+            'obj': obj}
+
+
+def append_record(device_path, record, timeout=10):
+    """
+    Appends a record to the journal of the given device.
+
+    :param device_path: full path to the device
+    :param record: a line produced by :func:`format_record`
+    :param timeout: seconds to wait for the journal lock
+    """
+    journal_dir = get_journal_dir(device_path)
+    with lock_path(journal_dir, timeout=timeout):
+        with open(os.path.join(journal_dir, JOURNAL_FILE), 'a') as fp:
+            fp.write(record)
+
+
+def claim_journal(device_path, timeout=10):
+    """
+    Moves the active journal of a device aside so writers start a new one.
+
+    :param device_path: full path to the device
+    :param timeout: seconds to wait for the journal lock
+    :returns: sorted list of claimed journal paths, including ones left
+              over from passes that were never acknowledged
+    """
+    journal_dir = get_journal_dir(device_path)
+    if not os.path.isdir(journal_dir):
+        return []
+    with lock_path(journal_dir, timeout=timeout):
+        journal = os.path.join(journal_dir, JOURNAL_FILE)
+        if os.path.exists(journal):
+            os.rename(journal, '%s.%s%s' % (
+                journal, normalize_timestamp(time.time()), CLAIMED_SUFFIX))
+    return sorted(os.path.join(journal_dir, f)
+                  for f in os.listdir(journal_dir)
+                  if f.endswith(CLAIMED_SUFFIX))
+
+
+def iter_claimed_records(claimed):
+    """
+    Yields the parsed records of claimed journal files, dropping duplicates
+    so each object shows up once, with its most recent change.
+
+    :param claimed: list of claimed journal paths
+    """
+    latest = {}
+    for path in claimed:
+        with open(path) as fp:
+            for line in fp:
+                record = parse_record(line)
+                if record is None:
+                    continue
+                seen = latest.get(record['name'])
+                if seen is None or seen['timestamp'] <= record['timestamp']:
+                    latest[record['name']] = record
+    for record in sorted(latest.itervalues(), key=lambda r: r['timestamp']):
+        yield record
+
+
+def release_claimed(claimed):
+    """
+    Removes claimed journal files once their changes have been delivered.
+
+    :param claimed: list of claimed journal paths
+    """
+    for path in claimed:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
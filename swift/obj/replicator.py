@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import errno
 import os
 from os.path import isdir, isfile, join
 import random
@@ -20,10 +21,13 @@ import shutil
 import time
 import itertools
 import cPickle as pickle
+from collections import defaultdict, deque
+from heapq import heappop, heappush
 from swift import gettext_ as _
 
 import eventlet
 from eventlet import GreenPool, tpool, Timeout, sleep, hubs
+from eventlet.event import Event
 from eventlet.green import subprocess
 from eventlet.support.greenlets import GreenletExit
 
@@ -31,17 +35,165 @@ from swift.common.ring import Ring
 from swift.common.utils import whataremyips, unlink_older_than, \
     compute_eta, get_logger, dump_recon_cache, ismount, \
     rsync_ip, mkdirs, config_true_value, list_from_csv, get_hub, \
-    tpool_reraise, config_auto_int_value
+    tpool_reraise, config_auto_int_value, json
 from swift.common.bufferedhttp import http_connect
 from swift.common.daemon import Daemon
 from swift.common.http import HTTP_OK, HTTP_INSUFFICIENT_STORAGE
 from swift.obj import ssync_sender
-from swift.obj.diskfile import DiskFileManager, get_hashes
+from swift.obj.diskfile import DiskFileManager, get_hashes, \
+    HASH_INVALIDATIONS_FILE
 
 
 hubs.use_hub(get_hub())
 
 
+class PartitionStates(object):
+    """
+    Durable per-device, per-partition replication state: when a partition
+    last replicated to all of its nodes, and how many attempts in a row have
+    failed since.
+
+    The states survive daemon restarts by being kept in a recon style cache
+    file, one top level key per device.
+
+    :param state_file: path of the file the states are kept in
+    :param logger: logger used to report problems writing the file
+    """
+
+    def __init__(self, state_file, logger):
+        self.state_file = state_file
+        self.logger = logger
+        self.states = self._load()
+        self.changed = set()
+
+    def _load(self):
+        try:
+            with open(self.state_file) as fp:
+                states = json.loads(fp.readline())
+        except (IOError, ValueError):
+            return {}
+        if not isinstance(states, dict):
+            return {}
+        return states
+
+    def get(self, device, partition):
+        """
+        Returns (last_sync, failures) for a partition; (0, 0) if it has
+        never been replicated.
+        """
+        last_sync, failures = self.states.get(device, {}).get(
+            partition, (0, 0))
+        return float(last_sync), int(failures)
+
+    def record(self, device, partition, success, begin):
+        """
+        Records the outcome of replicating a partition.
+
+        :param success: whether every node was synced
+        :param begin: start time of the attempt, which becomes the
+                      partition's last sync if it succeeded
+        """
+        last_sync, failures = self.get(device, partition)
+        if success:
+            last_sync, failures = begin, 0
+        else:
+            failures += 1
+        self.states.setdefault(device, {})[partition] = [last_sync, failures]
+        self.changed.add(device)
+
+    def prune(self, device, partitions):
+        """
+        Forgets the partitions of a device that are no longer on it.
+
+        :param partitions: set of the partitions still on the device
+        """
+        states = self.states.get(device, {})
+        for partition in [p for p in states if p not in partitions]:
+            del states[partition]
+            self.changed.add(device)
+
+    def save(self):
+        """Persists the states of the devices changed since the last save."""
+        if self.changed:
+            dump_recon_cache(
+                dict((device, self.states.get(device, {}))
+                     for device in self.changed),
+                self.state_file, self.logger)
+            self.changed = set()
+
+
+class ReplicationQueue(object):
+    """
+    Jobs waiting to be run, handed out in the order they were put in except
+    that no device has more than per_device jobs running at once; a device
+    at its limit is passed over until one of its jobs is done.
+
+    :param per_device: most jobs running per device, 0 for no limit
+    """
+
+    def __init__(self, per_device=0):
+        self.per_device = per_device
+        self.waiting = defaultdict(deque)
+        self.running = defaultdict(int)
+        # (position of the first waiting job, device) for every device with
+        # jobs waiting and room to run one
+        self.ready = []
+        self.count = 0
+        self.pending = 0
+        self.wakeup = None
+
+    def _has_room(self, device):
+        return not self.per_device or self.running[device] < self.per_device
+
+    def put(self, job):
+        device = job['device']
+        waiting = self.waiting[device]
+        waiting.append((self.count, job))
+        if len(waiting) == 1 and self._has_room(device):
+            heappush(self.ready, (self.count, device))
+        self.count += 1
+        self.pending += 1
+
+    def get(self):
+        """
+        Returns the next job, waiting for a device to have room if need be,
+        or None once no jobs are left waiting. Every job returned must be
+        passed to task_done once it has run.
+        """
+        while not self.ready:
+            if not self.pending:
+                return None
+            self.wakeup = Event()
+            self.wakeup.wait()
+        _junk, device = heappop(self.ready)
+        waiting = self.waiting[device]
+        _junk, job = waiting.popleft()
+        self.pending -= 1
+        self.running[device] += 1
+        if waiting and self._has_room(device):
+            heappush(self.ready, (waiting[0][0], device))
+        return job
+
+    def __iter__(self):
+        return iter(self.get, None)
+
+    def task_done(self, job):
+        device = job['device']
+        self.running[device] -= 1
+        waiting = self.waiting[device]
+        if waiting and self.per_device and \
+                self.running[device] == self.per_device - 1:
+            heappush(self.ready, (waiting[0][0], device))
+        if self.wakeup:
+            wakeup, self.wakeup = self.wakeup, None
+            wakeup.send()
+
+    def depths(self):
+        """Returns the number of jobs waiting for each device."""
+        return dict((device, len(waiting))
+                    for device, waiting in self.waiting.iteritems())
+
+
 class ObjectReplicator(Daemon):
     """
     Replicate objects.
@@ -64,6 +216,7 @@ class ObjectReplicator(Daemon):
         self.swift_dir = conf.get('swift_dir', '/etc/swift')
         self.port = int(conf.get('bind_port', 6000))
         self.concurrency = int(conf.get('concurrency', 1))
+        self.device_concurrency = int(conf.get('device_concurrency', 0))
         self.stats_interval = int(conf.get('stats_interval', '300'))
         self.object_ring = Ring(self.swift_dir, ring_name='object')
         self.ring_check_interval = int(conf.get('ring_check_interval', 15))
@@ -79,11 +232,17 @@ class ObjectReplicator(Daemon):
         self.recon_cache_path = conf.get('recon_cache_path',
                                          '/var/cache/swift')
         self.rcache = os.path.join(self.recon_cache_path, "object.recon")
+        self.partition_states = PartitionStates(
+            os.path.join(self.recon_cache_path, 'object_replicator.state'),
+            self.logger)
+        self.job_queue = ReplicationQueue()
         self.conn_timeout = float(conf.get('conn_timeout', 0.5))
         self.node_timeout = float(conf.get('node_timeout', 10))
         self.sync_method = getattr(self, conf.get('sync_method') or 'rsync')
         self.network_chunk_size = int(conf.get('network_chunk_size', 65536))
         self.disk_chunk_size = int(conf.get('disk_chunk_size', 65536))
+        self.ssync_batch_size = int(conf.get('ssync_batch_size', 1000))
+        self.ssync_read_ahead = int(conf.get('ssync_read_ahead', 4))
         self.headers = {
             'Content-Length': '0',
             'user-agent': 'obj-replicator %s' % os.getpid()}
@@ -210,6 +369,7 @@ class ObjectReplicator(Daemon):
         belong on this node.
 
         :param job: a dict containing info about the partition to be replicated
+        :returns: True if the partition's data is on its nodes
         """
 
         def tpool_get_suffixes(path):
@@ -218,6 +378,7 @@ class ObjectReplicator(Daemon):
         self.replication_count += 1
         self.logger.increment('partition.delete.count.%s' % (job['device'],))
         begin = time.time()
+        success = False
         try:
             responses = []
             suffixes = tpool.execute(tpool_get_suffixes, job['path'])
@@ -244,21 +405,25 @@ class ObjectReplicator(Daemon):
             if not suffixes or delete_handoff:
                 self.logger.info(_("Removing partition: %s"), job['path'])
                 tpool.execute(shutil.rmtree, job['path'], ignore_errors=True)
+                success = True
         except (Exception, Timeout):
             self.logger.exception(_("Error syncing handoff partition"))
         finally:
             self.partition_times.append(time.time() - begin)
             self.logger.timing_since('partition.delete.timing', begin)
+        return success
 
     def update(self, job):
         """
         High-level method that replicates a single partition.
 
         :param job: a dict containing info about the partition to be replicated
+        :returns: True if every node was synced
         """
         self.replication_count += 1
         self.logger.increment('partition.update.count.%s' % (job['device'],))
         begin = time.time()
+        success = False
         try:
             hashed, local_hash = tpool_reraise(
                 get_hashes, job['path'],
@@ -266,6 +431,7 @@ class ObjectReplicator(Daemon):
                 reclaim_age=self.reclaim_age)
             self.suffix_hash += hashed
             self.logger.update_stats('suffix.hashes', hashed)
+            success = True
             attempts_left = len(job['nodes'])
             nodes = itertools.chain(
                 job['nodes'],
@@ -290,6 +456,7 @@ class ObjectReplicator(Daemon):
                                                 "from %(ip)s"),
                                               {'resp': resp.status,
                                                'ip': node['replication_ip']})
+                            success = False
                             continue
                         remote_hash = pickle.loads(resp.read())
                         del resp
@@ -307,7 +474,8 @@ class ObjectReplicator(Daemon):
                     suffixes = [suffix for suffix in local_hash if
                                 local_hash[suffix] !=
                                 remote_hash.get(suffix, -1)]
-                    self.sync(node, job, suffixes)
+                    if not self.sync(node, job, suffixes):
+                        success = False
                     with Timeout(self.http_timeout):
                         conn = http_connect(
                             node['replication_ip'], node['replication_port'],
@@ -320,12 +488,15 @@ class ObjectReplicator(Daemon):
                 except (Exception, Timeout):
                     self.logger.exception(_("Error syncing with node: %s") %
                                           node)
+                    success = False
             self.suffix_count += len(local_hash)
         except (Exception, Timeout):
             self.logger.exception(_("Error syncing partition"))
+            success = False
         finally:
             self.partition_times.append(time.time() - begin)
             self.logger.timing_since('partition.update.timing', begin)
+        return success
 
     def stats_line(self):
         """
@@ -380,6 +551,17 @@ class ObjectReplicator(Daemon):
         while True:
             eventlet.sleep(self.stats_interval)
             self.stats_line()
+            self.dump_queue()
+
+    def dump_queue(self):
+        """
+        Saves the partition states and reports the number of partitions still
+        waiting on each device to recon.
+        """
+        self.partition_states.save()
+        dump_recon_cache(
+            {'object_replication_queue': self.job_queue.depths()},
+            self.rcache, self.logger)
 
     def detect_lockups(self):
         """
@@ -394,6 +576,30 @@ class ObjectReplicator(Daemon):
                 self.kill_coros()
             self.last_replication_count = self.replication_count
 
+    def job_priority(self, job):
+        """
+        Returns the sort key of a job; jobs with lower keys run first.
+
+        Partitions whose last sync failed come first, then handoff
+        partitions, then partitions written to since they were last hashed,
+        then the rest; with handoffs_first handoff partitions come before
+        all of them. Within each of those the partition that was last synced
+        longest ago comes first.
+        """
+        last_sync, failures = self.partition_states.get(
+            job['device'], job['partition'])
+        if job['delete'] and self.handoffs_first:
+            tier = 0
+        elif failures:
+            tier = 1
+        elif job['delete']:
+            tier = 2
+        elif job['last_write']:
+            tier = 3
+        else:
+            tier = 4
+        return tier, last_sync
+
     def collect_jobs(self):
         """
         Returns a sorted list of jobs (dictionaries) that specify the
@@ -417,7 +623,9 @@ class ObjectReplicator(Daemon):
                 except Exception:
                     self.logger.exception('ERROR creating %s' % obj_path)
                 continue
-            for partition in os.listdir(obj_path):
+            partitions = os.listdir(obj_path)
+            self.partition_states.prune(local_dev['device'], set(partitions))
+            for partition in partitions:
                 try:
                     job_path = join(obj_path, partition)
                     if isfile(job_path):
@@ -431,18 +639,27 @@ class ObjectReplicator(Daemon):
                         self.object_ring.get_part_nodes(int(partition))
                     nodes = [node for node in part_nodes
                              if node['id'] != local_dev['id']]
+                    try:
+                        # a partition with invalidations not yet folded
+                        # into its hashes was written to; note when
+                        stat = os.stat(join(job_path, HASH_INVALIDATIONS_FILE))
+                        last_write = stat.st_mtime if stat.st_size else 0
+                    except OSError as err:
+                        if err.errno != errno.ENOENT:
+                            raise
+                        last_write = 0
                     jobs.append(
                         dict(path=job_path,
                              device=local_dev['device'],
                              nodes=nodes,
                              delete=len(nodes) > len(part_nodes) - 1,
-                             partition=partition))
+                             partition=partition,
+                             last_write=last_write))
                 except (ValueError, OSError):
                     continue
+        # shuffle first so that ties are broken at random
         random.shuffle(jobs)
-        if self.handoffs_first:
-            # Move the handoff parts to the front of the list
-            jobs.sort(key=lambda job: not job['delete'])
+        jobs.sort(key=self.job_priority)
         self.job_count = len(jobs)
         return jobs
 
@@ -467,6 +684,7 @@ class ObjectReplicator(Daemon):
 
         try:
             self.run_pool = GreenPool(size=self.concurrency)
+            self.job_queue = ReplicationQueue(self.device_concurrency)
             jobs = self.collect_jobs()
             for job in jobs:
                 if override_devices and job['device'] not in override_devices:
@@ -474,18 +692,20 @@ class ObjectReplicator(Daemon):
                 if override_partitions and \
                         job['partition'] not in override_partitions:
                     continue
+                self.job_queue.put(job)
+            self.dump_queue()
+            for job in self.job_queue:
                 dev_path = join(self.devices_dir, job['device'])
                 if self.mount_check and not ismount(dev_path):
                     self.logger.warn(_('%s is not mounted'), job['device'])
+                    self.job_queue.task_done(job)
                     continue
                 if not self.check_ring():
                     self.logger.info(_("Ring change detected. Aborting "
                                        "current replication pass."))
+                    self.job_queue.task_done(job)
                     return
-                if job['delete']:
-                    self.run_pool.spawn(self.update_deleted, job)
-                else:
-                    self.run_pool.spawn(self.update, job)
+                self.run_pool.spawn(self.run_job, job)
             with Timeout(self.lockup_timeout):
                 self.run_pool.waitall()
         except (Exception, Timeout):
@@ -495,6 +715,25 @@ class ObjectReplicator(Daemon):
             stats.kill()
             lockup_detector.kill()
             self.stats_line()
+            self.dump_queue()
+
+    def run_job(self, job):
+        """
+        Replicates the partition of a job taken from the job queue and
+        records how it went.
+
+        :param job: a dict containing info about the partition to be replicated
+        """
+        begin = time.time()
+        try:
+            if job['delete']:
+                success = self.update_deleted(job)
+            else:
+                success = self.update(job)
+            self.partition_states.record(
+                job['device'], job['partition'], success, begin)
+        finally:
+            self.job_queue.task_done(job)
 
     def run_once(self, *args, **kwargs):
         start = time.time()
@@ -26,7 +26,8 @@ from datetime import datetime
 from swift import gettext_ as _
 from hashlib import md5
 
-from eventlet import sleep, Timeout
+from eventlet import sleep, spawn, Timeout
+from eventlet.queue import Full, LightQueue
 
 from swift.common.utils import public, get_logger, \
     config_true_value, timing_stats, replication
@@ -46,6 +47,8 @@ from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPCreated, \
     HTTPInsufficientStorage, HTTPForbidden, HTTPException, HeaderKeyDict, \
     HTTPConflict
 from swift.obj.diskfile import DATAFILE_SYSTEM_META, DiskFileManager
+from swift.metadata.utils import format_metadata, get_metadata_ring, \
+    get_sender, object_tombstone
 
 
 class ObjectController(object):
@@ -95,6 +98,26 @@ class ObjectController(object):
             'expiring_objects'
         self.expiring_objects_container_divisor = \
             int(conf.get('expiring_objects_container_divisor') or 86400)
+        self.change_journal = config_true_value(
+            conf.get('change_journal', 'false'))
+        # publish each change to the metadata server as it is made, instead
+        # of waiting for the object crawler to find it
+        self.publish_metadata = config_true_value(
+            conf.get('publish_metadata', 'false'))
+        if self.publish_metadata:
+            self.md_server_ip = conf.get('md-server-ip', '127.0.0.1')
+            self.md_server_port = conf.get('md-server-port', '6090')
+            self.metadata_ring = get_metadata_ring(conf)
+            # a failed publish is saved for the object crawler to retry
+            self.metadata_conf = {'conn_timeout': self.conn_timeout,
+                                  'node_timeout': self.node_timeout,
+                                  'send_retries': 0}
+            # changes are queued for a publisher greenthread, so requests
+            # don't wait on the metadata server
+            self.metadata_queue = LightQueue(
+                int(conf.get('metadata_queue_size', 10000)))
+            self.metadata_senders = {}
+            self.metadata_publisher = None
         # Initialization was successful, so now apply the network chunk size
         # parameter as the default read / write buffer size for the network
         # sockets.
@@ -137,6 +160,8 @@ class ObjectController(object):
             conf.get('replication_failure_threshold') or 100)
         self.replication_failure_ratio = float(
             conf.get('replication_failure_ratio') or 1.0)
+        self.replication_update_workers = int(
+            conf.get('replication_update_workers') or 4)
 
     def get_diskfile(self, device, partition, account, container, obj,
                      **kwargs):
@@ -241,6 +266,125 @@ class ObjectController(object):
                               contpartition, contdevice, headers_out,
                               objdevice)
 
+    def journal_update(self, op, device, partition, account, container, obj,
+                       timestamp):
+        """
+        Records the change in the device's change journal, if enabled, so the
+        object crawler only has to look at objects that actually changed.
+
+        :param op: operation performed (ex: 'PUT', 'POST' or 'DELETE')
+        :param device: device name that the object is in
+        :param partition: partition that the object is in
+        :param account: account name for the object
+        :param container: container name for the object
+        :param obj: object name
+        :param timestamp: X-Timestamp of the change
+        """
+        if not self.change_journal:
+            return
+        try:
+            self._diskfile_mgr.journal_change(
+                device, partition, account, container, obj, op, timestamp)
+        except (Exception, Timeout):
+            self.logger.exception(_(
+                'ERROR failed to journal %(op)s of %(path)s'),
+                {'op': op, 'path': '/%s/%s/%s' % (account, container, obj)})
+
+    def metadata_update(self, op, device, partition, account, container, obj,
+                        metadata):
+        """
+        Queues the object's new metadata, or its tombstone, to be published
+        to the metadata server, if enabled. A change that cannot be queued
+        or sent is saved to be sent later by the object crawler.
+
+        :param op: operation performed (ex: 'PUT', 'POST' or 'DELETE')
+        :param device: device name that the object is in
+        :param partition: partition that the object is in
+        :param account: account name for the object
+        :param container: container name for the object
+        :param obj: object name
+        :param metadata: the object's metadata after the change; for a
+                         DELETE only its X-Timestamp
+        """
+        if not self.publish_metadata:
+            return
+        timestamp = metadata['X-Timestamp']
+        tag = (device, partition, account, container, obj, op, timestamp)
+        try:
+            if op == 'DELETE':
+                item = object_tombstone(account, container, obj, timestamp)
+            else:
+                item = format_metadata(dict(metadata))
+            if self.metadata_publisher is None or \
+                    self.metadata_publisher.dead:
+                # not started at init, which also runs in the parent
+                # process before the workers fork
+                self.metadata_publisher = spawn(self.run_metadata_publisher)
+            self.metadata_queue.put_nowait((op, item, tag))
+        except Full:
+            self.logger.increment('async_metadata.queue_full')
+            self._diskfile_mgr.pickle_async_metadata(*tag)
+        except (Exception, Timeout):
+            self.logger.exception(_(
+                'ERROR failed to publish metadata of %(op)s of %(path)s'),
+                {'op': op, 'path': '/%s/%s/%s' % (account, container, obj)})
+            self._diskfile_mgr.pickle_async_metadata(*tag)
+
+    def run_metadata_publisher(self):
+        """
+        Publishes the changes queued by metadata_update for as long as the
+        server runs, as many at a time as have queued up.
+        """
+        while True:
+            changes = [self.metadata_queue.get()]
+            while not self.metadata_queue.empty():
+                changes.append(self.metadata_queue.get_nowait())
+            try:
+                self.publish_metadata_changes(changes)
+            except (Exception, Timeout):
+                self.logger.exception(_('ERROR publishing metadata'))
+
+    def publish_metadata_changes(self, changes):
+        """
+        Sends metadata changes to the metadata server in order, batching
+        each run of PUTs or of DELETEs, over connections that are kept open
+        from one call to the next.
+
+        :param changes: list of (op, item, tag) tuples, as queued by
+                        metadata_update
+        """
+        sender = None
+        for op, item, tag in changes:
+            method = 'DELETE' if op == 'DELETE' else 'PUT'
+            if method not in self.metadata_senders:
+                self.metadata_senders[method] = get_sender(
+                    self.metadata_conf, 'object_crawler', self.md_server_ip,
+                    self.md_server_port, self.logger,
+                    ring=self.metadata_ring,
+                    on_batch=self._metadata_published, method=method)
+            if sender is not None and \
+                    sender is not self.metadata_senders[method]:
+                sender.flush()
+            sender = self.metadata_senders[method]
+            sender.add(item, tag)
+        if sender is not None:
+            sender.flush()
+
+    def _metadata_published(self, success, tags):
+        """
+        Saves the changes of a batch the metadata server did not accept
+        for the object crawler to resend.
+        """
+        if success:
+            return
+        for tag in tags:
+            try:
+                self._diskfile_mgr.pickle_async_metadata(*tag)
+            except (Exception, Timeout):
+                self.logger.exception(_(
+                    'ERROR saving unpublished metadata of %s'),
+                    '/%s/%s/%s' % tag[2:5])
+
     def delete_at_update(self, op, delete_at, account, container, obj,
                          request, objdevice):
         """
@@ -352,6 +496,16 @@ class ObjectController(object):
                 self.delete_at_update('DELETE', orig_delete_at, account,
                                       container, obj, request, device)
         disk_file.write_metadata(metadata)
+        self.journal_update('POST', device, partition, account, container,
+                            obj, metadata['X-Timestamp'])
+        if self.publish_metadata:
+            # a POST keeps the system metadata of the data file
+            new_metadata = dict(
+                (key, val) for key, val in orig_metadata.iteritems()
+                if key == 'name' or key.lower() in DATAFILE_SYSTEM_META)
+            new_metadata.update(metadata)
+            self.metadata_update('POST', device, partition, account,
+                                 container, obj, new_metadata)
         return HTTPAccepted(request=request)
 
     @public
@@ -449,6 +603,10 @@ class ObjectController(object):
                 'x-timestamp': metadata['X-Timestamp'],
                 'x-etag': metadata['ETag']}),
             device)
+        self.journal_update('PUT', device, partition, account, container,
+                            obj, metadata['X-Timestamp'])
+        self.metadata_update('PUT', device, partition, account, container,
+                             obj, metadata)
         return HTTPCreated(request=request, etag=etag)
 
     @public
@@ -619,6 +777,11 @@ class ObjectController(object):
                 'DELETE', account, container, obj, request,
                 HeaderKeyDict({'x-timestamp': req_timestamp}),
                 device)
+            self.journal_update('DELETE', device, partition, account,
+                                container, obj, req_timestamp)
+            self.metadata_update('DELETE', device, partition, account,
+                                 container, obj,
+                                 {'X-Timestamp': req_timestamp})
         return response_class(request=request)
 
     @public
@@ -643,7 +806,9 @@ class ObjectController(object):
     @replication
     @timing_stats(sample_rate=0.1)
     def REPLICATION(self, request):
-        return Response(app_iter=ssync_receiver.Receiver(self, request)())
+        receiver = ssync_receiver.Receiver(self, request)
+        return Response(app_iter=receiver(), headers={
+            'X-Backend-Ssync-Version': str(receiver.version)})
 
     def __call__(self, env, start_response):
         """WSGI Application entry point for the Swift Object Server."""
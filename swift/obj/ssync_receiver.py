@@ -16,6 +16,7 @@
 import urllib
 
 import eventlet
+import eventlet.event
 import eventlet.wsgi
 import eventlet.greenio
 
@@ -26,6 +27,10 @@ from swift.common import swob
 from swift.common import utils
 
 
+#: Newest REPLICATION protocol version the receiver speaks.
+PROTOCOL_VERSION = 2
+
+
 class Receiver(object):
     """
     Handles incoming REPLICATION requests to the object server.
@@ -57,6 +62,12 @@ class Receiver(object):
         3. Updates: Sender sends the object information requested.
 
         4. Close down: Release semaphore lock, etc.
+
+    A sender that speaks version 2 of the protocol asks for it with an
+    X-Backend-Ssync-Version request header, and the receiver answers with
+    the version it will use in the same response header. In version 2
+    steps 2 and 3 are repeated, for one batch of objects at a time, until
+    the sender ends the request; see :py:meth:`pipeline`.
     """
 
     def __init__(self, app, request):
@@ -65,6 +76,11 @@ class Receiver(object):
         self.device = None
         self.partition = None
         self.fp = None
+        try:
+            self.version = min(max(int(request.headers.get(
+                'X-Backend-Ssync-Version', 1)), 1), PROTOCOL_VERSION)
+        except ValueError:
+            self.version = 1
         # We default to dropping the connection in case there is any exception
         # raised during processing because otherwise the sender could send for
         # quite some time before realizing it was all in vain.
@@ -99,10 +115,14 @@ class Receiver(object):
                         raise swob.HTTPServiceUnavailable()
                 try:
                     with self.app._diskfile_mgr.replication_lock(self.device):
-                        for data in self.missing_check():
-                            yield data
-                        for data in self.updates():
-                            yield data
+                        if self.version > 1:
+                            for data in self.pipeline():
+                                yield data
+                        else:
+                            for data in self.missing_check():
+                                yield data
+                            for data in self.updates():
+                                yield data
                     # We didn't raise an exception, so end the request
                     # normally.
                     self.disconnect = False
@@ -177,7 +197,40 @@ class Receiver(object):
         for data in self._ensure_flush():
             yield data
 
-    def missing_check(self):
+    def pipeline(self):
+        """
+        Handles the MISSING_CHECK and UPDATES steps of a version 2
+        REPLICATION request.
+
+        The sender sends any number of MISSING_CHECK and UPDATES steps,
+        each for a batch of objects, and ends the request once it has read
+        the response to the last of them. It sends the MISSING_CHECK step of
+        the next batch before the UPDATES step of the current one, so this
+        looks for the next batch's objects while the current batch is still
+        on its way, and there's no round trip between the two.
+
+        The subrequests of each UPDATES step are committed by up to
+        replication_update_workers greenthreads at once; see
+        :py:meth:`updates`.
+        """
+        while True:
+            with exceptions.MessageTimeout(
+                    self.app.client_timeout, 'pipeline start'):
+                line = self.fp.readline(self.app.network_chunk_size)
+            if not line:
+                break
+            if line.strip() == ':MISSING_CHECK: START':
+                steps = self.missing_check(line)
+            elif line.strip() == ':UPDATES: START':
+                steps = self.updates(line)
+            else:
+                raise Exception(
+                    'Looking for :MISSING_CHECK: START or :UPDATES: START '
+                    'got %r' % line[:1024])
+            for data in steps:
+                yield data
+
+    def missing_check(self, line=None):
         """
         Handles the receiver-side of the MISSING_CHECK step of a
         REPLICATION request.
@@ -210,10 +263,14 @@ class Receiver(object):
         The collection and then response is so the sender doesn't
         have to read while it writes to ensure network buffers don't
         fill up and block everything.
+
+        :param line: the `:MISSING_CHECK: START` line, if it has already
+                     been read
         """
-        with exceptions.MessageTimeout(
-                self.app.client_timeout, 'missing_check start'):
-            line = self.fp.readline(self.app.network_chunk_size)
+        if line is None:
+            with exceptions.MessageTimeout(
+                    self.app.client_timeout, 'missing_check start'):
+                line = self.fp.readline(self.app.network_chunk_size)
         if line.strip() != ':MISSING_CHECK: START':
             raise Exception(
                 'Looking for :MISSING_CHECK: START got %r' % line[:1024])
@@ -249,7 +306,7 @@ class Receiver(object):
         for data in self._ensure_flush():
             yield data
 
-    def updates(self):
+    def updates(self, line=None):
         """
         Handles the UPDATES step of a REPLICATION request.
 
@@ -286,14 +343,33 @@ class Receiver(object):
         thresholds) so the sender knows the whole was not entirely a
         success. This is so the sender knows if it can remove an out
         of place partition, for example.
+
+        In version 2 of the protocol, once the body of a subrequest has
+        been read it is committed in a greenthread of its own while the
+        next subrequest is read, up to replication_update_workers at once.
+
+        :param line: the `:UPDATES: START` line, if it has already been
+                     read
         """
-        with exceptions.MessageTimeout(
-                self.app.client_timeout, 'updates start'):
-            line = self.fp.readline(self.app.network_chunk_size)
+        if line is None:
+            with exceptions.MessageTimeout(
+                    self.app.client_timeout, 'updates start'):
+                line = self.fp.readline(self.app.network_chunk_size)
         if line.strip() != ':UPDATES: START':
             raise Exception('Looking for :UPDATES: START got %r' % line[:1024])
-        successes = 0
-        failures = 0
+        results = {'successes': 0, 'failures': 0}
+        errors = []
+        pool = None
+        if self.version > 1:
+            pool = eventlet.GreenPool(self.app.replication_update_workers)
+        try:
+            for data in self._updates(pool, results, errors):
+                yield data
+        finally:
+            if pool:
+                pool.waitall()
+
+    def _updates(self, pool, results, errors):
         while True:
             with exceptions.MessageTimeout(
                     self.app.client_timeout, 'updates line'):
@@ -347,6 +423,8 @@ class Receiver(object):
                                 'Early termination for %s %s' % (method, path))
                         left -= len(chunk)
                         yield chunk
+                    if body_read and not body_read.ready():
+                        body_read.send()
                 subreq.environ['wsgi.input'] = utils.FileLikeIter(
                     subreq_iter())
             else:
@@ -355,13 +433,20 @@ class Receiver(object):
             if replication_headers:
                 subreq.headers['X-Backend-Replication-Headers'] = \
                     ' '.join(replication_headers)
-            # Route subrequest and translate response.
-            resp = subreq.get_response(self.app)
-            if http.is_success(resp.status_int) or \
-                    resp.status_int == http.HTTP_NOT_FOUND:
-                successes += 1
+            if pool:
+                # Commit the subrequest in the background, but only go on
+                # to the next one once this one's body has been read.
+                body_read = eventlet.event.Event()
+                pool.spawn(self._commit, subreq, body_read, results, errors)
+                if method == 'PUT':
+                    body_read.wait()
             else:
-                failures += 1
+                body_read = None
+                self._commit(subreq, results=results)
+            if errors:
+                raise errors[0]
+            successes = results['successes']
+            failures = results['failures']
             if failures >= self.app.replication_failure_threshold and (
                     not successes or
                     float(failures) / successes >
@@ -369,11 +454,12 @@ class Receiver(object):
                 raise Exception(
                     'Too many %d failures to %d successes' %
                     (failures, successes))
-            # The subreq may have failed, but we want to read the rest of the
-            # body from the remote side so we can continue on with the next
-            # subreq.
-            for junk in subreq.environ['wsgi.input']:
-                pass
+        if pool:
+            pool.waitall()
+            if errors:
+                raise errors[0]
+        successes = results['successes']
+        failures = results['failures']
         if failures:
             raise swob.HTTPInternalServerError(
                 'ERROR: With :UPDATES: %d failures to %d successes' %
@@ -382,3 +468,38 @@ class Receiver(object):
         yield ':UPDATES: END\r\n'
         for data in self._ensure_flush():
             yield data
+
+    def _commit(self, subreq, body_read=None, results=None, errors=None):
+        """
+        Routes an UPDATES subrequest to the object server.
+
+        :param subreq: the subrequest
+        :param body_read: if given, an event to send once the body of the
+                          subrequest has been read, and any exception is
+                          appended to errors instead of being raised
+        :param results: if given, a dict whose 'successes' or 'failures'
+                        count is incremented with the subrequest's result
+        :param errors: list for the exceptions of subrequests committed
+                       with a body_read event
+        :returns: True if the subrequest succeeded
+        """
+        try:
+            resp = subreq.get_response(self.app)
+            # The subreq may have failed, but we want to read the rest of the
+            # body from the remote side so we can continue on with the next
+            # subreq.
+            for junk in subreq.environ['wsgi.input']:
+                pass
+            success = http.is_success(resp.status_int) or \
+                resp.status_int == http.HTTP_NOT_FOUND
+        except (Exception, exceptions.Timeout) as err:
+            if body_read is None:
+                raise
+            errors.append(err)
+            return False
+        finally:
+            if body_read and not body_read.ready():
+                body_read.send()
+        if results is not None:
+            results['successes' if success else 'failures'] += 1
+        return success
@@ -13,12 +13,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import itertools
 import urllib
+
+import eventlet
+import eventlet.queue
+
 from swift.common import bufferedhttp
 from swift.common import exceptions
 from swift.common import http
 
 
+#: Newest REPLICATION protocol version the sender speaks.
+PROTOCOL_VERSION = 2
+
+
 class Sender(object):
     """
     Sends REPLICATION requests to the object server.
@@ -26,6 +35,10 @@ class Sender(object):
     These requests are eventually handled by
     :py:mod:`.ssync_receiver` and full documentation about the
     process is there.
+
+    The sender asks for version 2 of the protocol, which pipelines the
+    request (see :py:meth:`pipeline`), and falls back to version 1 with
+    object servers that don't answer with it.
     """
 
     def __init__(self, daemon, node, job, suffixes):
@@ -37,8 +50,10 @@ class Sender(object):
         self.response = None
         self.response_buffer = ''
         self.response_chunk_left = 0
+        self.response_lines = None
         self.send_list = None
         self.failures = 0
+        self.version = 1
 
     def __call__(self):
         if not self.suffixes:
@@ -52,8 +67,11 @@ class Sender(object):
                 # abort the replication attempt and log a simple error. All
                 # other exceptions will be logged with a full stack trace.
                 self.connect()
-                self.missing_check()
-                self.updates()
+                if self.version > 1:
+                    self.pipeline()
+                else:
+                    self.missing_check()
+                    self.updates()
                 self.disconnect()
                 return self.failures == 0
             except (exceptions.MessageTimeout,
@@ -94,6 +112,8 @@ class Sender(object):
             self.connection.putrequest('REPLICATION', '/%s/%s' % (
                 self.node['device'], self.job['partition']))
             self.connection.putheader('Transfer-Encoding', 'chunked')
+            self.connection.putheader('X-Backend-Ssync-Version',
+                                      str(PROTOCOL_VERSION))
             self.connection.endheaders()
         with exceptions.MessageTimeout(
                 self.daemon.node_timeout, 'connect receive'):
@@ -102,6 +122,12 @@ class Sender(object):
                 raise exceptions.ReplicationException(
                     'Expected status %s; got %s' %
                     (http.HTTP_OK, self.response.status))
+        # Object servers that predate versions don't send the header.
+        try:
+            self.version = min(int(self.response.getheader(
+                'X-Backend-Ssync-Version', 1)), PROTOCOL_VERSION)
+        except ValueError:
+            self.version = 1
 
     def readline(self):
         """
@@ -148,6 +174,71 @@ class Sender(object):
             data += '\n'
         return data
 
+    def next_line(self):
+        """
+        Returns the next line of the REPLICATION response body, from
+        :py:meth:`read_responses` when the request is pipelined.
+        """
+        if self.response_lines is None:
+            return self.readline()
+        line = self.response_lines.get()
+        if not isinstance(line, str):
+            raise line
+        return line
+
+    def read_responses(self):
+        """
+        Reads the lines of the REPLICATION response body into
+        response_lines as they arrive, so that the receiver never waits on
+        the sender to read its responses while the sender is still sending.
+        """
+        try:
+            while True:
+                line = self.readline()
+                self.response_lines.put(line)
+                if not line:
+                    break
+        except Exception as err:
+            self.response_lines.put(err)
+
+    def pipeline(self):
+        """
+        Handles the MISSING_CHECK and UPDATES steps of a version 2
+        REPLICATION request.
+
+        The objects of the suffixes are checked ssync_batch_size at a time
+        and the MISSING_CHECK step of each batch is sent before the UPDATES
+        step of the previous one, so the receiver looks for the next batch's
+        objects while the current batch's are on their way. The responses
+        come back in the order the steps were sent.
+
+        Full documentation of this can be found at
+        :py:meth:`.Receiver.pipeline`.
+        """
+        self.response_lines = eventlet.queue.LightQueue()
+        reader = eventlet.spawn(self.read_responses)
+        try:
+            hashes = self.daemon._diskfile_mgr.yield_hashes(
+                self.job['device'], self.job['partition'], self.suffixes)
+            batch_size = self.daemon.ssync_batch_size
+            self.send_missing_check(itertools.islice(hashes, batch_size))
+            send_list = self.receive_missing_check()
+            updating = False
+            while True:
+                batch = list(itertools.islice(hashes, batch_size))
+                if batch:
+                    self.send_missing_check(batch)
+                self.send_updates(send_list)
+                if updating:
+                    self.receive_updates()
+                updating = True
+                if not batch:
+                    break
+                send_list = self.receive_missing_check()
+            self.receive_updates()
+        finally:
+            reader.kill()
+
     def missing_check(self):
         """
         Handles the sender-side of the MISSING_CHECK step of a
@@ -156,14 +247,22 @@ class Sender(object):
         Full documentation of this can be found at
         :py:meth:`.Receiver.missing_check`.
         """
-        # First, send our list.
+        self.send_missing_check()
+        self.send_list = self.receive_missing_check()
+
+    def send_missing_check(self, hashes=None):
+        """
+        Sends a MISSING_CHECK step for the (path, object_hash, timestamp)
+        tuples of hashes, by default for all the objects of the suffixes.
+        """
         with exceptions.MessageTimeout(
                 self.daemon.node_timeout, 'missing_check start'):
             msg = ':MISSING_CHECK: START\r\n'
             self.connection.send('%x\r\n%s\r\n' % (len(msg), msg))
-        for path, object_hash, timestamp in \
-                self.daemon._diskfile_mgr.yield_hashes(
-                    self.job['device'], self.job['partition'], self.suffixes):
+        if hashes is None:
+            hashes = self.daemon._diskfile_mgr.yield_hashes(
+                self.job['device'], self.job['partition'], self.suffixes)
+        for path, object_hash, timestamp in hashes:
             with exceptions.MessageTimeout(
                     self.daemon.node_timeout,
                     'missing_check send line'):
@@ -175,11 +274,16 @@ class Sender(object):
                 self.daemon.node_timeout, 'missing_check end'):
             msg = ':MISSING_CHECK: END\r\n'
             self.connection.send('%x\r\n%s\r\n' % (len(msg), msg))
-        # Now, retrieve the list of what they want.
+
+    def receive_missing_check(self):
+        """
+        Reads the response to a MISSING_CHECK step and returns the list of
+        the object hashes the receiver wants.
+        """
         while True:
             with exceptions.MessageTimeout(
                     self.daemon.http_timeout, 'missing_check start wait'):
-                line = self.readline()
+                line = self.next_line()
             if not line:
                 raise exceptions.ReplicationException('Early disconnect')
             line = line.strip()
@@ -188,18 +292,19 @@ class Sender(object):
             elif line:
                 raise exceptions.ReplicationException(
                     'Unexpected response: %r' % line[:1024])
-        self.send_list = []
+        send_list = []
         while True:
             with exceptions.MessageTimeout(
                     self.daemon.http_timeout, 'missing_check line wait'):
-                line = self.readline()
+                line = self.next_line()
             if not line:
                 raise exceptions.ReplicationException('Early disconnect')
             line = line.strip()
             if line == ':MISSING_CHECK: END':
                 break
             if line:
-                self.send_list.append(line)
+                send_list.append(line)
+        return send_list
 
     def updates(self):
         """
@@ -209,12 +314,19 @@ class Sender(object):
         Full documentation of this can be found at
         :py:meth:`.Receiver.updates`.
         """
-        # First, send all our subrequests based on the send_list.
+        self.send_updates(self.send_list)
+        self.receive_updates()
+
+    def send_updates(self, send_list):
+        """
+        Sends an UPDATES step with the subrequests for the object hashes
+        of send_list.
+        """
         with exceptions.MessageTimeout(
                 self.daemon.node_timeout, 'updates start'):
             msg = ':UPDATES: START\r\n'
             self.connection.send('%x\r\n%s\r\n' % (len(msg), msg))
-        for object_hash in self.send_list:
+        for object_hash in send_list:
             try:
                 df = self.daemon._diskfile_mgr.get_diskfile_from_hash(
                     self.job['device'], self.job['partition'], object_hash)
@@ -234,11 +346,16 @@ class Sender(object):
                 self.daemon.node_timeout, 'updates end'):
             msg = ':UPDATES: END\r\n'
             self.connection.send('%x\r\n%s\r\n' % (len(msg), msg))
-        # Now, read their response for any issues.
+
+    def receive_updates(self):
+        """
+        Reads the response to an UPDATES step, raising if the receiver
+        reports any issues.
+        """
         while True:
             with exceptions.MessageTimeout(
                     self.daemon.http_timeout, 'updates start wait'):
-                line = self.readline()
+                line = self.next_line()
             if not line:
                 raise exceptions.ReplicationException('Early disconnect')
             line = line.strip()
@@ -250,7 +367,7 @@ class Sender(object):
         while True:
             with exceptions.MessageTimeout(
                     self.daemon.http_timeout, 'updates line wait'):
-                line = self.readline()
+                line = self.next_line()
             if not line:
                 raise exceptions.ReplicationException('Early disconnect')
             line = line.strip()
@@ -283,11 +400,40 @@ class Sender(object):
         msg = '\r\n'.join(msg) + '\r\n\r\n'
         with exceptions.MessageTimeout(self.daemon.node_timeout, 'send_put'):
             self.connection.send('%x\r\n%s\r\n' % (len(msg), msg))
-        for chunk in df.reader():
+        for chunk in self.read_ahead(df.reader()):
             with exceptions.MessageTimeout(
                     self.daemon.node_timeout, 'send_put chunk'):
                 self.connection.send('%x\r\n%s\r\n' % (len(chunk), chunk))
 
+    def read_ahead(self, chunks):
+        """
+        Yields the chunks of an object's body, read up to ssync_read_ahead
+        chunks ahead by another greenthread so that reading them from disk
+        (in the device's thread pool, if it has one) overlaps sending them.
+        """
+        queue = eventlet.queue.Queue(self.daemon.ssync_read_ahead)
+
+        def read():
+            try:
+                for chunk in chunks:
+                    queue.put(chunk)
+            except (Exception, exceptions.Timeout) as err:
+                queue.put(err)
+            else:
+                queue.put(None)
+
+        reader = eventlet.spawn(read)
+        try:
+            while True:
+                chunk = queue.get()
+                if chunk is None:
+                    break
+                if not isinstance(chunk, str):
+                    raise chunk
+                yield chunk
+        finally:
+            reader.kill()
+
     def disconnect(self):
         """
         Closes down the connection to the object server once done
@@ -28,9 +28,11 @@ import os
 import time
 import functools
 import inspect
+from hashlib import md5
 from sys import exc_info
 from swift import gettext_ as _
 from urllib import quote
+from urlparse import parse_qsl
 
 from eventlet import sleep
 from eventlet.timeout import Timeout
@@ -38,10 +40,11 @@ from eventlet.timeout import Timeout
 from swift.common.wsgi import make_pre_authed_env
 from swift.common.utils import normalize_timestamp, config_true_value, \
     public, split_path, list_from_csv, GreenthreadSafeIterator, \
-    quorum_size, GreenAsyncPile
+    quorum_size, GreenAsyncPile, json
 from swift.common.bufferedhttp import http_connect
 from swift.common.exceptions import ChunkReadTimeout, ChunkWriteTimeout, \
     ConnectionTimeout
+from swift.common.memcached import MemcacheConnectionError
 from swift.common.http import is_informational, is_success, is_redirection, \
     is_server_error, HTTP_OK, HTTP_PARTIAL_CONTENT, HTTP_MULTIPLE_CHOICES, \
     HTTP_BAD_REQUEST, HTTP_NOT_FOUND, HTTP_SERVICE_UNAVAILABLE, \
@@ -155,6 +158,7 @@ def headers_to_container_info(headers, status_int=HTTP_OK):
     headers, meta, sysmeta = _prep_headers_to_info(headers, 'container')
     return {
         'status': status_int,
+        'put_timestamp': headers.get('x-put-timestamp'),
         'read_acl': headers.get('x-container-read'),
         'write_acl': headers.get('x-container-write'),
         'sync_key': headers.get('x-container-sync-key'),
@@ -434,16 +438,147 @@ def _get_info_cache(app, env, account, container=None):
         return env[env_key]
     memcache = getattr(app, 'memcache', None) or env.get('swift.cache')
     if memcache:
-        info = memcache.get(cache_key)
-        if info:
-            for key in info:
-                if isinstance(info[key], unicode):
-                    info[key] = info[key].encode("utf-8")
-            env[env_key] = info
-        return info
+        keys = [(cache_key, env_key)]
+        if container and hasattr(memcache, 'get_many'):
+            # the account info is nearly always wanted next, so fetch it
+            # along with the container's in one round trip
+            account_keys = _get_cache_key(account, None)
+            if account_keys[1] not in env:
+                keys.append(account_keys)
+            infos = memcache.get_many([key for key, _junk in keys])
+        else:
+            infos = [memcache.get(cache_key)]
+        for (_junk, key_in_env), info in zip(keys, infos):
+            if info:
+                for key in info:
+                    if isinstance(info[key], unicode):
+                        info[key] = info[key].encode("utf-8")
+                env[key_in_env] = info
+        return infos[0]
     return None
 
 
+def _get_listing_cache_keys(account, container, req):
+    """
+    Get the memcache keys for the listing a container GET asks for
+    (listing_key) and for the count of object writes seen for the
+    container (generation_key), which cached listings are validated against.
+
+    :param account: The unquoted name of the account
+    :param container: The unquoted name of the container
+    :param req: the container GET request
+    :returns a tuple of (listing_key, generation_key)
+    """
+    params = sorted(parse_qsl(req.query_string, keep_blank_values=True))
+    digest = md5(json.dumps([params, req.headers.get('accept')]))
+    listing_key = 'container_listing/%s/%s/%s' % (
+        account, container, digest.hexdigest())
+    return listing_key, _get_listing_generation_key(account, container)
+
+
+def _get_listing_generation_key(account, container):
+    return 'container_listing_generation/%s/%s' % (account, container)
+
+
+def _get_listing_validator(info, generation):
+    """
+    Get the validator of a container listing: a digest of the container's
+    put timestamp, object count, bytes used, ACLs and metadata, and of its
+    listing generation.
+
+    :param info: the container info
+    :param generation: the container's listing generation or None
+    :returns: a hex digest
+    """
+    fields = [info.get(key) for key in (
+        'put_timestamp', 'object_count', 'bytes', 'read_acl', 'write_acl',
+        'sync_key', 'versions', 'meta', 'sysmeta')]
+    fields.append(generation)
+    return md5(json.dumps(fields, sort_keys=True)).hexdigest()
+
+
+def get_cached_listing(app, req, account, container):
+    """
+    Get a container listing from memcache, if it was cached while the
+    container had the same info as it has in the info cache now and no
+    object has been written to the container since.
+
+    :param app: the application object
+    :param req: the container GET request
+    :param account: The unquoted name of the account
+    :param container: The unquoted name of the container
+    :returns: a tuple of (generation, resp); generation is to be passed on
+              to set_cached_listing, resp is the cached listing or None
+    """
+    memcache = getattr(app, 'memcache', None) or req.environ.get('swift.cache')
+    if not memcache:
+        return None, None
+    keys = _get_listing_cache_keys(account, container, req)
+    if hasattr(memcache, 'get_many'):
+        cached, generation = memcache.get_many(keys)
+    else:
+        cached, generation = [memcache.get(key) for key in keys]
+    info = _get_info_cache(app, req.environ, account, container)
+    if cached and info and is_success(info['status']) and \
+            cached['validator'] == _get_listing_validator(info, generation):
+        app.logger.increment('container.listing_cache.hit')
+        resp = Response(request=req, status=cached['status'],
+                        body=cached['body'])
+        for key, value in cached['headers']:
+            resp.headers[str(key)] = value
+        return generation, resp
+    app.logger.increment('container.listing_cache.miss')
+    return generation, None
+
+
+def set_cached_listing(app, req, account, container, generation, resp):
+    """
+    Cache a container listing in memcache, unless it is larger than the
+    proxy's listing_cache_max_size.
+
+    :param app: the application object
+    :param req: the container GET request
+    :param account: The unquoted name of the account
+    :param container: The unquoted name of the container
+    :param generation: the generation returned by get_cached_listing before
+                       the listing was fetched
+    :param resp: the container GET response
+    """
+    memcache = getattr(app, 'memcache', None) or req.environ.get('swift.cache')
+    if not memcache or not is_success(resp.status_int) or \
+            resp.content_length is None or \
+            resp.content_length > app.listing_cache_max_size:
+        return
+    info = headers_to_container_info(resp.headers, resp.status_int)
+    listing_key, _junk = _get_listing_cache_keys(account, container, req)
+    memcache.set(listing_key, {
+        'validator': _get_listing_validator(info, generation),
+        'status': resp.status,
+        'headers': resp.headers.items(),
+        'body': resp.body}, time=app.listing_cache_time)
+
+
+def invalidate_cached_listings(app, env, account, container):
+    """
+    Invalidate the container listings cached for a container, after an
+    object in it was written, by bumping its listing generation.
+
+    :param app: the application object
+    :param env: the environment used by the current request
+    :param account: The unquoted name of the account
+    :param container: The unquoted name of the container
+    """
+    if not getattr(app, 'listing_cache_time', 0):
+        return
+    memcache = getattr(app, 'memcache', None) or env.get('swift.cache')
+    if memcache:
+        try:
+            memcache.incr(_get_listing_generation_key(account, container))
+        except MemcacheConnectionError:
+            # already logged; the listings still go stale with the info
+            pass
+
+
 def _prepare_pre_auth_info_request(env, path, swift_source):
     """
     Prepares a pre authed request to obtain info using a HEAD.
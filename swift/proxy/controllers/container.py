@@ -16,11 +16,11 @@
 from swift import gettext_ as _
 from urllib import unquote
 
-from swift.common.utils import public, csv_append
+from swift.common.utils import public, csv_append, config_true_value
 from swift.common.constraints import check_metadata, MAX_CONTAINER_NAME_LENGTH
 from swift.common.http import HTTP_ACCEPTED
 from swift.proxy.controllers.base import Controller, delay_denial, \
-    cors_validation, clear_info_cache
+    cors_validation, clear_info_cache, get_cached_listing, set_cached_listing
 from swift.common.swob import HTTPBadRequest, HTTPForbidden, \
     HTTPNotFound
 
@@ -61,11 +61,22 @@ class ContainerController(Controller):
         """Handler for HTTP GET/HEAD requests."""
         if not self.account_info(self.account_name, req)[1]:
             return HTTPNotFound(request=req)
-        part = self.app.container_ring.get_part(
-            self.account_name, self.container_name)
-        resp = self.GETorHEAD_base(
-            req, _('Container'), self.app.container_ring, part,
-            req.swift_entity_path)
+        use_cache = req.method == 'GET' and \
+            self.app.listing_cache_time and \
+            not config_true_value(req.headers.get('x-newest'))
+        resp = None
+        if use_cache:
+            generation, resp = get_cached_listing(
+                self.app, req, self.account_name, self.container_name)
+        if resp is None:
+            part = self.app.container_ring.get_part(
+                self.account_name, self.container_name)
+            resp = self.GETorHEAD_base(
+                req, _('Container'), self.app.container_ring, part,
+                req.swift_entity_path)
+            if use_cache:
+                set_cached_listing(self.app, req, self.account_name,
+                                   self.container_name, generation, resp)
         if 'swift.authorize' in req.environ:
             req.acl = resp.headers.get('x-container-read')
             aresp = req.environ['swift.authorize'](req)
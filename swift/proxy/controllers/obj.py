@@ -54,7 +54,7 @@ from swift.common.http import is_success, is_client_error, HTTP_CONTINUE, \
     HTTP_INTERNAL_SERVER_ERROR, HTTP_SERVICE_UNAVAILABLE, \
     HTTP_INSUFFICIENT_STORAGE, HTTP_OK
 from swift.proxy.controllers.base import Controller, delay_denial, \
-    cors_validation
+    cors_validation, invalidate_cached_listings
 from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPNotFound, \
     HTTPPreconditionFailed, HTTPRequestEntityTooLarge, HTTPRequestTimeout, \
     HTTPServerError, HTTPServiceUnavailable, Request, Response, \
@@ -1167,6 +1167,9 @@ class ObjectController(Controller):
                     source_resp.headers['last-modified']
             copy_headers_into(req, resp)
         resp.last_modified = math.ceil(float(req.headers['X-Timestamp']))
+        if is_success(resp.status_int):
+            invalidate_cached_listings(self.app, req.environ,
+                                       self.account_name, self.container_name)
         return resp
 
     @public
@@ -1263,6 +1266,9 @@ class ObjectController(Controller):
         resp = self.make_requests(req, self.app.object_ring,
                                   partition, 'DELETE', req.swift_entity_path,
                                   headers)
+        if is_success(resp.status_int):
+            invalidate_cached_listings(self.app, req.environ,
+                                       self.account_name, self.container_name)
         return resp
 
     @public
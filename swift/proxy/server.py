@@ -93,6 +93,10 @@ class Application(object):
             int(conf.get('recheck_container_existence', 60))
         self.recheck_account_existence = \
             int(conf.get('recheck_account_existence', 60))
+        self.listing_cache_time = \
+            int(conf.get('listing_cache_time', 0))
+        self.listing_cache_max_size = \
+            int(conf.get('listing_cache_max_size', 524288))
         self.allow_account_management = \
             config_true_value(conf.get('allow_account_management', 'no'))
         self.object_post_as_copy = \
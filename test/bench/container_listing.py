@@ -0,0 +1,122 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Container listing benchmark.
+
+Builds two containers and times ContainerBroker.list_objects_iter over
+their pseudo-directories, as the container server's GET does for listings
+with a delimiter, a prefix and a delimiter, or a path: a wide tree of
+--dirs directories of --objects objects each, and a deep tree --depth
+directories deep with --fanout subdirectories and objects in each::
+
+    python -m test.bench.container_listing --dirs 5000 --objects 20
+"""
+
+import os
+import time
+from optparse import OptionParser
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from swift.common.utils import normalize_timestamp
+from swift.container.backend import ContainerBroker
+
+
+def make_broker(path, names):
+    broker = ContainerBroker(path, account='a', container='c')
+    broker.initialize(normalize_timestamp(1))
+    timestamp = normalize_timestamp(1)
+    broker.merge_items([
+        {'name': name, 'created_at': timestamp, 'size': 0,
+         'content_type': 'text/plain', 'deleted': 0,
+         'etag': 'd41d8cd98f00b204e9800998ecf8427e'} for name in names])
+    return broker
+
+
+def deep_names(prefix, depth, fanout):
+    for i in xrange(fanout):
+        yield '%sobj%04d' % (prefix, i)
+        if depth:
+            for name in deep_names('%sdir%04d/' % (prefix, i), depth - 1,
+                                   fanout):
+                yield name
+
+
+def timed(label, count, func):
+    begin = time.time()
+    for i in xrange(count):
+        entries = len(func())
+    elapsed = time.time() - begin
+    print '  %-32s %8.3fms %6d entries' % (label, elapsed * 1000 / count,
+                                           entries)
+
+
+def run(dirs, objects, depth, fanout, count, limit):
+    testdir = mkdtemp()
+    try:
+        broker = make_broker(os.path.join(testdir, 'wide.db'), (
+            'dir%06d/obj%06d' % (i, j)
+            for i in xrange(dirs) for j in xrange(objects)))
+        print 'wide: %d directories of %d objects' % (dirs, objects)
+        timed('delimiter', count, lambda: broker.list_objects_iter(
+            limit, '', '', None, '/'))
+        timed('delimiter, past a marker', count,
+              lambda: broker.list_objects_iter(
+                  limit, 'dir%06d/' % (dirs / 2), '', None, '/'))
+        timed('path', count, lambda: broker.list_objects_iter(
+            limit, '', '', None, None, ''))
+        timed('prefix', count, lambda: broker.list_objects_iter(
+            limit, '', '', 'dir%06d/' % (dirs / 2), None))
+
+        broker = make_broker(os.path.join(testdir, 'deep.db'),
+                             deep_names('', depth, fanout))
+        print 'deep: %d directories deep, %d subdirectories and objects ' \
+            'in each' % (depth, fanout)
+        prefix = ''
+        for level in xrange(depth + 1):
+            timed('prefix and delimiter, level %d' % level, count,
+                  lambda: broker.list_objects_iter(
+                      limit, '', '', prefix, '/'))
+            prefix += 'dir%04d/' % (fanout / 2)
+        timed('path, top level', count, lambda: broker.list_objects_iter(
+            limit, '', '', None, None, ''))
+    finally:
+        rmtree(testdir, ignore_errors=True)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--dirs', type='int', default=2000,
+                      help='directories in the wide tree (default 2000)')
+    parser.add_option('--objects', type='int', default=20,
+                      help='objects in each directory of the wide tree '
+                           '(default 20)')
+    parser.add_option('--depth', type='int', default=3,
+                      help='depth of the deep tree (default 3)')
+    parser.add_option('--fanout', type='int', default=12,
+                      help='subdirectories and objects in each directory '
+                           'of the deep tree (default 12)')
+    parser.add_option('--count', type='int', default=10,
+                      help='times each listing is run (default 10)')
+    parser.add_option('--limit', type='int', default=10000,
+                      help='entries per listing (default 10000)')
+    options, _args = parser.parse_args()
+    run(options.dirs, options.objects, options.depth, options.fanout,
+        options.count, options.limit)
+
+
+if __name__ == '__main__':
+    main()
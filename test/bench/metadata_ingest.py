@@ -0,0 +1,93 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Ingest benchmark for MetadataBroker.
+
+Feeds synthetic object crawler payloads through insert_object_md in
+crawler sized batches and reports rows per second::
+
+    python -m test.bench.metadata_ingest --objects 1000000
+"""
+
+import os
+import time
+from optparse import OptionParser
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from swift.common.utils import normalize_timestamp
+from swift.metadata.backend import MetadataBroker, OBJECT_SYS_ATTRS
+
+
+def object_payload(index, custom_keys):
+    """Builds one object crawler record, the way ObjectCrawler formats it"""
+    account = 'AUTH_bench%d' % (index % 10)
+    container = 'con%d' % (index % 1000)
+    name = 'dir%d/obj%d' % (index % 100, index)
+    metadata = dict((attr, 'NULL') for attr in OBJECT_SYS_ATTRS)
+    metadata.update({
+        'object_uri': '/%s/%s/%s' % (account, container, name),
+        'object_name': name,
+        'object_account_name': account,
+        'object_container_name': container,
+        'object_uri_create_time': normalize_timestamp(index),
+        'object_last_modified_time': normalize_timestamp(index),
+        'object_last_activity_time': normalize_timestamp(index),
+        'object_etag_hash': '%032x' % index,
+        'object_content_type': 'application/octet-stream',
+        'object_content_length': str(index % 65536),
+    })
+    for key in xrange(custom_keys):
+        metadata['object_meta_key%d' % key] = 'value%d' % (index % 97)
+    return metadata
+
+
+def run(objects, batch_size, custom_keys, db_dir):
+    broker = MetadataBroker(os.path.join(db_dir, 'meta.db'))
+    broker.initialize(normalize_timestamp(time.time()))
+    elapsed = 0.0
+    for start in xrange(0, objects, batch_size):
+        batch = [object_payload(i, custom_keys)
+                 for i in xrange(start, min(start + batch_size, objects))]
+        begin = time.time()
+        broker.insert_object_md(batch)
+        elapsed += time.time() - begin
+    rows = objects * (1 + custom_keys)
+    print '%d objects (%d rows incl. custom metadata) in %.2fs' % (
+        objects, rows, elapsed)
+    print '%.0f objects/s, %.0f rows/s' % (
+        objects / elapsed, rows / elapsed)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--objects', type='int', default=1000000,
+                      help='number of objects to ingest (default 1000000)')
+    parser.add_option('--batch-size', type='int', default=1000,
+                      help='objects per insert_object_md call, matching the '
+                      'crawler batch_size (default 1000)')
+    parser.add_option('--custom-keys', type='int', default=2,
+                      help='custom metadata keys per object (default 2)')
+    options, _args = parser.parse_args()
+    db_dir = mkdtemp()
+    try:
+        run(options.objects, options.batch_size, options.custom_keys, db_dir)
+    finally:
+        rmtree(db_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sorting benchmark for the metadata GET API.
+
+Compares the in-memory Sort_metadata sorter with sorting done by SQLite
+through MetadataController.iter_sorted_results, on a container scope
+listing sorted by one or more attributes::
+
+    python -m test.bench.metadata_sort --objects 100000
+"""
+
+import os
+import time
+from optparse import OptionParser
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from swift.common.utils import normalize_timestamp
+from swift.metadata.backend import MetadataBroker, scope_args
+from swift.metadata.server import MetadataController
+from swift.metadata.utils import Sort_metadata
+from test.bench.metadata_ingest import object_payload
+
+ATTRS = 'object_uri,object_name,object_content_length'
+
+
+def timed(func, *args):
+    begin = time.time()
+    result = func(*args)
+    return result, time.time() - begin
+
+
+def run(objects, sort_keys, page_size, db_dir):
+    broker = MetadataBroker(os.path.join(db_dir, 'meta.db'))
+    broker.initialize(normalize_timestamp(time.time()))
+    # every object in the one container, so the listing is the whole DB
+    for start in xrange(0, objects, 1000):
+        batch = []
+        for i in xrange(start, min(start + 1000, objects)):
+            item = object_payload(i, 0)
+            item['object_account_name'] = 'AUTH_bench'
+            item['object_container_name'] = 'con'
+            item['object_uri'] = '/AUTH_bench/con/%s' % item['object_name']
+            batch.append(item)
+        broker.insert_object_md(batch)
+    query = broker.get_attributes_query('AUTH_bench', 'con', None, ATTRS)
+    controller = MetadataController({'location': db_dir})
+    args = scope_args('AUTH_bench', 'con', None)
+    scopes = [(3, query, args, 'object_uri', True)]
+    custom = ('', False, False, False)
+
+    def python_sort():
+        rows = broker.execute_query(query, 'AUTH_bench', 'con', None, True)
+        return Sort_metadata().sort_data(rows, sort_keys)
+
+    def sql_sort(limit=None):
+        return list(controller.iter_sorted_results(
+            broker, scopes, custom, sort_keys, limit=limit))
+
+    print 'sorting %d objects by %s' % (objects, ','.join(sort_keys))
+    rows, elapsed = timed(python_sort)
+    print '  Sort_metadata, whole listing:  %8.3fs' % elapsed
+    rows, elapsed = timed(sql_sort)
+    print '  ORDER BY, whole listing:       %8.3fs' % elapsed
+    rows, elapsed = timed(sql_sort, page_size)
+    print '  ORDER BY, first %5d results: %8.3fs' % (page_size, elapsed)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--objects', type='int', default=100000,
+                      help='number of objects to list (default 100000)')
+    parser.add_option('--sorted', default='object_content_length',
+                      help='comma separated attributes to sort by '
+                      '(default object_content_length)')
+    parser.add_option('--page-size', type='int', default=1000,
+                      help='limit of the paged request (default 1000)')
+    options, _args = parser.parse_args()
+    db_dir = mkdtemp()
+    try:
+        run(options.objects, options.sorted.split(','), options.page_size,
+            db_dir)
+    finally:
+        rmtree(db_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Ring lookup benchmark.
+
+Compares resolving many object names one get_part/get_part_nodes call at
+a time with the batched get_parts_many/get_part_nodes_many, and times
+walking handoff nodes with and without the ring's handoff cache::
+
+    python -m test.bench.ring_lookup --names 1000000 --part-power 18
+"""
+
+import os
+import time
+from itertools import islice
+from optparse import OptionParser
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from swift.common import utils
+from swift.common.ring import Ring, RingBuilder
+
+
+def timed(func, *args):
+    begin = time.time()
+    result = func(*args)
+    return result, time.time() - begin
+
+
+def build_ring(ring_dir, part_power, replicas, devices):
+    builder = RingBuilder(part_power, replicas, 1)
+    for dev_id in xrange(devices):
+        builder.add_dev({'id': dev_id, 'region': 1, 'zone': dev_id % 5,
+                         'weight': 100.0, 'ip': '10.0.0.%d' % (dev_id % 250),
+                         'port': 6000, 'device': 'sd%d' % dev_id})
+    builder.rebalance()
+    ring_file = os.path.join(ring_dir, 'object.ring.gz')
+    builder.get_ring().save(ring_file)
+    return ring_file
+
+
+def run(names, part_power, replicas, devices, ring_dir):
+    ring_file = build_ring(ring_dir, part_power, replicas, devices)
+    ring = Ring(ring_file)
+    objects = [('AUTH_bench', 'con%d' % (i % 100), 'obj%d' % i)
+               for i in xrange(names)]
+
+    def per_call():
+        return [ring.get_part_nodes(ring.get_part(*name))
+                for name in objects]
+
+    def batched():
+        return ring.get_part_nodes_many(ring.get_parts_many(objects))
+
+    print 'resolving %d names, 2^%d partitions, %d replicas, %d devices' % (
+        names, part_power, replicas, devices)
+    expected, elapsed = timed(per_call)
+    print '  get_part + get_part_nodes:            %8.3fs' % elapsed
+    result, elapsed = timed(batched)
+    print '  get_parts_many + get_part_nodes_many: %8.3fs' % elapsed
+    if result != expected:
+        print '  MISMATCH between the two paths'
+    parts, elapsed = timed(ring.get_parts_many, objects)
+    print '    of which get_parts_many:            %8.3fs' % elapsed
+    result, elapsed = timed(ring.get_part_nodes_many, parts)
+    print '    of which get_part_nodes_many:       %8.3fs' % elapsed
+
+    # every request of an outage needs a handoff or two
+    hot_parts = parts[:500] * (names / 5000)
+
+    def handoffs(ring):
+        return [list(islice(ring.get_more_nodes(part), 2))
+                for part in hot_parts]
+
+    print 'walking 2 handoffs for %d requests' % len(hot_parts)
+    expected, elapsed = timed(
+        handoffs, Ring(ring_file, handoff_cache_size=0))
+    print '  get_more_nodes, uncached:             %8.3fs' % elapsed
+    result, elapsed = timed(handoffs, Ring(ring_file))
+    print '  get_more_nodes, cached:               %8.3fs' % elapsed
+    if result != expected:
+        print '  MISMATCH between the two paths'
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--names', type='int', default=1000000,
+                      help='number of object names to resolve '
+                      '(default 1000000)')
+    parser.add_option('--part-power', type='int', default=18,
+                      help='partition power of the ring (default 18)')
+    parser.add_option('--replicas', type='int', default=3,
+                      help='replicas in the ring (default 3)')
+    parser.add_option('--devices', type='int', default=100,
+                      help='devices in the ring (default 100)')
+    options, _args = parser.parse_args()
+    # any values do, the ring only refuses to load without them
+    utils.HASH_PATH_SUFFIX = utils.HASH_PATH_SUFFIX or 'bench'
+    ring_dir = mkdtemp()
+    try:
+        run(options.names, options.part_power, options.replicas,
+            options.devices, ring_dir)
+    finally:
+        rmtree(ring_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Ring rebalance benchmark.
+
+Builds a ring over a synthetic topology of regions, zones, servers and
+disks of mixed weights, then times the rebalances of a cluster's life:
+the initial one, adding a server to every zone, failing some disks, and
+draining a zone::
+
+    python -m test.bench.ring_rebalance --part-power 20 --regions 3 \\
+        --zones 4 --servers 8 --disks 24
+
+Every ring is validated, and its balance and a digest of its partition
+assignments are printed; with the same --seed the digest only changes
+when the builder places partitions differently.
+"""
+
+import time
+from hashlib import md5
+from optparse import OptionParser
+
+from swift.common.ring import RingBuilder
+
+
+def add_server(builder, region, zone, server, disks, next_id):
+    ip = '10.%d.%d.%d' % (region, zone, server)
+    for disk in xrange(disks):
+        # a mix of disk sizes, like a cluster that grew over time
+        weight = 100.0 if disk % 3 else 200.0
+        builder.add_dev({'id': next_id, 'region': region, 'zone': zone,
+                         'weight': weight, 'ip': ip, 'port': 6000,
+                         'device': 'sd%d' % disk, 'meta': ''})
+        next_id += 1
+    return next_id
+
+
+def timed_rebalance(builder, seed, label):
+    if builder._last_part_moves is not None:
+        # every step is a rebalance some hours after the last one
+        builder.pretend_min_part_hours_passed()
+    begin = time.time()
+    moved, balance = builder.rebalance(seed=seed)
+    elapsed = time.time() - begin
+    builder.validate()
+    digest = md5()
+    for part2dev in builder._replica2part2dev:
+        digest.update(part2dev.tostring())
+    print '  %-28s %9.2fs  moved %8d  balance %6.2f  %s' % (
+        label, elapsed, moved, balance, digest.hexdigest()[:12])
+    return elapsed
+
+
+def run(part_power, replicas, regions, zones, servers, disks, seed):
+    builder = RingBuilder(part_power, replicas, 1)
+    next_id = 0
+    for region in xrange(regions):
+        for zone in xrange(zones):
+            for server in xrange(servers):
+                next_id = add_server(builder, region, zone, server, disks,
+                                     next_id)
+    print ('2^%d partitions, %s replicas, %d regions x %d zones x %d '
+           'servers x %d disks = %d devices' % (
+               part_power, replicas, regions, zones, servers, disks,
+               next_id))
+    total = timed_rebalance(builder, seed, 'initial')
+
+    for region in xrange(regions):
+        for zone in xrange(zones):
+            next_id = add_server(builder, region, zone, servers, disks,
+                                 next_id)
+    total += timed_rebalance(builder, seed, 'add a server per zone')
+
+    for dev_id in xrange(0, next_id, 97):
+        builder.remove_dev(dev_id)
+    total += timed_rebalance(builder, seed, 'fail every 97th disk')
+
+    for dev in builder._iter_devs():
+        if dev['region'] == 0 and dev['zone'] == 0:
+            builder.set_dev_weight(dev['id'], 0)
+    total += timed_rebalance(builder, seed, 'drain zone 0 of region 0')
+    print '  %-28s %9.2fs' % ('total', total)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--part-power', type='int', default=18,
+                      help='partition power of the ring (default 18)')
+    parser.add_option('--replicas', type='float', default=3,
+                      help='replicas in the ring (default 3)')
+    parser.add_option('--regions', type='int', default=2,
+                      help='regions (default 2)')
+    parser.add_option('--zones', type='int', default=4,
+                      help='zones per region (default 4)')
+    parser.add_option('--servers', type='int', default=8,
+                      help='servers per zone (default 8)')
+    parser.add_option('--disks', type='int', default=12,
+                      help='disks per server (default 12)')
+    parser.add_option('--seed', type='int', default=1,
+                      help='random seed of the rebalances (default 1)')
+    options, _args = parser.parse_args()
+    run(options.part_power, options.replicas, options.regions,
+        options.zones, options.servers, options.disks, options.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Suffix hash benchmark.
+
+Builds a partition with one object in each of --suffixes suffix
+directories, then times the hashes file operations of the object server
+and the replicator: invalidate_hash (every PUT and DELETE), get_hashes of
+an unchanged partition (a REPLICATE without suffixes, or a replicator
+pass), and get_hashes after a few PUTs and with a suffix to recalculate
+(a REPLICATE after an rsync)::
+
+    python -m test.bench.suffix_hashes --suffixes 4096
+"""
+
+import os
+import time
+from optparse import OptionParser
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from swift.obj.diskfile import get_hashes, invalidate_hash
+
+
+def timed(label, count, func):
+    begin = time.time()
+    for i in xrange(count):
+        func(i)
+    elapsed = time.time() - begin
+    print '  %-32s %8.3fms' % (label, elapsed * 1000 / count)
+
+
+def run(suffixes, count, puts):
+    testdir = mkdtemp()
+    try:
+        part = os.path.join(testdir, 'sda', 'objects', '0')
+        names = ['%03x' % (i * 4096 / suffixes) for i in xrange(suffixes)]
+        for suffix in names:
+            hsh = os.path.join(part, suffix, 'a' * 29 + suffix)
+            os.makedirs(hsh)
+            open(os.path.join(hsh, '%s.data' % time.time()), 'w').close()
+        get_hashes(part)
+        print '%d suffixes, %d PUTs between REPLICATEs' % (suffixes, puts)
+        timed('invalidate_hash', count, lambda i: invalidate_hash(
+            os.path.join(part, names[i % suffixes])))
+        get_hashes(part)
+        timed('get_hashes, unchanged', count, lambda i: get_hashes(part))
+
+        def replicate(i):
+            for j in xrange(puts):
+                invalidate_hash(
+                    os.path.join(part, names[(i * puts + j) % suffixes]))
+            get_hashes(part, recalculate=[names[i % suffixes]])
+        timed('PUTs, then get_hashes(recalc)', count, replicate)
+    finally:
+        rmtree(testdir, ignore_errors=True)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--suffixes', type='int', default=1024,
+                      help='suffix directories in the partition '
+                           '(default 1024)')
+    parser.add_option('--count', type='int', default=200,
+                      help='times each operation is run (default 200)')
+    parser.add_option('--puts', type='int', default=10,
+                      help='PUTs between REPLICATEs (default 10)')
+    options, _args = parser.parse_args()
+    run(options.suffixes, options.count, options.puts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from StringIO import StringIO
+
+import mock
+
+from swift.common.middleware import metadata
+from swift.common.swob import Request, Response
+from test.unit import FakeLogger
+
+
+class FakeApp(object):
+
+    def __call__(self, env, start_response):
+        return Response(body='FAKE APP')(env, start_response)
+
+
+class FakeResponse(object):
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = StringIO(body)
+
+    def read(self, size):
+        return self.body.read(size)
+
+    def getheader(self, name):
+        return 'text/plain'
+
+
+class TestMetaDataMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        # ip -> status, or an exception to raise
+        self.servers = {}
+        self.requests = []
+
+        def fake_connection(host):
+            conn = mock.Mock()
+
+            def request(method, path, headers):
+                self.requests.append((host, method, path))
+                if isinstance(self.servers[host], Exception):
+                    raise self.servers[host]
+            conn.request.side_effect = request
+            conn.getresponse.return_value = FakeResponse(
+                self.servers.get(host), 'from %s\n' % host)
+            return conn
+
+        self.patcher = mock.patch.object(metadata, 'HTTPConnection',
+                                         fake_connection)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def _app(self, conf, ring=None):
+        with mock.patch.object(metadata, 'get_metadata_ring',
+                               return_value=ring):
+            app = metadata.filter_factory(conf)(FakeApp())
+        app.logger = FakeLogger()
+        return app
+
+    def _get(self, app, path):
+        req = Request.blank(path + '?metadata=v1&format=json')
+        resp = req.get_response(app)
+        return resp.status_int, resp.body
+
+    def test_single_server(self):
+        app = self._app({'md-server-ip': '10.0.0.9'})
+        self.servers['10.0.0.9:6090'] = 200
+        self.assertEquals(self._get(app, '/v1/AUTH_a'),
+                          (200, 'from 10.0.0.9:6090\n'))
+        self.assertEquals(self.requests,
+                          [('10.0.0.9:6090', 'GET', '/v1/AUTH_a')])
+        # requests without ?metadata go on down the pipeline
+        resp = Request.blank('/v1/AUTH_a').get_response(app)
+        self.assertEquals(resp.body, 'FAKE APP')
+
+    def test_routes_to_account_shard(self):
+        ring = mock.Mock()
+        ring.get_nodes.return_value = (
+            3, [{'ip': '10.0.0.%d' % n, 'port': 6090} for n in (1, 2, 3)])
+        app = self._app({}, ring)
+        self.servers.update({'10.0.0.1:6090': Exception('down'),
+                             '10.0.0.2:6090': 503,
+                             '10.0.0.3:6090': 200})
+        self.assertEquals(self._get(app, '/v1/AUTH_a/c'),
+                          (200, 'from 10.0.0.3:6090\n'))
+        ring.get_nodes.assert_called_once_with('AUTH_a')
+        self.assertEquals([host for host, method, path in self.requests],
+                          ['10.0.0.1:6090', '10.0.0.2:6090', '10.0.0.3:6090'])
+        self.assertEquals(len(app.logger.log_dict['exception']), 1)
+        # the last server's error is passed on
+        self.servers['10.0.0.3:6090'] = 500
+        self.assertEquals(self._get(app, '/v1/AUTH_a/c'),
+                          (500, 'from 10.0.0.3:6090\n'))
+        self.servers['10.0.0.3:6090'] = Exception('down')
+        self.assertEquals(self._get(app, '/v1/AUTH_a/c')[0], 503)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -454,16 +454,19 @@ class TestReconSuccess(TestCase):
 
     def test_get_replication_object(self):
         from_cache_response = {"object_replication_time": 200.0,
-                               "object_replication_last": 1357962809.15}
+                               "object_replication_last": 1357962809.15,
+                               "object_replication_queue": {"sda1": 12}}
         self.fakecache.fakeout_calls = []
         self.fakecache.fakeout = from_cache_response
         rv = self.app.get_replication_info('object')
         self.assertEquals(self.fakecache.fakeout_calls,
                           [((['object_replication_time',
-                              'object_replication_last'],
+                              'object_replication_last',
+                              'object_replication_queue'],
                               '/var/cache/swift/object.recon'), {})])
         self.assertEquals(rv, {'object_replication_time': 200.0,
-                               'object_replication_last': 1357962809.15})
+                               'object_replication_last': 1357962809.15,
+                               'object_replication_queue': {'sda1': 12}})
 
     def test_get_updater_info_container(self):
         from_cache_response = {"container_updater_sweep": 18.476239919662476}
@@ -18,8 +18,10 @@ import operator
 import os
 import unittest
 import cPickle as pickle
+from array import array
 from collections import defaultdict
 from shutil import rmtree
+from time import time
 
 from swift.common import exceptions
 from swift.common import ring
@@ -556,6 +558,35 @@ class TestRingBuilder(unittest.TestCase):
                     "Partition %d not in zones 0 and 1 (got %r)" %
                     (part, zones))
 
+    def test_drain_devs_holding_other_replicas(self):
+        rb = ring.RingBuilder(8, 4, 1)
+        for dev_id in xrange(6):
+            rb.add_dev({'id': dev_id, 'region': 0, 'zone': dev_id / 2,
+                        'weight': 1, 'ip': '127.0.0.%d' % (dev_id / 2),
+                        'port': 10000, 'device': 'sd%d' % dev_id})
+        rb.rebalance(seed=1)
+
+        # only one replica of a partition moves per rebalance, so the
+        # drained devices still hold the others while it is placed
+        rb.set_dev_weight(0, 0)
+        rb.set_dev_weight(1, 0)
+        rb.pretend_min_part_hours_passed()
+        rb.rebalance(seed=1)
+        rb.validate()
+        for part in xrange(rb.parts):
+            on_drained = [replica for replica in xrange(rb.replicas)
+                          if rb._replica2part2dev[replica][part] in (0, 1)]
+            self.assert_(len(on_drained) <= 1, (part, on_drained))
+
+    def test_update_last_part_moves(self):
+        rb = ring.RingBuilder(2, 1, 1)
+        rb._last_part_moves = array('B', [0, 10, 250, 0xff])
+        rb._last_part_moves_epoch = time() - 3600 * 7 - 60
+        rb._update_last_part_moves()
+        self.assertEquals(list(rb._last_part_moves), [7, 17, 0xff, 0xff])
+        rb._update_last_part_moves()
+        self.assertEquals(list(rb._last_part_moves), [7, 17, 0xff, 0xff])
+
     def test_rerebalance(self):
         rb = ring.RingBuilder(8, 3, 1)
         rb.add_dev({'id': 0, 'region': 0, 'zone': 0, 'weight': 1,
@@ -15,6 +15,8 @@
 
 import array
 import cPickle as pickle
+import ctypes
+import imp
 import os
 import sys
 import unittest
@@ -23,6 +25,8 @@ from gzip import GzipFile
 from shutil import rmtree
 from time import sleep, time
 
+import mock
+
 from swift.common import ring, utils
 
 
@@ -97,6 +101,61 @@ class TestRingData(unittest.TestCase):
             with open(ring_fname2) as ring2:
                 self.assertEqual(ring1.read(), ring2.read())
 
+    def test_roundtrip_mmap_format(self):
+        ring_fname = os.path.join(self.testdir, 'foo.ring.gz')
+        rd = ring.RingData(
+            [array.array('H', [0, 1, 0, 1]), array.array('H', [0, 1, 0, 1]),
+             array.array('H', [1, 0])],
+            [{'id': 0, 'zone': 0}, {'id': 1, 'zone': 1}], 30)
+        rd.save(ring_fname, mmap_format=True)
+        with open(ring_fname, 'rb') as f:
+            self.assertEquals(f.read(4), 'R1NG')
+        self.assertEquals(os.listdir(self.testdir), ['foo.ring.gz'])
+        rd2 = ring.RingData.load(ring_fname)
+        self.assert_ring_data_equal(rd, rd2)
+        # so it can be saved in either format again
+        rd2.save(ring_fname)
+        self.assert_ring_data_equal(rd, ring.RingData.load(ring_fname))
+        pickle.dumps(rd2)
+
+        # unless the tables are asked to be mapped, not read
+        rd.save(ring_fname, mmap_format=True)
+        rd2 = ring.RingData.load(ring_fname, mapped=True)
+        self.assertEquals(rd2.devs, rd.devs)
+        self.assertEquals(rd2._part_shift, 30)
+        self.assertEquals([list(row) for row in rd2._replica2part2dev_id],
+                          [[0, 1, 0, 1], [0, 1, 0, 1], [1, 0]])
+        self.assert_(isinstance(rd2._replica2part2dev_id[0], ctypes.Array))
+
+        # and a ring written on a host of the other byte order is swapped
+        # while read
+        swapped = ring.RingData(
+            [array.array('H', row) for row in rd._replica2part2dev_id],
+            rd.devs, 30)
+        for row in swapped._replica2part2dev_id:
+            row.byteswap()
+        other = {'little': 'big', 'big': 'little'}[sys.byteorder]
+        with mock.patch.object(sys, 'byteorder', other):
+            swapped.save(ring_fname, mmap_format=True)
+        rd2 = ring.RingData.load(ring_fname, mapped=True)
+        self.assert_ring_data_equal(rd, rd2)
+
+    def test_checksum(self):
+        ring_fname = os.path.join(self.testdir, 'foo.ring.gz')
+        rd = ring.RingData(
+            [array.array('H', [0, 1, 0, 1]), array.array('H', [0, 1, 0, 1])],
+            [{'id': 0, 'zone': 0}, {'id': 1, 'zone': 1}], 30)
+        rd.save(ring_fname)
+        self.assertEquals(ring.RingData.checksum(ring_fname), None)
+        rd.save(ring_fname, mmap_format=True)
+        checksum = ring.RingData.checksum(ring_fname)
+        self.assert_(checksum)
+        rd.save(ring_fname, mmap_format=True)
+        self.assertEquals(ring.RingData.checksum(ring_fname), checksum)
+        rd._replica2part2dev_id[1][0] = 1
+        rd.save(ring_fname, mmap_format=True)
+        self.assertNotEquals(ring.RingData.checksum(ring_fname), checksum)
+
 
 class TestRing(unittest.TestCase):
 
@@ -228,6 +287,76 @@ class TestRing(unittest.TestCase):
         self.assertEquals(len(self.ring.devs), 9)
         self.assertNotEquals(self.ring._mtime, orig_mtime)
 
+    def test_mmap_format(self):
+        ring.RingData(
+            self.intended_replica2part2dev_id, self.intended_devs,
+            self.intended_part_shift).save(self.testgz, mmap_format=True)
+        mapped = ring.Ring(self.testdir, ring_name='whatever')
+        self.assert_(isinstance(mapped._replica2part2dev_id[0], ctypes.Array))
+        self.assertEquals(mapped.devs, self.ring.devs)
+        for name in ('a', 'b', 'c'):
+            self.assertEquals(mapped.get_nodes(name),
+                              self.ring.get_nodes(name))
+        part = mapped.get_part('a')
+        self.assertEquals(list(mapped.get_more_nodes(part)),
+                          list(self.ring.get_more_nodes(part)))
+
+    def test_write_builder_mmap_format(self):
+        replica2part2dev_id = [array.array('H', [0, 1, 0, 1]),
+                               array.array('H', [1, 0, 1, 0])]
+        ring.RingData(
+            replica2part2dev_id, self.intended_devs[:2],
+            self.intended_part_shift).save(self.testgz, mmap_format=True)
+        ring_builder = imp.load_source('swift_ring_builder', os.path.join(
+            os.path.dirname(__file__), '..', '..', '..', '..', 'bin',
+            'swift-ring-builder'))
+        builder_file = os.path.join(self.testdir, 'whatever.builder')
+        ring_builder.argv = ['swift-ring-builder', self.testgz,
+                             'write_builder', '1']
+        ring_builder.builder_file = builder_file
+        ring_builder.ring_file = self.testgz
+        ring_builder.Commands.write_builder.im_func()
+        builder = ring.RingBuilder.load(builder_file)
+        self.assertEquals(builder._replica2part2dev, replica2part2dev_id)
+        self.assertEquals(builder.min_part_hours, 1)
+        self.assertEquals([dev['parts'] for dev in builder.devs], [4, 4])
+
+    def test_reload_mmap_format(self):
+        rd = ring.RingData(self.intended_replica2part2dev_id,
+                           self.intended_devs, self.intended_part_shift)
+        rd.save(self.testgz, mmap_format=True)
+        self.ring = ring.Ring(self.testdir, reload_time=0,
+                              ring_name='whatever')
+        # the same ring pushed out again is not loaded again
+        rd.save(self.testgz, mmap_format=True)
+        os.utime(self.testgz, (time() + 60, time() + 60))
+        with mock.patch.object(ring.RingData, 'load') as mock_load:
+            self.ring.get_nodes('a')
+        self.assertFalse(mock_load.called)
+        self.assertFalse(self.ring.has_changed())
+
+        # new assignments of the same devices keep the tier data
+        rd._replica2part2dev_id[2] = array.array('H', [4, 3, 4, 3])
+        rd.save(self.testgz, mmap_format=True)
+        os.utime(self.testgz, (time() + 120, time() + 120))
+        with mock.patch.object(self.ring, '_rebuild_tier_data') as rebuild:
+            part, nodes = self.ring.get_nodes('a')
+        self.assertFalse(rebuild.called)
+        self.assertEquals(
+            [node['id'] for node in self.ring.get_part_nodes(0)], [0, 4])
+        self.assertEquals(
+            [node['id'] for node in self.ring.get_part_nodes(1)], [1, 3])
+
+        # while new devices rebuild it
+        self.intended_devs.append(
+            {'id': 5, 'region': 0, 'zone': 4, 'weight': 1.0,
+             'ip': '10.5.5.5', 'port': 6000})
+        rd.save(self.testgz, mmap_format=True)
+        os.utime(self.testgz, (time() + 180, time() + 180))
+        self.ring.get_nodes('a')
+        self.assertEquals(len(self.ring.devs), 6)
+        self.assert_((0, 4) in self.ring.tier2devs)
+
     def test_reload_without_replication(self):
         replication_less_devs = [{'id': 0, 'region': 0, 'zone': 0,
                                   'weight': 1.0, 'ip': '10.1.1.1',
@@ -396,6 +525,83 @@ class TestRing(unittest.TestCase):
         self.assertEquals(nodes, [self.intended_devs[0],
                                   self.intended_devs[3]])
 
+    def test_get_parts_many(self):
+        names = [('a',), ('a4', None, None), ('a', 'c0'), ('a', 'c3'),
+                 ('a', 'c', 'o1'), ('a', 'c', 'o2')]
+        self.assertEquals(self.ring.get_parts_many(names),
+                          [self.ring.get_part(*name) for name in names])
+        self.assertEquals(self.ring.get_parts_many(names),
+                          [0, 1, 3, 2, 1, 2])
+        self.assertEquals(self.ring.get_parts_many([]), [])
+
+    def test_get_part_nodes_many(self):
+        parts = [3, 0, 3, 1, 2]
+        nodes = self.ring.get_part_nodes_many(parts)
+        self.assertEquals(nodes,
+                          [self.ring.get_part_nodes(part) for part in parts])
+        # every list can be changed without affecting the others
+        nodes[0].append('x')
+        self.assertEquals(len(nodes[2]), 2)
+        self.assertEquals(self.ring.get_part_nodes_many([1]),
+                          [[self.intended_devs[1], self.intended_devs[4]]])
+        self.assertEquals(self.ring.get_part_nodes_many([]), [])
+
+    def test_get_part_nodes_many_partial_replica(self):
+        self.intended_replica2part2dev_id[2] = array.array('H', [3, 4])
+        ring.RingData(
+            self.intended_replica2part2dev_id,
+            self.intended_devs, self.intended_part_shift).save(self.testgz)
+        self.ring = ring.Ring(self.testgz)
+        parts = [0, 1, 2, 3]
+        self.assertEquals(self.ring.get_part_nodes_many(parts),
+                          [self.ring.get_part_nodes(part) for part in parts])
+        self.assertEquals(self.ring.get_part_nodes_many([2]),
+                          [[self.intended_devs[0]]])
+
+    def test_get_more_nodes_cached(self):
+        uncached = ring.Ring(self.testdir, ring_name='whatever',
+                             handoff_cache_size=0)
+        self.ring = ring.Ring(self.testdir, ring_name='whatever',
+                              handoff_cache_size=2)
+        for part in xrange(4):
+            expected = list(uncached.get_more_nodes(part))
+            self.assert_(expected)
+            # partly walked, then in full
+            self.assertEquals(self.ring.get_more_nodes(part).next(),
+                              expected[0])
+            self.assertEquals(list(self.ring.get_more_nodes(part)), expected)
+            with mock.patch.object(self.ring, '_get_more_nodes') as search:
+                self.assertEquals(list(self.ring.get_more_nodes(part)),
+                                  expected)
+            self.assertFalse(search.called)
+        self.assertEquals(self.ring._handoffs.keys(), [2, 3])
+        self.assertEquals(uncached._handoffs, {})
+
+        # two walks at once share what is found
+        walk1 = self.ring.get_more_nodes(0)
+        walk2 = self.ring.get_more_nodes(0)
+        self.assertEquals(walk1.next(), walk2.next())
+        self.assertEquals(list(walk2), list(walk1))
+
+    def test_handoff_cache_cleared_on_reload(self):
+        self.ring = ring.Ring(self.testdir, reload_time=0,
+                              ring_name='whatever')
+        self.ring.precompute_handoffs([0, 1], count=1)
+        self.assertEquals(sorted(self.ring._handoffs), [0, 1])
+        self.assertEquals(len(self.ring._handoffs[0][0]), 1)
+        self.ring.precompute_handoffs([1])
+        self.assertEquals(self.ring._handoffs[1][0],
+                          list(self.ring._get_more_nodes(1)))
+
+        self.intended_replica2part2dev_id[2] = array.array('H', [4, 3, 4, 3])
+        ring.RingData(
+            self.intended_replica2part2dev_id,
+            self.intended_devs, self.intended_part_shift).save(self.testgz)
+        os.utime(self.testgz, (time() + 60, time() + 60))
+        handoffs = list(self.ring.get_more_nodes(0))
+        self.assertEquals(handoffs, list(self.ring._get_more_nodes(0)))
+        self.assertEquals(self.ring._handoffs.keys(), [0])
+
     def add_dev_to_ring(self, new_dev):
         self.ring.devs.append(new_dev)
         self.ring._rebuild_tier_data()
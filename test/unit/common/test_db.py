@@ -100,6 +100,27 @@ class TestGreenDBConnection(unittest.TestCase):
                              list((InterceptCursor.execute.call_args,) *
                                   InterceptCursor.execute.call_count))
 
+    def test_retry_locked(self):
+        conn = sqlite3.connect(':memory:', check_same_thread=False,
+                               factory=GreenDBConnection, timeout=0.1)
+        calls = []
+
+        def call():
+            calls.append(1)
+            if len(calls) < 3:
+                raise sqlite3.OperationalError('database is locked')
+            return conn.cursor(sqlite3.Cursor).execute('select 1').fetchall()
+        self.assertEqual(conn.retry_locked(call), [(1,)])
+        self.assertEqual(len(calls), 3)
+
+        def locked():
+            raise sqlite3.OperationalError('database is locked')
+        self.assertRaises(Timeout, conn.retry_locked, locked)
+
+        def broken():
+            raise sqlite3.OperationalError('no such table: object')
+        self.assertRaises(sqlite3.OperationalError, conn.retry_locked, broken)
+
     def text_commit_when_locked(self):
         # This test is dependant on the code under test calling commit and
         # commit as sqlite3.Connection.commit in a subclass.
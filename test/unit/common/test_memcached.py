@@ -154,6 +154,17 @@ class MockMemcached(object):
         pass
 
 
+class CountingMockMemcached(MockMemcached):
+
+    def __init__(self):
+        MockMemcached.__init__(self)
+        self.sends = 0
+
+    def sendall(self, string):
+        self.sends += 1
+        MockMemcached.sendall(self, string)
+
+
 class TestMemcached(unittest.TestCase):
     """Tests for swift.common.memcached"""
 
@@ -332,6 +343,74 @@ class TestMemcached(unittest.TestCase):
             ('some_key2', 'some_key1', 'not_exists'), 'multi_key'),
             [[4, 5, 6], [1, 2, 3], None])
 
+    def test_many(self):
+        servers = ['1.2.3.4:11211', '1.2.3.5:11211', '1.2.3.6:11211']
+        memcache_client = memcached.MemcacheRing(servers)
+        mocks = {}
+        for server in servers:
+            mock = mocks[server] = CountingMockMemcached()
+            memcache_client._client_cache[server] = MockedMemcachePool(
+                [(mock, mock)] * 2)
+
+        def sends():
+            counts = [mock.sends for mock in mocks.values()]
+            for mock in mocks.values():
+                mock.sends = 0
+            return counts
+
+        mapping = dict(('key%d' % i, [i]) for i in xrange(30))
+        memcache_client.set_many(mapping, time=20)
+        # one request to each server
+        self.assertEquals(sends(), [1, 1, 1])
+        for key, value in mapping.iteritems():
+            hashed_key = memcached.md5hash(key)
+            server = memcache_client._servers_for(hashed_key)[0]
+            self.assertEquals(mocks[server].cache[hashed_key],
+                              ('2', '20', '[%d]' % value[0]))
+        self.assertEquals(memcache_client.get(key), value)
+
+        sends()
+        keys = ['key3', 'nope', 'key1', 'key3'] + sorted(mapping)
+        self.assertEquals(memcache_client.get_many(keys),
+                          [[3], None, [1], [3]] +
+                          [mapping[key] for key in sorted(mapping)])
+        self.assertEquals(sends(), [1, 1, 1])
+        self.assertEquals(memcache_client.get_many([]), [])
+
+        deltas = dict(('counter%d' % i, i - 5) for i in xrange(10))
+        self.assertEquals(memcache_client.incr_many(deltas),
+                          dict((key, max(delta, 0))
+                               for key, delta in deltas.iteritems()))
+        self.assertEquals(memcache_client.incr_many(deltas),
+                          dict((key, max(delta, 0) + delta if delta > 0
+                                else 0)
+                               for key, delta in deltas.iteritems()))
+        self.assertEquals(memcache_client.incr('counter9'), 9)
+
+    def test_many_retry(self):
+        logging.getLogger().addHandler(NullLoggingHandler())
+        memcache_client = memcached.MemcacheRing(
+            ['1.2.3.4:11211', '1.2.3.5:11211'])
+        mock1 = ExplodingMockMemcached()
+        mock2 = MockMemcached()
+        memcache_client._client_cache['1.2.3.4:11211'] = MockedMemcachePool(
+            [(mock2, mock2)] * 2)
+        memcache_client._client_cache['1.2.3.5:11211'] = MockedMemcachePool(
+            [(mock1, mock1)] * 3)
+        mapping = dict(('key%d' % i, [i]) for i in xrange(10))
+        memcache_client.set_many(mapping)
+        self.assertEquals(mock1.exploded, True)
+        self.assertEquals(len(mock2.cache), 10)
+        self.assertEquals(memcache_client.get_many(sorted(mapping)),
+                          [mapping[key] for key in sorted(mapping)])
+        self.assertEquals(memcache_client.incr_many({'a': 1, 'b': 2}),
+                          {'a': 1, 'b': 2})
+
+        mock2.down = True
+        self.assertEquals(memcache_client.get_many(['key1']), [None])
+        self.assertRaises(memcached.MemcacheConnectionError,
+                          memcache_client.incr_many, {'a': 1})
+
     def test_serialization(self):
         memcache_client = memcached.MemcacheRing(['1.2.3.4:11211'],
                                                  allow_pickle=True)
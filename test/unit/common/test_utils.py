@@ -2700,6 +2700,22 @@ class TestAuditLocationGenerator(unittest.TestCase):
             self.assertEqual(list(locations),
                              [(obj_path, "drive", "partition2")])
 
+    def test_device_dirs(self):
+        with temptree([]) as tmpdir:
+            obj_paths = {}
+            for drive in ("drive1", "drive2"):
+                hash_path = os.path.join(tmpdir, drive, "data", "partition1",
+                                         "suffix1", "hash1")
+                os.makedirs(hash_path)
+                obj_paths[drive] = os.path.join(hash_path, "obj1.dat")
+                with open(obj_paths[drive], "w"):
+                    pass
+            locations = utils.audit_location_generator(
+                tmpdir, "data", ".dat", mount_check=False,
+                device_dirs=["drive2", "drive3"])
+            self.assertEqual(list(locations),
+                             [(obj_paths["drive2"], "drive2", "partition1")])
+
 
 class TestGreenAsyncPile(unittest.TestCase):
     def test_runs_everything(self):
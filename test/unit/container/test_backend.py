@@ -125,6 +125,22 @@ class TestContainerBroker(unittest.TestCase):
         broker.reclaim(normalize_timestamp(time()), time())
         broker.delete_db(normalize_timestamp(time()))
 
+    def test_get_deleted_objects(self):
+        # Test ContainerBroker.get_deleted_objects
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        for name in ('o1', 'o2', 'o3'):
+            broker.put_object(name, normalize_timestamp(2), 0, 'text/plain',
+                              'd41d8cd98f00b204e9800998ecf8427e')
+        broker.delete_object('o1', normalize_timestamp(3))
+        broker.delete_object('o2', normalize_timestamp(5))
+        self.assertEquals(sorted(broker.get_deleted_objects(0)),
+                          [('o1', normalize_timestamp(3)),
+                           ('o2', normalize_timestamp(5))])
+        self.assertEquals(broker.get_deleted_objects(4),
+                          [('o2', normalize_timestamp(5))])
+        self.assertEquals(broker.get_deleted_objects(5), [])
+
     def test_delete_object(self):
         # Test ContainerBroker.delete_object
         broker = ContainerBroker(':memory:', account='a', container='c')
@@ -751,6 +767,35 @@ class TestContainerBroker(unittest.TestCase):
         self.assertEquals([row[0] for row in listing],
                           ['/pets/fish/a', '/pets/fish/b'])
 
+    def test_list_objects_iter_path_skips_subdirs(self):
+        # Test ContainerBroker.list_objects_iter
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        for obj in ('pets/', 'pets/dogs/1', 'pets/dogs/2', 'pets/dogs0',
+                    'pets/fish/', 'pets/fish/a', 'pets/fish0', 'pets/snakes',
+                    'petsy'):
+            broker.put_object(
+                obj, normalize_timestamp(0), 0,
+                'text/plain', 'd41d8cd98f00b204e9800998ecf8427e')
+
+        listing = broker.list_objects_iter(100, None, None, None, None,
+                                           'pets')
+        self.assertEquals([row[0] for row in listing],
+                          ['pets/dogs0', 'pets/fish/', 'pets/fish0',
+                           'pets/snakes'])
+        listing = broker.list_objects_iter(2, None, None, None, None,
+                                           'pets')
+        self.assertEquals([row[0] for row in listing],
+                          ['pets/dogs0', 'pets/fish/'])
+        listing = broker.list_objects_iter(100, 'pets/fish/', None, None,
+                                           None, 'pets')
+        self.assertEquals([row[0] for row in listing],
+                          ['pets/fish0', 'pets/snakes'])
+        listing = broker.list_objects_iter(100, None, 'pets/fish0', None,
+                                           None, 'pets')
+        self.assertEquals([row[0] for row in listing],
+                          ['pets/dogs0', 'pets/fish/'])
+
     def test_double_check_trailing_delimiter(self):
         # Test ContainerBroker.list_objects_iter for a
         # container that has an odd file with a trailing delimiter
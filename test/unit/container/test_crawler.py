@@ -16,6 +16,7 @@
 # import cPickle as pickle
 import os
 import unittest
+import mock
 # from contextlib import closing
 from shutil import rmtree
 from tempfile import mkdtemp
@@ -24,8 +25,9 @@ from tempfile import mkdtemp
 
 # from swift.common import utils
 from swift.container import crawler
+from swift.metadata.utils import BatchSender
 from swift.container.backend import ContainerBroker
-from swift.common.utils import normalize_timestamp
+from swift.common.utils import normalize_timestamp, json
 from swift.container import server as container_server
 
 
@@ -90,6 +92,114 @@ class TestAuditor(unittest.TestCase):
         self.assertEquals(metaDict['x_container_sync_point1'], -1)
         self.assertEquals(metaDict['x_container_sync_point2'], -1)
 
+    def test_checkpoints(self):
+        conf = {'devices': self.devices_dir, 'mount_check': 'false',
+                'recon_cache_path': self.testdir, 'send_retries': '0'}
+        hash_dir = os.path.join(self.sda1, container_server.DATADIR, '0',
+                                'fff', 'ffffffff')
+        os.makedirs(hash_dir)
+        os.rename(os.path.join(self.subdir, 'hash.db'),
+                  os.path.join(hash_dir, 'ffffffff.db'))
+        sent = []
+        statuses = [True]
+
+        def fake_send(sender, chunks):
+            sent.append([json.loads(c)['container_uri'] for c in chunks])
+            return statuses.pop(0)
+
+        with mock.patch.object(BatchSender, '_send_batch',
+                               fake_send):
+            crawler.ContainerCrawler(conf).run_once()
+            self.assertEquals(sent, [['/a/c']])
+            # nothing changed, so nothing is resent, even after a restart
+            crawler.ContainerCrawler(conf).run_once()
+            self.assertEquals(len(sent), 1)
+
+            cb = ContainerBroker(os.path.join(hash_dir, 'ffffffff.db'))
+            cb.put_object('o2', normalize_timestamp(3), 3, 'text/plain',
+                          '68b329da9893e34099c7d8ad5cb9c940')
+            statuses.extend([False, True])
+            cc = crawler.ContainerCrawler(conf)
+            cc.run_once()
+            self.assertEquals(len(sent), 2)
+            # the failed send did not advance the checkpoint
+            cc.run_once()
+            self.assertEquals(len(sent), 3)
+            self.assertEquals(sent[2], ['/a/c'])
+            crawler.ContainerCrawler(conf).run_once()
+            self.assertEquals(len(sent), 3)
+
+    def test_tombstones(self):
+        conf = {'devices': self.devices_dir, 'mount_check': 'false',
+                'recon_cache_path': self.testdir, 'send_retries': '0'}
+        hash_dir = os.path.join(self.sda1, container_server.DATADIR, '0',
+                                'fff', 'ffffffff')
+        os.makedirs(hash_dir)
+        os.rename(os.path.join(self.subdir, 'hash.db'),
+                  os.path.join(hash_dir, 'ffffffff.db'))
+        cb = ContainerBroker(os.path.join(hash_dir, 'ffffffff.db'))
+        cb.delete_object('o', normalize_timestamp(3))
+        sent = []
+
+        def fake_send(sender, chunks):
+            sent.append((sender.method, sender.data_type,
+                         [json.loads(c) for c in chunks]))
+            return True
+
+        with mock.patch.object(BatchSender, '_send_batch', fake_send):
+            crawler.ContainerCrawler(conf).run_once()
+            self.assertEquals(len(sent), 2)
+            self.assertEquals(sent[0][:2], ('PUT', 'container_crawler'))
+            self.assertEquals(sent[1], ('DELETE', 'object_crawler', [{
+                'object_uri': '/a/c/o', 'object_name': 'o',
+                'object_account_name': 'a', 'object_container_name': 'c',
+                'object_delete_time': normalize_timestamp(3)}]))
+
+            # the object's tombstone is only sent once
+            del sent[:]
+            cb.delete_db(normalize_timestamp(4))
+            crawler.ContainerCrawler(conf).run_once()
+        self.assertEquals(sent, [('DELETE', 'container_crawler', [{
+            'container_uri': '/a/c', 'container_name': 'c',
+            'container_account_name': 'a',
+            'container_delete_time': normalize_timestamp(4)}])])
+
+    def test_device_workers(self):
+        conf = {'devices': self.devices_dir, 'mount_check': 'false',
+                'recon_cache_path': self.testdir, 'send_retries': '0',
+                'concurrency': '2', 'files_per_second': '100'}
+        os.mkdir(os.path.join(self.devices_dir, 'sdb1'))
+        hash_dir = os.path.join(self.sda1, container_server.DATADIR, '0',
+                                'fff', 'ffffffff')
+        os.makedirs(hash_dir)
+        os.rename(os.path.join(self.subdir, 'hash.db'),
+                  os.path.join(hash_dir, 'ffffffff.db'))
+        sent = []
+
+        def fake_send(sender, chunks):
+            sent.append([json.loads(c)['container_uri'] for c in chunks])
+            return True
+
+        cc = crawler.ContainerCrawler(conf)
+        with mock.patch.object(crawler, 'run_device_workers') as workers:
+            cc.run_once()
+        workers.assert_called_once_with(cc.crawl_devices, mock.ANY, 2,
+                                        cc.logger)
+        self.assertEquals(sorted(workers.call_args[0][1]), ['sda1', 'sdb1'])
+
+        # a worker only crawls its own devices, at its own pace
+        with mock.patch.object(BatchSender, '_send_batch', fake_send):
+            with mock.patch('swift.metadata.utils.ratelimit_sleep',
+                            return_value=0) as ratelimit_sleep:
+                cc.crawl_devices(['sdb1'])
+                self.assertEquals(sent, [])
+                self.assertFalse(ratelimit_sleep.called)
+                cc.crawl_devices(['sda1'])
+        self.assertEquals(sent, [['/a/c']])
+        db_size = os.path.getsize(os.path.join(hash_dir, 'ffffffff.db'))
+        self.assertEquals(ratelimit_sleep.call_args_list, [
+            mock.call(0, 100.0), mock.call(0, 0.0, incr_by=db_size)])
+
     def test_format_metadata(self):
         inputdata = {'object_count': 1,
             'account': 'AUTH_admin',
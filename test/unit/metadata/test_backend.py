@@ -18,9 +18,12 @@ import unittest
 from time import sleep, time
 from uuid import uuid4
 
+import mock
+
 from swift.account.backend import AccountBroker
 from swift.common.utils import normalize_timestamp
-from swift.metadata.backend import MetadataBroker
+from swift.metadata.backend import MetadataBroker, ACCOUNT_SYS_ATTRS, \
+    OBJECT_SYS_ATTRS, scope_args
 
 
 class TestMetadataBroker(unittest.TestCase):
@@ -57,6 +60,368 @@ class TestMetadataBroker(unittest.TestCase):
             pass
         self.assert_(broker.conn is None)
 
+    def test_insert_object_md(self):
+        broker = MetadataBroker(':memory:')
+        broker.initialize(normalize_timestamp('1'))
+        data = []
+        for i in xrange(3):
+            item = dict((attr, 'NULL') for attr in OBJECT_SYS_ATTRS)
+            item.update({
+                'object_uri': '/a/c/o%d' % i,
+                'object_name': 'o%d' % i,
+                'object_content_length': str(i),
+                'object_content_type': 'text/"quoted"',
+                'object_meta_color': 'red',
+                'object_meta_size': str(i)})
+            data.append(item)
+        broker.insert_object_md(data)
+        # upserts replace existing rows
+        data[0]['object_meta_color'] = 'blue'
+        broker.insert_object_md(data[:1])
+        with broker.get() as conn:
+            rows = conn.execute('''
+                SELECT object_uri, object_content_length, object_content_type
+                FROM object_metadata ORDER BY object_uri''').fetchall()
+            self.assertEquals([tuple(r) for r in rows],
+                              [('/a/c/o0', 0, 'text/"quoted"'),
+                               ('/a/c/o1', 1, 'text/"quoted"'),
+                               ('/a/c/o2', 2, 'text/"quoted"')])
+            rows = conn.execute('''
+                SELECT uri, custom_key, custom_value FROM custom_metadata
+                ORDER BY uri, custom_key''').fetchall()
+            self.assertEquals([tuple(r) for r in rows],
+                              [('/a/c/o0', 'object_meta_color', 'blue'),
+                               ('/a/c/o0', 'object_meta_size', '0'),
+                               ('/a/c/o1', 'object_meta_color', 'red'),
+                               ('/a/c/o1', 'object_meta_size', '1'),
+                               ('/a/c/o2', 'object_meta_color', 'red'),
+                               ('/a/c/o2', 'object_meta_size', '2')])
+            timestamps = conn.execute('''
+                SELECT DISTINCT timestamp FROM custom_metadata
+                WHERE uri != '/a/c/o0' ''').fetchall()
+            self.assertEquals(len(timestamps), 1)
+
+    def _object(self, name, modified, **custom):
+        item = dict((attr, 'NULL') for attr in OBJECT_SYS_ATTRS)
+        item.update({'object_uri': '/a/c/' + name, 'object_name': name,
+                     'object_account_name': 'a',
+                     'object_container_name': 'c',
+                     'object_last_modified_time': normalize_timestamp(
+                         modified)})
+        item.update(custom)
+        return item
+
+    def _tombstone(self, name, deleted):
+        return {'object_uri': '/a/c/' + name,
+                'object_delete_time': normalize_timestamp(deleted)}
+
+    def _rows(self, broker):
+        with broker.get() as conn:
+            objects = [r[0] for r in conn.execute(
+                'SELECT object_uri FROM object_metadata ORDER BY object_uri')]
+            custom = [tuple(r) for r in conn.execute(
+                'SELECT uri, custom_key FROM custom_metadata '
+                'ORDER BY uri, custom_key')]
+            tombstones = [tuple(r) for r in conn.execute(
+                'SELECT uri, delete_time FROM metadata_tombstone '
+                'ORDER BY uri')]
+        return objects, custom, tombstones
+
+    def test_delete_md(self):
+        broker = MetadataBroker(':memory:')
+        broker.initialize(normalize_timestamp('1'))
+        broker.insert_object_md([
+            self._object('o1', 10, object_meta_color='red'),
+            self._object('o2', 10, object_meta_color='red'),
+            self._object('o3', 30, object_meta_color='red')])
+        broker.delete_md('object', [
+            self._tombstone('o1', 20), self._tombstone('o3', 20),
+            self._tombstone('gone', 20)])
+        # o3 was modified after the delete, so it stays
+        self.assertEquals(self._rows(broker), (
+            ['/a/c/o2', '/a/c/o3'],
+            [('/a/c/o2', 'object_meta_color'),
+             ('/a/c/o3', 'object_meta_color')],
+            [('/a/c/gone', normalize_timestamp(20)),
+             ('/a/c/o1', normalize_timestamp(20))]))
+        # metadata crawled before the delete does not bring o1 back, an
+        # older tombstone does not move the delete time back...
+        broker.insert_object_md([self._object('o1', 15)])
+        broker.delete_md('object', [self._tombstone('o1', 12)])
+        self.assertEquals(self._rows(broker)[0], ['/a/c/o2', '/a/c/o3'])
+        self.assertEquals(self._rows(broker)[2][1],
+                          ('/a/c/o1', normalize_timestamp(20)))
+        # ...but a newer PUT does, and custom keys it no longer has go away
+        broker.insert_object_md([
+            self._object('o1', 25, object_meta_size='1'),
+            self._object('o2', 25, object_meta_size='2')])
+        self.assertEquals(self._rows(broker), (
+            ['/a/c/o1', '/a/c/o2', '/a/c/o3'],
+            [('/a/c/o1', 'object_meta_size'),
+             ('/a/c/o2', 'object_meta_size'),
+             ('/a/c/o3', 'object_meta_color')],
+            [('/a/c/gone', normalize_timestamp(20))]))
+
+    def test_reclaim_and_vacuum(self):
+        broker = MetadataBroker(':memory:')
+        broker.initialize(normalize_timestamp('1'))
+        with broker.get() as conn:
+            self.assertEquals(
+                conn.execute('PRAGMA auto_vacuum').fetchone()[0], 2)
+        broker.delete_md('object', [self._tombstone('o1', 10),
+                                    self._tombstone('o2', 20)])
+        self.assertEquals(broker.reclaim(15, 15), 1)
+        self.assertEquals(self._rows(broker)[2],
+                          [('/a/c/o2', normalize_timestamp(20))])
+        self.assertEquals(broker.reclaim(15, 15), 0)
+        self.assertEquals(broker.vacuum(100), 0)
+        # DBs created before incremental vacuuming are switched over
+        with broker.get() as conn:
+            conn.execute('PRAGMA auto_vacuum = NONE')
+            conn.execute('VACUUM')
+        broker.logger = mock.Mock()
+        broker.vacuum(100)
+        with broker.get() as conn:
+            self.assertEquals(
+                conn.execute('PRAGMA auto_vacuum').fetchone()[0], 2)
+        self.assertEquals(broker.logger.info.call_count, 1)
+
+    def _query_plan(self, broker, query, args=()):
+        with broker.get() as conn:
+            return ' | '.join(
+                row['detail'] for row in
+                conn.execute('EXPLAIN QUERY PLAN ' + query, args))
+
+    def test_migrate(self):
+        # a DB created before there were any migrations
+        broker = MetadataBroker(':memory:')
+        with mock.patch.object(MetadataBroker, 'schema_migrations', ()):
+            broker.initialize(normalize_timestamp('1'))
+        with broker.get() as conn:
+            self.assertEquals(broker.get_schema_version(conn), 0)
+        self.assert_('SCAN' in self._query_plan(
+            broker, 'SELECT object_uri FROM object_metadata '
+            'WHERE object_account_name = ?', ('a',)))
+        self.assertEquals(broker.migrate(), len(broker.schema_migrations))
+        with broker.get() as conn:
+            self.assertEquals(broker.get_schema_version(conn),
+                              broker.schema_version)
+            indexes = [r[0] for r in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' "
+                "AND name LIKE '%_idx'")]
+        self.assertEquals(sorted(indexes),
+                          ['account_name_idx', 'container_scope_idx',
+                           'custom_key_value_idx', 'object_account_uri_idx',
+                           'object_scope_idx', 'tombstone_delete_time_idx'])
+        # already current, nothing left to do
+        self.assertEquals(broker.migrate(), 0)
+
+    def test_initialize_is_migrated(self):
+        broker = MetadataBroker(':memory:')
+        broker.initialize(normalize_timestamp('1'))
+        with broker.get() as conn:
+            self.assertEquals(broker.get_schema_version(conn),
+                              broker.schema_version)
+        self.assertEquals(broker.migrate(), 0)
+
+    def test_scope_query_plans(self):
+        broker = MetadataBroker(':memory:')
+        broker.initialize(normalize_timestamp('1'))
+        # account scope, objects
+        plan = self._query_plan(broker, broker.get_attributes_query(
+            'a', None, None, 'object_uri'), scope_args('a', None, None))
+        self.assert_('SEARCH object_metadata USING' in plan, plan)
+        self.assert_('(object_account_name=?)' in plan, plan)
+        self.assert_('SCAN' not in plan, plan)
+        # container scope, objects
+        plan = self._query_plan(broker, broker.get_attributes_query(
+            'a', 'c', None, 'object_uri'), scope_args('a', 'c', None))
+        self.assert_('USING COVERING INDEX object_scope_idx' in plan, plan)
+        # account scope, containers
+        plan = self._query_plan(broker, broker.get_attributes_query(
+            'a', None, None, 'container_uri,container_name'),
+            scope_args('a', None, None))
+        self.assert_('USING COVERING INDEX container_scope_idx' in plan,
+                     plan)
+        # the join from containers back to their account
+        self.assert_('account_name_idx' in plan, plan)
+        self.assert_('SCAN' not in plan, plan)
+
+    def test_execute_page(self):
+        broker = MetadataBroker(':memory:')
+        broker.initialize(normalize_timestamp('1'))
+        account = dict((attr, None) for attr in ACCOUNT_SYS_ATTRS)
+        account.update({'account_uri': '/a', 'account_name': 'a'})
+        broker.insert_account_md([account])
+        data = []
+        for c in ('c1', 'c2'):
+            for o in ('o2', 'o1'):
+                item = dict((attr, None) for attr in OBJECT_SYS_ATTRS)
+                item.update({
+                    'object_uri': '/a/%s/%s' % (c, o), 'object_name': o,
+                    'object_account_name': 'a', 'object_container_name': c})
+                data.append(item)
+        broker.insert_object_md(data)
+        query = broker.get_attributes_query('a', 'c1', None, 'object_name')
+        args = scope_args('a', 'c1', None)
+        self.assertEquals(
+            broker.execute_page(query, args, 'object_uri', False),
+            [{'/a/c1/o1': {'object_name': 'o1'}},
+             {'/a/c1/o2': {'object_name': 'o2'}}])
+        self.assertEquals(
+            broker.execute_page(query, args, 'object_uri', True, limit=1),
+            [{'/a/c1/o1': {'object_name': 'o1', 'object_uri': '/a/c1/o1'}}])
+        self.assertEquals(
+            broker.execute_page(
+                query, args, 'object_uri', False, '/a/c1/o1', 5),
+            [{'/a/c1/o2': {'object_name': 'o2'}}])
+        self.assertEquals(
+            broker.execute_page(
+                query, args, 'object_uri', False, '/a/c1/o2', 5),
+            [])
+        # pages of object listings are read in index order, not sorted
+        for acc, con in (('a', None), ('a', 'c')):
+            query = broker.get_attributes_query(acc, con, None, 'object_uri')
+            args = dict(scope_args(acc, con, None), marker='/a/c/o', limit=10)
+            plan = self._query_plan(
+                broker, query + ' AND object_uri > :marker '
+                'ORDER BY object_uri LIMIT :limit', args)
+            self.assert_('object_uri>?' in plan, plan)
+            self.assert_('FOR ORDER BY' not in plan, plan)
+
+    def test_execute_sorted_page(self):
+        broker = MetadataBroker(':memory:')
+        broker.initialize(normalize_timestamp('1'))
+        data = []
+        for o, length, color in (('o1', 10, 'red'), ('o2', 9, None),
+                                 ('o3', 10, 'blue'), ('o4', None, 'red')):
+            item = dict((attr, None) for attr in OBJECT_SYS_ATTRS)
+            item.update({
+                'object_uri': '/a/c/%s' % o, 'object_name': o,
+                'object_account_name': 'a', 'object_container_name': 'c',
+                'object_content_length': length})
+            if color:
+                item['object_meta_color'] = color
+            data.append(item)
+        broker.insert_object_md(data)
+        query = broker.get_attributes_query('a', 'c', None, 'object_name')
+        args = scope_args('a', 'c', None)
+
+        def names(rows):
+            return [x.values()[0]['object_name'] for position, x in rows]
+
+        sort = ['object_content_length', 'object_meta_color']
+        rows = broker.execute_sorted_page(query, args, 'object_uri', False,
+                                          sort)
+        self.assertEquals(names(rows), ['o2', 'o3', 'o1', 'o4'])
+        self.assertEquals([position for position, x in rows], [
+            (False, 9, True, None, '/a/c/o2'),
+            (False, 10, False, 'blue', '/a/c/o3'),
+            (False, 10, False, 'red', '/a/c/o1'),
+            (True, None, False, 'red', '/a/c/o4')])
+        # pages pick up right after the position they are given
+        for i, (position, x) in enumerate(rows):
+            self.assertEquals(names(broker.execute_sorted_page(
+                query, args, 'object_uri', False, sort, position)),
+                names(rows[i + 1:]))
+            self.assertEquals(broker.get_sort_position(x.keys()[0], sort),
+                              position)
+        self.assertEquals(names(broker.execute_sorted_page(
+            query, args, 'object_uri', False, sort, rows[0][0], 2)),
+            ['o3', 'o1'])
+        # attributes of other kinds of items are all missing
+        self.assertEquals(
+            names(broker.execute_sorted_page(
+                query, args, 'object_uri', False, ['container_name'])),
+            ['o1', 'o2', 'o3', 'o4'])
+        # a marker that is gone sorts with the items missing everything
+        self.assertEquals(broker.get_sort_position('/a/c/gone', sort),
+                          (True, None, True, None, '/a/c/gone'))
+
+    def test_custom_query_plans(self):
+        broker = MetadataBroker(':memory:')
+        broker.initialize(normalize_timestamp('1'))
+        plan = self._query_plan(
+            broker, 'SELECT uri FROM custom_metadata '
+            'WHERE custom_key = ? AND custom_value = ?',
+            ('object_meta_color', 'red'))
+        self.assert_('USING COVERING INDEX custom_key_value_idx' in plan,
+                     plan)
+        plan = self._query_plan(
+            broker, 'SELECT uri FROM custom_metadata '
+            'WHERE custom_key = ? AND custom_value > ?',
+            ('object_meta_size', '3'))
+        self.assert_('USING COVERING INDEX custom_key_value_idx' in plan,
+                     plan)
+        # the per-uri EXISTS subqueries of ?query= still use the primary key
+        plan = self._query_plan(
+            broker, 'SELECT custom_value FROM custom_metadata '
+            'WHERE uri = ? AND custom_key = ?', ('/a/c/o', 'object_meta_x'))
+        self.assert_('sqlite_autoindex_custom_metadata_1' in plan, plan)
+
+    def test_custom_attributes_query(self):
+        broker = MetadataBroker(':memory:')
+        broker.initialize(normalize_timestamp('1'))
+        with broker.get() as conn:
+            for uri, key, value in (
+                    ('/a', 'account_meta_owner', 'bob'),
+                    ('/a/c', 'container_meta_team', 'blue'),
+                    ('/a/c/o1', 'object_meta_color', 'red'),
+                    ('/a/c/o1', 'object_meta_size', '1'),
+                    ('/a/c/o2', 'object_meta_color', 'green'),
+                    ('/a/c/o3', 'object_meta_color', 'not in results')):
+                broker.insert_custom_md(conn, uri, key, value)
+            conn.commit()
+
+        def results():
+            return [{'/a': {}}, {'/a/c': {}},
+                    {'/a/c/o1': {'object_name': 'o1'}}, {'/a/c/o2': {}}]
+
+        ret = broker.custom_attributes_query(
+            'object_meta_color', results(), False, False, False)
+        self.assertEquals(ret, [
+            {'/a': {}}, {'/a/c': {}},
+            {'/a/c/o1': {'object_name': 'o1', 'object_meta_color': 'red'}},
+            {'/a/c/o2': {'object_meta_color': 'green'}}])
+        ret = broker.custom_attributes_query(
+            'account_meta_owner', results(), True, False, False)
+        self.assertEquals(ret, [
+            {'/a': {'account_meta_owner': 'bob'}}, {'/a/c': {}},
+            {'/a/c/o1': {'object_name': 'o1', 'object_meta_color': 'red',
+                         'object_meta_size': '1'}},
+            {'/a/c/o2': {'object_meta_color': 'green'}}])
+        ret = broker.custom_attributes_query(
+            '', results(), False, True, True)
+        self.assertEquals(ret, [
+            {'/a': {'account_meta_owner': 'bob'}},
+            {'/a/c': {'container_meta_team': 'blue'}},
+            {'/a/c/o1': {'object_name': 'o1'}}, {'/a/c/o2': {}}])
+        # nothing requested, nothing looked up
+        self.assertEquals(broker.custom_attributes_query(
+            '', results(), False, False, False), results())
+        # the same uri listed twice gets its attributes both times
+        ret = broker.custom_attributes_query(
+            'object_meta_size', [{'/a/c/o1': {}}, {'/a/c/o1': {}}],
+            False, False, False)
+        self.assertEquals(ret, [{'/a/c/o1': {'object_meta_size': '1'}}] * 2)
+        # temp rows do not leak into the next query
+        with broker.get() as conn:
+            self.assertEquals(
+                conn.execute('SELECT COUNT(*) FROM result_uri').fetchone()[0],
+                0)
+        # custom_metadata is searched by uri for each row of the result set
+        join = ('SELECT custom_metadata.uri, custom_key, custom_value '
+                'FROM result_uri CROSS JOIN custom_metadata '
+                'ON custom_metadata.uri = result_uri.uri WHERE ')
+        for condition, args in (
+                ('custom_key IN (?)', ('object_meta_color',)),
+                ('substr(custom_key, 1, ?) = ?', (11, 'object_meta'))):
+            plan = self._query_plan(broker, join + condition, args)
+            self.assert_(plan.startswith('SCAN result_uri'), plan)
+            self.assert_('SEARCH custom_metadata USING INDEX '
+                         'sqlite_autoindex_custom_metadata_1 (uri=?' in plan,
+                         plan)
+
     def test_empty(self):
         # Test AccountBroker.empty
         self.assert_(True)
@@ -0,0 +1,84 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import mock
+
+from swift.metadata import cache
+from swift.metadata.cache import LocalCache, ResultCache
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def test_lru(self):
+        local = LocalCache(2)
+        local.set('a', 1)
+        local.set('b', 2)
+        self.assertEquals(local.get('a'), 1)
+        local.set('c', 3)
+        self.assertEquals(local.get('b'), None)
+        self.assertEquals(local.get('a'), 1)
+        self.assertEquals(local.get('c'), 3)
+
+    def test_ttl(self):
+        local = LocalCache()
+        with mock.patch.object(cache, 'now', return_value=100):
+            local.set('a', 1, time=10)
+            local.set('b', 2)
+        with mock.patch.object(cache, 'now', return_value=110):
+            self.assertEquals(local.get('a'), None)
+            self.assertEquals(local.get('b'), 2)
+
+
+class TestResultCache(unittest.TestCase):
+
+    def _store(self, results, key, body='body'):
+        list(results.iter_store(key, 'text/plain', [body]))
+
+    def test_invalidate(self):
+        results = ResultCache(LocalCache())
+        scopes = [(None, None), ('a', None), ('a', 'c1'), ('a', 'c2'),
+                  ('b', None)]
+        keys = {}
+        for acc, con in scopes:
+            keys[acc, con] = results.key(acc, con, None, [])
+            self._store(results, keys[acc, con])
+            self.assertEquals(results.get(keys[acc, con]),
+                              ('text/plain', 'body'))
+
+        def fresh():
+            return [(acc, con) for acc, con in scopes
+                    if results.key(acc, con, None, []) == keys[acc, con]]
+
+        results.invalidate(containers=[('a', 'c1')])
+        self.assertEquals(fresh(), [('a', 'c2'), ('b', None)])
+        keys = dict((scope, results.key(scope[0], scope[1], None, []))
+                    for scope in scopes)
+        # account rows are seen from every scope of the account
+        results.invalidate(accounts=['b'])
+        self.assertEquals(fresh(), [('a', None), ('a', 'c1'), ('a', 'c2')])
+
+    def test_max_size(self):
+        results = ResultCache(LocalCache(), max_size=4)
+        key = results.key('a', None, None, [])
+        self._store(results, key, 'too big')
+        self.assertEquals(results.get(key), None)
+        self._store(results, key, 'ok')
+        self.assertEquals(results.get(key), ('text/plain', 'ok'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import mock
+
+from swift.common.utils import normalize_timestamp
+from swift.metadata import compactor
+from swift.metadata.backend import MetadataBroker
+from test.unit import FakeLogger
+
+
+class TestMetadataCompactor(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def _broker(self, *parts):
+        broker = MetadataBroker(os.path.join(self.testdir, *parts))
+        broker.initialize(normalize_timestamp(1))
+        broker.delete_md('object', [
+            {'object_uri': '/a/c/old', 'object_delete_time': 100},
+            {'object_uri': '/a/c/new', 'object_delete_time': 900}])
+        return broker
+
+    def test_compact_all(self):
+        brokers = [self._broker('meta.db'), self._broker('3', 'meta.db')]
+        os.mkdir(os.path.join(self.testdir, 'spool'))
+        compact = compactor.MetadataCompactor(
+            {'location': self.testdir, 'reclaim_age': '500'})
+        compact.logger = FakeLogger()
+        self.assertEquals(compact.db_files(),
+                          [broker.db_file for broker in brokers[::-1]])
+        with mock.patch.object(compactor.time, 'time', return_value=1000):
+            compact.run_once()
+        for broker in brokers:
+            with broker.get() as conn:
+                self.assertEquals([r[0] for r in conn.execute(
+                    'SELECT uri FROM metadata_tombstone')], ['/a/c/new'])
+        self.assertEquals(compact.logger.log_dict['update_stats'],
+                          [(('tombstones_reclaimed', 1), {})] * 2)
+
+    def test_compact_failure(self):
+        broker = self._broker('meta.db')
+        compact = compactor.MetadataCompactor({'location': self.testdir})
+        compact.logger = FakeLogger()
+        with mock.patch.object(MetadataBroker, 'vacuum',
+                               side_effect=Exception('oops')):
+            compact.run_once()
+        self.assertEquals(compact.logger.get_increment_counts(),
+                          {'failures': 1})
+        self.assert_(os.path.exists(broker.db_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
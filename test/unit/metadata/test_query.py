@@ -0,0 +1,114 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import mock
+
+from swift.common.exceptions import MetadataQueryError
+from swift.metadata import query
+from swift.metadata.query import BoolOp, Comparison, Not, QueryCache, \
+    compile_query, normalize, parse, tokenize
+
+
+class TestQuery(unittest.TestCase):
+
+    def test_tokenize(self):
+        self.assertEquals(
+            tokenize("object_name='it''s'and(NOT object_content_length>=1.5)"),
+            [('word', 'object_name'), ('op', '='), ('string', "'it''s'"),
+             ('keyword', 'AND'), ('lparen', '('), ('keyword', 'NOT'),
+             ('word', 'object_content_length'), ('op', '>='),
+             ('number', '1.5'), ('rparen', ')')])
+        for text in ('object_name=1;', 'object_name=`x`', "object_name='x",
+                     'object_name=1abc', 'object_name=[1]'):
+            self.assertRaises(MetadataQueryError, tokenize, text)
+
+    def test_normalize(self):
+        self.assertEquals(
+            normalize(tokenize("  object_name  =  'a b'  or\tobject_uri<>3")),
+            "object_name = 'a b' OR object_uri != 3")
+
+    def test_parse(self):
+        self.assertEquals(parse('object_content_length == 10'),
+                          Comparison('object_content_length', '=', 10))
+        self.assertEquals(parse('object_meta_x <> "a""b"'),
+                          Comparison('object_meta_x', '!=', 'a"b'))
+        # AND binds tighter than OR
+        a = Comparison('object_name', '=', 'a')
+        b = Comparison('object_name', '=', 'b')
+        c = Comparison('object_name', '=', 'c')
+        self.assertEquals(
+            parse("object_name='a' OR object_name='b' AND object_name='c'"),
+            BoolOp('OR', (a, BoolOp('AND', (b, c)))))
+        self.assertEquals(
+            parse("NOT (object_name='a' OR object_name='b') AND "
+                  "object_name='c'"),
+            BoolOp('AND', (Not(BoolOp('OR', (a, b))), c)))
+
+    def test_parse_errors(self):
+        for text in ('', 'nosuchattr=1', 'object_meta_=1', "'a'='a'",
+                     'object_name', 'object_name=', 'object_name=object_uri',
+                     '(object_name=1', 'object_name=1)', 'object_name=1 AND',
+                     'object_name=1 object_uri=2', 'NOT', 'AND object_name=1'):
+            self.assertRaises(MetadataQueryError, parse, text)
+        deep = '(' * (query.MAX_DEPTH + 1) + 'object_name=1' + \
+            ')' * (query.MAX_DEPTH + 1)
+        self.assertRaises(MetadataQueryError, parse, deep)
+        parse(deep[1:-1])
+
+    def test_compile(self):
+        plan = compile_query(parse(
+            "object_content_length > 5 AND NOT object_meta_color='red'"))
+        self.assertEquals(plan.sql, (
+            '((object_content_length > :query_0) AND '
+            '(NOT EXISTS (SELECT 1 FROM custom_metadata '
+            'WHERE uri = object_uri AND custom_key = :query_2 '
+            'AND custom_value = :query_1)))'))
+        self.assertEquals(plan.args, {'query_0': 5, 'query_1': 'red',
+                                      'query_2': 'object_meta_color'})
+        # nothing from the query text ends up in the SQL but attribute
+        # names, which are all known columns
+        plan = compile_query(parse(
+            "container_meta_x='''; DROP TABLE object_metadata; --'"))
+        self.assert_('DROP' not in plan.sql, plan.sql)
+        self.assert_('container_uri' in plan.sql, plan.sql)
+        self.assertEquals(plan.args['query_0'],
+                          "'; DROP TABLE object_metadata; --")
+
+    def test_cache(self):
+        cache = QueryCache(2)
+        plan = cache.get('object_name = 1')
+        with mock.patch.object(query, 'compile_query') as compile_mock:
+            # the same query, spelled differently
+            self.assert_(cache.get('object_name=1') is plan)
+            self.assert_(cache.get('  object_name ==1') is plan)
+        self.assertFalse(compile_mock.called)
+        cache.get('object_uri = 1')
+        cache.get('object_name = 1')
+        # least recently used goes first
+        cache.get('object_etag_hash = 1')
+        self.assertEquals(cache.plans.keys(),
+                          ['object_name = 1', 'object_etag_hash = 1'])
+        self.assertRaises(MetadataQueryError, cache.get, 'object_name')
+        self.assertEquals(len(cache.plans), 2)
+        # a cache of size 0 keeps nothing
+        cache = QueryCache(0)
+        cache.get('object_name = 1')
+        self.assertEquals(len(cache.plans), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
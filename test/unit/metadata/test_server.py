@@ -19,11 +19,15 @@ import unittest
 import time
 from shutil import rmtree
 
+import mock
+
 from swift.common.swob import Request
 
+from swift.metadata.backend import MetadataBroker
 from swift.metadata.server import MetadataController
 
 from swift.common.utils import normalize_timestamp, json
+from test.unit import FakeLogger
 
 Aattrs = (
     "account_uri,account_name,account_last_activity_time,"
@@ -808,6 +812,420 @@ class TestMetadataController(unittest.TestCase):
         resp = req.get_response(self.controller)
         self.assert_(resp.status.startswith('400'))
 
+    def _get_uris(self, path, headers):
+        headers.setdefault('format', 'json')
+        req = Request.blank(path, environ={'REQUEST_METHOD': 'GET'},
+                            headers=headers)
+        resp = req.get_response(self.controller)
+        self.assert_(resp.status.startswith('200'), resp.status)
+        return [d.keys()[0] for d in json.loads(resp.body)]
+
+    def test_GET_limit_marker(self):
+        everything = [
+            '/TEST_acc1',
+            '/TEST_acc1/TEST_con1', '/TEST_acc1/TEST_con2',
+            '/TEST_acc1/TEST_con1/TEST_obj1',
+            '/TEST_acc1/TEST_con1/TEST_obj2',
+            '/TEST_acc1/TEST_con2/TEST_obj3']
+        self.assertEquals(self._get_uris('/v1/TEST_acc1', {}), everything)
+        for chunk_size in (1, 2, 1000):
+            self.controller.listing_chunk_size = chunk_size
+            for limit in (1, 2, 4, 6, 10):
+                # walk the whole listing a page at a time
+                pages = []
+                marker = None
+                while True:
+                    headers = {'limit': str(limit)}
+                    if marker:
+                        headers['marker'] = marker
+                    page = self._get_uris('/v1/TEST_acc1', headers)
+                    self.assert_(len(page) <= limit)
+                    if not page:
+                        break
+                    pages.extend(page)
+                    marker = page[-1]
+                self.assertEquals(pages, everything)
+        self.assertEquals(self._get_uris('/v1/TEST_acc1', {'limit': '0'}), [])
+        self.assertEquals(self._get_uris(
+            '/v1/TEST_acc1', {'marker': '/TEST_acc1/TEST_con1/TEST_obj1'}),
+            everything[4:])
+        self.assertEquals(self._get_uris(
+            '/v1/TEST_acc1', {'marker': '/TEST_acc1/TEST_con1', 'limit': 2}),
+            everything[2:4])
+
+    def test_GET_limit_counts_results(self):
+        # objects without the requested custom attribute are not listed,
+        # and do not use up the limit
+        self.uploadObj(1, 1, 4)
+        with MetadataBroker(self.controller.db_file).get() as conn:
+            conn.execute("DELETE FROM custom_metadata WHERE uri IN "
+                         "('/TEST_acc1/TEST_con1/TEST_obj1', "
+                         "'/TEST_acc1/TEST_con1/TEST_obj2')")
+            conn.commit()
+        self.controller.listing_chunk_size = 1
+        self.assertEquals(self._get_uris(
+            '/v1/TEST_acc1',
+            {'attributes': 'all_object_meta_attrs', 'limit': '1'}),
+            ['/TEST_acc1/TEST_con1/TEST_obj4'])
+
+    def test_GET_bad_limit(self):
+        for limit in ('-1', 'abc', ''):
+            req = Request.blank(
+                '/v1/TEST_acc1', environ={'REQUEST_METHOD': 'GET'},
+                headers={'limit': limit})
+            resp = req.get_response(self.controller)
+            self.assertEquals(resp.status_int, 400)
+
+    def test_GET_sorted_limit_marker(self):
+        headers = {'attributes': 'object_uri,object_name',
+                   'sorted': 'object_name', 'limit': '2'}
+        self.assertEquals(self._get_uris('/v1/TEST_acc1', dict(headers)), [
+            '/TEST_acc1/TEST_con1/TEST_obj1',
+            '/TEST_acc1/TEST_con1/TEST_obj2'])
+        headers['marker'] = '/TEST_acc1/TEST_con1/TEST_obj2'
+        self.assertEquals(self._get_uris('/v1/TEST_acc1', headers), [
+            '/TEST_acc1/TEST_con2/TEST_obj3'])
+
+    def _set_sort_values(self):
+        broker = MetadataBroker(self.controller.db_file)
+        with broker.get() as conn:
+            for obj, length, color in ((1, 100, 'b'), (2, 9, None),
+                                       (3, 42, 'a')):
+                uri = '/TEST_acc1/TEST_con%d/TEST_obj%d' % (
+                    2 if obj == 3 else 1, obj)
+                conn.execute('UPDATE object_metadata '
+                             'SET object_content_length = ? '
+                             'WHERE object_uri = ?', (length, uri))
+                if color:
+                    broker.insert_custom_md(
+                        conn, uri, 'object_meta_color', color)
+            conn.commit()
+
+    def test_GET_sorted(self):
+        self._set_sort_values()
+        obj1 = '/TEST_acc1/TEST_con1/TEST_obj1'
+        obj2 = '/TEST_acc1/TEST_con1/TEST_obj2'
+        obj3 = '/TEST_acc1/TEST_con2/TEST_obj3'
+        # numeric columns sort as numbers
+        self.assertEquals(self._get_uris('/v1/TEST_acc1', {
+            'attributes': 'object_content_length',
+            'sorted': 'object_content_length'}), [obj2, obj3, obj1])
+        # by custom attributes, items without one last
+        self.assertEquals(self._get_uris('/v1/TEST_acc1', {
+            'attributes': 'object_uri', 'sorted': 'object_meta_color'}),
+            [obj3, obj1, obj2])
+        # several keys
+        self.assertEquals(self._get_uris('/v1/TEST_acc1', {
+            'attributes': 'object_uri',
+            'sorted': 'object_container_name,object_content_length'}),
+            [obj2, obj1, obj3])
+        # across kinds of items, those without the attribute come last
+        self.assertEquals(self._get_uris('/v1/TEST_acc1', {
+            'sorted': 'object_content_length'}),
+            [obj2, obj3, obj1, '/TEST_acc1', '/TEST_acc1/TEST_con1',
+             '/TEST_acc1/TEST_con2'])
+        # by uri
+        self.assertEquals(self._get_uris('/v1/TEST_acc1', {'sorted': ''}), [
+            '/TEST_acc1', '/TEST_acc1/TEST_con1', obj1, obj2,
+            '/TEST_acc1/TEST_con2', obj3])
+
+    def test_GET_sorted_pages(self):
+        self._set_sort_values()
+        for sort in ('object_content_length', 'object_meta_color,uri',
+                     'container_name,object_meta_color', ''):
+            everything = self._get_uris('/v1/TEST_acc1', {'sorted': sort})
+            self.assertEquals(len(everything), 6)
+            for chunk_size in (1, 1000):
+                self.controller.listing_chunk_size = chunk_size
+                for limit in (1, 4):
+                    pages = []
+                    marker = None
+                    while True:
+                        headers = {'sorted': sort, 'limit': str(limit)}
+                        if marker:
+                            headers['marker'] = marker
+                        page = self._get_uris('/v1/TEST_acc1', headers)
+                        if not page:
+                            break
+                        pages.extend(page)
+                        marker = page[-1]
+                    self.assertEquals(pages, everything)
+
+    def test_GET_bad_sort(self):
+        for sort in ('bad_attr', 'object_name,object_uri;'):
+            req = Request.blank(
+                '/v1/TEST_acc1', environ={'REQUEST_METHOD': 'GET'},
+                headers={'sorted': sort})
+            resp = req.get_response(self.controller)
+            self.assertEquals(resp.status_int, 400)
+
+    def test_GET_streams(self):
+        self.controller.listing_chunk_size = 1
+        for format in ('json', 'xml', 'plain'):
+            req = Request.blank(
+                '/v1/TEST_acc1', environ={'REQUEST_METHOD': 'GET'},
+                headers={'format': format})
+            resp = self.controller.GET(req)
+            self.assertEquals(resp.status_int, 200)
+            self.assert_(resp.content_length is None)
+            body = list(resp.app_iter)
+            self.assert_(len(body) > 6, body)
+            self.assert_(''.join(body).endswith('\n'))
+
+    def test_GET_query(self):
+        self._set_sort_values()
+        obj1 = '/TEST_acc1/TEST_con1/TEST_obj1'
+        obj2 = '/TEST_acc1/TEST_con1/TEST_obj2'
+        obj3 = '/TEST_acc1/TEST_con2/TEST_obj3'
+        for query, expected in (
+                ('object_content_length > 10', [obj1, obj3]),
+                ('object_content_length>=9 AND object_meta_color=\'b\'',
+                 [obj1]),
+                ("object_meta_color = 'a' or object_name == 'TEST_obj2'",
+                 [obj2, obj3]),
+                ('NOT (object_meta_color="a" OR object_meta_color="b")',
+                 [obj2]),
+                ('object_container_name<>"TEST_con1"', [obj3]),
+                ('object_content_length%20<%2010', [obj2])):
+            self.assertEquals(self._get_uris('/v1/TEST_acc1', {
+                'attributes': 'object_uri', 'query': query}), expected)
+        # each kind of item is joined with its container and account, so
+        # a query can select items by attributes of their parents
+        self.assertEquals(self._get_uris('/v1/TEST_acc1/TEST_con1', {
+            'query': "container_name='TEST_con1'"}),
+            ['/TEST_acc1', '/TEST_acc1/TEST_con1', obj1, obj2])
+        self.assertEquals(self._get_uris('/v1/TEST_acc1/TEST_con1', {
+            'attributes': 'object_uri,container_uri',
+            'query': "object_meta_color='b'"}),
+            ['/TEST_acc1/TEST_con1', obj1])
+
+    def test_GET_query_is_not_sql(self):
+        # values are bound, never spliced into the SQL
+        self.assertEquals(self._get_uris('/v1/TEST_acc1', {
+            'attributes': 'object_uri',
+            'query': "object_name='x'' OR ''a''=''a'"}), [])
+        req = Request.blank(
+            '/v1/TEST_acc1', environ={'REQUEST_METHOD': 'GET'},
+            headers={'query': "object_name='x' OR 'a'='a'"})
+        self.assertEquals(req.get_response(self.controller).status_int, 400)
+        # and neither is the scope
+        self.assertEquals(self._get_uris(
+            "/v1/TEST_acc1' OR 'a'='a", {'attributes': 'object_uri'}), [])
+
+    def test_GET_bad_query(self):
+        for query in ('nosuchcolumn=1', 'object_name', "object_name='x",
+                      'object_name=1; DROP TABLE object_metadata',
+                      '(object_name=1', 'object_name=1 AND',
+                      'object_meta_=1', 'object_name=object_uri', ''):
+            req = Request.blank(
+                '/v1/TEST_acc1', environ={'REQUEST_METHOD': 'GET'},
+                headers={'attributes': 'object_uri', 'query': query})
+            resp = req.get_response(self.controller)
+            self.assertEquals(resp.status_int, 400, query)
+        self.assertEquals(len(self._get_uris(
+            '/v1/TEST_acc1', {'attributes': 'object_uri'})), 3)
+
+    def test_GET_result_cache(self):
+        self.controller = MetadataController(
+            {'location': self.testDir,
+             'db_file': os.path.join(self.testDir, 'meta.db'),
+             'result_cache': 'true'}, logger=FakeLogger())
+        obj4 = '/TEST_acc1/TEST_con1/TEST_obj4'
+        con1 = {'attributes': 'object_uri', 'format': 'json'}
+
+        def get_con2():
+            req = Request.blank(
+                '/v1/TEST_acc1/TEST_con2', environ={'REQUEST_METHOD': 'GET'},
+                headers={'attributes': 'object_uri', 'format': 'xml'})
+            resp = req.get_response(self.controller)
+            self.assertEquals(resp.content_type, 'application/xml')
+            return resp.body
+
+        everything = self._get_uris('/v1/TEST_acc1', {
+            'attributes': 'object_uri,container_uri,account_uri'})
+        self.assertEquals(len(everything), 6)
+        con1_uris = self._get_uris('/v1/TEST_acc1/TEST_con1', dict(con1))
+        con2_body = get_con2()
+        self.assertEquals(
+            self.controller.logger.get_increment_counts(),
+            {'result_cache.misses': 3})
+        with mock.patch.object(MetadataBroker, 'execute_page') as execute:
+            # the same requests, spelled differently, are answered from
+            # the cache
+            self.assertEquals(self._get_uris(
+                '/v1/TEST_acc1/TEST_con1', dict(con1)), con1_uris)
+            self.assertEquals(self._get_uris(
+                '/v1/TEST_acc1', {'attributes': 'account_uri,container_uri,'
+                                  'object_uri'}), everything)
+            self.assertEquals(get_con2(), con2_body)
+        self.assertFalse(execute.called)
+        # ingesting an object invalidates its container and account only
+        self.uploadObj(1, 1, 4)
+        self.assert_(obj4 in self._get_uris('/v1/TEST_acc1', {}))
+        self.assertEquals(self._get_uris(
+            '/v1/TEST_acc1/TEST_con1', dict(con1)), con1_uris + [obj4])
+        self.assertEquals(get_con2(), con2_body)
+        self.assertEquals(
+            self.controller.logger.get_increment_counts(),
+            {'result_cache.misses': 5, 'result_cache.hits': 4})
+        # errors and oversized bodies are not cached
+        self.controller.result_cache.max_size = 10
+        for i in range(2):
+            self._get_uris('/v1/TEST_acc1', {'limit': '3'})
+            req = Request.blank('/v1/TEST_acc1',
+                                environ={'REQUEST_METHOD': 'GET'},
+                                headers={'attributes': 'bad_attr'})
+            self.assertEquals(req.get_response(self.controller).status_int,
+                              400)
+        self.assertEquals(
+            self.controller.logger.get_increment_counts(),
+            {'result_cache.misses': 9, 'result_cache.hits': 4})
+
+    def test_sharded_by_account(self):
+        ring = mock.Mock()
+        ring.get_part.side_effect = lambda account: int(account[-1])
+        with mock.patch('swift.metadata.server.get_metadata_ring',
+                        return_value=ring):
+            self.controller = MetadataController(
+                {'location': self.testDir, 'shard_by_account': 'true'})
+        for acc in (1, 2):
+            self.uploadAcc(acc)
+            self.uploadCon(acc, 1)
+        self.uploadObj(2, 1, 1)
+        self.uploadObj(1, 1, 4)
+        # each account's metadata lives in the DB of its partition
+        for part, uris in ((1, ['/TEST_acc1/TEST_con1/TEST_obj4']),
+                           (2, ['/TEST_acc2/TEST_con1/TEST_obj1'])):
+            broker = MetadataBroker(
+                os.path.join(self.testDir, str(part), 'meta.db'))
+            with broker.get() as conn:
+                self.assertEquals([r[0] for r in conn.execute(
+                    'SELECT object_uri FROM object_metadata')], uris)
+        self.assertEquals(self._get_uris('/v1/TEST_acc2', {}), [
+            '/TEST_acc2', '/TEST_acc2/TEST_con1',
+            '/TEST_acc2/TEST_con1/TEST_obj1'])
+        self.assertEquals(
+            self._get_uris('/v1/TEST_acc1', {'attributes': 'object_uri'}),
+            ['/TEST_acc1/TEST_con1/TEST_obj4'])
+        self.assertEquals(self.controller.schema_checked, set(
+            os.path.join(self.testDir, part, 'meta.db')
+            for part in ('1', '2')))
+
+    def test_DELETE(self):
+        def delete(md_type, tombstones):
+            req = Request.blank(
+                '/', environ={'REQUEST_METHOD': 'DELETE'},
+                headers={'user-agent': md_type},
+                body=json.dumps(tombstones))
+            return req.get_response(self.controller).status_int
+
+        later = normalize_timestamp(float(self.t) + 1)
+        self.assertEquals(delete('object_crawler', [{
+            'object_uri': '/TEST_acc1/TEST_con1/TEST_obj1',
+            'object_account_name': 'TEST_acc1',
+            'object_container_name': 'TEST_con1',
+            'object_delete_time': later}]), 204)
+        self.assertEquals(delete('container_crawler', [{
+            'container_uri': '/TEST_acc1/TEST_con2',
+            'container_account_name': 'TEST_acc1',
+            'container_name': 'TEST_con2',
+            'container_delete_time': later}]), 204)
+        self.assertEquals(self._get_uris('/v1/TEST_acc1', {}), [
+            '/TEST_acc1', '/TEST_acc1/TEST_con1',
+            '/TEST_acc1/TEST_con1/TEST_obj2'])
+        # crawls from before the delete do not bring the object back
+        self.uploadObj(1, 1, 1)
+        self.assertEquals(self._get_uris(
+            '/v1/TEST_acc1/TEST_con1', {'attributes': 'object_uri'}),
+            ['/TEST_acc1/TEST_con1/TEST_obj2'])
+        self.assertEquals(delete('bad_crawler', []), 400)
+        self.assertEquals(delete('object_crawler', {}), 400)
+
+    def test_async_ingest(self):
+        self.controller = MetadataController(
+            {'location': self.testDir,
+             'db_file': os.path.join(self.testDir, 'meta.db'),
+             'async_ingest': 'true', 'recon_cache_path': self.testDir},
+            logger=FakeLogger())
+        obj4 = '/TEST_acc1/TEST_con1/TEST_obj4'
+
+        def put(body):
+            req = Request.blank(
+                '/', environ={'REQUEST_METHOD': 'PUT'},
+                headers={'user-agent': 'object_crawler'}, body=body)
+            return req.get_response(self.controller).status_int
+
+        with mock.patch('swift.metadata.server.spawn') as spawn:
+            spawn.return_value.dead = False
+            self.assertEquals(put(json.dumps(
+                [self.getTestObjDict(1, 1, 4)])), 202)
+            self.assertEquals(put(json.dumps(
+                [self.getTestObjDict(1, 1, 5)])), 202)
+        spawn.assert_called_once_with(self.controller.run_spool_writer)
+        self.assertEquals(len(self.controller.spool.batches()), 2)
+        # after a restart, the writer starts with whatever request comes
+        # first, not just a PUT
+        self.controller = MetadataController(
+            {'location': self.testDir,
+             'db_file': os.path.join(self.testDir, 'meta.db'),
+             'async_ingest': 'true', 'recon_cache_path': self.testDir},
+            logger=FakeLogger())
+        with mock.patch('swift.metadata.server.spawn') as spawn:
+            spawn.return_value.dead = False
+            Request.blank('/', environ={'REQUEST_METHOD': 'GET'}).get_response(
+                self.controller)
+        spawn.assert_called_once_with(self.controller.run_spool_writer)
+        self.assert_(obj4 not in self._get_uris('/v1/TEST_acc1', {}))
+        # malformed batches are refused up front
+        for body in ('{"uri": ', '{}', '["/TEST_acc1"]'):
+            self.assertEquals(put(body), 400, body)
+
+        self.assertEquals(self.controller.drain_spool(), 2)
+        self.assertEquals(self.controller.spool.batches(), [])
+        self.assert_(obj4 in self._get_uris('/v1/TEST_acc1', {}))
+        self.assertEquals(self.controller.logger.log_dict['update_stats'],
+                          [(('ingest_spool.items', 2), {})])
+        with open(os.path.join(self.testDir, 'metadata.recon')) as fp:
+            self.assertEquals(json.load(fp), {'ingest_spool_depth': 0,
+                                              'ingest_spool_lag': 0})
+
+    def test_existing_db_migrated(self):
+        rmtree(self.testDir)
+        broker = MetadataBroker(self.controller.db_file)
+        with mock.patch.object(MetadataBroker, 'schema_migrations', ()):
+            broker.initialize(self.t)
+        # rows as an older server would have written them
+        with broker.get() as conn:
+            self.assertEquals(broker.get_schema_version(conn), 0)
+            conn.execute("INSERT INTO account_metadata "
+                         "(account_uri, account_name) "
+                         "VALUES ('/TEST_acc1', 'TEST_acc1')")
+            conn.execute("INSERT INTO container_metadata "
+                         "(container_uri, container_name, "
+                         "container_account_name) "
+                         "VALUES ('/TEST_acc1/TEST_con1', 'TEST_con1', "
+                         "'TEST_acc1')")
+            for obj in ('TEST_obj1', 'TEST_obj2', 'TEST_obj3'):
+                conn.execute("INSERT INTO object_metadata "
+                             "(object_uri, object_name, object_account_name, "
+                             "object_container_name) "
+                             "VALUES (?, ?, 'TEST_acc1', 'TEST_con1')",
+                             ('/TEST_acc1/TEST_con1/' + obj, obj))
+            conn.commit()
+        controller = MetadataController(
+            {'location': self.testDir,
+             'db_file': os.path.join(self.testDir, 'meta.db')})
+        req = Request.blank(
+            '/v1/TEST_acc1', environ={'REQUEST_METHOD': 'GET'},
+            headers={'attributes': 'object_uri', 'format': 'json'})
+        resp = req.get_response(controller)
+        self.assert_(resp.status.startswith('200'))
+        self.assertEquals(len(json.loads(resp.body)), 3)
+        self.assert_(controller.schema_checked)
+        with broker.get() as conn:
+            self.assertEquals(broker.get_schema_version(conn),
+                              broker.schema_version)
+
     ########################
     #   HELPER FUNCTIONS   #
     ########################
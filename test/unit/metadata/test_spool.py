@@ -0,0 +1,100 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import mock
+
+from swift.common.utils import json
+from swift.metadata import spool
+from swift.metadata.spool import IngestSpool
+from test.unit import FakeLogger
+
+
+class TestIngestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+        self.spool = IngestSpool(os.path.join(self.testdir, 'spool'),
+                                 FakeLogger())
+        self.ingested = []
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def _append(self, md_type, uris, when):
+        with mock.patch.object(spool.time, 'time', return_value=when):
+            return self.spool.append(md_type, json.dumps(
+                [{'uri': uri} for uri in uris]))
+
+    def _ingest(self, md_type, items):
+        if any(item['uri'] == 'bad' for item in items):
+            raise ValueError('bad item')
+        self.ingested.append((md_type, [item['uri'] for item in items]))
+
+    def test_append(self):
+        self.assertEquals(self.spool.batches(), [])
+        self.assertEquals(self.spool.stats(), {'depth': 0, 'lag': 0})
+        second = self._append('object_crawler', ['o1'], 200)
+        first = self._append('account_crawler', ['a1'], 100)
+        self.assertEquals(self.spool.batches(), [first, second])
+        self.assert_(first.startswith('0000000100.00000-'), first)
+        self.assert_(first.endswith('.account_crawler'), first)
+        # nothing is left behind in the temporary directory
+        self.assertEquals(os.listdir(os.path.join(self.spool.spool_dir,
+                                                  spool.TMP_DIR)), [])
+        with mock.patch.object(spool.time, 'time', return_value=130):
+            self.assertEquals(self.spool.stats(), {'depth': 2, 'lag': 30})
+
+    def test_drain(self):
+        self._append('object_crawler', ['o1', 'o2'], 100)
+        self._append('container_crawler', ['c1'], 101)
+        self._append('object_crawler', ['o3'], 102)
+        last = self._append('object_crawler', ['o4'], 103)
+        # batches of a kind are ingested together, oldest first
+        self.assertEquals(self.spool.drain(self._ingest, max_items=4), 4)
+        self.assertEquals(self.ingested, [
+            ('object_crawler', ['o1', 'o2', 'o3']),
+            ('container_crawler', ['c1'])])
+        self.assertEquals(self.spool.batches(), [last])
+        self.assertEquals(self.spool.drain(self._ingest), 1)
+        self.assertEquals(self.spool.batches(), [])
+        self.assertEquals(self.spool.drain(self._ingest), 0)
+
+    def test_drain_failures(self):
+        self._append('object_crawler', ['o1'], 100)
+        bad = self._append('object_crawler', ['bad'], 101)
+        self._append('object_crawler', ['o2'], 102)
+        with open(os.path.join(self.spool.spool_dir,
+                               '0000000103.00000-x.object_crawler'),
+                  'w') as fp:
+            fp.write('[{"uri": ')
+        self.assertEquals(self.spool.drain(self._ingest), 2)
+        # the good batches are retried on their own
+        self.assertEquals(self.ingested, [('object_crawler', ['o1']),
+                                          ('object_crawler', ['o2'])])
+        self.assertEquals(self.spool.batches(), [])
+        self.assertEquals(
+            sorted(os.listdir(os.path.join(self.spool.spool_dir,
+                                           spool.QUARANTINE_DIR))),
+            [bad, '0000000103.00000-x.object_crawler'])
+        self.assertEquals(len(self.spool.logger.log_dict['exception']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,7 +13,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import time
 import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+import mock
+from test.unit import FakeLogger
+from swift.metadata import utils
 from swift.metadata.utils import *
 #from sort_dict4 import Sort_metadata
 
@@ -60,6 +67,331 @@ class Test_Sort_metadata(unittest.TestCase):
         self.assertEquals(result,exp_result)
 
 
+class FakeConn(object):
+    """Records what BatchSender writes and answers with canned statuses"""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.requests = []
+        self.closed = False
+
+    def connect(self):
+        pass
+
+    def putrequest(self, method, path):
+        self.requests.append({'method': method, 'path': path,
+                              'headers': {}, 'data': ''})
+
+    def putheader(self, key, value):
+        self.requests[-1]['headers'][key] = value
+
+    def endheaders(self):
+        pass
+
+    def send(self, data):
+        self.requests[-1]['data'] += data
+
+    def getresponse(self):
+        status = self.statuses.pop(0)
+        if isinstance(status, Exception):
+            raise status
+        return mock.Mock(status=status, will_close=False)
+
+    def close(self):
+        self.closed = True
+
+    def bodies(self):
+        """De-chunks every request body and parses it"""
+        bodies = []
+        for request in self.requests:
+            data, body = request['data'], ''
+            while True:
+                size, data = data.split('\r\n', 1)
+                size = int(size, 16)
+                if not size:
+                    break
+                body, data = body + data[:size], data[size + 2:]
+            bodies.append(json.loads(body))
+        return bodies
+
+
+class Test_BatchSender(unittest.TestCase):
+
+    def setUp(self):
+        self.conns = []
+        self.statuses = []
+
+        def fake_http_connection(host):
+            self.conns.append(FakeConn(self.statuses))
+            return self.conns[-1]
+
+        self.patches = [
+            mock.patch.object(utils, 'HTTPConnection', fake_http_connection),
+            mock.patch.object(utils, 'sleep')]
+        self.sleep = [p.start() for p in self.patches][1]
+        self.batches = []
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def _sender(self, **conf):
+        return BatchSender(
+            conf, 'object_crawler', '1.2.3.4', '6090', FakeLogger(),
+            on_batch=lambda success, tags: self.batches.append(
+                (success, tags)))
+
+    def test_batches_by_count(self):
+        sender = self._sender(batch_size='2')
+        self.statuses.extend([204, 204, 204])
+        for i in xrange(5):
+            sender.add({'object_uri': '/a/c/o%d' % i}, tag=i // 2)
+        self.assertEquals(len(self.batches), 2)
+        self.assert_(sender.flush())
+        self.assert_(sender.flush())
+        sender.close()
+        # one connection, kept alive for all batches
+        self.assertEquals(len(self.conns), 1)
+        self.assert_(self.conns[0].closed)
+        self.assertEquals(
+            [[d['object_uri'] for d in b] for b in self.conns[0].bodies()],
+            [['/a/c/o0', '/a/c/o1'], ['/a/c/o2', '/a/c/o3'], ['/a/c/o4']])
+        request = self.conns[0].requests[0]
+        self.assertEquals(request['method'], 'PUT')
+        self.assertEquals(request['headers'],
+                          {'User-Agent': 'object_crawler',
+                           'Transfer-Encoding': 'chunked'})
+        self.assertEquals(self.batches,
+                          [(True, set([0])), (True, set([1])),
+                           (True, set([2]))])
+        self.assertEquals(sender.batches_sent, 3)
+
+    def test_delete(self):
+        # tombstones are sent with DELETEs
+        self.statuses.append(204)
+        sender = get_sender({}, 'object_crawler', '1.2.3.4', '6090',
+                            FakeLogger(), method='DELETE')
+        sender.add({'object_uri': '/a/c/o', 'object_delete_time': '1'})
+        self.assert_(sender.flush())
+        self.assertEquals(self.conns[0].requests[0]['method'], 'DELETE')
+
+    def test_batches_by_bytes(self):
+        sender = self._sender(batch_bytes='30')
+        self.statuses.extend([204, 204])
+        sender.add({'object_uri': '/a/c/%s' % ('x' * 20)})
+        self.assertEquals(len(self.batches), 1)
+        sender.add({'object_uri': '/a/c/o'})
+        self.assertEquals(len(self.batches), 1)
+        sender.flush()
+        self.assertEquals(len(self.batches), 2)
+
+    def test_retry_with_backoff(self):
+        sender = self._sender(retry_backoff='1', send_retries='3')
+        self.statuses.extend([503, Exception('boom'), 204])
+        sender.add({'object_uri': '/a/c/o'}, tag='sda1')
+        self.assert_(sender.flush())
+        self.assertEquals([c[0][0] for c in self.sleep.call_args_list],
+                          [1, 2])
+        # the connection is dropped after an error and then reestablished
+        self.assertEquals(len(self.conns), 2)
+        self.assertEquals(self.batches, [(True, set(['sda1']))])
+
+    def test_retries_exhausted(self):
+        sender = self._sender(send_retries='1')
+        self.statuses.extend([503, 500])
+        sender.add({'object_uri': '/a/c/o'}, tag='sda1')
+        self.assertFalse(sender.flush())
+        self.assertEquals(self.batches, [(False, set(['sda1']))])
+        self.assertEquals(sender.batches_failed, 1)
+        # nothing left to send
+        self.assert_(sender.flush())
+        self.assertEquals(len(self.batches), 1)
+
+
+class FakeShardRing(object):
+    """Puts account N in partition N, on servers N and N + 1"""
+
+    def get_nodes(self, account):
+        part = int(account[1:])
+        return part, [{'ip': '10.0.0.%d' % n, 'port': 6090}
+                      for n in (part, part + 1)]
+
+
+class Test_ShardedBatchSender(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def test_routes_by_account(self):
+        sender = ShardedBatchSender(
+            {'send_retries': '0'}, 'object_crawler', FakeShardRing(),
+            FakeLogger(), on_batch=lambda success, tags: self.batches.append(
+                (success, tags)))
+        sent = {}
+
+        def fake_send(sender, chunks):
+            sent.setdefault(sender.host, []).extend(
+                json.loads(chunk)['object_uri'] for chunk in chunks)
+            return sender.host != '10.0.0.3:6090'
+
+        with mock.patch.object(BatchSender, '_send_batch', fake_send):
+            sender.add({'object_account_name': 'a1', 'object_uri': '/a1/c/o'},
+                       tag='sda')
+            sender.add({'object_account_name': 'a2', 'object_uri': '/a2/c/o'},
+                       tag='sdb')
+            self.assertFalse(sender.flush())
+        self.assertEquals(sent, {
+            '10.0.0.1:6090': ['/a1/c/o'],
+            '10.0.0.2:6090': ['/a1/c/o', '/a2/c/o'],
+            '10.0.0.3:6090': ['/a2/c/o']})
+        # sdb is only acknowledged by one of its replicas
+        self.assertEquals(sorted(self.batches), [
+            (False, set(['sdb'])), (True, set(['sda'])),
+            (True, set(['sda', 'sdb']))])
+        self.assertEquals(sender.batches_sent, 2)
+        self.assertEquals(sender.batches_failed, 1)
+
+    def test_item_account(self):
+        self.assertEquals(item_account({'account_name': 'a'}), 'a')
+        self.assertEquals(item_account({'container_account_name': 'a',
+                                        'container_name': 'c'}), 'a')
+        self.assertEquals(item_account({'object_account_name': 'a',
+                                        'object_container_name': 'c'}), 'a')
+        self.assertRaises(ValueError, item_account, {'object_uri': '/a'})
+
+    def test_get_sender(self):
+        self.assertEquals(get_metadata_ring({}), None)
+        self.assert_(isinstance(
+            get_sender({}, 'object_crawler', '1.2.3.4', '6090', FakeLogger(),
+                       ring=get_metadata_ring({})), BatchSender))
+        with mock.patch.object(utils, 'Ring') as ring:
+            self.assert_(get_metadata_ring(
+                {'shard_by_account': 'yes', 'swift_dir': '/etc/x'})
+                is ring.return_value)
+        ring.assert_called_once_with('/etc/x', ring_name='metadata')
+        self.assert_(isinstance(
+            get_sender({}, 'object_crawler', '1.2.3.4', '6090', FakeLogger(),
+                       ring=FakeShardRing()), ShardedBatchSender))
+
+
+class Test_CrawlCheckpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+        self.conf = {'recon_cache_path': self.testdir}
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=1)
+
+    def test_advance_and_reload(self):
+        checkpoints = CrawlCheckpoints(self.conf, 'object_crawler',
+                                       FakeLogger())
+        self.assertEquals(checkpoints.get('sda1', '0'), 0)
+        checkpoints.advance([('sda1', '0'), ('sda1', '1')], 10.5)
+        checkpoints.advance([('sdb1', '0')], 11.5)
+        checkpoints.advance([('sda1', '1')], 12.5)
+        self.assert_(os.path.exists(
+            os.path.join(self.testdir, 'object_crawler.checkpoint')))
+        reloaded = CrawlCheckpoints(self.conf, 'object_crawler',
+                                    FakeLogger())
+        self.assertEquals(reloaded.get('sda1', '0'), 10.5)
+        self.assertEquals(reloaded.get('sda1', '1'), 12.5)
+        self.assertEquals(reloaded.get('sdb1', '0'), 11.5)
+        self.assertEquals(reloaded.get('sdb1', '1'), 0)
+        # positions moved forward by another worker are picked up
+        checkpoints.advance([('sdb1', '1')], 13.5)
+        self.assertEquals(reloaded.get('sdb1', '1'), 0)
+        reloaded.reload()
+        self.assertEquals(reloaded.get('sdb1', '1'), 13.5)
+
+    def test_corrupt_file(self):
+        with open(os.path.join(self.testdir, 'object_crawler.checkpoint'),
+                  'w') as fp:
+            fp.write('garbage')
+        checkpoints = CrawlCheckpoints(self.conf, 'object_crawler',
+                                       FakeLogger())
+        self.assertEquals(checkpoints.positions, {})
+
+    def test_db_changed_since(self):
+        db_file = os.path.join(self.testdir, 'hash.db')
+        self.assertFalse(db_changed_since(db_file, 0))
+        with open(db_file, 'w'):
+            pass
+        now = time.time()
+        self.assert_(db_changed_since(db_file, 0))
+        self.assertFalse(db_changed_since(db_file, now + 1))
+        with open(db_file + '.pending', 'w'):
+            pass
+        os.utime(db_file + '.pending', (now + 2, now + 2))
+        self.assert_(db_changed_since(db_file, now + 1))
+
+    def test_db_size(self):
+        db_file = os.path.join(self.testdir, 'hash.db')
+        self.assertEquals(db_size(db_file), 0)
+        with open(db_file, 'w') as fp:
+            fp.write('x' * 10)
+        self.assertEquals(db_size(db_file), 10)
+
+
+class Test_CrawlWorkers(unittest.TestCase):
+
+    def test_rate_limiter(self):
+        limiter = CrawlRateLimiter({'files_per_second': '10',
+                                    'bytes_per_second': '1000'})
+        with mock.patch.object(utils, 'ratelimit_sleep',
+                               side_effect=lambda running, *a, **kw:
+                               running + 1) as ratelimit_sleep:
+            limiter.wait(100)
+            limiter.wait()
+        self.assertEquals(ratelimit_sleep.call_args_list, [
+            mock.call(0, 10.0), mock.call(0, 1000.0, incr_by=100),
+            mock.call(1, 10.0), mock.call(1, 1000.0, incr_by=0)])
+        self.assertEquals(limiter.files_running_time, 2)
+        # unlimited unless configured
+        limiter = CrawlRateLimiter({})
+        self.assertEquals(limiter.max_files_per_second, 0)
+        self.assertEquals(limiter.max_bytes_per_second, 0)
+
+    def test_run_device_workers(self):
+        running = []
+        pids = iter(range(1, 10))
+
+        def fake_fork():
+            running.append(next(pids))
+            # at most two workers at a time
+            self.assert_(len(running) <= 2)
+            return running[-1]
+
+        def fake_wait():
+            return running.pop(0), 0
+
+        with mock.patch.object(utils.os, 'fork', fake_fork):
+            with mock.patch.object(utils.os, 'wait', fake_wait):
+                run_device_workers(None, ['sda1', 'sdb1', 'sdc1'], 2,
+                                   FakeLogger())
+        self.assertEquals(next(pids), 4)
+        self.assertEquals(running, [])
+
+    def test_device_worker(self):
+        crawled = []
+
+        def crawl(devices):
+            crawled.extend(devices)
+            raise Exception('oops')
+
+        logger = FakeLogger()
+        with mock.patch.object(utils.os, 'fork', return_value=0):
+            with mock.patch.object(utils.os, '_exit',
+                                   side_effect=SystemExit) as fake_exit:
+                with mock.patch.object(utils.signal, 'signal'):
+                    self.assertRaises(SystemExit, run_device_workers, crawl,
+                                      ['sda1'], 2, logger)
+        self.assertEquals(crawled, ['sda1'])
+        # the worker exits even though the crawl failed
+        fake_exit.assert_called_once_with(0)
+        self.assertEquals(len(logger.log_dict['exception']), 1)
+
+
 """
 Each test fetches the fake meta data dictionaries (https://wiki.openstack.org/wiki/MetadataSearchAPI) to output functions.
 Then it checks if output functions produce the same output as exp_result 
@@ -34,8 +34,9 @@ from test.unit import FakeLogger, mock as unit_mock, temptree
 
 from swift.obj import diskfile
 from swift.obj import crawler
+from swift.metadata.utils import BatchSender
 from swift.common import utils
-from swift.common.utils import hash_path, mkdirs, normalize_timestamp
+from swift.common.utils import hash_path, mkdirs, normalize_timestamp, json
 from swift.common import ring
 from swift.common.exceptions import DiskFileNotExist, DiskFileQuarantined, \
     DiskFileDeviceUnavailable, DiskFileDeleted, DiskFileNotOpen, \
@@ -55,7 +56,8 @@ class TestObjectCrawler(unittest.TestCase):
         self._orig_tpool_exc = tpool.execute
         tpool.execute = lambda f, *args, **kwargs: f(*args, **kwargs)
         self.conf = dict(devices=self.testdir, mount_check='false',
-                         keep_cache_size=2 * 1024, mb_per_sync=1)
+                         keep_cache_size=2 * 1024, mb_per_sync=1,
+                         recon_cache_path=self.tmpdir, send_retries='0')
         self.df_mgr = diskfile.DiskFileManager(self.conf, FakeLogger())
         self.crawler = crawler.ObjectCrawler(self.conf)
 
@@ -127,5 +129,227 @@ class TestObjectCrawler(unittest.TestCase):
         self.assertEquals(formattedmetadata['object_content_length'],'NULL')
         # added more tests as more attributes are implemented.
 
+    def test_object_sweep_checkpoints(self):
+        t = normalize_timestamp(42)
+        self._create_test_file('data', timestamp=t,
+                               metadata={'X-Timestamp': t,
+                                         'Content-Length': '4',
+                                         'ETag': md5('data').hexdigest()})
+        sent = []
+        statuses = [False, True]
+
+        def fake_send(sender, chunks):
+            sent.append([json.loads(c)['object_uri'] for c in chunks])
+            return statuses.pop(0)
+
+        with mock.patch.object(BatchSender, '_send_batch',
+                               fake_send):
+            self.crawler.run_once()
+            self.assertEquals(self.crawler.checkpoints.get('sda', '1'), 0)
+            self.crawler.run_once()
+            self.assertEquals(sent, [['/a/c/o'], ['/a/c/o']])
+            # a restarted crawler resumes from the acknowledged checkpoint
+            crawler.ObjectCrawler(self.conf).run_once()
+        self.assertEquals(len(sent), 2)
+
+    def test_object_sweep_object_arriving_after_checkpoint(self):
+        t = normalize_timestamp(42)
+        df = self._create_test_file('data', timestamp=t,
+                                    metadata={'X-Timestamp': t,
+                                              'Content-Length': '4',
+                                              'ETag': md5('data').hexdigest()})
+        os.utime(df._datadir, (time() - 60, time() - 60))
+        sent = []
+
+        def fake_send(sender, chunks):
+            sent.append([json.loads(c)['object_uri'] for c in chunks])
+            return True
+
+        with mock.patch.object(BatchSender, '_send_batch', fake_send):
+            self.crawler.run_once()
+            self.assert_(self.crawler.checkpoints.get('sda', '1') > 42)
+            # an upload that started (and was timestamped) before the
+            # checkpoint, but only landed on disk after it
+            self._create_test_file('data', timestamp=t, obj='late',
+                                   metadata={'X-Timestamp': t,
+                                             'Content-Length': '4',
+                                             'ETag': md5('data').hexdigest()})
+            self.crawler.run_once()
+        self.assertEquals(sent, [['/a/c/o'], ['/a/c/late']])
+
+    def _journal_crawler(self):
+        conf = dict(self.conf, crawl_mode='journal', send_retries='0')
+        return crawler.ObjectCrawler(conf)
+
+    def test_journal_sweep(self):
+        t = normalize_timestamp(42)
+        self._create_test_file('data', timestamp=t,
+                               metadata={'X-Timestamp': t,
+                                         'Content-Length': '4',
+                                         'ETag': md5('data').hexdigest()})
+        device_path = os.path.join(self.testdir, 'sda')
+        self.df_mgr.journal_change('sda', '1', 'a', 'c', 'o', 'PUT', t)
+        self.df_mgr.journal_change('sda', '1', 'a', 'c', 'o', 'POST', t)
+        self.df_mgr.journal_change('sda', '1', 'a', 'c', 'gone', 'PUT', t)
+        sent = []
+
+        def fake_send(sender, chunks):
+            sent.append([json.loads(c) for c in chunks])
+            return True
+
+        with mock.patch.object(BatchSender, '_send_batch',
+                               fake_send):
+            self._journal_crawler().run_once()
+        self.assertEquals(len(sent), 1)
+        self.assertEquals([m['object_uri'] for m in sent[0]], ['/a/c/o'])
+        self.assertEquals(
+            os.listdir(os.path.join(device_path, 'change_journal')),
+            ['.lock'])
+
+    def test_journal_sweep_tombstones(self):
+        t = normalize_timestamp(42)
+        df = self._create_test_file('data', timestamp=t,
+                                    metadata={'X-Timestamp': t,
+                                              'Content-Length': '4',
+                                              'ETag': md5('data').hexdigest()})
+        df.delete(normalize_timestamp(43))
+        self.df_mgr.journal_change('sda', '1', 'a', 'c', 'o', 'PUT', t)
+        self.df_mgr.journal_change('sda', '1', 'a', 'c', 'o', 'DELETE',
+                                   normalize_timestamp(43))
+        sent = []
+
+        def fake_send(sender, chunks):
+            sent.append((sender.method, [json.loads(c) for c in chunks]))
+            return True
+
+        with mock.patch.object(BatchSender, '_send_batch',
+                               fake_send):
+            self._journal_crawler().run_once()
+        self.assertEquals(sent, [('DELETE', [{
+            'object_uri': '/a/c/o', 'object_name': 'o',
+            'object_account_name': 'a', 'object_container_name': 'c',
+            'object_delete_time': normalize_timestamp(43)}])])
+
+    def test_journal_sweep_failed_send_keeps_journal(self):
+        t = normalize_timestamp(42)
+        self._create_test_file('data', timestamp=t,
+                               metadata={'X-Timestamp': t,
+                                         'Content-Length': '4',
+                                         'ETag': md5('data').hexdigest()})
+        self.df_mgr.journal_change('sda', '1', 'a', 'c', 'o', 'PUT', t)
+        sent = []
+
+        def fake_send(sender, chunks):
+            sent.append(chunks)
+            return False
+
+        with mock.patch.object(BatchSender, '_send_batch',
+                               fake_send):
+            obj_crawler = self._journal_crawler()
+            obj_crawler.run_once()
+            obj_crawler.run_once()
+        # the unacknowledged journal is resent on the next pass
+        self.assertEquals(len(sent), 2)
+        self.assertEquals(sent[0], sent[1])
+
+    def test_journal_sweep_failed_record_keeps_journal(self):
+        t = normalize_timestamp(42)
+        self._create_test_file('data', timestamp=t,
+                               metadata={'X-Timestamp': t,
+                                         'Content-Length': '4',
+                                         'ETag': md5('data').hexdigest()})
+        self.df_mgr.journal_change('sda', '1', 'a', 'c', 'o', 'PUT', t)
+        sent = []
+
+        def fake_send(sender, chunks):
+            sent.append([json.loads(c)['object_uri'] for c in chunks])
+            return True
+
+        obj_crawler = self._journal_crawler()
+        with mock.patch.object(BatchSender, '_send_batch', fake_send):
+            with mock.patch.object(obj_crawler, 'collect_journal_record',
+                                   side_effect=DiskFileError()):
+                obj_crawler.run_once()
+            self.assertEquals(sent, [])
+            # the journal was not released, so the change is sent next pass
+            obj_crawler.run_once()
+        self.assertEquals(sent, [['/a/c/o']])
+
+    def test_device_workers(self):
+        t = normalize_timestamp(42)
+        self._create_test_file('data', timestamp=t,
+                               metadata={'X-Timestamp': t,
+                                         'Content-Length': '4',
+                                         'ETag': md5('data').hexdigest()})
+        self.df_mgr.journal_change('sda', '1', 'a', 'c', 'o', 'PUT', t)
+        obj_crawler = crawler.ObjectCrawler(dict(self.conf, concurrency='4'))
+        with mock.patch.object(crawler, 'run_device_workers') as workers:
+            obj_crawler.run_once()
+        workers.assert_called_once_with(obj_crawler.object_sweep, mock.ANY,
+                                        4, obj_crawler.logger)
+        self.assertEquals(sorted(workers.call_args[0][1]), ['sda', 'sda1'])
+
+        sent = []
+
+        def fake_send(sender, chunks):
+            sent.append([json.loads(c)['object_uri'] for c in chunks])
+            return True
+
+        with mock.patch.object(BatchSender, '_send_batch', fake_send):
+            # a worker only crawls its own devices
+            for obj_crawler in (crawler.ObjectCrawler(self.conf),
+                                self._journal_crawler()):
+                obj_crawler.object_sweep(['sda1'])
+                self.assertEquals(sent, [])
+                obj_crawler.object_sweep(['sda'])
+                self.assertEquals(sent, [['/a/c/o']])
+                del sent[:]
+
+    def test_async_metadata_sweep(self):
+        t = normalize_timestamp(42)
+        self._create_test_file('data', timestamp=t,
+                               metadata={'X-Timestamp': t,
+                                         'Content-Length': '4',
+                                         'ETag': md5('data').hexdigest()})
+        df = self._create_test_file('data', timestamp=t, obj='d',
+                                    metadata={'X-Timestamp': t,
+                                              'Content-Length': '4',
+                                              'ETag': md5('data').hexdigest()})
+        df.delete(normalize_timestamp(43))
+        for obj, op, when in (('o', 'PUT', 40), ('o', 'POST', 42),
+                              ('d', 'DELETE', 43), ('gone', 'PUT', 42)):
+            self.df_mgr.pickle_async_metadata('sda', '1', 'a', 'c', obj, op,
+                                              normalize_timestamp(when))
+        async_dir = os.path.join(self.testdir, 'sda',
+                                 diskfile.ASYNC_METADATA_DIR)
+        sent = []
+        statuses = [False, False, True, True]
+
+        def fake_send(sender, chunks):
+            sent.append((sender.method,
+                         [json.loads(c)['object_uri'] for c in chunks]))
+            return statuses.pop(0)
+
+        obj_crawler = crawler.ObjectCrawler(dict(self.conf,
+                                                 crawl_mode='inline'))
+        with mock.patch.object(BatchSender, '_send_batch', fake_send):
+            obj_crawler.run_once()
+            # only the newest change of an object is kept
+            self.assertEquals(sorted(sent), [('DELETE', ['/a/c/d']),
+                                             ('PUT', ['/a/c/o'])])
+            self.assertEquals(
+                sum(len(files) for _, _, files in os.walk(async_dir)), 2)
+            # unacknowledged changes are resent on the next pass
+            del sent[:]
+            obj_crawler.run_once()
+            self.assertEquals(sorted(sent), [('DELETE', ['/a/c/d']),
+                                             ('PUT', ['/a/c/o'])])
+        self.assertEquals(os.listdir(async_dir), [])
+
+    def test_journal_sweep_no_journal(self):
+        with mock.patch.object(BatchSender, '_send_batch') as send:
+            self._journal_crawler().run_once()
+        self.assertFalse(send.called)
+
 if __name__ == '__main__':
     unittest.main()
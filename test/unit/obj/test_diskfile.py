@@ -254,17 +254,34 @@ class TestDiskFileModuleMethods(unittest.TestCase):
         whole_path_from = os.path.join(self.objects, '0', data_dir)
         hashes_file = os.path.join(self.objects, '0',
                                    diskfile.HASH_FILE)
+        invalidations_file = os.path.join(self.objects, '0',
+                                          diskfile.HASH_INVALIDATIONS_FILE)
         # test that non existent file except caught
         self.assertEquals(diskfile.invalidate_hash(whole_path_from),
                           None)
-        # test that hashes get cleared
+        # without a hashes file every suffix gets hashed anyway
+        self.assertEquals(
+            diskfile.consolidate_hashes(os.path.dirname(whole_path_from)),
+            None)
+        self.assertEquals(os.path.getsize(invalidations_file), 0)
+        # test that hashes get cleared, and that a suffix missing from the
+        # hashes file gets added
         check_pickle_data = pickle.dumps({data_dir: None},
                                          diskfile.PICKLE_PROTOCOL)
-        for data_hash in [{data_dir: None}, {data_dir: 'abcdefg'}]:
+        for data_hash in [{data_dir: None}, {data_dir: 'abcdefg'}, {}]:
             with open(hashes_file, 'wb') as fp:
                 pickle.dump(data_hash, fp, diskfile.PICKLE_PROTOCOL)
             diskfile.invalidate_hash(whole_path_from)
+            # the hashes file is left alone until it is consolidated
+            with open(hashes_file, 'rb') as fp:
+                self.assertEquals(pickle.load(fp), data_hash)
+            with open(invalidations_file, 'rb') as fp:
+                self.assertEquals(fp.read(), data_dir + '\n')
+            self.assertEquals(
+                diskfile.consolidate_hashes(os.path.dirname(whole_path_from)),
+                {data_dir: None})
             assertFileData(hashes_file, check_pickle_data)
+            self.assertEquals(os.path.getsize(invalidations_file), 0)
 
     def test_invalidate_hash_bad_pickle(self):
         df = self.df_mgr.get_diskfile('sda', '0', 'a', 'c', 'o')
@@ -405,9 +422,63 @@ class TestDiskFileModuleMethods(unittest.TestCase):
                 i[0] += 1
             return i[0]
         with unit_mock({'swift.obj.diskfile.getmtime': _getmtime}):
-            hashed, hashes = diskfile.get_hashes(
-                part, recalculate=['a83'])
-        self.assertEquals(i[0], 3)
+            with mock.patch('swift.obj.diskfile.write_pickle') as wp:
+                hashed, hashes = diskfile.get_hashes(
+                    part, recalculate=['a83'])
+        # the hashes file changed under us, so it is not written over,
+        # and the suffixes are not hashed again
+        self.assertEquals(i[0], 2)
+        self.assertEquals(hashed, 1)
+        self.assertFalse(wp.called)
+        self.assert_('a83' in hashes)
+
+    def test_get_hashes_invalidated(self):
+        df = self.df_mgr.get_diskfile('sda', '0', 'a', 'c', 'o')
+        mkdirs(df._datadir)
+        with open(
+                os.path.join(df._datadir,
+                             normalize_timestamp(time()) + '.ts'),
+                'wb') as f:
+            f.write('1234567890')
+        part = os.path.join(self.objects, '0')
+        hashed, hashes = diskfile.get_hashes(part)
+        self.assertEquals(hashed, 1)
+        suffix_dir = os.path.dirname(df._datadir)
+        for i in xrange(3):
+            diskfile.invalidate_hash(suffix_dir)
+        hashed, hashes = diskfile.get_hashes(part)
+        self.assertEquals(hashed, 1)
+        self.assert_(hashes['a83'])
+        hashed, hashes = diskfile.get_hashes(part)
+        self.assertEquals(hashed, 0)
+
+    def test_get_hashes_invalidated_while_hashing(self):
+        df = self.df_mgr.get_diskfile('sda', '0', 'a', 'c', 'o')
+        mkdirs(df._datadir)
+        with open(
+                os.path.join(df._datadir,
+                             normalize_timestamp(time()) + '.ts'),
+                'wb') as f:
+            f.write('1234567890')
+        part = os.path.join(self.objects, '0')
+        hashed, hashes = diskfile.get_hashes(part)
+        self.assertEquals(hashed, 1)
+        hash_suffix = diskfile.hash_suffix
+
+        def racing_hash_suffix(path, reclaim_age):
+            hash_ = hash_suffix(path, reclaim_age)
+            # a PUT lands while the suffix is being hashed
+            diskfile.invalidate_hash(path)
+            return hash_
+        with mock.patch('swift.obj.diskfile.hash_suffix',
+                        racing_hash_suffix):
+            hashed, hashes = diskfile.get_hashes(part, recalculate=['a83'])
+        self.assertEquals(hashed, 1)
+        # the hash computed before the PUT is not trusted
+        hashed, hashes = diskfile.get_hashes(part)
+        self.assertEquals(hashed, 1)
+        hashed, hashes = diskfile.get_hashes(part)
+        self.assertEquals(hashed, 0)
 
     def check_hash_cleanup_listdir(self, input_files, output_files):
         file_list = list(input_files)
@@ -616,6 +687,22 @@ class TestObjectAuditLocationGenerator(unittest.TestCase):
                     'Skipping %s as it is not mounted',
                     'sdq')
 
+    def test_device_dirs(self):
+        with temptree([]) as tmpdir:
+            os.makedirs(os.path.join(tmpdir, "sdp", "objects", "1519", "aca",
+                                     "5c1fdc1ffb12e5eaf84edc30d8b67aca"))
+            os.makedirs(os.path.join(tmpdir, "sdq", "objects", "3071", "8eb",
+                                     "fcd938702024c25fef6c32fef05298eb"))
+            locations = [(loc.path, loc.device, loc.partition)
+                         for loc in diskfile.object_audit_location_generator(
+                             devices=tmpdir, mount_check=False,
+                             device_dirs=["sdq", "sdr"])]
+            self.assertEqual(
+                locations,
+                [(os.path.join(tmpdir, "sdq", "objects", "3071", "8eb",
+                               "fcd938702024c25fef6c32fef05298eb"),
+                  "sdq", "3071")])
+
     def test_only_catch_expected_errors(self):
         # Crazy exceptions should still escape object_audit_location_generator
         # so that errors get logged and a human can see what's going wrong;
@@ -0,0 +1,82 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for swift.obj.journal"""
+
+import os
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from swift.obj import journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+        self.device_path = os.path.join(self.testdir, 'sda1')
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=1)
+
+    def test_format_parse_record(self):
+        line = journal.format_record('PUT', '7', '/a/c/o with space', '1.5')
+        self.assertEquals(line,
+                          '0000000001.50000 PUT 7 /a/c/o%20with%20space\n')
+        record = journal.parse_record(line)
+        self.assertEquals(record['op'], 'PUT')
+        self.assertEquals(record['partition'], '7')
+        self.assertEquals(record['name'], '/a/c/o with space')
+        self.assertEquals(record['account'], 'a')
+        self.assertEquals(record['container'], 'c')
+        self.assertEquals(record['obj'], 'o with space')
+
+    def test_parse_bad_record(self):
+        # truncated write
+        self.assertEquals(journal.parse_record('0000000001.50000 PUT 7'),
+                          None)
+        self.assertEquals(journal.parse_record('garbage\n'), None)
+        self.assertEquals(
+            journal.parse_record('0000000001.50000 PUT 7 /a/c\n'), None)
+
+    def test_claim_and_release(self):
+        self.assertEquals(journal.claim_journal(self.device_path), [])
+        for ts, name in ((3, '/a/c/o1'), (1, '/a/c/o2'), (2, '/a/c/o1')):
+            journal.append_record(
+                self.device_path, journal.format_record('PUT', '0', name, ts))
+        claimed = journal.claim_journal(self.device_path)
+        self.assertEquals(len(claimed), 1)
+        journal_dir = journal.get_journal_dir(self.device_path)
+        self.assertFalse(
+            os.path.exists(os.path.join(journal_dir, journal.JOURNAL_FILE)))
+        # writers carry on with a fresh journal
+        journal.append_record(
+            self.device_path, journal.format_record('DELETE', '0', '/a/c/o3',
+                                                    4))
+        records = list(journal.iter_claimed_records(claimed))
+        self.assertEquals([(r['name'], r['timestamp']) for r in records],
+                          [('/a/c/o2', '0000000001.00000'),
+                           ('/a/c/o1', '0000000003.00000')])
+        # unreleased claims are handed out again with the new journal
+        claimed_again = journal.claim_journal(self.device_path)
+        self.assertEquals(len(claimed_again), 2)
+        self.assertEquals(claimed_again[0], claimed[0])
+        journal.release_claimed(claimed_again)
+        self.assertEquals(journal.claim_journal(self.device_path), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,7 @@
 import unittest
 import os
 import mock
+import json
 from gzip import GzipFile
 from shutil import rmtree
 import cPickle as pickle
@@ -23,6 +24,7 @@ import time
 import tempfile
 from contextlib import contextmanager, closing
 
+import eventlet
 from eventlet.green import subprocess
 from eventlet import Timeout, tpool
 
@@ -153,7 +155,7 @@ class TestObjectReplicator(unittest.TestCase):
         self.ring = _create_test_ring(self.testdir)
         self.conf = dict(
             swift_dir=self.testdir, devices=self.devices, mount_check='false',
-            timeout='300', stats_interval='1')
+            timeout='300', stats_interval='1', recon_cache_path=self.testdir)
         self.replicator = object_replicator.ObjectReplicator(self.conf)
         self.replicator.logger = FakeLogger()
         self.df_mgr = diskfile.DiskFileManager(self.conf,
@@ -165,7 +167,8 @@ class TestObjectReplicator(unittest.TestCase):
     def test_run_once(self):
         replicator = object_replicator.ObjectReplicator(
             dict(swift_dir=self.testdir, devices=self.devices,
-                 mount_check='false', timeout='300', stats_interval='1'))
+                 mount_check='false', timeout='300', stats_interval='1',
+                 recon_cache_path=self.testdir))
         was_connector = object_replicator.http_connect
         object_replicator.http_connect = mock_http_connect(200)
         cur_part = '0'
@@ -292,6 +295,132 @@ class TestObjectReplicator(unittest.TestCase):
                part_1_path), {})],
             self.replicator.logger.log_dict['warning'])
 
+    def test_collect_jobs_priority(self):
+        # partition 1 is a handoff, partition 2 failed to sync last time,
+        # partition 3 was written to and partition 0 was not
+        self.replicator.partition_states.record('sda', '2', False, 0)
+        with open(os.path.join(self.parts['3'],
+                               diskfile.HASH_INVALIDATIONS_FILE), 'w') as fp:
+            fp.write('abc\n')
+        with open(os.path.join(self.parts['0'],
+                               diskfile.HASH_INVALIDATIONS_FILE), 'w') as fp:
+            pass
+        jobs = self.replicator.collect_jobs()
+        self.assertEquals([job['partition'] for job in jobs],
+                          ['2', '1', '3', '0'])
+        self.assertTrue(jobs[2]['last_write'])
+        self.assertEquals(jobs[3]['last_write'], 0)
+
+        self.replicator.handoffs_first = True
+        jobs = self.replicator.collect_jobs()
+        self.assertEquals([job['partition'] for job in jobs],
+                          ['1', '2', '3', '0'])
+
+    def test_collect_jobs_stalest_first(self):
+        for part, last_sync in [('0', 300), ('2', 100), ('3', 200)]:
+            self.replicator.partition_states.record(
+                'sda', part, True, last_sync)
+        jobs = self.replicator.collect_jobs()
+        self.assertEquals([job['partition'] for job in jobs],
+                          ['1', '2', '3', '0'])
+
+    def test_partition_states(self):
+        states = self.replicator.partition_states
+        self.assertEquals(states.get('sda', '0'), (0, 0))
+        states.record('sda', '0', False, 100)
+        states.record('sda', '0', False, 200)
+        self.assertEquals(states.get('sda', '0'), (0, 2))
+        states.record('sda', '0', True, 300)
+        states.record('sda', '9', True, 300)
+        states.record('sda', '1', False, 400)
+        self.assertEquals(states.get('sda', '0'), (300, 0))
+        self.assertEquals(states.get('sda', '1'), (0, 1))
+        states.save()
+
+        replicator = object_replicator.ObjectReplicator(self.conf)
+        self.assertEquals(replicator.partition_states.get('sda', '0'),
+                          (300, 0))
+        self.assertEquals(replicator.partition_states.get('sda', '9'),
+                          (300, 0))
+        # partition 9 is not on sda any more
+        replicator.collect_jobs()
+        replicator.partition_states.save()
+        replicator = object_replicator.ObjectReplicator(self.conf)
+        self.assertEquals(replicator.partition_states.get('sda', '9'), (0, 0))
+        self.assertEquals(replicator.partition_states.get('sda', '1'), (0, 1))
+
+    def test_replication_queue(self):
+        queue = object_replicator.ReplicationQueue(2)
+        jobs = [{'device': device, 'partition': str(i)}
+                for i, device in enumerate('aaaabba')]
+        for job in jobs:
+            queue.put(job)
+        self.assertEquals(queue.depths(), {'a': 5, 'b': 2})
+        got = [queue.get() for _junk in range(4)]
+        # a is at its limit, so b's jobs come next
+        self.assertEquals(got, [jobs[0], jobs[1], jobs[4], jobs[5]])
+        self.assertEquals(queue.depths(), {'a': 3, 'b': 0})
+
+        got = []
+
+        def consume():
+            for job in queue:
+                got.append(job)
+        consumer = eventlet.spawn(consume)
+        eventlet.sleep()
+        self.assertEquals(got, [])
+        queue.task_done(jobs[4])
+        eventlet.sleep()
+        self.assertEquals(got, [])
+        queue.task_done(jobs[0])
+        eventlet.sleep()
+        self.assertEquals(got, [jobs[2]])
+        queue.task_done(jobs[1])
+        queue.task_done(jobs[2])
+        eventlet.sleep()
+        self.assertEquals(got, [jobs[2], jobs[3], jobs[6]])
+        consumer.wait()
+        self.assertEquals(queue.depths(), {'a': 0, 'b': 0})
+
+    def test_replication_queue_unlimited(self):
+        queue = object_replicator.ReplicationQueue()
+        jobs = [{'device': device, 'partition': str(i)}
+                for i, device in enumerate('aaba')]
+        for job in jobs:
+            queue.put(job)
+        self.assertEquals(list(queue), jobs)
+
+    def test_replicate_records_partition_states(self):
+        self.replicator.device_concurrency = 1
+        running = []
+
+        def fake_update(job):
+            running.append(job['partition'])
+            self.assertEquals(len(running), 1)
+            eventlet.sleep()
+            running.remove(job['partition'])
+            return job['partition'] != '2'
+
+        with mock.patch.object(self.replicator, 'update', fake_update):
+            with mock.patch.object(self.replicator, 'update_deleted',
+                                   fake_update):
+                self.replicator.concurrency = 4
+                self.replicator.replicate()
+        states = object_replicator.ObjectReplicator(
+            self.conf).partition_states
+        for part in ['0', '1', '3']:
+            last_sync, failures = states.get('sda', part)
+            self.assertTrue(last_sync >= self.replicator.start)
+            self.assertEquals(failures, 0)
+        self.assertEquals(states.get('sda', '2'), (0, 1))
+        with open(os.path.join(self.testdir, 'object.recon')) as fp:
+            recon = json.load(fp)
+        self.assertEquals(recon['object_replication_queue'], {'sda': 0})
+
+        # the failed partition goes first next time
+        jobs = self.replicator.collect_jobs()
+        self.assertEquals(jobs[0]['partition'], '2')
+
     def test_delete_partition(self):
         with mock.patch('swift.obj.replicator.http_connect',
                         mock_http_connect(200)):
@@ -439,7 +568,8 @@ class TestObjectReplicator(unittest.TestCase):
     def test_run_once_recover_from_failure(self):
         replicator = object_replicator.ObjectReplicator(
             dict(swift_dir=self.testdir, devices=self.devices,
-                 mount_check='false', timeout='300', stats_interval='1'))
+                 mount_check='false', timeout='300', stats_interval='1',
+                 recon_cache_path=self.testdir))
         was_connector = object_replicator.http_connect
         try:
             object_replicator.http_connect = mock_http_connect(200)
@@ -483,7 +613,8 @@ class TestObjectReplicator(unittest.TestCase):
     def test_run_once_recover_from_timeout(self):
         replicator = object_replicator.ObjectReplicator(
             dict(swift_dir=self.testdir, devices=self.devices,
-                 mount_check='false', timeout='300', stats_interval='1'))
+                 mount_check='false', timeout='300', stats_interval='1',
+                 recon_cache_path=self.testdir))
         was_connector = object_replicator.http_connect
         was_get_hashes = object_replicator.get_hashes
         was_execute = tpool.execute
@@ -586,7 +717,7 @@ class TestObjectReplicator(unittest.TestCase):
         expect = 'Error syncing partition'
         for job in jobs:
             set_default(self)
-            self.replicator.update(job)
+            self.assertFalse(self.replicator.update(job))
             self.assertTrue(error in mock_logger.error.call_args[0][0])
             self.assertTrue(expect in mock_logger.exception.call_args[0][0])
             self.assertEquals(len(self.replicator.partition_times), 1)
@@ -607,7 +738,7 @@ class TestObjectReplicator(unittest.TestCase):
         error = 'Invalid response %(resp)s from %(ip)s'
         for job in jobs:
             set_default(self)
-            self.replicator.update(job)
+            self.assertFalse(self.replicator.update(job))
             self.assertTrue(error in mock_logger.error.call_args[0][0])
             self.assertEquals(len(self.replicator.partition_times), 1)
             mock_logger.reset_mock()
@@ -618,7 +749,7 @@ class TestObjectReplicator(unittest.TestCase):
         expect = 'Error syncing with node:'
         for job in jobs:
             set_default(self)
-            self.replicator.update(job)
+            self.assertFalse(self.replicator.update(job))
             self.assertTrue(expect in mock_logger.exception.call_args[0][0])
             self.assertEquals(len(self.replicator.partition_times), 1)
             mock_logger.reset_mock()
@@ -633,7 +764,7 @@ class TestObjectReplicator(unittest.TestCase):
             if job['partition'] == '0':
                 local_job = job.copy()
                 continue
-            self.replicator.update(job)
+            self.assertTrue(self.replicator.update(job))
             self.assertEquals(mock_logger.exception.call_count, 0)
             self.assertEquals(mock_logger.error.call_count, 0)
             self.assertEquals(len(self.replicator.partition_times), 1)
@@ -36,9 +36,10 @@ from test.unit import FakeLogger, debug_logger
 from test.unit import connect_tcp, readuntil2crlfs
 from swift.obj import server as object_server
 from swift.obj import diskfile
+from swift.metadata.utils import BatchSender
 from swift.common import utils
 from swift.common.utils import hash_path, mkdirs, normalize_timestamp, \
-    NullLogger, storage_directory, public, replication
+    NullLogger, storage_directory, public, replication, json
 from swift.common import constraints
 from swift.common.swob import Request, HeaderKeyDict
 from swift.common.exceptions import DiskFileDeviceUnavailable
@@ -117,6 +118,136 @@ class TestObjectController(unittest.TestCase):
             conf, logger=debug_logger())
         self.assertEqual(self.object_controller.allowed_headers, set(dah))
 
+    def test_change_journal(self):
+        conf = {'devices': self.testdir, 'mount_check': 'false',
+                'change_journal': 'true'}
+        self.object_controller = object_server.ObjectController(
+            conf, logger=debug_logger())
+        self.check_all_api_methods(obj_name='o%20x')
+        journal_file = os.path.join(self.testdir, 'sda1', 'change_journal',
+                                    'changes')
+        with open(journal_file) as fp:
+            lines = fp.readlines()
+        self.assertEquals([l.split()[1:] for l in lines],
+                          [['PUT', 'p', '/a/c/o%20x'],
+                           ['POST', 'p', '/a/c/o%20x'],
+                           ['DELETE', 'p', '/a/c/o%20x']])
+
+    def test_publish_metadata(self):
+        conf = {'devices': self.testdir, 'mount_check': 'false',
+                'publish_metadata': 'true'}
+        self.object_controller = object_server.ObjectController(
+            conf, logger=debug_logger())
+        sent = []
+
+        def fake_send(sender, chunks):
+            sent.append((sender.method, [json.loads(c) for c in chunks]))
+            return True
+
+        with mock.patch('swift.obj.server.spawn') as spawn:
+            spawn.return_value.dead = False
+            self.check_all_api_methods()
+        # the requests only queue the changes for the publisher
+        spawn.assert_called_once_with(
+            self.object_controller.run_metadata_publisher)
+        self.assertEquals(sent, [])
+        with mock.patch.object(BatchSender, '_send_batch', fake_send):
+            self._publish_queued_metadata()
+        # a run of PUTs goes in one batch, but never past a DELETE
+        self.assertEquals([(method, len(items)) for method, items in sent],
+                          [('PUT', 2), ('DELETE', 1)])
+        put, post = sent[0][1]
+        self.assertEquals(put['object_uri'], '/a/c/o')
+        self.assertEquals(put['object_content_length'], '14')
+        # a POST keeps the content length and etag of the PUT
+        self.assertEquals(post['object_content_length'], '14')
+        self.assertEquals(post['object_etag_hash'], put['object_etag_hash'])
+        self.assert_(post['object_last_modified_time'] >
+                     put['object_last_modified_time'])
+        self.assertEquals(sorted(sent[1][1][0]), [
+            'object_account_name', 'object_container_name',
+            'object_delete_time', 'object_name', 'object_uri'])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.testdir, 'sda1', diskfile.ASYNC_METADATA_DIR)))
+
+    def _publish_queued_metadata(self):
+        changes = []
+        while not self.object_controller.metadata_queue.empty():
+            changes.append(self.object_controller.metadata_queue.get())
+        self.object_controller.publish_metadata_changes(changes)
+
+    def test_publish_metadata_reuses_senders(self):
+        conf = {'devices': self.testdir, 'mount_check': 'false',
+                'publish_metadata': 'true'}
+        self.object_controller = object_server.ObjectController(
+            conf, logger=debug_logger())
+        with mock.patch('swift.obj.server.spawn') as spawn, \
+                mock.patch.object(BatchSender, '_send_batch',
+                                  return_value=True), \
+                mock.patch('swift.obj.server.get_sender',
+                           side_effect=object_server.get_sender) as get:
+            spawn.return_value.dead = False
+            for i in range(2):
+                self.check_all_api_methods()
+                self._publish_queued_metadata()
+        self.assertEquals([call[1]['method'] for call in get.call_args_list],
+                          ['PUT', 'DELETE'])
+
+    def test_publish_metadata_queue_full(self):
+        conf = {'devices': self.testdir, 'mount_check': 'false',
+                'publish_metadata': 'true', 'metadata_queue_size': '1'}
+        timestamp = normalize_timestamp(time())
+        self.object_controller = object_server.ObjectController(
+            conf, logger=debug_logger())
+        self.object_controller.metadata_queue.put(None)
+        with mock.patch('swift.obj.server.spawn') as spawn:
+            spawn.return_value.dead = False
+            req = Request.blank(
+                '/sda1/p/a/c/o', environ={'REQUEST_METHOD': 'PUT'},
+                headers={'X-Timestamp': timestamp,
+                         'Content-Type': 'application/x-test'})
+            req.body = 'data'
+            resp = req.get_response(self.object_controller)
+        self.assertEquals(resp.status_int, 201)
+        # the change is saved for the object crawler to resend
+        ohash = hash_path('a', 'c', 'o')
+        self.assert_(os.path.exists(os.path.join(
+            self.testdir, 'sda1', diskfile.ASYNC_METADATA_DIR, ohash[-3:],
+            ohash + '-' + timestamp)))
+
+    def test_publish_metadata_failure(self):
+        conf = {'devices': self.testdir, 'mount_check': 'false',
+                'publish_metadata': 'true'}
+        self.object_controller = object_server.ObjectController(
+            conf, logger=debug_logger())
+        timestamp = normalize_timestamp(time())
+        req = Request.blank(
+            '/sda1/p/a/c/o', environ={'REQUEST_METHOD': 'PUT'},
+            headers={'X-Timestamp': timestamp,
+                     'Content-Type': 'application/x-test'})
+        req.body = 'data'
+        with mock.patch('swift.obj.server.spawn') as spawn:
+            spawn.return_value.dead = False
+            resp = req.get_response(self.object_controller)
+        self.assertEquals(resp.status_int, 201)
+        with mock.patch.object(BatchSender, '_send_batch',
+                               return_value=False):
+            self._publish_queued_metadata()
+        # the change is saved for the object crawler to resend
+        ohash = hash_path('a', 'c', 'o')
+        async_file = os.path.join(
+            self.testdir, 'sda1', diskfile.ASYNC_METADATA_DIR, ohash[-3:],
+            ohash + '-' + timestamp)
+        self.assertEquals(
+            pickle.load(open(async_file)),
+            {'op': 'PUT', 'partition': 'p', 'account': 'a',
+             'container': 'c', 'obj': 'o'})
+
+    def test_change_journal_disabled(self):
+        self.check_all_api_methods()
+        self.assertFalse(os.path.exists(
+            os.path.join(self.testdir, 'sda1', 'change_journal')))
+
     def test_POST_update_meta(self):
         # Test swift.obj.server.ObjectController.POST
         original_headers = self.object_controller.allowed_headers
@@ -1269,5 +1269,145 @@ class TestReceiver(unittest.TestCase):
         self.assertEqual(_requests, [])
 
 
+    def test_REPLICATION_version(self):
+        for sent, expected in [(None, '1'), ('1', '1'), ('2', '2'),
+                               ('9', '2'), ('0', '1'), ('x', '1')]:
+            req = swob.Request.blank(
+                '/sda1/1',
+                environ={'REQUEST_METHOD': 'REPLICATION'},
+                body=':MISSING_CHECK: START\r\n'
+                     ':MISSING_CHECK: END\r\n'
+                     ':UPDATES: START\r\n:UPDATES: END\r\n')
+            if sent:
+                req.headers['X-Backend-Ssync-Version'] = sent
+            resp = req.get_response(self.controller)
+            self.assertEqual(resp.headers['X-Backend-Ssync-Version'],
+                             expected)
+            self.assertEqual(
+                self.body_lines(resp.body),
+                [':MISSING_CHECK: START', ':MISSING_CHECK: END',
+                 ':UPDATES: START', ':UPDATES: END'])
+
+    def test_pipeline(self):
+        _requests = []
+        running = [0, 0]
+
+        @server.public
+        def _PUT(request):
+            if request.path.endswith('o3'):
+                # Deliberately leaving some of the body to be thrown away.
+                request.read_body = request.environ['wsgi.input'].read(1)
+            else:
+                request.read_body = request.environ['wsgi.input'].read()
+            running[0] += 1
+            running[1] = max(running)
+            eventlet.sleep(0.01)
+            running[0] -= 1
+            _requests.append(request)
+            return swob.HTTPCreated()
+
+        @server.public
+        def _DELETE(request):
+            _requests.append(request)
+            return swob.HTTPNoContent()
+
+        self.controller.logger = mock.MagicMock()
+        with contextlib.nested(
+                mock.patch.object(self.controller, 'PUT', _PUT),
+                mock.patch.object(self.controller, 'DELETE', _DELETE)):
+            req = swob.Request.blank(
+                '/sda1/1',
+                environ={'REQUEST_METHOD': 'REPLICATION'},
+                headers={'X-Backend-Ssync-Version': '2'},
+                body=':MISSING_CHECK: START\r\n' +
+                     self.hash1 + ' ' + self.ts1 + '\r\n'
+                     ':MISSING_CHECK: END\r\n'
+                     ':MISSING_CHECK: START\r\n' +
+                     self.hash2 + ' ' + self.ts2 + '\r\n'
+                     ':MISSING_CHECK: END\r\n'
+                     ':UPDATES: START\r\n'
+                     'PUT /a/c/o1\r\n'
+                     'Content-Length: 2\r\n'
+                     'X-Timestamp: 1364456113.00001\r\n'
+                     '\r\n'
+                     '12'
+                     'PUT /a/c/o3\r\n'
+                     'Content-Length: 2\r\n'
+                     'X-Timestamp: 1364456113.00003\r\n'
+                     '\r\n'
+                     '34'
+                     ':UPDATES: END\r\n'
+                     ':UPDATES: START\r\n'
+                     'DELETE /a/c/o2\r\n'
+                     'X-Timestamp: 1364456113.00002\r\n'
+                     '\r\n'
+                     ':UPDATES: END\r\n')
+            resp = req.get_response(self.controller)
+            body_lines = self.body_lines(resp.body)
+        self.assertEqual(resp.headers['X-Backend-Ssync-Version'], '2')
+        self.assertEqual(
+            body_lines,
+            [':MISSING_CHECK: START', self.hash1, ':MISSING_CHECK: END',
+             ':MISSING_CHECK: START', self.hash2, ':MISSING_CHECK: END',
+             ':UPDATES: START', ':UPDATES: END',
+             ':UPDATES: START', ':UPDATES: END'])
+        self.assertEqual(resp.status_int, 200)
+        self.assertFalse(self.controller.logger.exception.called)
+        self.assertFalse(self.controller.logger.error.called)
+        # the second PUT was read while the first was being committed
+        self.assertEqual(running[1], 2)
+        self.assertEqual(
+            sorted((req.method, req.path, getattr(req, 'read_body', None))
+                   for req in _requests),
+            [('DELETE', '/sda1/1/a/c/o2', None),
+             ('PUT', '/sda1/1/a/c/o1', '12'),
+             ('PUT', '/sda1/1/a/c/o3', '3')])
+
+    def test_pipeline_failures(self):
+
+        @server.public
+        def _PUT(request):
+            request.environ['wsgi.input'].read()
+            eventlet.sleep(0.01)
+            return swob.HTTPInternalServerError()
+
+        self.controller.logger = mock.MagicMock()
+        with mock.patch.object(self.controller, 'PUT', _PUT):
+            req = swob.Request.blank(
+                '/sda1/1',
+                environ={'REQUEST_METHOD': 'REPLICATION'},
+                headers={'X-Backend-Ssync-Version': '2'},
+                body=':MISSING_CHECK: START\r\n:MISSING_CHECK: END\r\n'
+                     ':UPDATES: START\r\n'
+                     'PUT /a/c/o1\r\n'
+                     'Content-Length: 1\r\n'
+                     'X-Timestamp: 1364456113.00001\r\n'
+                     '\r\n'
+                     '1'
+                     ':UPDATES: END\r\n')
+            resp = req.get_response(self.controller)
+            body_lines = self.body_lines(resp.body)
+        self.assertEqual(
+            body_lines,
+            [':MISSING_CHECK: START', ':MISSING_CHECK: END',
+             ":ERROR: 500 'ERROR: With :UPDATES: 1 failures to 0 successes'"])
+
+    def test_pipeline_unexpected_line(self):
+        self.controller.logger = mock.MagicMock()
+        req = swob.Request.blank(
+            '/sda1/1',
+            environ={'REQUEST_METHOD': 'REPLICATION'},
+            headers={'X-Backend-Ssync-Version': '2'},
+            body=':MISSING_CHECK: START\r\n:MISSING_CHECK: END\r\n'
+                 'bad\r\n')
+        resp = req.get_response(self.controller)
+        self.assertEqual(
+            self.body_lines(resp.body),
+            [':MISSING_CHECK: START', ':MISSING_CHECK: END',
+             ':ERROR: 0 "Looking for :MISSING_CHECK: START or :UPDATES: '
+             'START got \'bad\\\\r\\\\n\'"'])
+        self.controller.logger.exception.assert_called_once_with(
+            'None/sda1/1 EXCEPTION in replication.Receiver')
+
 if __name__ == '__main__':
     unittest.main()
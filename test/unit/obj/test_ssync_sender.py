@@ -39,6 +39,8 @@ class FakeReplicator(object):
         self.http_timeout = 3
         self.network_chunk_size = 65536
         self.disk_chunk_size = 4096
+        self.ssync_batch_size = 1000
+        self.ssync_read_ahead = 4
         conf = {
             'devices': testdir,
             'mount_check': 'false',
@@ -69,10 +71,14 @@ class FakeResponse(object):
     def __init__(self, chunk_body=''):
         self.status = 200
         self.close_called = False
+        self.headers = {}
         if chunk_body:
             self.fp = StringIO.StringIO(
                 '%x\r\n%s\r\n0\r\n\r\n' % (len(chunk_body), chunk_body))
 
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
     def close(self):
         self.close_called = True
 
@@ -206,6 +212,52 @@ class TestSender(unittest.TestCase):
         self.sender.updates.assert_called_once_with()
         self.sender.disconnect.assert_called_once_with()
 
+    def test_call_pipelines(self):
+        self.sender.suffixes = ['abc']
+
+        def connect():
+            self.sender.version = 2
+
+        self.sender.connect = connect
+        self.sender.pipeline = mock.MagicMock()
+        self.sender.missing_check = mock.MagicMock()
+        self.sender.updates = mock.MagicMock()
+        self.sender.disconnect = mock.MagicMock()
+        self.assertTrue(self.sender())
+        self.sender.pipeline.assert_called_once_with()
+        self.assertFalse(self.sender.missing_check.called)
+        self.assertFalse(self.sender.updates.called)
+        self.sender.disconnect.assert_called_once_with()
+
+    def test_connect_version(self):
+        node = dict(ip='1.2.3.4', port=5678, device='sda1')
+        job = dict(partition='9')
+        sent_headers = {}
+        response = FakeResponse()
+
+        class FakeBufferedHTTPConnection(NullBufferedHTTPConnection):
+
+            def putheader(self, header, value):
+                sent_headers[header] = value
+
+            def getresponse(*args, **kwargs):
+                return response
+
+        with mock.patch.object(
+                ssync_sender.bufferedhttp, 'BufferedHTTPConnection',
+                FakeBufferedHTTPConnection):
+            for received, expected in [(None, 1), ('1', 1), ('2', 2),
+                                       ('9', 2), ('x', 1)]:
+                response.headers = {}
+                if received:
+                    response.headers['X-Backend-Ssync-Version'] = received
+                self.sender = ssync_sender.Sender(
+                    self.replicator, node, job, ['abc'])
+                self.sender.connect()
+                self.assertEqual(self.sender.version, expected)
+                self.assertEqual(sent_headers['X-Backend-Ssync-Version'],
+                                 '2')
+
     def test_connect_send_timeout(self):
         self.replicator.conn_timeout = 0.01
         node = dict(ip='1.2.3.4', port=5678, device='sda1')
@@ -732,6 +784,96 @@ class TestSender(unittest.TestCase):
             '11\r\n:UPDATES: START\r\n\r\n'
             'f\r\n:UPDATES: END\r\n\r\n')
 
+    def test_pipeline(self):
+        device = 'dev'
+        part = '9'
+        hashes = []
+        for obj in ('o1', 'o2', 'o3'):
+            df = self._make_open_diskfile(device, part, 'a', 'c', obj)
+            hashes.append(
+                (df._datadir, utils.hash_path('a', 'c', obj), df.timestamp))
+        self.sender.connection = FakeConnection()
+        self.sender.job = {'device': device, 'partition': part}
+        self.sender.suffixes = ['abc']
+        self.sender.daemon.ssync_batch_size = 2
+        self.sender.daemon._diskfile_mgr.yield_hashes = \
+            lambda *args: iter(hashes)
+        self.sender.send_put = mock.MagicMock()
+        self.sender.response = FakeResponse(
+            chunk_body=(
+                ':MISSING_CHECK: START\r\n' + hashes[0][1] + '\r\n' +
+                ':MISSING_CHECK: END\r\n'
+                ':MISSING_CHECK: START\r\n' + hashes[2][1] + '\r\n' +
+                ':MISSING_CHECK: END\r\n'
+                ':UPDATES: START\r\n:UPDATES: END\r\n'
+                ':UPDATES: START\r\n:UPDATES: END\r\n'))
+        self.sender.pipeline()
+        self.assertEqual(
+            [args[0] for args, _kwargs in self.sender.send_put.call_args_list],
+            ['/a/c/o1', '/a/c/o3'])
+        # the second missing check is sent before the first updates; the
+        # put lines themselves aren't sent since we mock send_put
+        self.assertEqual(
+            ''.join(self.sender.connection.sent),
+            '17\r\n:MISSING_CHECK: START\r\n\r\n'
+            '33\r\n%s %s\r\n\r\n'
+            '33\r\n%s %s\r\n\r\n'
+            '15\r\n:MISSING_CHECK: END\r\n\r\n'
+            '17\r\n:MISSING_CHECK: START\r\n\r\n'
+            '33\r\n%s %s\r\n\r\n'
+            '15\r\n:MISSING_CHECK: END\r\n\r\n'
+            '11\r\n:UPDATES: START\r\n\r\n'
+            'f\r\n:UPDATES: END\r\n\r\n'
+            '11\r\n:UPDATES: START\r\n\r\n'
+            'f\r\n:UPDATES: END\r\n\r\n' % tuple(
+                value for _path, object_hash, timestamp in hashes
+                for value in (object_hash, timestamp)))
+
+    def test_pipeline_error(self):
+        self.sender.connection = FakeConnection()
+        self.sender.job = {'device': 'dev', 'partition': '9'}
+        self.sender.suffixes = ['abc']
+        self.sender.daemon._diskfile_mgr.yield_hashes = \
+            lambda *args: iter([])
+        self.sender.response = FakeResponse(
+            chunk_body=(
+                ':MISSING_CHECK: START\r\n:MISSING_CHECK: END\r\n'
+                ":ERROR: 500 'ERROR: With :UPDATES: 1 failures'\r\n"))
+        exc = None
+        try:
+            self.sender.pipeline()
+        except exceptions.ReplicationException as err:
+            exc = err
+        self.assertEqual(
+            str(exc),
+            "Unexpected response: \":ERROR: 500 'ERROR: With :UPDATES: 1 "
+            "failures'\"")
+
+    def test_read_ahead(self):
+        self.sender.daemon.ssync_read_ahead = 2
+        read = []
+
+        def chunks():
+            for chunk in 'abcdefghij':
+                read.append(chunk)
+                yield chunk
+
+        reader = self.sender.read_ahead(chunks())
+        self.assertEqual(next(reader), 'a')
+        eventlet.sleep()
+        self.assertTrue(2 < len(read) < 10)
+        self.assertEqual(''.join(reader), 'bcdefghij')
+
+    def test_read_ahead_error(self):
+
+        def chunks():
+            yield 'a'
+            raise exceptions.DiskFileError('oops')
+
+        reader = self.sender.read_ahead(chunks())
+        self.assertEqual(next(reader), 'a')
+        self.assertRaises(exceptions.DiskFileError, next, reader)
+
     def test_send_delete_timeout(self):
         self.sender.connection = FakeConnection()
         self.sender.connection.send = lambda d: eventlet.sleep(1)
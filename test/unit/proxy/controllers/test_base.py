@@ -274,6 +274,38 @@ class TestFuncs(unittest.TestCase):
         resp = get_container_info(req.environ, 'xxx')
         self.assertEquals(resp['bytes'], 3867)
 
+    def test_get_container_info_prefetches_account(self):
+        class BatchingCache(object):
+            def __init__(self, store):
+                self.store = store
+                self.calls = []
+
+            def get_many(self, keys):
+                self.calls.append(keys)
+                return [self.store.get(key) for key in keys]
+
+        cache = BatchingCache({
+            'account/account': {'status': 200, 'bytes': 5555},
+            'container/account/cont': {'status': 200,
+                                       'bytes': 3333,
+                                       'versions': u"\u1F4A9"}})
+        req = Request.blank("/v1/account/cont",
+                            environ={'swift.cache': cache})
+        resp = get_container_info(req.environ, 'xxx')
+        self.assertEquals(resp['bytes'], 3333)
+        self.assertEquals(resp['versions'], "\xe1\xbd\x8a\x39")
+        self.assertEquals(cache.calls, [['container/account/cont',
+                                         'account/account']])
+        # the account info came along and is served from the env
+        resp = get_account_info(req.environ, 'xxx')
+        self.assertEquals(resp['bytes'], 5555)
+        self.assertEquals(len(cache.calls), 1)
+
+        # an account already in the env is not fetched again
+        del req.environ['swift.container/account/cont']
+        get_container_info(req.environ, 'xxx')
+        self.assertEquals(cache.calls[-1], ['container/account/cont'])
+
     def test_get_account_info_swift_source(self):
         req = Request.blank("/v1/a", environ={'swift.cache': FakeCache({})})
         with patch('swift.proxy.controllers.base.'
@@ -380,9 +412,11 @@ class TestFuncs(unittest.TestCase):
             'x-container-read': 'readvalue',
             'x-container-write': 'writevalue',
             'x-container-sync-key': 'keyvalue',
+            'x-put-timestamp': '1.00000',
             'x-container-meta-access-control-allow-origin': 'here',
         }
         resp = headers_to_container_info(headers.items(), 200)
+        self.assertEquals(resp['put_timestamp'], '1.00000')
         self.assertEquals(resp['read_acl'], 'readvalue')
         self.assertEquals(resp['write_acl'], 'writevalue')
         self.assertEquals(resp['cors']['allow_origin'], 'here')
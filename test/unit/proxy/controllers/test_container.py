@@ -16,10 +16,12 @@
 import mock
 import unittest
 
-from swift.common.swob import Request
+from swift.common.swob import Request, HTTPUnauthorized
 from swift.proxy import server as proxy_server
-from swift.proxy.controllers.base import headers_to_container_info
-from test.unit import fake_http_connect, FakeRing, FakeMemcache
+from swift.proxy.controllers.base import headers_to_container_info, \
+    invalidate_cached_listings
+from test.unit import fake_http_connect, FakeRing, FakeMemcache, \
+    FakeLogger
 from swift.common.request_helpers import get_sys_meta_prefix
 
 
@@ -119,5 +121,128 @@ class TestContainerController(unittest.TestCase):
         self.assertNotEqual(context['headers']['x-timestamp'], '1.0')
 
 
+    def _listing_GET(self, req, body='["o"]', headers=None):
+        backend = []
+
+        def callback(ipaddr, port, device, partition, method, path,
+                     headers=None, query_string=None, ssl=False):
+            backend.append((method, path))
+
+        container_headers = {'x-put-timestamp': '1.00000',
+                             'x-container-object-count': '1',
+                             'x-container-bytes-used': '3'}
+        container_headers.update(headers or {})
+        controller = proxy_server.ContainerController(self.app, 'a', 'c')
+        with mock.patch('swift.proxy.controllers.base.http_connect',
+                        fake_http_connect(200, 200, body=body,
+                                          headers=container_headers,
+                                          give_connect=callback)):
+            resp = getattr(controller, req.method)(req)
+            resp_body = resp.body
+        return resp, resp_body, [method for method, path in backend
+                                 if path == '/a/c']
+
+    def test_GET_listing_cache_off(self):
+        for i in range(2):
+            resp, body, backend = self._listing_GET(Request.blank('/v1/a/c'))
+            self.assertEquals(resp.status_int, 200)
+            self.assertEquals(body, '["o"]')
+            self.assertEquals(backend, ['GET'])
+        self.assertFalse([key for key in self.app.memcache.keys()
+                          if key.startswith('container_listing')])
+
+    def test_GET_listing_cache(self):
+        self.app.listing_cache_time = 60
+        self.app.logger = FakeLogger()
+        resp, body, backend = self._listing_GET(
+            Request.blank('/v1/a/c?prefix=p&limit=2'))
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(backend, ['GET'])
+        resp, body, backend = self._listing_GET(
+            Request.blank('/v1/a/c?limit=2&prefix=p'))
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(body, '["o"]')
+        self.assertEquals(resp.headers['x-container-object-count'], '1')
+        self.assertEquals(backend, [])
+        # another query, or another format, is another listing
+        resp, body, backend = self._listing_GET(
+            Request.blank('/v1/a/c?prefix=q&limit=2'))
+        self.assertEquals(backend, ['GET'])
+        resp, body, backend = self._listing_GET(
+            Request.blank('/v1/a/c?prefix=p&limit=2',
+                          headers={'Accept': 'application/xml'}))
+        self.assertEquals(backend, ['GET'])
+        self.assertEquals(self.app.logger.get_increment_counts(),
+                          {'container.listing_cache.hit': 1,
+                           'container.listing_cache.miss': 3})
+
+    def test_GET_listing_cache_invalidated(self):
+        self.app.listing_cache_time = 60
+        req = Request.blank('/v1/a/c')
+        resp, body, backend = self._listing_GET(req)
+        self.assertEquals(backend, ['GET'])
+        # an object written to the container
+        invalidate_cached_listings(self.app, {}, 'a', 'c')
+        resp, body, backend = self._listing_GET(Request.blank('/v1/a/c'))
+        self.assertEquals(backend, ['GET'])
+        resp, body, backend = self._listing_GET(Request.blank('/v1/a/c'))
+        self.assertEquals(backend, [])
+        # container info that changed since the listing was cached
+        self.app.memcache.get('container/a/c')['object_count'] = '2'
+        resp, body, backend = self._listing_GET(Request.blank('/v1/a/c'))
+        self.assertEquals(backend, ['GET'])
+        # or that is no longer cached
+        self.app.memcache.delete('container/a/c')
+        resp, body, backend = self._listing_GET(Request.blank('/v1/a/c'))
+        self.assertEquals(backend, ['GET'])
+        resp, body, backend = self._listing_GET(
+            Request.blank('/v1/a/c'), headers={'x-container-read': '.r:*'})
+        self.assertEquals(backend, [])
+        self.assertEquals(resp.headers.get('x-container-read'), None)
+
+    def test_GET_listing_cache_skipped(self):
+        self.app.listing_cache_time = 60
+        self.app.listing_cache_max_size = 4
+        for i in range(2):
+            resp, body, backend = self._listing_GET(Request.blank('/v1/a/c'))
+            self.assertEquals(body, '["o"]')
+            self.assertEquals(backend, ['GET'])
+        self.app.listing_cache_max_size = 5
+        for req in (Request.blank('/v1/a/c', headers={'X-Newest': 'true'}),
+                    Request.blank('/v1/a/c', environ={'REQUEST_METHOD':
+                                                      'HEAD'})):
+            for i in range(2):
+                resp, body, backend = self._listing_GET(req)
+                self.assertTrue(backend)
+                self.assertEquals(set(backend), set([req.method]))
+        self.assertFalse([key for key in self.app.memcache.keys()
+                          if key.startswith('container_listing/')])
+
+    def test_GET_listing_cache_authorized(self):
+        self.app.listing_cache_time = 60
+        owner_headers = {'x-container-read': '.r:*',
+                         'x-container-sync-key': 'secret'}
+        req = Request.blank('/v1/a/c', environ={'swift_owner': True})
+        resp, body, backend = self._listing_GET(req, headers=owner_headers)
+        self.assertEquals(backend, ['GET'])
+        self.assertEquals(resp.headers['x-container-sync-key'], 'secret')
+
+        acls = []
+
+        def authorize(req):
+            acls.append(req.acl)
+            return HTTPUnauthorized(request=req)
+
+        req = Request.blank('/v1/a/c', environ={'swift.authorize': authorize})
+        resp, body, backend = self._listing_GET(req, headers=owner_headers)
+        self.assertEquals(backend, [])
+        self.assertEquals(resp.status_int, 401)
+        self.assertEquals(acls, ['.r:*'])
+        req = Request.blank('/v1/a/c')
+        resp, body, backend = self._listing_GET(req, headers=owner_headers)
+        self.assertEquals(backend, [])
+        self.assertEquals(resp.status_int, 200)
+        self.assertTrue('x-container-sync-key' not in resp.headers)
+
 if __name__ == '__main__':
     unittest.main()
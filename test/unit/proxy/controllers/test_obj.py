@@ -118,5 +118,21 @@ class TestObjController(unittest.TestCase):
             self.assertEquals(req.environ.get('swift.log_info'), None)
 
 
+    def test_DELETE_invalidates_cached_listings(self):
+        key = 'container_listing_generation/a/c'
+        for listing_cache_time, status, generation in (
+                (0, 204, None), (60, 404, None), (60, 204, 1)):
+            app = proxy_server.Application(
+                {'listing_cache_time': listing_cache_time}, FakeMemcache(),
+                account_ring=FakeRing(), container_ring=FakeRing(),
+                object_ring=FakeRing())
+            controller = proxy_server.ObjectController(app, 'a', 'c', 'o')
+            req = swift.common.swob.Request.blank(
+                '/v1/a/c/o', environ={'REQUEST_METHOD': 'DELETE'})
+            with set_http_connect(200, 200, status, status, status):
+                resp = controller.DELETE(req)
+            self.assertEquals(resp.status_int, status)
+            self.assertEquals(app.memcache.get(key), generation)
+
 if __name__ == '__main__':
     unittest.main()